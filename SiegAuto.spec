@@ -6,11 +6,18 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[('assets', 'assets'), ('src', 'src')],
-    hiddenimports=[],
+    # Telas importadas sob demanda por nome (src/utils/carregamento.py: VIEWS)
+    hiddenimports=[
+        'src.views.dashboard_view', 'src.views.admin_view', 'src.views.sped_view',
+        'src.views.invest_view', 'src.views.keys_extractor_view', 'src.views.sped_filter_view',
+        'src.views.settings_view', 'src.views.jobs_view',
+        # Chaves em string Arrow (tipos_dados) e exportacao em Parquet (exportacao_dados)
+        'pyarrow', 'pyarrow.parquet',
+    ],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    excludes=['matplotlib'],
     noarchive=False,
     optimize=0,
 )
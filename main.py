@@ -1,14 +1,10 @@
 import flet as ft
+import multiprocessing
 from src.views.login_view import LoginView
-from src.views.dashboard_view import DashboardView
-from src.views.admin_view import AdminView
-from src.views.sped_view import SpedView
-from src.views.invest_view import InvestView
-from src.views.settings_view import SettingsView
-from src.views.keys_extractor_view import KeysExtractorView
-from src.views.sped_filter_view import SpedFilterView
 from src.utils.database import initialize_db
 from src.utils.logger import log_action
+# As demais telas (e pandas/openpyxl) são importadas na primeira navegação
+from src.utils.carregamento import VIEWS, RegistroTelas, aquecer_modulos
 
 def main(page: ft.Page):
     # --- Configurações da Janela ---
@@ -41,6 +37,9 @@ def main(page: ft.Page):
 
     page_content = ft.Container(expand=True, padding=20)
 
+    # Telas criadas uma vez por sessão e preservadas entre navegações
+    telas = RegistroTelas(page)
+
     # --- Funções de Navegação e Lógica ---
 
     def logout(e):
@@ -49,6 +48,7 @@ def main(page: ft.Page):
             log_action(f"User logged out: {current_user['username']}")
 
         current_user = None
+        telas.limpar()
         page.clean()
         page.add(LoginView(page, on_login_success))
         page.update()
@@ -67,27 +67,13 @@ def main(page: ft.Page):
         index = e.control.selected_index
         selected_label = rail.destinations[index].label
 
-        # Limpa overlay para evitar conflitos/duplicações de FilePickers
-        page.overlay.clear()
-
-        # Limpa o conteúdo atual
-        page_content.content = None
-
-        # Roteamento das Telas
-        if selected_label == "Dashboard":
-            page_content.content = DashboardView()
-        elif selected_label == "Admin":
-            page_content.content = AdminView(page)
-        elif selected_label == "SPED":
-            page_content.content = SpedView(page)
-        elif selected_label == "Invest / Contrib":
-            page_content.content = InvestView(page)
-        elif selected_label == "Extrator Chaves":
-            page_content.content = KeysExtractorView(page)
-        elif selected_label == "Filtro SPED":
-            page_content.content = SpedFilterView(page)
-        elif selected_label == "Configurações":
-            page_content.content = SettingsView(page)
+        # Roteamento das Telas: a tela é criada na primeira visita (FilePickers
+        # entram no overlay uma vez) e nas seguintes só volta a ficar visível
+        if selected_label in VIEWS:
+            telas.exibir(selected_label)
+            page_content.content = telas.conteudo
+        else:
+            page_content.content = None
 
         # Atualiza a página inteira para garantir que os FilePickers no overlay sejam registrados
         page.update()
@@ -121,6 +107,7 @@ def main(page: ft.Page):
             dests.append(get_destination(ft.Icons.MONETIZATION_ON_OUTLINED, "Invest / Contrib", ft.Icons.MONETIZATION_ON))
             dests.append(get_destination(ft.Icons.KEY_OUTLINED, "Extrator Chaves", ft.Icons.KEY))
             dests.append(get_destination(ft.Icons.FILTER_ALT_OUTLINED, "Filtro SPED", ft.Icons.FILTER_ALT))
+            dests.append(get_destination(ft.Icons.QUEUE_OUTLINED, "Fila de Jobs", ft.Icons.QUEUE))
 
         if has_perm("settings"):
             dests.append(get_destination(ft.Icons.SETTINGS_OUTLINED, "Configurações", ft.Icons.SETTINGS))
@@ -132,17 +119,8 @@ def main(page: ft.Page):
         if dests:
             rail.selected_index = 0
             first_label = dests[0].label
-
-            if first_label == "Dashboard":
-                page_content.content = DashboardView()
-            elif first_label == "Admin":
-                page_content.content = AdminView(page)
-            elif first_label == "SPED":
-                page_content.content = SpedView(page)
-            elif first_label == "Invest / Contrib":
-                page_content.content = InvestView(page)
-            elif first_label == "Configurações":
-                page_content.content = SettingsView(page)
+            telas.exibir(first_label)
+            page_content.content = telas.conteudo
         else:
             page_content.content = ft.Text("Sem permissões de acesso.", size=20, color="red")
 
@@ -160,10 +138,19 @@ def main(page: ft.Page):
         )
         page.update()
 
+        # Adianta pandas/openpyxl e as lógicas em segundo plano enquanto o usuário navega
+        aquecer_modulos()
+
+        # Retoma os jobs que ficaram pendentes na fila (jobs.db) em sessões anteriores
+        if has_perm("sped"):
+            from src.utils.fila_jobs import gerenciador_jobs
+            gerenciador_jobs()
+
     # --- Início do App ---
     # Adiciona a view de login ao iniciar
     page.add(LoginView(page, on_login_success))
     page.update()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # Necessário para os workers do lote no executável (PyInstaller)
     ft.app(target=main)
\ No newline at end of file
@@ -0,0 +1,246 @@
+import logging
+import re
+import pandas as pd
+from copy import copy, deepcopy
+from io import BytesIO
+from pathlib import Path
+from openpyxl import load_workbook
+from openpyxl.drawing.image import Image
+from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
+from typing import Dict, List, Optional
+
+from .constants import MAPA_CST_UNIFICADO
+from .core_logic import _calcular_totalizadores_cfop_cst, separar_totalizadores_entrada_saida, calcular_base_difal_por_cfop
+from .monetario import para_centavos, para_reais, ratear_centavos
+from .setores_apuracao import preencher_aba_setor, validar_setor
+from .sped_parser import extrair_dados_sped, ler_periodo_sped
+
+# ==============================================================================
+# 1. TOTALIZADORES POR PERÍODO (CACHE) E CONSOLIDAÇÃO
+# ==============================================================================
+
+COLUNAS_SOMA_TOTALIZADORES = [
+    'QTD Documentos', 'Total Operação', 'Base de Cálculo ICMS', 'Total ICMS',
+    'Base de Cálculo ICMS ST', 'Total ICMS ST', 'Total IPI'
+]
+
+def carregar_totalizadores_relatorio(caminho_relatorio: Path) -> Dict[str, pd.DataFrame]:
+    """Lê as abas Totalizadores_Entrada/Saida de um Relatorio_Conciliacao_Fiscal já gerado."""
+    abas = {'df_entradas': 'Totalizadores_Entrada', 'df_saidas': 'Totalizadores_Saida'}
+    resultado = {}
+    with pd.ExcelFile(caminho_relatorio) as xls:
+        for chave, aba in abas.items():
+            if aba in xls.sheet_names:
+                resultado[chave] = pd.read_excel(xls, sheet_name=aba, dtype={'CFOP (SPED)': str, 'CST (SPED)': str})
+            else:
+                logging.warning(f"Aba '{aba}' não encontrada em {caminho_relatorio}.")
+                resultado[chave] = pd.DataFrame()
+    return resultado
+
+def periodos_de_relatorios(relatorios: Dict[str, Path]) -> List[Dict]:
+    """Monta a lista de períodos a partir de {rótulo: caminho do relatório de conciliação}."""
+    periodos = []
+    for rotulo, caminho in relatorios.items():
+        logging.info(f"[ANUAL] Lendo totalizadores em cache do período {rotulo}: {caminho}")
+        periodos.append({'periodo': rotulo, **carregar_totalizadores_relatorio(caminho)})
+    return periodos
+
+def periodos_de_speds(caminhos_sped: List[Path]) -> List[Dict]:
+    """
+    Monta a lista de períodos direto dos SPEDs (um arquivo por período), sem
+    XMLs nem relatório: os totalizadores de entrada/saída e a base DIFAL saem
+    dos C190/D190/C590/D590 e C101, como na análise completa. O rótulo é o
+    mês do 0000 (MM.AAAA) ou, sem 0000, o nome do arquivo.
+    """
+    periodos = []
+    for caminho in caminhos_sped:
+        caminho = Path(caminho)
+        datas = ler_periodo_sped(caminho)
+        rotulo = f"{datas[0]:%m.%Y}" if datas else caminho.stem
+        logging.info(f"[ANUAL] Calculando totalizadores do período {rotulo}: {caminho}")
+
+        _, _, df_analitico, _, df_chaves_difal = extrair_dados_sped(caminho)
+        df_entradas, df_saidas = separar_totalizadores_entrada_saida(_calcular_totalizadores_cfop_cst(df_analitico))
+        df_base_difal = pd.DataFrame()
+        if not df_chaves_difal.empty and not df_analitico.empty:
+            df_base_difal = calcular_base_difal_por_cfop(
+                df_analitico.astype({'CHV_NFE': object}).merge(df_chaves_difal, on='CHV_NFE', how='inner')
+            )
+        periodos.append({'periodo': rotulo, 'df_entradas': df_entradas, 'df_saidas': df_saidas,
+                         'df_base_difal': df_base_difal if not df_base_difal.empty else None})
+    return periodos
+
+def consolidar_totalizadores(lista_dfs: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Soma os totalizadores de vários períodos por CFOP/CST/Alíquota (SPED), em
+    centavos, e recalcula a Alíquota ICMS efetiva com a mesma fórmula de
+    _calcular_totalizadores_cfop_cst. Os totais voltam em reais.
+    """
+    frames = [df for df in lista_dfs if df is not None and not df.empty]
+    if not frames:
+        return pd.DataFrame()
+
+    df = pd.concat(frames, ignore_index=True)
+    df['CFOP (SPED)'] = df['CFOP (SPED)'].astype(str).str.strip()
+    df['CST (SPED)'] = df['CST (SPED)'].astype(str).str.strip() if 'CST (SPED)' in df.columns else 'N/A'
+    df['Alíquota (SPED)'] = pd.to_numeric(df['Alíquota (SPED)'], errors='coerce').fillna(0.0)
+    for col in COLUNAS_SOMA_TOTALIZADORES:
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0.0) if col in df.columns else 0.0
+    colunas_valor = COLUNAS_SOMA_TOTALIZADORES[1:]
+    for col in colunas_valor:
+        df[col] = para_centavos(df[col])
+
+    df_anual = df.groupby(['CFOP (SPED)', 'CST (SPED)', 'Alíquota (SPED)'], as_index=False)[COLUNAS_SOMA_TOTALIZADORES].sum()
+
+    nova_base_calculo = df_anual['Total Operação'] - df_anual['Total IPI'] - df_anual['Total ICMS ST']
+    df_anual['Alíquota ICMS'] = para_reais(ratear_centavos(df_anual['Total ICMS'], 10_000, nova_base_calculo))
+    for col in colunas_valor:
+        df_anual[col] = para_reais(df_anual[col])
+    df_anual['QTD Documentos'] = df_anual['QTD Documentos'].astype(int)
+    df_anual['Descricao CST'] = df_anual['CST (SPED)'].map(MAPA_CST_UNIFICADO).fillna(df_anual['CST (SPED)'])
+
+    colunas_ordenadas = [
+        'CFOP (SPED)', 'CST (SPED)', 'Descricao CST', 'Alíquota (SPED)', 'Alíquota ICMS',
+        'Total Operação', 'Base de Cálculo ICMS', 'Total ICMS',
+        'Base de Cálculo ICMS ST', 'Total ICMS ST', 'Total IPI', 'QTD Documentos'
+    ]
+    return df_anual[colunas_ordenadas]
+
+def _consolidar_difal(lista_dfs: List[pd.DataFrame]) -> pd.DataFrame:
+    frames = [df for df in lista_dfs if df is not None and not df.empty]
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames, ignore_index=True)
+    df['CFOP'] = df['CFOP'].astype(str).str.strip()
+    return df.groupby('CFOP', as_index=False)['VALOR_BASE_DIFAL'].sum()
+
+# ==============================================================================
+# 2. ABA DE RESUMO ANUAL
+# ==============================================================================
+
+def _totais(df: Optional[pd.DataFrame]) -> List[float]:
+    if df is None or df.empty: return [0.0, 0.0, 0.0]
+    return [float(pd.to_numeric(df[col], errors='coerce').fillna(0.0).sum()) if col in df.columns else 0.0
+            for col in ['Total Operação', 'Base de Cálculo ICMS', 'Total ICMS']]
+
+def _escrever_resumo_anual(ws, periodos: List[Dict], df_ent_anual: pd.DataFrame, df_sai_anual: pd.DataFrame):
+    thin = Side(border_style="thin", color="000000")
+    borda = Border(top=thin, left=thin, right=thin, bottom=thin)
+
+    cabecalho = ["Período", "Entradas - Vlr Contábil", "Entradas - Base Calc", "Entradas - ICMS",
+                 "Saídas - Vlr Contábil", "Saídas - Base Calc", "Saídas - ICMS"]
+    for c, titulo in enumerate(cabecalho, start=1):
+        cell = ws.cell(row=1, column=c, value=titulo)
+        cell.fill = PatternFill(start_color="203764", end_color="203764", fill_type="solid")
+        cell.font = Font(bold=True, color="FFFFFF")
+        cell.alignment = Alignment(horizontal="center", vertical="center")
+        cell.border = borda
+        ws.column_dimensions[cell.column_letter].width = 22 if c > 1 else 14
+
+    linhas = [[p['periodo']] + _totais(p.get('df_entradas')) + _totais(p.get('df_saidas')) for p in periodos]
+    linhas.append(["TOTAL ANUAL"] + _totais(df_ent_anual) + _totais(df_sai_anual))
+
+    for r, valores in enumerate(linhas, start=2):
+        for c, valor in enumerate(valores, start=1):
+            cell = ws.cell(row=r, column=c, value=valor)
+            cell.border = borda
+            if c > 1: cell.number_format = '#,##0.00'
+            if r == len(linhas) + 1: cell.font = Font(bold=True)
+
+    ws.freeze_panes = 'A2'
+
+# ==============================================================================
+# 3. FUNÇÃO PRINCIPAL (ANUAL)
+# ==============================================================================
+
+def _titulo_aba(rotulo: str, existentes: List[str]) -> str:
+    titulo = re.sub(r'[\[\]:*?/\\]', '.', str(rotulo)).strip()[:31] or "Periodo"
+    base, n = titulo, 2
+    while titulo in existentes:
+        sufixo = f" ({n})"
+        titulo = base[:31 - len(sufixo)] + sufixo
+        n += 1
+    return titulo
+
+def _copiar_layout(wb, ws_base):
+    """
+    Cópia da aba do template. O copy_worksheet do openpyxl leva valores,
+    estilos, dimensões, mesclagens e configuração de página; validações de
+    dados, formatação condicional, imagens, painéis congelados, títulos/área
+    de impressão e proteção são copiados aqui. Gráficos não são copiados.
+    """
+    ws = wb.copy_worksheet(ws_base)
+    for validacao in ws_base.data_validations.dataValidation:
+        ws.add_data_validation(deepcopy(validacao))
+    for formatacao in ws_base.conditional_formatting:
+        for regra in formatacao.rules:
+            ws.conditional_formatting.add(str(formatacao.sqref), deepcopy(regra))
+    for imagem in ws_base._images:
+        nova = Image(BytesIO(imagem._data()))
+        nova.anchor = deepcopy(imagem.anchor)
+        nova.width, nova.height = imagem.width, imagem.height
+        ws.add_image(nova)
+    if ws_base._charts:
+        logging.warning(f"[ANUAL] {len(ws_base._charts)} gráficos do template não são copiados para as abas dos períodos.")
+
+    ws.freeze_panes = ws_base.freeze_panes
+    ws.print_title_rows = ws_base.print_title_rows
+    ws.print_title_cols = ws_base.print_title_cols
+    ws._print_area = copy(ws_base._print_area)
+    ws.protection = copy(ws_base.protection)
+    return ws
+
+def preencher_apuracao_anual(
+    template_path: Path,
+    periodos: List[Dict],
+    tipo_setor: str = 'Comercio',
+    caminho_saida: Optional[Path] = None
+) -> str:
+    """
+    Gera um único workbook de apuração com uma aba por período e uma aba de
+    consolidação anual, todas a partir do mesmo layout de template.
+
+    Cada período é um dict com 'periodo' (rótulo da aba), 'df_entradas',
+    'df_saidas' e, no moveleiro, 'df_base_difal'. Os totalizadores podem vir de
+    vários SPEDs (periodos_de_speds) ou do cache (periodos_de_relatorios). A aba
+    anual é preenchida com a soma dos totalizadores (DataFrames), sem reler as abas.
+    """
+    validar_setor(tipo_setor)
+    if not periodos:
+        raise ValueError("Nenhum período informado para a apuração anual.")
+
+    path_origem = Path(template_path)
+    path_destino = Path(caminho_saida) if caminho_saida else path_origem.parent / f"{path_origem.stem}_ANUAL_PREENCHIDA{path_origem.suffix}"
+
+    logging.info(f"[ANUAL] Carregando template: {path_origem} ({len(periodos)} períodos, setor {tipo_setor})")
+    wb = load_workbook(path_origem)
+    ws_base = wb["Entradas"] if "Entradas" in wb.sheetnames else wb.active
+
+    # --- Uma aba por período (cópia do layout antes de preencher a base) ---
+    for periodo in periodos:
+        rotulo = periodo.get('periodo')
+        ws = _copiar_layout(wb, ws_base)
+        ws.title = _titulo_aba(rotulo, wb.sheetnames)
+        logging.info(f"[ANUAL] Preenchendo aba do período {rotulo}...")
+
+        df_difal = periodo.get('df_base_difal')
+        preencher_aba_setor(tipo_setor, ws, periodo.get('df_entradas'), periodo.get('df_saidas'),
+                            df_difal.copy() if df_difal is not None else None)
+
+    # --- Consolidação anual a partir dos totalizadores ---
+    logging.info("[ANUAL] Consolidando totalizadores do ano...")
+    df_ent_anual = consolidar_totalizadores([p.get('df_entradas') for p in periodos])
+    df_sai_anual = consolidar_totalizadores([p.get('df_saidas') for p in periodos])
+    df_difal_anual = _consolidar_difal([p.get('df_base_difal') for p in periodos])
+
+    ws_base.title = _titulo_aba("Consolidado Anual", [t for t in wb.sheetnames if t != ws_base.title])
+    preencher_aba_setor(tipo_setor, ws_base, df_ent_anual, df_sai_anual, df_difal_anual if not df_difal_anual.empty else None)
+    wb.move_sheet(ws_base, offset=len(wb.sheetnames) - 1 - wb.sheetnames.index(ws_base.title))
+
+    ws_resumo = wb.create_sheet(_titulo_aba("Resumo Anual", wb.sheetnames))
+    _escrever_resumo_anual(ws_resumo, periodos, df_ent_anual, df_sai_anual)
+
+    wb.active = wb.sheetnames.index(ws_base.title)
+    wb.save(path_destino)
+    logging.info(f"[ANUAL] Sucesso! Arquivo gerado: {path_destino}")
+    return str(path_destino)
@@ -5,24 +5,14 @@ import numpy as np
 from pathlib import Path
 from openpyxl import load_workbook
 from openpyxl.worksheet.worksheet import Worksheet
-from openpyxl.cell.cell import MergedCell
 from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
-from typing import List
+from typing import Dict, List, Optional
+from .escritor_planilha import EscritorPlanilha
 
 # ==============================================================================
 # 1. FUNÇÕES AUXILIARES E ESTILO
 # ==============================================================================
 
-def _ler_valor_mesclado(ws: Worksheet, linha: int, coluna: int):
-    """Lê valor lidando com merge."""
-    cell = ws.cell(row=linha, column=coluna)
-    if cell.value is None:
-        for merged_range in ws.merged_cells.ranges:
-            if cell.coordinate in merged_range:
-                top_left_cell = ws.cell(row=merged_range.min_row, column=merged_range.min_col)
-                return top_left_cell.value
-    return cell.value
-
 def _limpar_cfop_excel(valor_celula) -> List[str]:
     if not valor_celula: return []
     s = str(valor_celula)
@@ -31,18 +21,6 @@ def _limpar_cfop_excel(valor_celula) -> List[str]:
     partes = s.split('/')
     return [p for p in partes if p.isdigit()]
 
-def _escrever_seguro(ws: Worksheet, linha: int, coluna: int, valor: float):
-    cell = ws.cell(row=linha, column=coluna)
-    if isinstance(cell, MergedCell):
-        for merged_range in ws.merged_cells.ranges:
-            if cell.coordinate in merged_range:
-                top_left_cell = ws.cell(row=merged_range.min_row, column=merged_range.min_col)
-                top_left_cell.value = valor
-                return cell
-    else:
-        cell.value = valor
-        return cell
-
 def _aplicar_estilo_tabela_sobras(ws, linha, col_inicial, col_final, is_header=False, cor_header="4F81BD"):
     """Estilização do relatório lateral."""
     thick = Side(border_style="medium", color="000000")
@@ -63,16 +41,16 @@ def _aplicar_estilo_tabela_sobras(ws, linha, col_inicial, col_final, is_header=F
                 cell.alignment = Alignment(horizontal="right")
                 cell.number_format = '#,##0.00'
 
-def _gerar_relatorio_sobras(ws: Worksheet, df: pd.DataFrame, col_inicio: int, titulo_bloco: str, cor_fundo: str):
+def _gerar_relatorio_sobras(ws: Worksheet, escritor: EscritorPlanilha, df: pd.DataFrame, col_inicio: int, titulo_bloco: str, cor_fundo: str) -> Optional[pd.DataFrame]:
     """Gera o relatório de itens não utilizados na lateral."""
-    if df is None or df.empty: return
+    if df is None or df.empty: return None
 
     logging.info(f"[E-COMMERCE] Gerando relatório de sobras: {titulo_bloco}")
 
     mask_sobra = (~df['Utilizado']) & (df['Total Operação'] > 0.01)
     df_sobra = df.loc[mask_sobra].copy().sort_values(by='Total Operação', ascending=False)
 
-    if df_sobra.empty: return
+    if df_sobra.empty: return df_sobra
 
     C_CFOP = col_inicio
     C_ALIQ = col_inicio + 1
@@ -84,7 +62,7 @@ def _gerar_relatorio_sobras(ws: Worksheet, df: pd.DataFrame, col_inicio: int, ti
     LINHA = 5
 
     # Título
-    ws.merge_cells(start_row=LINHA-2, start_column=col_inicio, end_row=LINHA-2, end_column=C_MOTIVO)
+    escritor.mesclar(start_row=LINHA-2, start_column=col_inicio, end_row=LINHA-2, end_column=C_MOTIVO)
     cell_title = ws.cell(row=LINHA-2, column=col_inicio, value=f"⚠️ SOBRAS - {titulo_bloco}")
     cell_title.font = Font(bold=True, color="FFFFFF", size=11)
     cell_title.fill = PatternFill(start_color=cor_fundo, end_color=cor_fundo, fill_type="solid")
@@ -92,7 +70,7 @@ def _gerar_relatorio_sobras(ws: Worksheet, df: pd.DataFrame, col_inicio: int, ti
 
     # Cabeçalho da Tabela
     titulos = {C_CFOP: "CFOP", C_ALIQ: "Aliq %", C_VALOR: "Vlr Contábil", C_BASE: "Base Calc", C_ICMS: "ICMS", C_MOTIVO: "Provável Motivo"}
-    for col, titulo in titulos.items(): _escrever_seguro(ws, LINHA-1, col, titulo)
+    for col, titulo in titulos.items(): escritor.escrever(LINHA-1, col, titulo)
     _aplicar_estilo_tabela_sobras(ws, LINHA-1, col_inicio, C_MOTIVO, is_header=True, cor_header=cor_fundo)
 
     # Dados
@@ -107,16 +85,18 @@ def _gerar_relatorio_sobras(ws: Worksheet, df: pd.DataFrame, col_inicio: int, ti
         elif cfop in ['1403', '2403', '5403', '6403']: motivo = "ST (Aliq 0)"
         elif cfop.startswith('59') or cfop.startswith('69'): motivo = "Remessa/Isento"
 
-        _escrever_seguro(ws, LINHA, C_CFOP, cfop)
-        _escrever_seguro(ws, LINHA, C_ALIQ, aliq)
-        _escrever_seguro(ws, LINHA, C_VALOR, row['Total Operação'])
-        _escrever_seguro(ws, LINHA, C_BASE, row['Base de Cálculo ICMS'])
-        _escrever_seguro(ws, LINHA, C_ICMS, row['Total ICMS'])
-        _escrever_seguro(ws, LINHA, C_MOTIVO, motivo)
+        escritor.escrever(LINHA, C_CFOP, cfop)
+        escritor.escrever(LINHA, C_ALIQ, aliq)
+        escritor.escrever(LINHA, C_VALOR, row['Total Operação'])
+        escritor.escrever(LINHA, C_BASE, row['Base de Cálculo ICMS'])
+        escritor.escrever(LINHA, C_ICMS, row['Total ICMS'])
+        escritor.escrever(LINHA, C_MOTIVO, motivo)
 
         _aplicar_estilo_tabela_sobras(ws, LINHA, col_inicio, C_MOTIVO, is_header=False)
         LINHA += 1
 
+    return df_sobra
+
 def _preparar_dataframe(df_orig: pd.DataFrame) -> pd.DataFrame:
     if df_orig is None or df_orig.empty:
         return pd.DataFrame()
@@ -142,15 +122,17 @@ def _preparar_dataframe(df_orig: pd.DataFrame) -> pd.DataFrame:
 # 2. LÓGICA MISTA INTELIGENTE (ENTRADAS E SAÍDAS NO MESMO QUADRO)
 # ==============================================================================
 
-def preencher_quadro_misto_ecommerce(ws: Worksheet, df_entradas: pd.DataFrame, df_saidas: pd.DataFrame):
+def preencher_quadro_misto_ecommerce(ws: Worksheet, df_entradas: pd.DataFrame, df_saidas: pd.DataFrame, escritor: Optional[EscritorPlanilha] = None) -> Dict[str, Optional[pd.DataFrame]]:
     logging.info("[E-COMMERCE] Iniciando preenchimento HÍBRIDO (Entradas + Saídas)...")
+    descarregar_ao_fim = escritor is None
+    if escritor is None: escritor = EscritorPlanilha(ws)
 
     df_ent = _preparar_dataframe(df_entradas)
     df_sai = _preparar_dataframe(df_saidas)
 
     def processar_range_inteligente(inicio, fim):
         for linha in range(inicio, fim + 1):
-            valor_cfop_excel = _ler_valor_mesclado(ws, linha, 2)
+            valor_cfop_excel = escritor.ler(linha, 2)
             lista_cfops = _limpar_cfop_excel(valor_cfop_excel)
 
             if not lista_cfops: continue
@@ -177,8 +159,8 @@ def preencher_quadro_misto_ecommerce(ws: Worksheet, df_entradas: pd.DataFrame, d
                 soma_base = df_filtered['Base de Cálculo ICMS'].sum()
                 soma_icms = df_filtered['Total ICMS'].sum()
 
-                if soma_base > 0: _escrever_seguro(ws, linha, 3, soma_base)
-                if soma_icms > 0: _escrever_seguro(ws, linha, 4, soma_icms)
+                if soma_base > 0: escritor.escrever(linha, 3, soma_base)
+                if soma_icms > 0: escritor.escrever(linha, 4, soma_icms)
 
     # --- Executa as faixas solicitadas ---
     processar_range_inteligente(9, 15)
@@ -190,25 +172,36 @@ def preencher_quadro_misto_ecommerce(ws: Worksheet, df_entradas: pd.DataFrame, d
     if not df_ent.empty:
         total_icms_ent = df_ent['Total ICMS'].sum()
         if total_icms_ent > 0:
-            _escrever_seguro(ws, 62, 5, total_icms_ent) # E62
-            _escrever_seguro(ws, 50, 3, total_icms_ent) # C50
+            escritor.escrever(62, 5, total_icms_ent) # E62
+            escritor.escrever(50, 3, total_icms_ent) # C50
 
     if not df_sai.empty:
         total_icms_sai = df_sai['Total ICMS'].sum()
         if total_icms_sai > 0:
-            _escrever_seguro(ws, 54, 5, total_icms_sai) # E54
+            escritor.escrever(54, 5, total_icms_sai) # E54
 
     # --- RELATÓRIOS LATERAIS ---
     # ATENÇÃO: Removido o relatório de ENTRADAS conforme solicitado.
 
     # Saídas na Coluna 16 (P) - Agora tem espaço pois tiramos as entradas
+    sobras = {'entradas': None, 'saidas': None}
     if not df_sai.empty:
-        _gerar_relatorio_sobras(ws, df_sai, 16, "SAÍDAS", "C65911")   # Laranja
+        sobras['saidas'] = _gerar_relatorio_sobras(ws, escritor, df_sai, 16, "SAÍDAS", "C65911")   # Laranja
+
+    if descarregar_ao_fim: escritor.descarregar()
+    return sobras
 
 # ==============================================================================
 # 3. FUNÇÃO PRINCIPAL (ORQUESTRADOR)
 # ==============================================================================
 
+def preencher_aba_ecommerce(ws: Worksheet, df_entradas: pd.DataFrame, df_saidas: pd.DataFrame = None) -> Dict[str, Optional[pd.DataFrame]]:
+    """Preenche o quadro misto em uma aba já carregada e retorna as sobras."""
+    escritor = EscritorPlanilha(ws)
+    sobras = preencher_quadro_misto_ecommerce(ws, df_entradas, df_saidas, escritor)
+    escritor.descarregar()
+    return sobras
+
 def preencher_template_ecommerce(template_path: Path, df_entradas: pd.DataFrame, df_saidas: pd.DataFrame = None) -> str:
     logging.info(f"[E-COMMERCE] Processando arquivo base: {template_path}")
 
@@ -225,7 +218,7 @@ def preencher_template_ecommerce(template_path: Path, df_entradas: pd.DataFrame,
         wb = load_workbook(path_destino)
         ws = wb["Entradas"] if "Entradas" in wb.sheetnames else wb.active
 
-        preencher_quadro_misto_ecommerce(ws, df_entradas, df_saidas)
+        preencher_aba_ecommerce(ws, df_entradas, df_saidas)
 
         wb.save(path_destino)
         logging.info(f"[E-COMMERCE] Sucesso! Arquivo gerado: {path_destino}")
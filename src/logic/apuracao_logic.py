@@ -5,9 +5,9 @@ import numpy as np
 from pathlib import Path
 from openpyxl import load_workbook
 from openpyxl.worksheet.worksheet import Worksheet
-from openpyxl.cell.cell import MergedCell
 from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
-from typing import List, Optional
+from typing import Dict, List, Optional
+from .escritor_planilha import EscritorPlanilha
 
 # ==============================================================================
 # 1. FUNÇÕES AUXILIARES E ESTILO
@@ -27,18 +27,6 @@ def _normalizar_aliquota(valor_celula) -> float:
         return val
     except (ValueError, TypeError): return 0.0
 
-def _escrever_seguro(ws: Worksheet, linha: int, coluna: int, valor: float):
-    cell = ws.cell(row=linha, column=coluna)
-    if isinstance(cell, MergedCell):
-        for merged_range in ws.merged_cells.ranges:
-            if cell.coordinate in merged_range:
-                top_left_cell = ws.cell(row=merged_range.min_row, column=merged_range.min_col)
-                top_left_cell.value = valor
-                return cell
-    else:
-        cell.value = valor
-        return cell
-
 def _aplicar_estilo_tabela(ws, linha, col_inicial, col_final, is_header=False, cor_header="4F81BD"):
     thin = Side(border_style="thin", color="000000")
     borda = Border(top=thin, left=thin, right=thin, bottom=thin)
@@ -56,13 +44,13 @@ def _aplicar_estilo_tabela(ws, linha, col_inicial, col_final, is_header=False, c
                 cell.alignment = Alignment(horizontal="right")
                 cell.number_format = '#,##0.00'
 
-def _escrever_placar_geral(ws, df, col_inicio, titulo_bloco, cor_fundo):
+def _escrever_placar_geral(ws, escritor: EscritorPlanilha, df, col_inicio, titulo_bloco, cor_fundo):
     total_contabil = df['Total Operação'].sum()
     total_base = df['Base de Cálculo ICMS'].sum()
     total_icms = df['Total ICMS'].sum()
 
     ws.cell(row=1, column=col_inicio).value = f"TOTAL GERAL SPED ({titulo_bloco})"
-    ws.merge_cells(start_row=1, start_column=col_inicio, end_row=1, end_column=col_inicio+2)
+    escritor.mesclar(start_row=1, start_column=col_inicio, end_row=1, end_column=col_inicio+2)
 
     cell_title = ws.cell(row=1, column=col_inicio)
     cell_title.fill = PatternFill(start_color=cor_fundo, end_color=cor_fundo, fill_type="solid")
@@ -85,21 +73,102 @@ def _escrever_placar_geral(ws, df, col_inicio, titulo_bloco, cor_fundo):
         c.font = Font(bold=True, size=11)
         c.alignment = Alignment(horizontal="right")
 
+class _IndiceTotalizadores:
+    """
+    Totalizadores indexados por CFOP, com as posições de cada CFOP ordenadas
+    pela Alíquota (SPED). Cada linha do template resolve seus candidatos pelo
+    índice (busca binária na alíquota) e o 'Utilizado' é rastreado em um
+    array booleano, sem máscaras sobre o DataFrame inteiro.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df.reset_index(drop=True)
+        n = len(self.df)
+
+        def _numerica(col: str) -> np.ndarray:
+            if col not in self.df.columns: return np.zeros(n, dtype=float)
+            return pd.to_numeric(self.df[col], errors='coerce').fillna(0.0).to_numpy(dtype=float)
+
+        self.cfop = self.df['CFOP (SPED)'].astype(str).str.strip().to_numpy(dtype=object)
+        self.aliq_sped = _numerica('Alíquota (SPED)')
+        self.aliq_icms = _numerica('Alíquota ICMS')
+        self.total_operacao = _numerica('Total Operação')
+        self.base_icms = _numerica('Base de Cálculo ICMS')
+        self.total_icms = _numerica('Total ICMS')
+        self.utilizado = np.zeros(n, dtype=bool)
+
+        # Ordena por (CFOP, Alíquota) e guarda a fatia de posições de cada CFOP
+        self._posicoes: Dict[str, np.ndarray] = {}
+        self._aliquotas: Dict[str, np.ndarray] = {}
+        if n:
+            ordem = np.lexsort((self.aliq_sped, self.cfop.astype(str)))
+            cfops_ordenados = self.cfop[ordem]
+            inicios = np.flatnonzero(np.r_[True, cfops_ordenados[1:] != cfops_ordenados[:-1]])
+            fins = np.r_[inicios[1:], n]
+            for ini, fim in zip(inicios, fins):
+                posicoes = ordem[ini:fim]
+                self._posicoes[cfops_ordenados[ini]] = posicoes
+                self._aliquotas[cfops_ordenados[ini]] = self.aliq_sped[posicoes]
+
+    def candidatos(self, lista_cfops: List[str], aliq_alvo: Optional[float] = None, tolerancia: float = 0.5) -> np.ndarray:
+        """Posições dos CFOPs pedidos; com aliq_alvo, só as que passam em np.isclose(atol=tolerancia)."""
+        partes = []
+        for cfop in dict.fromkeys(lista_cfops):
+            posicoes = self._posicoes.get(cfop)
+            if posicoes is None: continue
+            if aliq_alvo is not None:
+                # Mesmo limite do np.isclose (atol + rtol * |alvo|), com folga para a busca
+                limite = tolerancia + 1e-05 * abs(aliq_alvo) + 1e-9
+                aliquotas = self._aliquotas[cfop]
+                ini = np.searchsorted(aliquotas, aliq_alvo - limite, side='left')
+                fim = np.searchsorted(aliquotas, aliq_alvo + limite, side='right')
+                posicoes = posicoes[ini:fim]
+            partes.append(posicoes)
+
+        if not partes: return np.empty(0, dtype=np.intp)
+        pos = np.sort(np.concatenate(partes))
+        if aliq_alvo is not None:
+            pos = pos[np.isclose(self.aliq_sped[pos], aliq_alvo, atol=tolerancia)]
+        return pos
+
+    def condicao_igual(self, pos: np.ndarray) -> np.ndarray:
+        """Validação de igualdade padrão (-0.5% a +0.01%) entre Alíquota ICMS e Alíquota (SPED)."""
+        aliq_sped = self.aliq_sped[pos]
+        aliq_icms = self.aliq_icms[pos]
+        return (aliq_icms >= (aliq_sped - 0.5)) & (aliq_icms <= (aliq_sped + 0.01))
+
+    def somar(self, pos: np.ndarray):
+        """Marca as posições como utilizadas e retorna (contábil, base, icms)."""
+        self.utilizado[pos] = True
+        return self.total_operacao[pos].sum(), self.base_icms[pos].sum(), self.total_icms[pos].sum()
+
+    def sobras(self) -> pd.DataFrame:
+        mask_sobra = (~self.utilizado) & (self.total_operacao > 0.01)
+        df_sobra = self.df.loc[mask_sobra].copy()
+        df_sobra['Alíquota (SPED)'] = self.aliq_sped[mask_sobra]
+        df_sobra['Total Operação'] = self.total_operacao[mask_sobra]
+        df_sobra['Base de Cálculo ICMS'] = self.base_icms[mask_sobra]
+        df_sobra['Total ICMS'] = self.total_icms[mask_sobra]
+        return df_sobra.sort_values(by='Total Operação', ascending=False)
+
 # ==============================================================================
 # 2. ENTRADAS (06-26, 28-52, 53-56)
 # ==============================================================================
 
-def preencher_quadro_entradas(ws: Worksheet, df_totalizadores: pd.DataFrame):
+def preencher_quadro_entradas(ws: Worksheet, df_totalizadores: pd.DataFrame, escritor: Optional[EscritorPlanilha] = None) -> pd.DataFrame:
     logging.info("Iniciando preenchimento ENTRADAS...")
+    descarregar_ao_fim = escritor is None
+    if escritor is None: escritor = EscritorPlanilha(ws)
     df = df_totalizadores.copy()
-    df['Utilizado'] = False
 
     cols = ['Alíquota (SPED)', 'Alíquota ICMS', 'Total Operação', 'Base de Cálculo ICMS', 'Total ICMS']
     for col in cols:
         if col in df.columns:
             df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0.0)
 
-    _escrever_placar_geral(ws, df, col_inicio=17, titulo_bloco="ENTRADAS", cor_fundo="203764")
+    _escrever_placar_geral(ws, escritor, df, col_inicio=17, titulo_bloco="ENTRADAS", cor_fundo="203764")
+
+    indice = _IndiceTotalizadores(df)
 
     # --- Lógica ---
     def processar_linha_padrao(linha_num, regra_tipo):
@@ -110,76 +179,61 @@ def preencher_quadro_entradas(ws: Worksheet, df_totalizadores: pd.DataFrame):
         if not lista_cfops or aliq_cell is None: return
 
         # Filtro 1: Compatibilidade básica (Tolerância 0.5)
-        mask_target = (df['CFOP (SPED)'].isin(lista_cfops) &
-                       np.isclose(df['Alíquota (SPED)'], aliq_alvo, atol=0.5))
+        pos = indice.candidatos(lista_cfops, aliq_alvo, tolerancia=0.5)
 
         # --- PROTEÇÃO CONTRA SIMPLES NACIONAL ---
         # Se a linha da planilha pede 4% ou mais, NÃO aceitar notas < 4.0 (Simples)
         # Isso evita que a tolerância de 0.5 puxe notas de 3.5% para a linha de 4.0%
         if aliq_alvo >= 4.0:
-            mask_target = mask_target & (df['Alíquota (SPED)'] >= 4.0)
+            pos = pos[indice.aliq_sped[pos] >= 4.0]
         # ----------------------------------------
 
-        if not mask_target.any(): return
+        if pos.size == 0: return
 
         # Filtro 2: Validação de Igualdade Padrão (-0.5% a +0.01%)
-        condicao_igual_padrao = (
-            (df['Alíquota ICMS'] >= (df['Alíquota (SPED)'] - 0.5)) &
-            (df['Alíquota ICMS'] <= (df['Alíquota (SPED)'] + 0.01))
-        )
+        condicao_igual_padrao = indice.condicao_igual(pos)
 
         if regra_tipo == 'IGUAL':
             # --- REGRA DE EXCEÇÃO (CFOP 2102/2910 e Aliq > 7) ---
             condicao_excecao_cfop = (
-                df['CFOP (SPED)'].isin(['2102', '2910']) &
-                (df['Alíquota (SPED)'] > 7.0)
+                np.isin(indice.cfop[pos], ['2102', '2910']) &
+                (indice.aliq_sped[pos] > 7.0)
             )
-            mask = mask_target & (condicao_igual_padrao | condicao_excecao_cfop)
+            pos = pos[condicao_igual_padrao | condicao_excecao_cfop]
 
         else: # DIFERENTE
-            if aliq_alvo <= 7.0:
-                mask = mask_target # Aceita tudo se Alíquota da Planilha for <= 7%
-            else:
-                mask = mask_target & (~condicao_igual_padrao)
-
-        if mask.any(): df.loc[mask, 'Utilizado'] = True
+            if aliq_alvo > 7.0: # Aceita tudo se Alíquota da Planilha for <= 7%
+                pos = pos[~condicao_igual_padrao]
 
-        df_filtered = df.loc[mask]
-        if df_filtered.empty: return
+        if pos.size == 0: return
 
-        soma_contabil = df_filtered['Total Operação'].sum()
-        soma_base = df_filtered['Base de Cálculo ICMS'].sum()
-        soma_icms = df_filtered['Total ICMS'].sum()
-        if soma_contabil > 0: _escrever_seguro(ws, linha_num, 3, soma_contabil)
-        if soma_base > 0: _escrever_seguro(ws, linha_num, 5, soma_base)
-        if soma_icms > 0: _escrever_seguro(ws, linha_num, 13, soma_icms)
+        soma_contabil, soma_base, soma_icms = indice.somar(pos)
+        if soma_contabil > 0: escritor.escrever(linha_num, 3, soma_contabil)
+        if soma_base > 0: escritor.escrever(linha_num, 5, soma_base)
+        if soma_icms > 0: escritor.escrever(linha_num, 13, soma_icms)
 
     def processar_simples_entradas(linha_num):
         cfop_cell = ws.cell(row=linha_num, column=2).value
         lista_cfops = _limpar_cfop_excel(cfop_cell)
         if not lista_cfops: return
-        mask = (df['CFOP (SPED)'].isin(lista_cfops) & (df['Alíquota (SPED)'] < 4.0))
-        if mask.any(): df.loc[mask, 'Utilizado'] = True
-        df_filtered = df.loc[mask]
-        if df_filtered.empty: return
-
-        soma_contabil = df_filtered['Total Operação'].sum()
-        soma_base = df_filtered['Base de Cálculo ICMS'].sum()
-        soma_icms = df_filtered['Total ICMS'].sum()
-        if soma_contabil > 0: _escrever_seguro(ws, linha_num, 3, soma_contabil)
-        if soma_base > 0: _escrever_seguro(ws, linha_num, 5, soma_base)
-        if soma_icms > 0: _escrever_seguro(ws, linha_num, 7, soma_icms)
+        pos = indice.candidatos(lista_cfops)
+        pos = pos[indice.aliq_sped[pos] < 4.0]
+        if pos.size == 0: return
+
+        soma_contabil, soma_base, soma_icms = indice.somar(pos)
+        if soma_contabil > 0: escritor.escrever(linha_num, 3, soma_contabil)
+        if soma_base > 0: escritor.escrever(linha_num, 5, soma_base)
+        if soma_icms > 0: escritor.escrever(linha_num, 7, soma_icms)
 
     def listar_sobras_entradas():
         logging.info("Listando ENTRADAS não processadas...")
-        mask_sobra = (~df['Utilizado']) & (df['Total Operação'] > 0.01)
-        df_sobra = df.loc[mask_sobra].copy().sort_values(by='Total Operação', ascending=False)
+        df_sobra = indice.sobras()
 
         C_CFOP, C_ALIQ, C_VALOR, C_BASE, C_ICMS, C_MOTIVO = 15, 16, 17, 18, 19, 20
         LINHA = 5
 
         titulos = {C_CFOP: "CFOP", C_ALIQ: "Aliq %", C_VALOR: "Vlr Contábil", C_BASE: "Base Calc", C_ICMS: "ICMS", C_MOTIVO: "Motivo (Entrada)"}
-        for col, titulo in titulos.items(): _escrever_seguro(ws, 4, col, titulo)
+        for col, titulo in titulos.items(): escritor.escrever(4, col, titulo)
         _aplicar_estilo_tabela(ws, 4, 15, 20, is_header=True, cor_header="305496")
 
         for _, row in df_sobra.iterrows():
@@ -190,37 +244,44 @@ def preencher_quadro_entradas(ws: Worksheet, df_totalizadores: pd.DataFrame):
             if aliq == 0: motivo = "Alíquota Zero"
             if cfop in ['1403', '2403']: motivo = "ST (Aliq 0)"
 
-            _escrever_seguro(ws, LINHA, C_CFOP, cfop)
-            _escrever_seguro(ws, LINHA, C_ALIQ, aliq)
-            _escrever_seguro(ws, LINHA, C_VALOR, row['Total Operação'])
-            _escrever_seguro(ws, LINHA, C_BASE, row['Base de Cálculo ICMS'])
-            _escrever_seguro(ws, LINHA, C_ICMS, row['Total ICMS'])
-            _escrever_seguro(ws, LINHA, C_MOTIVO, motivo)
+            escritor.escrever(LINHA, C_CFOP, cfop)
+            escritor.escrever(LINHA, C_ALIQ, aliq)
+            escritor.escrever(LINHA, C_VALOR, row['Total Operação'])
+            escritor.escrever(LINHA, C_BASE, row['Base de Cálculo ICMS'])
+            escritor.escrever(LINHA, C_ICMS, row['Total ICMS'])
+            escritor.escrever(LINHA, C_MOTIVO, motivo)
             _aplicar_estilo_tabela(ws, LINHA, 15, 20, is_header=False)
             LINHA += 1
+        return df_sobra
 
     # --- EXECUÇÃO ENTRADAS (06-26, 28-52, 53-56) ---
     for linha in range(6, 27): processar_linha_padrao(linha, 'IGUAL')
     for linha in range(28, 53): processar_linha_padrao(linha, 'DIFERENTE')
     for linha in range(53, 57): processar_simples_entradas(linha)
-    listar_sobras_entradas()
+    df_sobra = listar_sobras_entradas()
+
+    if descarregar_ao_fim: escritor.descarregar()
+    return df_sobra
 
 # ==============================================================================
 # 3. SAÍDAS (75-87, 98-114, 116-148)
 # ==============================================================================
 
-def preencher_quadro_saidas(ws: Worksheet, df_saidas: pd.DataFrame):
+def preencher_quadro_saidas(ws: Worksheet, df_saidas: pd.DataFrame, escritor: Optional[EscritorPlanilha] = None) -> Optional[pd.DataFrame]:
     logging.info("Iniciando preenchimento SAÍDAS...")
-    if df_saidas is None or df_saidas.empty: return
+    if df_saidas is None or df_saidas.empty: return None
+    descarregar_ao_fim = escritor is None
+    if escritor is None: escritor = EscritorPlanilha(ws)
     df = df_saidas.copy()
-    df['Utilizado'] = False
 
     cols = ['Alíquota (SPED)', 'Alíquota ICMS', 'Total Operação', 'Base de Cálculo ICMS', 'Total ICMS']
     for col in cols:
         if col in df.columns:
             df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0.0)
 
-    _escrever_placar_geral(ws, df, col_inicio=24, titulo_bloco="SAÍDAS", cor_fundo="974706")
+    _escrever_placar_geral(ws, escritor, df, col_inicio=24, titulo_bloco="SAÍDAS", cor_fundo="974706")
+
+    indice = _IndiceTotalizadores(df)
 
     COL_CONTABIL, COL_BASE, COL_ICMS = 5, 7, 13
 
@@ -240,72 +301,63 @@ def preencher_quadro_saidas(ws: Worksheet, df_saidas: pd.DataFrame):
         if not lista_cfops: return
 
         # Filtro 1 (Tolerância AJUSTADA para 0.5)
-        mask_target = (df['CFOP (SPED)'].isin(lista_cfops))
         if aliq_cell is not None:
-            mask_target = mask_target & np.isclose(df['Alíquota (SPED)'], aliq_alvo, atol=0.5)
+            pos = indice.candidatos(lista_cfops, aliq_alvo, tolerancia=0.5)
+        else:
+            pos = indice.candidatos(lista_cfops)
 
         # --- PROTEÇÃO CONTRA SIMPLES NACIONAL (Também nas Saídas) ---
         if aliq_cell is not None and aliq_alvo >= 4.0:
-            mask_target = mask_target & (df['Alíquota (SPED)'] >= 4.0)
+            pos = pos[indice.aliq_sped[pos] >= 4.0]
         # ------------------------------------------------------------
 
-        if not mask_target.any(): return
+        if pos.size == 0: return
 
         # Filtro 2 (Assimétrico -0.5%)
-        condicao_igual = (
-            (df['Alíquota ICMS'] >= (df['Alíquota (SPED)'] - 0.5)) &
-            (df['Alíquota ICMS'] <= (df['Alíquota (SPED)'] + 0.01))
-        )
+        condicao_igual = indice.condicao_igual(pos)
 
         if regra_tipo == 'IGUAL':
-            mask = mask_target & condicao_igual
+            selecao = condicao_igual
         elif regra_tipo == 'DIFERENTE':
-            mask = mask_target & (~condicao_igual)
-        elif regra_tipo == 'GENERICA':
-            mask = mask_target
+            selecao = ~condicao_igual
+        else: # GENERICA
+            selecao = np.ones(pos.size, dtype=bool)
 
         if regime_base == 'CHEIA':
-            mask = mask_target & condicao_igual
+            selecao = condicao_igual
         elif regime_base == 'REDUZIDA':
-            mask = mask_target & (~condicao_igual)
+            selecao = ~condicao_igual
 
-        if mask.any(): df.loc[mask, 'Utilizado'] = True
-        df_filtered = df.loc[mask]
-        if df_filtered.empty: return
+        pos = pos[selecao]
+        if pos.size == 0: return
 
-        soma_contabil = df_filtered['Total Operação'].sum()
-        soma_base = df_filtered['Base de Cálculo ICMS'].sum()
-        soma_icms = df_filtered['Total ICMS'].sum()
+        soma_contabil, soma_base, soma_icms = indice.somar(pos)
 
-        if soma_contabil > 0: _escrever_seguro(ws, linha_num, COL_CONTABIL, soma_contabil)
-        if soma_base > 0: _escrever_seguro(ws, linha_num, COL_BASE, soma_base)
-        if soma_icms > 0: _escrever_seguro(ws, linha_num, COL_ICMS, soma_icms)
+        if soma_contabil > 0: escritor.escrever(linha_num, COL_CONTABIL, soma_contabil)
+        if soma_base > 0: escritor.escrever(linha_num, COL_BASE, soma_base)
+        if soma_icms > 0: escritor.escrever(linha_num, COL_ICMS, soma_icms)
 
     def processar_saida_simples(linha_num):
         cfop_cell = ws.cell(row=linha_num, column=2).value
         lista_cfops = _limpar_cfop_excel(cfop_cell)
         if not lista_cfops: return
-        mask = (df['CFOP (SPED)'].isin(lista_cfops) & (df['Alíquota (SPED)'] < 4.0))
-        if mask.any(): df.loc[mask, 'Utilizado'] = True
-        df_filtered = df.loc[mask]
-        if df_filtered.empty: return
-        soma_contabil = df_filtered['Total Operação'].sum()
-        soma_base = df_filtered['Base de Cálculo ICMS'].sum()
-        soma_icms = df_filtered['Total ICMS'].sum()
-        if soma_contabil > 0: _escrever_seguro(ws, linha_num, COL_CONTABIL, soma_contabil)
-        if soma_base > 0: _escrever_seguro(ws, linha_num, COL_BASE, soma_base)
-        if soma_icms > 0: _escrever_seguro(ws, linha_num, COL_ICMS, soma_icms)
+        pos = indice.candidatos(lista_cfops)
+        pos = pos[indice.aliq_sped[pos] < 4.0]
+        if pos.size == 0: return
+        soma_contabil, soma_base, soma_icms = indice.somar(pos)
+        if soma_contabil > 0: escritor.escrever(linha_num, COL_CONTABIL, soma_contabil)
+        if soma_base > 0: escritor.escrever(linha_num, COL_BASE, soma_base)
+        if soma_icms > 0: escritor.escrever(linha_num, COL_ICMS, soma_icms)
 
     def listar_sobras_saidas():
         logging.info("Listando SAÍDAS não processadas...")
-        mask_sobra = (~df['Utilizado']) & (df['Total Operação'] > 0.01)
-        df_sobra = df.loc[mask_sobra].copy().sort_values(by='Total Operação', ascending=False)
+        df_sobra = indice.sobras()
 
         C_CFOP, C_ALIQ, C_VALOR, C_BASE, C_ICMS, C_MOTIVO = 22, 23, 24, 25, 26, 27
         LINHA = 5
 
         titulos = {C_CFOP: "CFOP", C_ALIQ: "Aliq %", C_VALOR: "Vlr Contábil", C_BASE: "Base Calc", C_ICMS: "ICMS", C_MOTIVO: "Motivo (Saída)"}
-        for col, titulo in titulos.items(): _escrever_seguro(ws, 4, col, titulo)
+        for col, titulo in titulos.items(): escritor.escrever(4, col, titulo)
         _aplicar_estilo_tabela(ws, 4, 22, 27, is_header=True, cor_header="C65911")
 
         for _, row in df_sobra.iterrows():
@@ -315,14 +367,15 @@ def preencher_quadro_saidas(ws: Worksheet, df_saidas: pd.DataFrame):
             motivo = "Não mapeado"
             if aliq == 0: motivo = "Alíquota Zero"
 
-            _escrever_seguro(ws, LINHA, C_CFOP, cfop)
-            _escrever_seguro(ws, LINHA, C_ALIQ, aliq)
-            _escrever_seguro(ws, LINHA, C_VALOR, row['Total Operação'])
-            _escrever_seguro(ws, LINHA, C_BASE, row['Base de Cálculo ICMS'])
-            _escrever_seguro(ws, LINHA, C_ICMS, row['Total ICMS'])
-            _escrever_seguro(ws, LINHA, C_MOTIVO, motivo)
+            escritor.escrever(LINHA, C_CFOP, cfop)
+            escritor.escrever(LINHA, C_ALIQ, aliq)
+            escritor.escrever(LINHA, C_VALOR, row['Total Operação'])
+            escritor.escrever(LINHA, C_BASE, row['Base de Cálculo ICMS'])
+            escritor.escrever(LINHA, C_ICMS, row['Total ICMS'])
+            escritor.escrever(LINHA, C_MOTIVO, motivo)
             _aplicar_estilo_tabela(ws, LINHA, 22, 27, is_header=False)
             LINHA += 1
+        return df_sobra
 
     # --- EXECUÇÃO SAÍDAS (75-87, 98-114, 116-148) ---
     for linha in range(75, 88):   processar_saida_padrao(linha, 'DIFERENTE')
@@ -343,12 +396,26 @@ def preencher_quadro_saidas(ws: Worksheet, df_saidas: pd.DataFrame):
         else:
             processar_saida_padrao(linha, 'GENERICA')
 
-    listar_sobras_saidas()
+    df_sobra = listar_sobras_saidas()
+
+    if descarregar_ao_fim: escritor.descarregar()
+    return df_sobra
 
 # ==============================================================================
 # 4. PRINCIPAL
 # ==============================================================================
 
+def preencher_aba_apuracao(ws: Worksheet, df_entradas: pd.DataFrame, df_saidas: pd.DataFrame = None) -> Dict[str, Optional[pd.DataFrame]]:
+    """Preenche os quadros de entradas e saídas em uma aba já carregada e retorna as sobras."""
+    sobras = {'entradas': None, 'saidas': None}
+    escritor = EscritorPlanilha(ws)
+    if df_entradas is not None and not df_entradas.empty:
+        sobras['entradas'] = preencher_quadro_entradas(ws, df_entradas, escritor)
+    if df_saidas is not None and not df_saidas.empty:
+        sobras['saidas'] = preencher_quadro_saidas(ws, df_saidas, escritor)
+    escritor.descarregar()
+    return sobras
+
 def preencher_template_apuracao(template_path: Path, df_entradas: pd.DataFrame, df_saidas: pd.DataFrame = None) -> str:
     logging.info(f"Processando arquivo base: {template_path}")
     if (df_entradas is None or df_entradas.empty) and (df_saidas is None or df_saidas.empty):
@@ -364,10 +431,7 @@ def preencher_template_apuracao(template_path: Path, df_entradas: pd.DataFrame,
         wb = load_workbook(path_destino)
         ws = wb["Entradas"] if "Entradas" in wb.sheetnames else wb.active
 
-        if df_entradas is not None and not df_entradas.empty:
-            preencher_quadro_entradas(ws, df_entradas)
-        if df_saidas is not None and not df_saidas.empty:
-            preencher_quadro_saidas(ws, df_saidas)
+        preencher_aba_apuracao(ws, df_entradas, df_saidas)
 
         wb.save(path_destino)
         logging.info(f"Sucesso! Arquivo gerado: {path_destino}")
@@ -0,0 +1,157 @@
+import logging
+import os
+import re
+import pickle
+import pandas as pd
+from collections import Counter
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from openpyxl import load_workbook
+from typing import Callable, Dict, List, Optional
+
+from .setores_apuracao import SETORES_APURACAO, preencher_aba_setor, validar_setor
+
+# ==============================================================================
+# 1. TEMPLATE EM MEMÓRIA
+# ==============================================================================
+
+# Template já parseado e serializado (pickle), recebido uma vez por worker
+_TEMPLATE_SERIALIZADO: Optional[bytes] = None
+
+# ==============================================================================
+# 2. FUNÇÕES AUXILIARES (EXECUTADAS NOS WORKERS)
+# ==============================================================================
+
+def _serializar_template(template_path: Path) -> bytes:
+    """Lê o template do disco uma única vez e guarda o workbook em memória serializado."""
+    wb = load_workbook(template_path)
+    return pickle.dumps(wb, protocol=pickle.HIGHEST_PROTOCOL)
+
+def _inicializar_worker(template_serializado: bytes):
+    global _TEMPLATE_SERIALIZADO
+    _TEMPLATE_SERIALIZADO = template_serializado
+
+def _nome_arquivo_seguro(nome: str) -> str:
+    return re.sub(r'[^\w\-. ]', '_', str(nome)).strip() or "job"
+
+def _nome_job(job: Dict, i: int) -> str:
+    """Parte variável do nome do arquivo: <nome>[_<periodo>] (job<n> sem nome)."""
+    nome = job.get('nome') or f"job{i + 1}"
+    if job.get('periodo'): nome = f"{nome}_{job['periodo']}"
+    return _nome_arquivo_seguro(nome)
+
+def _resumir_sobras(df_sobra: Optional[pd.DataFrame]) -> Dict:
+    if df_sobra is None or df_sobra.empty:
+        return {'qtd': 0, 'valor': 0.0}
+    return {'qtd': int(len(df_sobra)), 'valor': float(df_sobra['Total Operação'].sum())}
+
+def _preencher_job(tipo_setor: str, job: Dict, caminho_destino: str, template_serializado: Optional[bytes] = None) -> Dict:
+    """Clona o template em memória, preenche a aba de um job e salva o resultado."""
+    wb = pickle.loads(template_serializado or _TEMPLATE_SERIALIZADO)
+    ws = wb["Entradas"] if "Entradas" in wb.sheetnames else wb.active
+
+    sobras = preencher_aba_setor(tipo_setor, ws, job.get('df_entradas'), job.get('df_saidas'), job.get('df_base_difal'))
+
+    wb.save(caminho_destino)
+
+    return {
+        'caminho': caminho_destino,
+        'sobras_entradas': _resumir_sobras(sobras.get('entradas')),
+        'sobras_saidas': _resumir_sobras(sobras.get('saidas')),
+    }
+
+# ==============================================================================
+# 3. FUNÇÃO PRINCIPAL (LOTE)
+# ==============================================================================
+
+def preencher_templates_em_lote(
+    template_path: Path,
+    jobs: List[Dict],
+    tipo_setor: str = 'Comercio',
+    pasta_saida: Optional[Path] = None,
+    max_workers: Optional[int] = None,
+    progress_callback: Optional[Callable[[float], None]] = None
+) -> List[Dict]:
+    """
+    Preenche o mesmo template de apuração para várias empresas/períodos.
+
+    Cada job é um dict com 'nome', 'df_entradas', 'df_saidas' e, opcionais,
+    'periodo' e (moveleiro) 'df_base_difal'. O template é lido do disco uma
+    única vez; cada worker recebe o workbook serializado e gera
+    <template>_<nome>[_<periodo>]<sufixo>.xlsx. Dois jobs com o mesmo arquivo de
+    saída (ex.: mesmo cliente em dois períodos sem 'periodo') geram ValueError
+    antes de qualquer preenchimento.
+
+    Retorna, na ordem dos jobs, um resumo com nome, status, caminho e as sobras
+    (quantidade e valor contábil) de entradas e saídas.
+    """
+    validar_setor(tipo_setor)
+
+    path_origem = Path(template_path)
+    pasta = Path(pasta_saida) if pasta_saida else path_origem.parent
+    pasta.mkdir(parents=True, exist_ok=True)
+    _, sufixo = SETORES_APURACAO[tipo_setor]
+
+    nomes = [_nome_job(job, i) for i, job in enumerate(jobs)]
+    contagem = Counter(nome.casefold() for nome in nomes) # Windows não diferencia maiúsculas no nome do arquivo
+    repetidos = sorted({nome for nome in nomes if contagem[nome.casefold()] > 1})
+    if repetidos:
+        raise ValueError(f"Jobs com o mesmo arquivo de saída (informe 'periodo' ou nomes distintos): {', '.join(repetidos)}")
+
+    logging.info(f"[LOTE] Carregando template uma única vez: {path_origem}")
+    template_serializado = _serializar_template(path_origem)
+
+    resumo: List[Dict] = []
+    pendentes = []
+    for i, (job, nome) in enumerate(zip(jobs, nomes)):
+        item = {'nome': nome, 'status': 'ignorado', 'caminho': None,
+                'sobras_entradas': _resumir_sobras(None), 'sobras_saidas': _resumir_sobras(None), 'erro': None}
+        resumo.append(item)
+
+        df_ent, df_sai = job.get('df_entradas'), job.get('df_saidas')
+        if (df_ent is None or df_ent.empty) and (df_sai is None or df_sai.empty):
+            logging.warning(f"[LOTE] Job '{nome}' sem totalizadores. Ignorado.")
+            continue
+
+        destino = pasta / f"{path_origem.stem}_{nome}{sufixo}{path_origem.suffix}"
+        pendentes.append((i, job, str(destino)))
+
+    if not pendentes:
+        return resumo
+
+    total = len(pendentes)
+    concluidos = 0
+
+    def _registrar(i: int, resultado: Optional[Dict], erro: Optional[Exception]):
+        nonlocal concluidos
+        concluidos += 1
+        if erro is not None:
+            logging.error(f"[LOTE] Erro no job '{resumo[i]['nome']}': {erro}")
+            resumo[i].update({'status': 'erro', 'erro': str(erro)})
+        else:
+            resumo[i].update(resultado)
+            resumo[i]['status'] = 'ok'
+            logging.info(f"[LOTE] Job '{resumo[i]['nome']}' gerado: {resultado['caminho']}")
+        if progress_callback: progress_callback(concluidos / total)
+
+    n_workers = max_workers or min(total, os.cpu_count() or 1)
+
+    if n_workers <= 1 or total == 1:
+        for i, job, destino in pendentes:
+            try:
+                _registrar(i, _preencher_job(tipo_setor, job, destino, template_serializado), None)
+            except Exception as e:
+                _registrar(i, None, e)
+        return resumo
+
+    logging.info(f"[LOTE] Preenchendo {total} apurações em {n_workers} processos...")
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_inicializar_worker, initargs=(template_serializado,)) as executor:
+        futures = {executor.submit(_preencher_job, tipo_setor, job, destino): i for i, job, destino in pendentes}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                _registrar(i, future.result(), None)
+            except Exception as e:
+                _registrar(i, None, e)
+
+    return resumo
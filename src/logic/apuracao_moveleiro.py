@@ -5,9 +5,9 @@ import numpy as np
 from pathlib import Path
 from openpyxl import load_workbook
 from openpyxl.worksheet.worksheet import Worksheet
-from openpyxl.cell.cell import MergedCell
 from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
-from typing import List, Optional
+from typing import Dict, List, Optional
+from .escritor_planilha import EscritorPlanilha
 
 # ==============================================================================
 # 1. FUNÇÕES AUXILIARES E ESTILO
@@ -20,19 +20,6 @@ def _limpar_cfop_excel(valor_celula) -> List[str]:
     partes = s.split('/')
     return [p for p in partes if p.isdigit()]
 
-def _escrever_seguro(ws: Worksheet, linha: int, coluna: int, valor: float):
-    """Escreve em células mescladas ou normais."""
-    cell = ws.cell(row=linha, column=coluna)
-    if isinstance(cell, MergedCell):
-        for merged_range in ws.merged_cells.ranges:
-            if cell.coordinate in merged_range:
-                top_left_cell = ws.cell(row=merged_range.min_row, column=merged_range.min_col)
-                top_left_cell.value = valor
-                return cell
-    else:
-        cell.value = valor
-        return cell
-
 def _aplicar_estilo_tabela_sobras(ws, linha, col_inicial, col_final, is_header=False, cor_header="4F81BD"):
     """Aplica bordas e cores para o quadro de sobras."""
     thick = Side(border_style="medium", color="000000")
@@ -55,7 +42,7 @@ def _aplicar_estilo_tabela_sobras(ws, linha, col_inicial, col_final, is_header=F
                 cell.alignment = Alignment(horizontal="right")
                 cell.number_format = '#,##0.00'
 
-def _gerar_relatorio_sobras(ws: Worksheet, df: pd.DataFrame, col_inicio: int, titulo_bloco: str, cor_fundo: str):
+def _gerar_relatorio_sobras(ws: Worksheet, escritor: EscritorPlanilha, df: pd.DataFrame, col_inicio: int, titulo_bloco: str, cor_fundo: str) -> pd.DataFrame:
     """Gera a tabela lateral com as notas não utilizadas."""
     logging.info(f"[MOVELEIRO] Gerando relatório de sobras: {titulo_bloco}")
 
@@ -64,7 +51,7 @@ def _gerar_relatorio_sobras(ws: Worksheet, df: pd.DataFrame, col_inicio: int, ti
     df_sobra = df.loc[mask_sobra].copy().sort_values(by='Total Operação', ascending=False)
 
     if df_sobra.empty:
-        return
+        return df_sobra
 
     # Definição das colunas relativas ao inicio
     C_CFOP = col_inicio
@@ -77,7 +64,7 @@ def _gerar_relatorio_sobras(ws: Worksheet, df: pd.DataFrame, col_inicio: int, ti
     LINHA = 5 # Linha inicial do relatório
 
     # Título Geral
-    ws.merge_cells(start_row=LINHA-2, start_column=col_inicio, end_row=LINHA-2, end_column=C_MOTIVO)
+    escritor.mesclar(start_row=LINHA-2, start_column=col_inicio, end_row=LINHA-2, end_column=C_MOTIVO)
     cell_title = ws.cell(row=LINHA-2, column=col_inicio, value=f"⚠️ SOBRAS - {titulo_bloco}")
     cell_title.font = Font(bold=True, color="FFFFFF", size=11)
     cell_title.fill = PatternFill(start_color=cor_fundo, end_color=cor_fundo, fill_type="solid")
@@ -86,7 +73,7 @@ def _gerar_relatorio_sobras(ws: Worksheet, df: pd.DataFrame, col_inicio: int, ti
     # Cabeçalhos
     titulos = {C_CFOP: "CFOP", C_ALIQ: "Aliq %", C_VALOR: "Vlr Contábil", C_BASE: "Base Calc", C_ICMS: "ICMS", C_MOTIVO: "Provável Motivo"}
     for col, titulo in titulos.items():
-        _escrever_seguro(ws, LINHA-1, col, titulo)
+        escritor.escrever(LINHA-1, col, titulo)
     _aplicar_estilo_tabela_sobras(ws, LINHA-1, col_inicio, C_MOTIVO, is_header=True, cor_header=cor_fundo)
 
     # Preenchimento
@@ -102,18 +89,20 @@ def _gerar_relatorio_sobras(ws: Worksheet, df: pd.DataFrame, col_inicio: int, ti
         elif cfop in ['1403', '2403', '6403', '5403']: motivo = "Subst. Tributária"
         elif cfop.startswith('59') or cfop.startswith('69') or cfop.startswith('19') or cfop.startswith('29'): motivo = "Outras/Isentas"
 
-        _escrever_seguro(ws, LINHA, C_CFOP, cfop)
-        _escrever_seguro(ws, LINHA, C_ALIQ, aliq)
-        _escrever_seguro(ws, LINHA, C_VALOR, row['Total Operação'])
-        _escrever_seguro(ws, LINHA, C_BASE, row['Base de Cálculo ICMS'])
-        _escrever_seguro(ws, LINHA, C_ICMS, row['Total ICMS'])
-        _escrever_seguro(ws, LINHA, C_MOTIVO, motivo)
+        escritor.escrever(LINHA, C_CFOP, cfop)
+        escritor.escrever(LINHA, C_ALIQ, aliq)
+        escritor.escrever(LINHA, C_VALOR, row['Total Operação'])
+        escritor.escrever(LINHA, C_BASE, row['Base de Cálculo ICMS'])
+        escritor.escrever(LINHA, C_ICMS, row['Total ICMS'])
+        escritor.escrever(LINHA, C_MOTIVO, motivo)
 
         _aplicar_estilo_tabela_sobras(ws, LINHA, col_inicio, C_MOTIVO, is_header=False)
         LINHA += 1
 
+    return df_sobra
+
 
-def _escrever_caixa_informativa_difal(ws: Worksheet, df_difal: pd.DataFrame, row_start=15, col_start=14):
+def _escrever_caixa_informativa_difal(ws: Worksheet, escritor: EscritorPlanilha, df_difal: pd.DataFrame, row_start=15, col_start=14):
     """Cria uma caixa visual (aviso) mostrando quais CFOPs tiveram abatimento de DIFAL."""
     if df_difal is None or df_difal.empty: return
 
@@ -125,7 +114,7 @@ def _escrever_caixa_informativa_difal(ws: Worksheet, df_difal: pd.DataFrame, row
     fill_header = PatternFill(start_color="C0504D", end_color="C0504D", fill_type="solid")
     font_header = Font(bold=True, color="FFFFFF")
 
-    ws.merge_cells(start_row=row_start, start_column=col_start, end_row=row_start, end_column=col_start+1)
+    escritor.mesclar(start_row=row_start, start_column=col_start, end_row=row_start, end_column=col_start+1)
     cell_header = ws.cell(row=row_start, column=col_start, value="⚠️ ABATIMENTO DIFAL (C101)")
     cell_header.fill = fill_header
     cell_header.font = font_header
@@ -161,9 +150,11 @@ def _escrever_caixa_informativa_difal(ws: Worksheet, df_difal: pd.DataFrame, row
 # 2. LÓGICA ESPECÍFICA: SETOR MOVELEIRO (ENTRADAS)
 # ==============================================================================
 
-def preencher_quadro_entradas_moveleiro(ws: Worksheet, df_totalizadores: pd.DataFrame):
+def preencher_quadro_entradas_moveleiro(ws: Worksheet, df_totalizadores: pd.DataFrame, escritor: Optional[EscritorPlanilha] = None) -> Optional[pd.DataFrame]:
     logging.info("[MOVELEIRO] Iniciando preenchimento ENTRADAS...")
-    if df_totalizadores is None or df_totalizadores.empty: return
+    if df_totalizadores is None or df_totalizadores.empty: return None
+    descarregar_ao_fim = escritor is None
+    if escritor is None: escritor = EscritorPlanilha(ws)
 
     df = df_totalizadores.copy()
     df['Utilizado'] = False # Inicializa rastreamento
@@ -190,8 +181,8 @@ def preencher_quadro_entradas_moveleiro(ws: Worksheet, df_totalizadores: pd.Data
         if not df_filtered.empty:
             soma_base = df_filtered['Base de Cálculo ICMS'].sum()
             soma_icms = df_filtered['Total ICMS'].sum()
-            if soma_base > 0: _escrever_seguro(ws, linha, 2, soma_base)
-            if soma_icms > 0: _escrever_seguro(ws, linha, 3, soma_icms)
+            if soma_base > 0: escritor.escrever(linha, 2, soma_base)
+            if soma_icms > 0: escritor.escrever(linha, 3, soma_icms)
 
     # --- REGRA 2: Linhas 42 a 45 ---
     for linha in range(42, 46):
@@ -207,24 +198,29 @@ def preencher_quadro_entradas_moveleiro(ws: Worksheet, df_totalizadores: pd.Data
         if not df_filtered.empty:
             soma_base = df_filtered['Base de Cálculo ICMS'].sum()
             soma_icms = df_filtered['Total ICMS'].sum()
-            if soma_base > 0: _escrever_seguro(ws, linha, 2, soma_base)
-            if soma_icms > 0: _escrever_seguro(ws, linha, 3, soma_icms)
+            if soma_base > 0: escritor.escrever(linha, 2, soma_base)
+            if soma_icms > 0: escritor.escrever(linha, 3, soma_icms)
 
     # --- TOTALIZADOR CRÉDITO ---
     total_credito = df['Total ICMS'].sum()
     if total_credito > 0:
-        _escrever_seguro(ws, 72, 5, total_credito)
+        escritor.escrever(72, 5, total_credito)
 
     # --- RELATÓRIO SOBRAS ENTRADAS (COLUNA R / 18) ---
-    _gerar_relatorio_sobras(ws, df, 18, "ENTRADAS", "305496")
+    df_sobra = _gerar_relatorio_sobras(ws, escritor, df, 18, "ENTRADAS", "305496")
+
+    if descarregar_ao_fim: escritor.descarregar()
+    return df_sobra
 
 # ==============================================================================
 # 3. LÓGICA ESPECÍFICA: SETOR MOVELEIRO (SAÍDAS)
 # ==============================================================================
 
-def preencher_quadro_saidas_moveleiro(ws: Worksheet, df_saidas: pd.DataFrame, df_base_difal: pd.DataFrame = None):
+def preencher_quadro_saidas_moveleiro(ws: Worksheet, df_saidas: pd.DataFrame, df_base_difal: pd.DataFrame = None, escritor: Optional[EscritorPlanilha] = None) -> Optional[pd.DataFrame]:
     logging.info("[MOVELEIRO] Iniciando preenchimento SAÍDAS...")
-    if df_saidas is None or df_saidas.empty: return
+    if df_saidas is None or df_saidas.empty: return None
+    descarregar_ao_fim = escritor is None
+    if escritor is None: escritor = EscritorPlanilha(ws)
 
     df = df_saidas.copy()
     df['Utilizado'] = False # Inicializa rastreamento
@@ -236,7 +232,7 @@ def preencher_quadro_saidas_moveleiro(ws: Worksheet, df_saidas: pd.DataFrame, df
         mapa_difal = df_base_difal.set_index('CFOP')['VALOR_BASE_DIFAL'].to_dict()
         try:
             # Desenha a caixa de DIFAL na coluna N (14)
-            _escrever_caixa_informativa_difal(ws, df_base_difal, row_start=3, col_start=14)
+            _escrever_caixa_informativa_difal(ws, escritor, df_base_difal, row_start=3, col_start=14)
         except Exception as e:
             logging.warning(f"Não foi possível desenhar caixa de DIFAL: {e}")
 
@@ -268,21 +264,36 @@ def preencher_quadro_saidas_moveleiro(ws: Worksheet, df_saidas: pd.DataFrame, df
 
             valor_final_base = soma_base - abatimento_difal
             if valor_final_base > 0:
-                _escrever_seguro(ws, linha, 10, valor_final_base)
+                escritor.escrever(linha, 10, valor_final_base)
 
     # --- TOTALIZADOR DÉBITO ---
     total_debito = df['Total ICMS'].sum()
     if total_debito > 0:
-        _escrever_seguro(ws, 61, 5, total_debito)
+        escritor.escrever(61, 5, total_debito)
 
     # --- RELATÓRIO SOBRAS SAÍDAS (COLUNA Y / 25) ---
     # Colocado na coluna 25 (Y) para ficar longe da caixa de DIFAL (N/14) e do rel. de Entradas (R/18 a W/23)
-    _gerar_relatorio_sobras(ws, df, 25, "SAÍDAS", "C65911")
+    df_sobra = _gerar_relatorio_sobras(ws, escritor, df, 25, "SAÍDAS", "C65911")
+
+    if descarregar_ao_fim: escritor.descarregar()
+    return df_sobra
 
 # ==============================================================================
 # 4. FUNÇÃO PRINCIPAL (ORQUESTRADOR)
 # ==============================================================================
 
+def preencher_aba_moveleiro(ws: Worksheet, df_entradas: pd.DataFrame, df_saidas: pd.DataFrame, df_base_difal: pd.DataFrame = None) -> Dict[str, Optional[pd.DataFrame]]:
+    """Preenche os quadros do moveleiro em uma aba já carregada e retorna as sobras."""
+    sobras = {'entradas': None, 'saidas': None}
+    escritor = EscritorPlanilha(ws)
+    if df_entradas is not None and not df_entradas.empty:
+        sobras['entradas'] = preencher_quadro_entradas_moveleiro(ws, df_entradas, escritor)
+
+    if df_saidas is not None and not df_saidas.empty:
+        sobras['saidas'] = preencher_quadro_saidas_moveleiro(ws, df_saidas, df_base_difal, escritor)
+    escritor.descarregar()
+    return sobras
+
 def preencher_template_moveleiro(template_path: Path, df_entradas: pd.DataFrame, df_saidas: pd.DataFrame, df_base_difal: pd.DataFrame = None) -> str:
     logging.info(f"[MOVELEIRO] Processando arquivo base: {template_path}")
 
@@ -299,11 +310,7 @@ def preencher_template_moveleiro(template_path: Path, df_entradas: pd.DataFrame,
         wb = load_workbook(path_destino)
         ws = wb["Entradas"] if "Entradas" in wb.sheetnames else wb.active
 
-        if df_entradas is not None and not df_entradas.empty:
-            preencher_quadro_entradas_moveleiro(ws, df_entradas)
-
-        if df_saidas is not None and not df_saidas.empty:
-            preencher_quadro_saidas_moveleiro(ws, df_saidas, df_base_difal)
+        preencher_aba_moveleiro(ws, df_entradas, df_saidas, df_base_difal)
 
         wb.save(path_destino)
         logging.info(f"[MOVELEIRO] Sucesso! Arquivo gerado: {path_destino}")
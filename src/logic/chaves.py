@@ -0,0 +1,187 @@
+import logging
+import numpy as np
+import pandas as pd
+from typing import List, Optional, Sequence, Tuple, Union
+
+# ==============================================================================
+# ÍNDICE DE CHAVES DE ACESSO (TEXTO <-> CÓDIGO INTEIRO)
+# ==============================================================================
+# Cada chave de 44 dígitos recebe um código int32 denso, uma única vez por
+# análise: IndiceChaves.codificando() monta o dicionário com as chaves das
+# notas e consulta as chaves de todos os DataFrames lidos numa só passada,
+# devolvendo cada um já com a coluna de códigos.
+# Os merges/groupby/isin seguintes rodam sobre essa coluna (hash de inteiro em
+# vez de string de 44 posições), sem voltar ao texto, que é devolvido pelo
+# dicionário só onde o relatório precisa dele.
+
+COLUNA_CODIGO = 'ID_CHV'
+
+Colunas = Union[str, List[str]]
+
+def _lista(colunas: Colunas) -> List[str]:
+    return [colunas] if isinstance(colunas, str) else list(colunas)
+
+class IndiceChaves:
+    """
+    Dicionário de chaves compartilhado pelos DataFrames de uma análise.
+
+    As chaves passadas na criação são registradas em ordem crescente, então a
+    ordem dos códigos é a mesma do texto (merges 'outer' e groupby continuam
+    saindo ordenados pela chave). Chaves novas vão para o fim do dicionário.
+    """
+
+    def __init__(self, *series: pd.Series):
+        conhecidas = [s.dropna() for s in series if s is not None and len(s)]
+        unicas = pd.unique(pd.concat(conhecidas, ignore_index=True)) if conhecidas else []
+        self._dicionario = pd.Index(unicas, dtype=object).sort_values()
+
+    @classmethod
+    def codificando(
+        cls, notas: Sequence[Optional[pd.DataFrame]], demais: Sequence[Optional[pd.DataFrame]] = (), coluna: str = 'CHV_NFE'
+    ) -> Tuple['IndiceChaves', List[Optional[pd.DataFrame]], List[Optional[pd.DataFrame]]]:
+        """
+        Cria o índice com as chaves dos DataFrames de notas (uma linha por
+        nota) e devolve esses e os demais (itens, C190...) já com a coluna de
+        códigos; None ou sem a coluna voltam como vieram. As chaves de todos
+        passam por uma única consulta ao dicionário.
+        """
+        todos = list(notas) + list(demais)
+        codificaveis = [i for i, df in enumerate(todos) if df is not None and coluna in df.columns and COLUNA_CODIGO not in df.columns]
+        indice = cls(*[todos[i][coluna] for i in codificaveis if i < len(notas)])
+        if codificaveis:
+            codigos = indice.codificar(pd.concat([todos[i][coluna].astype(object) for i in codificaveis], ignore_index=True))
+            inicio = 0
+            for i in codificaveis:
+                fim = inicio + len(todos[i])
+                todos[i] = todos[i].assign(**{COLUNA_CODIGO: codigos[inicio:fim]})
+                inicio = fim
+        return indice, todos[:len(notas)], todos[len(notas):]
+
+    def __len__(self) -> int:
+        return len(self._dicionario)
+
+    def codificar(self, chaves: pd.Series) -> np.ndarray:
+        codigos = self._dicionario.get_indexer(chaves)
+        novos = codigos == -1
+        if novos.any():
+            novas = pd.Index(pd.unique(chaves[novos]), dtype=object)
+            self._dicionario = self._dicionario.append(novas)
+            codigos[novos] = self._dicionario.get_indexer(chaves[novos])
+        return codigos.astype('int32')
+
+    def decodificar(self, codigos: Union[pd.Series, np.ndarray]) -> np.ndarray:
+        return self._dicionario.take(np.asarray(codigos)).to_numpy()
+
+    def preparar(self, df: Optional[pd.DataFrame], coluna: str = 'CHV_NFE') -> Optional[pd.DataFrame]:
+        """Anexa a coluna de códigos ao DataFrame (não altera o original; não recodifica)."""
+        if df is None or coluna not in df.columns or COLUNA_CODIGO in df.columns: return df
+        return df.assign(**{COLUNA_CODIGO: self.codificar(df[coluna])})
+
+    def mesclar(
+        self,
+        esquerda: pd.DataFrame,
+        direita: pd.DataFrame,
+        how: str = 'inner',
+        on: Optional[Colunas] = None,
+        left_on: Optional[Colunas] = None,
+        right_on: Optional[Colunas] = None,
+        coluna: str = 'CHV_NFE',
+        **kwargs
+    ) -> pd.DataFrame:
+        """
+        pd.merge pela coluna de códigos no lugar da chave em texto. 'on' /
+        'left_on' / 'right_on' usam os nomes originais (ex.: ['CHV_NFE',
+        'N_ITEM']). O texto da chave volta na mesma posição da esquerda e a
+        coluna de códigos segue no resultado para os próximos cruzamentos.
+        """
+        esquerda = self.preparar(esquerda, coluna)
+        direita = self.preparar(direita, coluna)
+
+        def trocar(colunas: Colunas) -> List[str]:
+            return [COLUNA_CODIGO if c == coluna else c for c in _lista(colunas)]
+
+        if on is None and left_on is None: on = coluna
+        if on is not None:
+            kwargs['on'] = trocar(on)
+        else:
+            kwargs['left_on'], kwargs['right_on'] = trocar(left_on), trocar(right_on)
+
+        posicao = esquerda.columns.get_loc(coluna)
+        resultado = pd.merge(
+            esquerda.drop(columns=[coluna]),
+            direita.drop(columns=[coluna], errors='ignore'),
+            how=how, **kwargs
+        )
+        resultado.insert(posicao, coluna, self.decodificar(resultado[COLUNA_CODIGO]))
+        return resultado
+
+# ==============================================================================
+# DECOMPOSIÇÃO VETORIZADA DA CHAVE E VALIDAÇÃO DO DV (MÓDULO 11)
+# ==============================================================================
+# cUF(2) AAMM(4) CNPJ/CPF do emitente(14) modelo(2) série(3) número(9)
+# tpEmis(1) cNF(8) DV(1). A coluna inteira vira uma matriz n x 44 de dígitos,
+# sem abrir o XML.
+
+LAYOUT_CHAVE = (
+    ('CHV_UF', 0, 2), ('CHV_AAMM', 2, 6), ('CHV_CNPJ', 6, 20), ('CHV_MODELO', 20, 22),
+    ('CHV_SERIE', 22, 25), ('CHV_NUMERO', 25, 34), ('CHV_TP_EMIS', 34, 35),
+)
+CAMPOS_CHAVE = [nome for nome, _, _ in LAYOUT_CHAVE] + ['CHV_VALIDA']
+
+# Pesos 2..9 aplicados da direita para a esquerda sobre os 43 primeiros dígitos
+_PESOS_MOD11 = 2 + (np.arange(42, -1, -1) % 8)
+
+def _matriz_digitos(chaves: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """(máscara de formato = 44 dígitos, matriz n x 44 de bytes ASCII com '0' nas chaves fora do formato)."""
+    texto = chaves.astype(object).fillna('').astype(str)
+    fora = texto.str.len().to_numpy() != 44
+    if fora.any(): # espaços nas bordas: só as linhas fora do tamanho são aparadas
+        texto = texto.mask(fora, texto.str.strip())
+        fora = texto.str.len().to_numpy() != 44
+    preenchido = np.where(fora, '0' * 44, texto.to_numpy(dtype=object))
+    matriz = np.frombuffer(''.join(preenchido).encode('ascii', errors='replace'), dtype=np.uint8).reshape(-1, 44)
+    formato_ok = ~fora & ((matriz >= ord('0')) & (matriz <= ord('9'))).all(axis=1)
+    return formato_ok, np.where(formato_ok[:, None], matriz, np.uint8(ord('0')))
+
+def digito_verificador(digitos: np.ndarray) -> np.ndarray:
+    """DV módulo 11 das linhas de uma matriz n x 43 (resto 0 ou 1 -> DV 0)."""
+    resto = (digitos.astype(np.int64) @ _PESOS_MOD11) % 11
+    return np.where(resto < 2, 0, 11 - resto)
+
+def _valor_campo(digitos: np.ndarray, inicio: int, fim: int) -> np.ndarray:
+    return digitos[:, inicio:fim].astype(np.int64) @ (10 ** np.arange(fim - inicio - 1, -1, -1, dtype=np.int64))
+
+def decompor_chaves(chaves: pd.Series) -> pd.DataFrame:
+    """
+    Campos da chave de acesso e CHV_VALIDA (44 dígitos e DV conferido). Os
+    códigos saem como categóricas de texto com zeros à esquerda (vazio fora do
+    formato); CHV_NUMERO sai inteiro (0 fora do formato).
+    """
+    formato_ok, matriz = _matriz_digitos(chaves)
+    digitos = matriz - ord('0')
+    campos = {}
+    for nome, inicio, fim in LAYOUT_CHAVE:
+        valores = np.where(formato_ok, _valor_campo(digitos, inicio, fim), -1)
+        if nome == 'CHV_NUMERO':
+            campos[nome] = np.maximum(valores, 0)
+            continue
+        # Fatoração dos inteiros: o texto é montado só para os valores distintos
+        codigos, unicos = pd.factorize(valores, sort=True)
+        categorias = ['' if u < 0 else str(u).zfill(fim - inicio) for u in unicos]
+        campos[nome] = pd.Categorical.from_codes(codigos, categories=categorias)
+    campos['CHV_VALIDA'] = formato_ok & (digito_verificador(digitos[:, :43]) == digitos[:, 43])
+    return pd.DataFrame(campos, index=chaves.index)
+
+def anexar_campos_chave(df: pd.DataFrame, coluna: str = 'CHV_NFE', origem: str = '') -> pd.DataFrame:
+    """
+    Anexa os campos da chave ao DataFrame e avisa quantas chaves numéricas
+    estão corrompidas (tamanho ou DV errado). Identificadores sintéticos, como
+    'Energia_...' do C500 sem chave, só ficam com CHV_VALIDA = False.
+    """
+    if df is None or df.empty or coluna not in df.columns: return df
+    campos = decompor_chaves(df[coluna])
+    invalidas = df.loc[~campos['CHV_VALIDA'].to_numpy(), coluna].astype(object).fillna('').astype(str).str.strip()
+    corrompidas = int(invalidas.str.fullmatch(r'[0-9]+').sum())
+    if corrompidas:
+        logging.warning(f"{corrompidas} chaves de acesso inválidas (tamanho ou dígito verificador) em {origem or coluna}.")
+    return pd.concat([df.drop(columns=CAMPOS_CHAVE, errors='ignore'), campos], axis=1)
@@ -45,4 +45,8 @@ def criar_mapa_cst_completo():
                 mapa_completo[chave] = desc
     return mapa_completo
 
-MAPA_CST_UNIFICADO = criar_mapa_cst_completo()
\ No newline at end of file
+MAPA_CST_UNIFICADO = criar_mapa_cst_completo()
+
+# Alíquotas de PIS/COFINS não cumulativo (%) usadas no cálculo de conferência
+ALIQUOTA_PIS = 1.65
+ALIQUOTA_COFINS = 7.60
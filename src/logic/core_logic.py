@@ -6,6 +6,7 @@ from typing import Dict, Tuple, Optional, Any
 
 # Importa as constantes da pasta local
 from .constants import MAPA_CST_UNIFICADO
+from .monetario import para_reais, ratear_centavos
 
 def get_acumulador(row: pd.Series, regras_map: Dict[Tuple[str, str], str]) -> str:
 
@@ -135,6 +136,8 @@ def _calcular_totalizadores_cfop_cst(df_analitico_combinado: pd.DataFrame) -> pd
     Calcula o totalizador CONSOLIDADO por CFOP (SPED), CST (SPED) e Alíquota (SPED),
     e traduz o CST para sua descrição legal.
     FONTE: SPED C190, D190, C590, D590 combinados.
+    As somas são feitas em centavos; os totais saem em reais, prontos para o
+    relatório e para os templates de apuração.
     """
 
     if df_analitico_combinado is None or df_analitico_combinado.empty:
@@ -146,9 +149,9 @@ def _calcular_totalizadores_cfop_cst(df_analitico_combinado: pd.DataFrame) -> pd
     sped_value_cols = ['VL_OPR_SPED_ITEM', 'VL_BC_ICMS_SPED_ITEM', 'VL_ICMS_SPED_ITEM', 'VL_BC_ICMS_ST_SPED_ITEM', 'VL_ICMS_ST_SPED_ITEM', 'VLR_IPI_SPED_ITEM']
     for col in sped_value_cols:
         if col not in df_calc.columns:
-            df_calc[col] = 0.0
+            df_calc[col] = 0
         else:
-            df_calc[col] = pd.to_numeric(df_calc[col], errors='coerce').fillna(0.0)
+            df_calc[col] = pd.to_numeric(df_calc[col], errors='coerce').fillna(0).astype('int64')
 
     if 'CFOP_SPED_ITEM' not in df_calc.columns: df_calc['CFOP_SPED_ITEM'] = 'N/A'
     if 'CST_ICMS_SPED_ITEM' not in df_calc.columns: df_calc['CST_ICMS_SPED_ITEM'] = 'N/A'
@@ -176,11 +179,8 @@ def _calcular_totalizadores_cfop_cst(df_analitico_combinado: pd.DataFrame) -> pd
         df_totalizadores['Total_ICMS_ST']
     )
 
-    df_totalizadores['Alíquota ICMS'] = np.where(
-        nova_base_calculo > 0,
-        (df_totalizadores['Total_ICMS'] / nova_base_calculo) * 100,
-        0.0
-    ).round(2)
+    # ICMS / base em centésimos de ponto percentual (inteiros), arredondado ao centésimo
+    df_totalizadores['Alíquota ICMS'] = para_reais(ratear_centavos(df_totalizadores['Total_ICMS'], 10_000, nova_base_calculo))
 
     df_final = df_totalizadores.rename(columns={
         'CFOP_SPED_ITEM': 'CFOP (SPED)',
@@ -210,8 +210,24 @@ def _calcular_totalizadores_cfop_cst(df_analitico_combinado: pd.DataFrame) -> pd
     ]
     df_final = df_final[[col for col in colunas_ordenadas if col in df_final.columns]]
 
-    cols_to_round = ['Total Operação', 'Base de Cálculo ICMS', 'Total ICMS', 'Base de Cálculo ICMS ST', 'Total ICMS ST', 'Total IPI']
-    for col in cols_to_round:
-        if col in df_final.columns: df_final[col] = df_final[col].round(2)
+    cols_em_reais = ['Total Operação', 'Base de Cálculo ICMS', 'Total ICMS', 'Base de Cálculo ICMS ST', 'Total ICMS ST', 'Total IPI']
+    for col in cols_em_reais:
+        if col in df_final.columns: df_final[col] = para_reais(df_final[col])
 
-    return df_final.sort_values(by=['CFOP (SPED)', 'CST (SPED)', 'Alíquota (SPED)'])
\ No newline at end of file
+    return df_final.sort_values(by=['CFOP (SPED)', 'CST (SPED)', 'Alíquota (SPED)'])
+
+def separar_totalizadores_entrada_saida(df_totalizadores_cst: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """(entradas, saídas) dos totalizadores pelo primeiro dígito do CFOP (SPED): 1/2/3 e 5/6/7."""
+    if df_totalizadores_cst is None or df_totalizadores_cst.empty:
+        return pd.DataFrame(), pd.DataFrame()
+    cfop_str = df_totalizadores_cst['CFOP (SPED)'].astype(str)
+    return (df_totalizadores_cst[cfop_str.str.startswith(('1', '2', '3'))].copy(),
+            df_totalizadores_cst[cfop_str.str.startswith(('5', '6', '7'))].copy())
+
+def calcular_base_difal_por_cfop(df_analitico_difal: pd.DataFrame) -> pd.DataFrame:
+    """Base de cálculo do ICMS (C190) das notas com C101, somada por CFOP (em centavos): colunas CFOP e VALOR_BASE_DIFAL em reais."""
+    if df_analitico_difal is None or df_analitico_difal.empty:
+        return pd.DataFrame()
+    df_base = df_analitico_difal.groupby('CFOP_SPED_ITEM', observed=True)['VL_BC_ICMS_SPED_ITEM'].sum().reset_index()
+    df_base['VL_BC_ICMS_SPED_ITEM'] = para_reais(df_base['VL_BC_ICMS_SPED_ITEM'])
+    return df_base.rename(columns={'CFOP_SPED_ITEM': 'CFOP', 'VL_BC_ICMS_SPED_ITEM': 'VALOR_BASE_DIFAL'})
@@ -0,0 +1,80 @@
+import logging
+from typing import Any, Dict, Tuple
+from openpyxl.worksheet.worksheet import Worksheet
+from openpyxl.cell.cell import MergedCell
+
+# ==============================================================================
+# ESCRITOR DE PLANILHA (MESCLAGENS EM O(1) + ESCRITA EM BUFFER)
+# ==============================================================================
+
+class EscritorPlanilha:
+    """
+    Envolve uma aba do template para leitura/escrita ciente de células mescladas.
+
+    O mapa coordenada -> âncora (canto superior esquerdo da mesclagem) é montado
+    uma única vez na criação, então cada acesso é O(1) em vez de varrer
+    ws.merged_cells.ranges. As escritas ficam em buffer e são gravadas de uma
+    vez em descarregar(), que deve ser chamado antes de salvar o workbook.
+    """
+
+    def __init__(self, ws: Worksheet):
+        self.ws = ws
+        self._ancoras: Dict[Tuple[int, int], Tuple[int, int]] = {}
+        self._pendentes: Dict[Tuple[int, int], Any] = {}
+        self._mapear_mesclagens()
+
+    def _mapear_mesclagens(self):
+        self._ancoras.clear()
+        for merged_range in self.ws.merged_cells.ranges:
+            self._registrar_mesclagem(merged_range.min_row, merged_range.min_col, merged_range.max_row, merged_range.max_col)
+
+    def _registrar_mesclagem(self, min_row: int, min_col: int, max_row: int, max_col: int):
+        ancora = (min_row, min_col)
+        for linha in range(min_row, max_row + 1):
+            for coluna in range(min_col, max_col + 1):
+                self._ancoras[(linha, coluna)] = ancora
+
+    def ancora(self, linha: int, coluna: int) -> Tuple[int, int]:
+        """Retorna (linha, coluna) da célula que de fato guarda o valor."""
+        return self._ancoras.get((linha, coluna), (linha, coluna))
+
+    def escrever(self, linha: int, coluna: int, valor):
+        """Agenda a escrita (redirecionada para a âncora se a célula for mesclada)."""
+        self._pendentes[self.ancora(linha, coluna)] = valor
+
+    def ler(self, linha: int, coluna: int):
+        """Lê o valor considerando mesclagens e escritas ainda não descarregadas."""
+        chave = self.ancora(linha, coluna)
+        if chave in self._pendentes:
+            return self._pendentes[chave]
+        return self.ws.cell(row=chave[0], column=chave[1]).value
+
+    def mesclar(self, start_row: int, start_column: int, end_row: int, end_column: int):
+        """Mescla o intervalo mantendo o mapa de âncoras atualizado."""
+        # Assim como no openpyxl, valores fora da âncora se perdem ao mesclar
+        for linha in range(start_row, end_row + 1):
+            for coluna in range(start_column, end_column + 1):
+                if (linha, coluna) != (start_row, start_column):
+                    self._pendentes.pop(self.ancora(linha, coluna), None)
+
+        self.ws.merge_cells(start_row=start_row, start_column=start_column, end_row=end_row, end_column=end_column)
+        self._registrar_mesclagem(start_row, start_column, end_row, end_column)
+
+    def descarregar(self):
+        """Grava na aba todas as escritas pendentes."""
+        if not self._pendentes: return
+        remapeado = False
+        for (linha, coluna), valor in self._pendentes.items():
+            cell = self.ws.cell(row=linha, column=coluna)
+            if isinstance(cell, MergedCell):
+                # Mesclagem feita direto na aba depois da escrita: refaz o mapa uma vez
+                if not remapeado:
+                    self._mapear_mesclagens()
+                    remapeado = True
+                ancora = self.ancora(linha, coluna)
+                cell = self.ws.cell(row=ancora[0], column=ancora[1])
+                if isinstance(cell, MergedCell):
+                    logging.warning(f"Célula mesclada sem âncora ignorada: {cell.coordinate}")
+                    continue
+            cell.value = valor
+        self._pendentes.clear()
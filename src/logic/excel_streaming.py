@@ -0,0 +1,147 @@
+import logging
+import re
+import shutil
+import zipfile
+import pandas as pd
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet._write_only import WriteOnlyWorksheet
+
+# ==============================================================================
+# ESCRITA EM STREAMING (WORKBOOK WRITE-ONLY)
+# ==============================================================================
+# As linhas vão direto para o XML da aba à medida que são anexadas, então o uso
+# de memória não cresce com o número de linhas. Estilos são definidos por coluna
+# antes da escrita e larguras são estimadas por amostragem.
+
+TAMANHO_LOTE_PADRAO = 50_000
+AMOSTRA_LARGURA = 5_000
+
+def criar_workbook_streaming() -> Workbook:
+    return Workbook(write_only=True)
+
+def referencia_filtro(n_colunas: int, ultima_linha: int) -> str:
+    return f"A1:{get_column_letter(n_colunas)}{ultima_linha}"
+
+def estimar_largura(serie: pd.Series, titulo: str, minimo: int = 8, maximo: int = 60, amostra: int = AMOSTRA_LARGURA) -> int:
+    """Largura da coluna pelo maior texto de uma amostra (a coluna inteira se for pequena)."""
+    try:
+        if len(serie) > amostra:
+            serie = pd.concat([serie.iloc[:amostra // 2], serie.sample(amostra // 2, random_state=0)])
+        max_len = max(len(str(titulo)), serie.astype(str).map(len).max(), minimo) + 2
+    except Exception:
+        max_len = len(str(titulo)) + 5
+    return min(max_len, maximo)
+
+def _celula_estilizada(ws: WriteOnlyWorksheet, estilo: Dict[str, Any]) -> WriteOnlyCell:
+    cell = WriteOnlyCell(ws)
+    for atributo, valor in estilo.items():
+        setattr(cell, atributo, valor)
+    return cell
+
+def iterar_linhas(df: pd.DataFrame, tamanho_lote: int = TAMANHO_LOTE_PADRAO) -> Iterator[tuple]:
+    """Percorre o DataFrame em lotes, com tipos nativos do Python e NaN/NaT como None."""
+    for inicio in range(0, len(df), tamanho_lote):
+        bloco = df.iloc[inicio:inicio + tamanho_lote]
+        bloco = bloco.astype(object).where(bloco.notna(), None)
+        yield from bloco.itertuples(index=False, name=None)
+
+def escrever_dataframe_streaming(
+    ws: WriteOnlyWorksheet,
+    df: pd.DataFrame,
+    estilos_colunas: Optional[Dict[int, Dict[str, Any]]] = None,
+    estilo_cabecalho: Optional[Dict[str, Any]] = None,
+    larguras: Optional[Dict[int, float]] = None,
+    congelar: Optional[str] = 'A2',
+    filtro: bool = True,
+    tamanho_lote: int = TAMANHO_LOTE_PADRAO
+) -> int:
+    """
+    Escreve cabeçalho + linhas do DataFrame em uma aba write-only.
+
+    estilos_colunas: {índice 0-based: {'number_format': ..., 'font': ..., ...}}
+    aplicado a todas as células de dados da coluna. Retorna a última linha escrita.
+    """
+    estilos_colunas = estilos_colunas or {}
+    n_colunas = len(df.columns)
+
+    # Dimensões e painéis precisam estar definidos antes da primeira linha
+    for col_idx, largura in (larguras or {}).items():
+        ws.column_dimensions[get_column_letter(col_idx + 1)].width = largura
+    if congelar: ws.freeze_panes = congelar
+
+    ultima_linha = len(df) + 1
+    if filtro and n_colunas:
+        ws.auto_filter.ref = referencia_filtro(n_colunas, ultima_linha)
+
+    cabecalho = []
+    for titulo in df.columns:
+        cell = _celula_estilizada(ws, estilo_cabecalho or {})
+        cell.value = str(titulo)
+        cabecalho.append(cell)
+    ws.append(cabecalho)
+
+    # Uma célula-modelo por coluna estilizada: o valor é trocado a cada linha
+    # (a linha é serializada no append, então a célula pode ser reaproveitada)
+    modelos: List[Optional[WriteOnlyCell]] = [
+        _celula_estilizada(ws, estilos_colunas[i]) if estilos_colunas.get(i) else None
+        for i in range(n_colunas)
+    ]
+    colunas_estilizadas = [i for i, modelo in enumerate(modelos) if modelo is not None]
+
+    if not colunas_estilizadas:
+        for linha in iterar_linhas(df, tamanho_lote):
+            ws.append(linha)
+    else:
+        for linha in iterar_linhas(df, tamanho_lote):
+            linha = list(linha)
+            for i in colunas_estilizadas:
+                modelos[i].value = linha[i]
+                linha[i] = modelos[i]
+            ws.append(linha)
+
+    logging.info(f"Aba '{ws.title}' escrita em streaming: {len(df)} linhas.")
+    return ultima_linha
+
+# ==============================================================================
+# MONTAGEM DE UM .XLSX A PARTIR DE ABAS RENDERIZADAS SEPARADAMENTE
+# ==============================================================================
+
+_PADRAO_XML_ABA = re.compile(r'xl/worksheets/sheet(\d+)\.xml')
+
+def montar_xlsx_de_abas(caminho_esqueleto: Path, abas_renderizadas: List[Path], caminho_saida: Path):
+    """
+    Monta o pacote final a partir de um "esqueleto" (workbook com as abas vazias,
+    na ordem final) e de arquivos .xlsx de uma aba só, renderizados em paralelo.
+
+    O XML de cada aba do esqueleto é trocado pelo sheet1.xml do arquivo
+    correspondente. Para isso todos precisam ter o mesmo styles.xml (mesma paleta
+    registrada na mesma ordem) e usar strings inline (padrão do modo write-only);
+    caso contrário é levantado ValueError e o chamador deve gerar em sequência.
+    """
+    with zipfile.ZipFile(caminho_esqueleto) as z_esqueleto:
+        estilos = z_esqueleto.read('xl/styles.xml')
+        for caminho in abas_renderizadas:
+            with zipfile.ZipFile(caminho) as z_aba:
+                nomes = set(z_aba.namelist())
+                if z_aba.read('xl/styles.xml') != estilos:
+                    raise ValueError(f"Paleta de estilos divergente em {caminho}.")
+                if 'xl/sharedStrings.xml' in nomes or 'xl/worksheets/_rels/sheet1.xml.rels' in nomes:
+                    raise ValueError(f"Aba com partes compartilhadas não suportadas: {caminho}.")
+
+        with zipfile.ZipFile(caminho_saida, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as z_saida:
+            for item in z_esqueleto.infolist():
+                encontrado = _PADRAO_XML_ABA.fullmatch(item.filename)
+                if not encontrado:
+                    z_saida.writestr(item.filename, z_esqueleto.read(item.filename))
+                    continue
+
+                # Cópia em blocos: o XML de uma aba grande não é carregado inteiro em memória
+                origem = abas_renderizadas[int(encontrado.group(1)) - 1]
+                with zipfile.ZipFile(origem) as z_aba, z_aba.open('xl/worksheets/sheet1.xml') as src, \
+                        z_saida.open(item.filename, 'w', force_zip64=True) as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
@@ -0,0 +1,73 @@
+import logging
+import sqlite3
+import importlib.util
+import pandas as pd
+from pathlib import Path
+from typing import Dict
+
+from .monetario import em_reais
+
+# ==============================================================================
+# EXPORTAÇÃO DAS TABELAS DE DETALHE (FORA DO EXCEL)
+# ==============================================================================
+# Gera, ao lado do relatório, uma pasta <relatorio>_dados com cada tabela em
+# Parquet (pyarrow, dependência do app; sem ele, CSV.gz com aviso no log) e um arquivo
+# SQLite com todas as tabelas, para consulta sem abrir o Excel. Valores
+# monetários em centavos são gravados em reais, como no relatório.
+
+TAMANHO_LOTE_SQLITE = 50_000
+
+def _parquet_disponivel() -> bool:
+    return any(importlib.util.find_spec(motor) is not None for motor in ('pyarrow', 'fastparquet'))
+
+def _exportar_csv_gz(df: pd.DataFrame, caminho: Path) -> Path:
+    df.to_csv(caminho, index=False, sep=';', decimal=',', encoding='utf-8-sig', compression='gzip')
+    return caminho
+
+def exportar_tabelas_detalhe(
+    caminho_relatorio: Path,
+    tabelas: Dict[str, pd.DataFrame],
+    formato: str = 'auto',
+    gerar_sqlite: bool = True
+) -> Dict[str, str]:
+    """
+    Exporta as tabelas completas do relatório. formato: 'auto' (Parquet se
+    disponível, senão CSV.gz), 'parquet' ou 'csv'. Retorna {tabela: caminho},
+    incluindo a chave 'sqlite' quando o banco é gerado.
+    """
+    caminho_relatorio = Path(caminho_relatorio)
+    pasta = caminho_relatorio.parent / f"{caminho_relatorio.stem}_dados"
+    pasta.mkdir(parents=True, exist_ok=True)
+    tabelas = {nome: em_reais(df) for nome, df in tabelas.items() if df is not None and not df.empty}
+
+    usar_parquet = formato in ('parquet', 'auto')
+    if usar_parquet and not _parquet_disponivel():
+        logging.warning("Parquet indisponível (pyarrow não instalado; veja requirements.txt). Exportando em CSV.gz.")
+        usar_parquet = False
+
+    arquivos: Dict[str, str] = {}
+    for nome, df in tabelas.items():
+        if usar_parquet:
+            try:
+                caminho = pasta / f"{nome}.parquet"
+                df.to_parquet(caminho, index=False)
+                arquivos[nome] = str(caminho)
+                continue
+            except Exception as e:
+                logging.warning(f"Falha ao gravar '{nome}' em Parquet ({e}). Usando CSV.gz.")
+
+        arquivos[nome] = str(_exportar_csv_gz(df, pasta / f"{nome}.csv.gz"))
+
+    if gerar_sqlite:
+        caminho_db = pasta / f"{caminho_relatorio.stem}.sqlite"
+        conn = sqlite3.connect(caminho_db)
+        try:
+            for nome, df in tabelas.items():
+                df.to_sql(nome, conn, if_exists='replace', index=False, chunksize=TAMANHO_LOTE_SQLITE)
+            conn.commit()
+        finally:
+            conn.close()
+        arquivos['sqlite'] = str(caminho_db)
+
+    logging.info(f"Tabelas de detalhe exportadas em: {pasta}")
+    return arquivos
@@ -9,15 +9,22 @@ from typing import List, Tuple, Any, Dict, Optional, IO, Callable
 
 # --- IMPORTAÇÕES DOS MÓDULOS ---
 from .sped_parser import extrair_dados_sped
-from .xml_parser import processar_pasta_xml
+from .xml_parser import processar_pasta_xml, extrair_itens_nfe
 from .rules_parser import ler_regras_acumuladores
 from .report_generator import gerar_relatorio_excel
+from .constants import ALIQUOTA_PIS, ALIQUOTA_COFINS
+from .monetario import dentro_da_tolerancia, aplicar_aliquota, ratear_centavos
+from .tipos_dados import compactar_dataframe, preencher_vazios, registrar_memoria
+from .chaves import IndiceChaves, COLUNA_CODIGO, CAMPOS_CHAVE
+from .periodo import verificar_periodo, MODOS_PRE_VALIDACAO
 from .core_logic import (
     get_acumulador,
     check_cfop_status,
     calcular_status_geral,
     _executar_analise_detalhada_interna,
-    _calcular_totalizadores_cfop_cst
+    _calcular_totalizadores_cfop_cst,
+    separar_totalizadores_entrada_saida,
+    calcular_base_difal_por_cfop
 )
 
 # Importa a lógica de apuração padrão (COMERCIO)
@@ -66,8 +73,36 @@ def executar_analise_completa(
     caminho_regras_detalhadas: Optional[Path] = None,
     template_apuracao_path: Optional[Path] = None,
     tipo_setor: str = 'Comercio',
-    regras_cliente: Dict[str, Any] = None # <--- REGRAS DO CADASTRO DE CLIENTES
+    regras_cliente: Dict[str, Any] = None, # <--- REGRAS DO CADASTRO DE CLIENTES
+    somente_divergencias_excel: bool = False,
+    exportar_dados_completos: Optional[bool] = None,
+    modo_relatorio: str = 'completo',
+    leitura_xml_duas_fases: bool = True,
+    perfil_extracao: str = 'completo',
+    pre_validacao_periodo: str = 'avisar',
+    limite_sobreposicao_periodo: float = 0.3
 ) -> None:
+    """
+    modo_relatorio: 'completo' ou 'divergencias'. No modo divergências só as
+    notas com STATUS_GERAL diferente de OK (e seus itens) seguem para o cruzamento
+    de itens, rateios e Excel; os totalizadores continuam completos e a
+    conciliação completa + itens brutos dos XMLs vão para a exportação de dados.
+
+    leitura_xml_duas_fases: no modo divergências e sem regras detalhadas (NCM),
+    a primeira leitura dos XMLs traz só os totais das notas; os itens são lidos
+    depois apenas dos arquivos das notas divergentes. Com
+    exportar_dados_completos=True a leitura é feita numa fase só, para que a
+    exportação traga os itens de todas as notas (Itens_XML_Bruto).
+
+    perfil_extracao: 'completo' ou 'totais' (NFC-e/varejo de alto volume). Em
+    'totais' os itens não são lidos; as abas Itens_XML e Aliquota_XML não são
+    geradas e a conciliação traz o CST agregado por nota.
+
+    pre_validacao_periodo: 'avisar', 'abortar' ou 'desligado'. Antes da leitura
+    completa, compara o período do 0000 do SPED com o AAMM das chaves de uma
+    amostra dos XMLs; abaixo de limite_sobreposicao_periodo (fração da amostra
+    emitida no período) avisa ou interrompe a análise pelo error_callback.
+    """
 
     global df_itens_global
     try:
@@ -84,13 +119,47 @@ def executar_analise_completa(
         if exigir_acumulador:
             logging.info("REGRA ATIVA: Exigir Acumulador preenchido.")
 
+        # Pré-validação do período: pasta de XMLs de outro mês é detectada antes da leitura completa
+        if pre_validacao_periodo not in MODOS_PRE_VALIDACAO:
+            raise ValueError(f"Modo de pré-validação do período desconhecido: {pre_validacao_periodo}")
+        if pre_validacao_periodo != 'desligado':
+            if status_callback: status_callback("Conferindo o período do SPED e dos XMLs...")
+            resultado_periodo = verificar_periodo(caminho_sped, pasta_xmls)
+            if resultado_periodo is not None and resultado_periodo[0] < limite_sobreposicao_periodo:
+                descricao = resultado_periodo[1]
+                mensagem = f"Os XMLs parecem ser de outro período. {descricao} Verifique se a pasta de XMLs corresponde ao SPED."
+                if pre_validacao_periodo == 'abortar':
+                    logging.error(f"Análise interrompida na pré-validação do período. {descricao}")
+                    if error_callback: error_callback(mensagem)
+                    return
+                logging.warning(mensagem)
+                if status_callback: status_callback(f"AVISO: {mensagem}")
+
         # 2. Extração de dados
         logging.info("Iniciando extração do SPED...")
         df_sped, df_sped_itens, df_sped_analitico_combinado, df_sped_cte_d190, df_chaves_difal = extrair_dados_sped(caminho_sped)
 
         logging.info("Iniciando extração dos XMLs (NF-e e CT-e)...")
         if status_callback: status_callback("Processando XMLs...")
-        df_xml_totais, df_xml_itens, df_xml_cte_totais = processar_pasta_xml(pasta_xmls, progress_callback)
+        somente_totais = perfil_extracao == 'totais'
+        if somente_totais:
+            logging.info("Perfil de extração 'totais': itens dos XMLs não serão lidos (sem abas Itens_XML/Aliquota_XML).")
+            if caminho_regras_detalhadas:
+                logging.warning("Regras detalhadas (NCM) ignoradas no perfil 'totais'.")
+                caminho_regras_detalhadas = None
+
+        duas_fases = (leitura_xml_duas_fases and modo_relatorio == 'divergencias' and not caminho_regras_detalhadas
+                      and not somente_totais and not exportar_dados_completos)
+        if duas_fases:
+            logging.info("Leitura dos XMLs em duas fases: itens só das notas divergentes (a exportação de dados não terá Itens_XML_Bruto).")
+        df_xml_totais, df_xml_itens, df_xml_cte_totais = processar_pasta_xml(
+            pasta_xmls, progress_callback, extrair_itens=not duas_fases, perfil_extracao=perfil_extracao
+        )
+
+        # Índice de chaves: cada CHV_NFE lida é codificada uma vez aqui e os cruzamentos rodam sobre os códigos
+        indice_chaves, (df_xml_totais, df_sped), (df_xml_itens, df_sped_itens, df_sped_analitico_combinado, df_chaves_difal) = (
+            IndiceChaves.codificando([df_xml_totais, df_sped], [df_xml_itens, df_sped_itens, df_sped_analitico_combinado, df_chaves_difal])
+        )
         df_itens_global = df_xml_itens
 
         logging.info("Iniciando leitura das regras...")
@@ -108,7 +177,11 @@ def executar_analise_completa(
         logging.info('Cruzando dados SPED (C100, C500, D500) x XML (NF-e)...')
         if status_callback: status_callback("Cruzando dados SPED x XML...")
 
-        df_recon = pd.merge(df_xml_totais, df_sped, on='CHV_NFE', how='outer', indicator=True)
+        # Os campos decompostos da chave existem nos dois lados; ficam fora da conciliação
+        df_recon = indice_chaves.mesclar(
+            df_xml_totais.drop(columns=CAMPOS_CHAVE, errors='ignore'), df_sped.drop(columns=CAMPOS_CHAVE, errors='ignore'),
+            how='outer', indicator=True
+        )
 
         df_recon['SITUACAO_NOTA'] = np.select(
             [df_recon['_merge'] == 'left_only', df_recon['_merge'] == 'right_only'],
@@ -117,17 +190,17 @@ def executar_analise_completa(
         )
         df_recon.drop(columns=['_merge'], inplace=True)
 
-        # Tratamento de Nulos
+        # Tratamento de Nulos (valores monetários em centavos)
         numeric_cols = ['VL_DOC_XML', 'VL_DOC_SPED', 'ICMS_XML', 'ICMS_SPED', 'ICMS_ST_XML', 'ICMS_ST_SPED', 'FCP_ST_XML', 'FCP_ST_SPED', 'ICMS_SN_XML', 'ICMS_SN_SPED', 'ICMS_MONO_XML', 'ICMS_MONO_SPED', 'IPI_XML', 'IPI_SPED', 'IPI_DEVOL_XML', 'IPI_DEVOL_SPED', 'PIS_SPED', 'COFINS_SPED']
         string_cols = [ 'CHV_NFE', 'NUM_NF', 'CNPJ_EMITENTE', 'CFOP_XML', 'CFOP_SPED', 'CEST_XML', 'TIPO_NOTA', 'TIPO_NOTA_SPED' ]
 
         for col in numeric_cols:
-            if col not in df_recon.columns: df_recon[col] = 0.0
+            if col not in df_recon.columns: df_recon[col] = 0
         for col in string_cols:
             if col not in df_recon.columns: df_recon[col] = ''
 
-        df_recon[numeric_cols] = df_recon[numeric_cols].fillna(0).round(2)
-        df_recon[string_cols] = df_recon[string_cols].fillna('')
+        df_recon[numeric_cols] = df_recon[numeric_cols].fillna(0).astype('int64')
+        preencher_vazios(df_recon, string_cols)
 
         df_recon['TIPO_NOTA'] = np.where(
             (df_recon['TIPO_NOTA'] == '') & (df_recon['TIPO_NOTA_SPED'] != ''),
@@ -139,8 +212,8 @@ def executar_analise_completa(
         logging.info('Aplicando regras de acumuladores (NF-e, C500, D500)...')
         df_recon['ACUMULADOR'] = df_recon.apply(get_acumulador, axis=1, regras_map=regras_map)
 
-        df_recon['ICMS_TOTAL_XML'] = (df_recon['ICMS_XML'] + df_recon['ICMS_SN_XML']).round(2)
-        df_recon['IPI_TOTAL_XML'] = (df_recon['IPI_XML'] + df_recon['IPI_DEVOL_XML']).round(2)
+        df_recon['ICMS_TOTAL_XML'] = df_recon['ICMS_XML'] + df_recon['ICMS_SN_XML']
+        df_recon['IPI_TOTAL_XML'] = df_recon['IPI_XML'] + df_recon['IPI_DEVOL_XML']
 
         # Ajuste IPI Devolução
         condicao_devolucao_ipi = (
@@ -160,34 +233,37 @@ def executar_analise_completa(
         impostos_a_verificar = ['ICMS', 'ICMS_ST', 'IPI', 'FCP_ST', 'ICMS_MONO']
         for imposto in impostos_a_verificar:
             sped_col, status_col = f'{imposto}_SPED', f'STATUS_{imposto}'; xml_col = f'{imposto}_XML'; xml_total_col = f'{imposto}_TOTAL_XML' if imposto in ['ICMS', 'IPI'] else xml_col
-            if sped_col not in df_recon.columns: df_recon[sped_col] = 0.0
-            if xml_total_col not in df_recon.columns: df_recon[xml_total_col] = df_recon[xml_col] if xml_col in df_recon.columns else 0.0
+            if sped_col not in df_recon.columns: df_recon[sped_col] = 0
+            if xml_total_col not in df_recon.columns: df_recon[xml_total_col] = df_recon[xml_col] if xml_col in df_recon.columns else 0
             cond_cfop_sem_credito = pd.Series(False, index=df_recon.index)
             cfop_sped_col_exists = 'CFOP_SPED' in df_recon.columns
             if imposto == 'ICMS' and cfop_sem_credito_icms and cfop_sped_col_exists:
                 cond_cfop_sem_credito = df_recon['CFOP_SPED'].apply(lambda x: isinstance(x, str) and any(cfop in x.split('/') for cfop in cfop_sem_credito_icms))
             elif imposto == 'IPI' and cfop_sem_credito_ipi and cfop_sped_col_exists:
                 cond_cfop_sem_credito = df_recon['CFOP_SPED'].apply(lambda x: isinstance(x, str) and any(cfop in x.split('/') for cfop in cfop_sem_credito_ipi))
-            cond_valores_iguais = (df_recon[xml_total_col] - df_recon[sped_col]).abs() <= tolerancia_valor
+            cond_valores_iguais = dentro_da_tolerancia(df_recon[xml_total_col], df_recon[sped_col], tolerancia_valor)
             df_recon[status_col] = np.where(cond_valores_iguais | cond_cfop_sem_credito, 'OK', 'DIVERGENTE')
 
-        cond_valor_divergente = (df_recon['VL_DOC_XML'] - df_recon['VL_DOC_SPED']).abs() > tolerancia_valor
+        cond_valor_divergente = ~dentro_da_tolerancia(df_recon['VL_DOC_XML'], df_recon['VL_DOC_SPED'], tolerancia_valor)
         df_recon['STATUS_VALOR'] = np.where(cond_valor_divergente & (df_recon['SITUACAO_NOTA'] == 'OK'), 'DIVERGENTE', 'OK')
 
         # PIS/COFINS Calculado
-        if df_itens_global is not None and 'BC_PIS_COFINS_CALC' in df_itens_global.columns:
-            df_itens_sum_bc = df_itens_global.groupby('CHV_NFE')['BC_PIS_COFINS_CALC'].sum().round(2).reset_index()
-            df_recon = pd.merge(df_recon, df_itens_sum_bc, on='CHV_NFE', how='left')
-            df_recon['BC_PIS_COFINS_CALC'] = df_recon['BC_PIS_COFINS_CALC'].fillna(0)
+        if 'BC_PIS_COFINS_CALC' in df_recon.columns:
+            # Leitura em duas fases: a base já vem somada nos totais de cada nota
+            df_recon['BC_PIS_COFINS_CALC'] = df_recon['BC_PIS_COFINS_CALC'].fillna(0).astype('int64')
+        elif df_itens_global is not None and 'BC_PIS_COFINS_CALC' in df_itens_global.columns:
+            df_itens_sum_bc = df_itens_global.groupby(COLUNA_CODIGO)['BC_PIS_COFINS_CALC'].sum().reset_index()
+            df_recon = pd.merge(df_recon, df_itens_sum_bc, on=COLUNA_CODIGO, how='left')
+            df_recon['BC_PIS_COFINS_CALC'] = df_recon['BC_PIS_COFINS_CALC'].fillna(0).astype('int64')
         else:
-            df_recon['BC_PIS_COFINS_CALC'] = 0.0
+            df_recon['BC_PIS_COFINS_CALC'] = 0
 
-        df_recon['BC_PIS_COFINS_CALC'] = df_recon['BC_PIS_COFINS_CALC'].apply(lambda x: max(x, 0))
-        df_recon['PIS_CALC'] = (df_recon['BC_PIS_COFINS_CALC'] * 0.0165).round(2)
-        df_recon['COFINS_CALC'] = (df_recon['BC_PIS_COFINS_CALC'] * 0.0760).round(2)
+        df_recon['BC_PIS_COFINS_CALC'] = df_recon['BC_PIS_COFINS_CALC'].clip(lower=0)
+        df_recon['PIS_CALC'] = aplicar_aliquota(df_recon['BC_PIS_COFINS_CALC'], ALIQUOTA_PIS)
+        df_recon['COFINS_CALC'] = aplicar_aliquota(df_recon['BC_PIS_COFINS_CALC'], ALIQUOTA_COFINS)
 
-        df_recon['STATUS_PIS'] = np.where((df_recon['PIS_CALC'] - df_recon['PIS_SPED']).abs() <= tolerancia_valor, 'OK', 'DIVERGENTE')
-        df_recon['STATUS_COFINS'] = np.where((df_recon['COFINS_CALC'] - df_recon['COFINS_SPED']).abs() <= tolerancia_valor, 'OK', 'DIVERGENTE')
+        df_recon['STATUS_PIS'] = np.where(dentro_da_tolerancia(df_recon['PIS_CALC'], df_recon['PIS_SPED'], tolerancia_valor), 'OK', 'DIVERGENTE')
+        df_recon['STATUS_COFINS'] = np.where(dentro_da_tolerancia(df_recon['COFINS_CALC'], df_recon['COFINS_SPED'], tolerancia_valor), 'OK', 'DIVERGENTE')
 
         # --- APLICA REGRA: IGNORAR PIS/COFINS ---
         if ignorar_pis_cofins:
@@ -210,10 +286,34 @@ def executar_analise_completa(
             mask_nota_existe = (df_recon['SITUACAO_NOTA'] == 'OK')
             df_recon.loc[mask_falta_acumulador & mask_nota_existe, 'STATUS_GERAL'] = 'REVISAR'
 
+        # --- MODO DIVERGÊNCIAS: descarta notas OK antes do pipeline de itens ---
+        modo_divergencias = modo_relatorio == 'divergencias'
+        tabelas_exportacao = {}
+        df_itens_base = df_itens_global
+        if modo_divergencias:
+            total_notas = len(df_recon)
+            df_recon_completo = df_recon
+            df_recon = df_recon[df_recon['STATUS_GERAL'] != 'OK'].copy()
+            chaves_divergentes = df_recon[COLUNA_CODIGO]
+
+            if duas_fases:
+                arquivos_itens = df_recon['ARQUIVO_XML'].dropna().unique().tolist() if 'ARQUIVO_XML' in df_recon.columns else []
+                if status_callback: status_callback("Lendo itens das notas divergentes...")
+                df_itens_base = indice_chaves.preparar(extrair_itens_nfe([Path(a) for a in arquivos_itens], progress_callback))
+                logging.info(f"Modo divergências: itens lidos de {len(arquivos_itens)} XMLs.")
+            elif df_itens_base is not None and not df_itens_base.empty:
+                tabelas_exportacao['Itens_XML_Bruto'] = df_itens_base.drop(columns=[COLUNA_CODIGO])
+                df_itens_base = df_itens_base[df_itens_base[COLUNA_CODIGO].isin(chaves_divergentes)]
+                logging.info(f"Modo divergências: {len(df_itens_base)} de {len(df_itens_global)} itens seguem para o cruzamento.")
+            if not df_sped_itens.empty:
+                df_sped_itens = df_sped_itens[df_sped_itens[COLUNA_CODIGO].isin(chaves_divergentes)].copy()
+
+            logging.info(f"Modo divergências: {len(df_recon)} de {total_notas} notas com STATUS_GERAL diferente de OK.")
+
         # -------------------------------------------------------------------------
         # 4. Preparação dos Itens (C170)
         # -------------------------------------------------------------------------
-        df_itens_final = df_itens_global.copy() if df_itens_global is not None else pd.DataFrame()
+        df_itens_final = df_itens_base.copy() if df_itens_base is not None else pd.DataFrame()
         if not df_itens_final.empty:
 
             def check_item_cfop(row: pd.Series) -> str:
@@ -236,7 +336,7 @@ def executar_analise_completa(
                 except Exception as e:
                     logging.warning(f"Falha ao converter N_ITEM/N_ITEM_SPED para inteiro: {e}")
 
-                df_itens_final = pd.merge(df_itens_final, df_sped_itens,
+                df_itens_final = indice_chaves.mesclar(df_itens_final, df_sped_itens,
                                         left_on=['CHV_NFE', 'N_ITEM'],
                                         right_on=['CHV_NFE', 'N_ITEM_SPED'],
                                         how='left')
@@ -248,14 +348,17 @@ def executar_analise_completa(
                 for col in sped_c170_cols:
                     if col not in df_itens_final.columns: df_itens_final[col] = np.nan
 
-                df_itens_final['CFOP_SPED_ITEM'] = df_itens_final['CFOP_SPED_ITEM'].fillna('N/A no SPED')
-                cols_to_fill_zero = [col for col in sped_c170_cols[1:]]
-                df_itens_final[cols_to_fill_zero] = df_itens_final[cols_to_fill_zero].fillna(0.0)
+                # Itens sem C170 (nota FALTA NO SPED): valores zerados (centavos); códigos (categóricos) ficam vazios
+                preencher_vazios(df_itens_final, ['CFOP_SPED_ITEM'], 'N/A no SPED')
+                colunas_c170 = df_itens_final[sped_c170_cols[1:]]
+                cols_to_fill_zero = colunas_c170.select_dtypes('number').columns.tolist()
+                df_itens_final[cols_to_fill_zero] = df_itens_final[cols_to_fill_zero].fillna(0).astype('int64')
+                preencher_vazios(df_itens_final, colunas_c170.columns.difference(cols_to_fill_zero), '')
 
             else:
                 logging.warning("Itens SPED (C170) não encontrados. CFOP do item ficará 'N/A'.")
                 df_itens_final['CFOP_SPED_ITEM'] = 'N/A no SPED'
-                df_itens_final['VLR_IPI_SPED_ITEM'] = 0.0
+                df_itens_final['VLR_IPI_SPED_ITEM'] = 0
 
             logging.info("Calculando status do CFOP a nível de item (NF-e)...")
             df_itens_final['STATUS_CFOP_ITEM'] = df_itens_final.apply(check_item_cfop, axis=1)
@@ -288,10 +391,9 @@ def executar_analise_completa(
                 if cols_to_drop_from_itens:
                     df_itens_final = df_itens_final.drop(columns=cols_to_drop_from_itens)
 
-                df_itens_final = pd.merge(
+                df_itens_final = indice_chaves.mesclar(
                     df_itens_final,
-                    df_recon[cols_existentes_em_recon],
-                    on='CHV_NFE',
+                    df_recon[cols_existentes_em_recon + [COLUNA_CODIGO]],
                     how='left',
                     suffixes=('_ITEM', '_TOTAL_NOTA')
                 )
@@ -304,24 +406,20 @@ def executar_analise_completa(
                     'PIS_SPED_TOTAL_NOTA': 'PIS_SPED_TOTAL', 'COFINS_SPED_TOTAL_NOTA': 'COFINS_SPED_TOTAL'
                 }, inplace=True)
 
-                # Preenchimento de Nulos após merge
+                # Preenchimento de Nulos após merge (as colunas numéricas da nota são todas em centavos)
                 cols_preencher = [col for col in cols_existentes_em_recon if col != 'CHV_NFE']
                 cols_preencher.extend(['PIS_CALC_TOTAL', 'COFINS_CALC_TOTAL', 'PIS_SPED_TOTAL', 'COFINS_SPED_TOTAL'])
                 for col in cols_preencher:
                     if col in df_itens_final.columns:
                         if pd.api.types.is_numeric_dtype(df_itens_final[col]):
-                            df_itens_final[col] = df_itens_final[col].fillna(0)
+                            df_itens_final[col] = df_itens_final[col].fillna(0).astype('int64')
                         else:
-                            df_itens_final[col] = df_itens_final[col].fillna('')
+                            preencher_vazios(df_itens_final, [col])
 
                 logging.info("Calculando impostos proporcionais a nível de item (NF-e)...")
-                df_itens_final['VLR_PROD'] = pd.to_numeric(df_itens_final['VLR_PROD'], errors='coerce').fillna(0)
-                df_itens_final['VL_DOC_XML'] = pd.to_numeric(df_itens_final['VL_DOC_XML'], errors='coerce').fillna(0)
-                df_itens_final['TAXA_PROPORCAO_ITEM'] = np.where(
-                    df_itens_final['VL_DOC_XML'] > 0,
-                    df_itens_final['VLR_PROD'] / df_itens_final['VL_DOC_XML'],
-                    0
-                )
+                # Rateio em centavos: total da nota x VLR_PROD / VL_DOC_XML (0 se a nota não tem valor)
+                vlr_prod = df_itens_final['VLR_PROD'].fillna(0).astype('int64')
+                vl_doc = df_itens_final['VL_DOC_XML']
 
                 colunas_para_prorratear = [
                     'ICMS_SPED', 'ICMS_ST_SPED', 'ICMS_ST_XML', 'FCP_ST_SPED', 'FCP_ST_XML',
@@ -330,38 +428,34 @@ def executar_analise_completa(
 
                 for col in colunas_para_prorratear:
                     if col in df_itens_final.columns:
-                        df_itens_final[col] = pd.to_numeric(df_itens_final[col], errors='coerce').fillna(0)
                         novo_nome_col = col.replace('_TOTAL', '')
-                        df_itens_final[novo_nome_col] = (df_itens_final[col] * df_itens_final['TAXA_PROPORCAO_ITEM']).round(2)
+                        df_itens_final[novo_nome_col] = ratear_centavos(df_itens_final[col], vlr_prod, vl_doc)
                         if novo_nome_col != col:
                             df_itens_final.drop(columns=[col], inplace=True, errors='ignore')
 
-                df_itens_final.drop(columns=['TAXA_PROPORCAO_ITEM', 'PIS_CALC_TOTAL', 'COFINS_CALC_TOTAL'], inplace=True, errors='ignore')
+                df_itens_final.drop(columns=['PIS_CALC_TOTAL', 'COFINS_CALC_TOTAL'], inplace=True, errors='ignore')
 
                 if 'ICMS_TOTAL_XML' in df_itens_final.columns and 'VLR_ICMS' in df_itens_final.columns:
                     df_itens_final['ICMS_TOTAL_XML'] = df_itens_final['VLR_ICMS']
                 if 'BC_PIS_COFINS_CALC' in df_itens_final.columns:
-                    df_itens_final['PIS_CALC'] = (df_itens_final['BC_PIS_COFINS_CALC'] * 0.0165).round(2)
-                    df_itens_final['COFINS_CALC'] = (df_itens_final['BC_PIS_COFINS_CALC'] * 0.0760).round(2)
+                    df_itens_final['PIS_CALC'] = aplicar_aliquota(df_itens_final['BC_PIS_COFINS_CALC'], ALIQUOTA_PIS)
+                    df_itens_final['COFINS_CALC'] = aplicar_aliquota(df_itens_final['BC_PIS_COFINS_CALC'], ALIQUOTA_COFINS)
                 else:
-                    df_itens_final['PIS_CALC'] = 0.0
-                    df_itens_final['COFINS_CALC'] = 0.0
+                    df_itens_final['PIS_CALC'] = 0
+                    df_itens_final['COFINS_CALC'] = 0
 
                 if 'MVA ORIGINAL' in df_itens_final.columns:
                     df_itens_final['MVA ORIGINAL'] = pd.to_numeric(df_itens_final['MVA ORIGINAL'], errors='coerce').fillna(0)
 
                 if 'VLR_ICMS' in df_itens_final.columns and 'VLR_ICMS_SN' in df_itens_final.columns and 'VLR_ICMS_MONO' in df_itens_final.columns:
-                    df_itens_final['VLR_ICMS'] = pd.to_numeric(df_itens_final['VLR_ICMS'], errors='coerce').fillna(0)
-                    df_itens_final['VLR_ICMS_SN'] = pd.to_numeric(df_itens_final['VLR_ICMS_SN'], errors='coerce').fillna(0)
-                    df_itens_final['VLR_ICMS_MONO'] = pd.to_numeric(df_itens_final['VLR_ICMS_MONO'], errors='coerce').fillna(0)
-                    df_itens_final['VLR_ICMS_TOTAL_ITEM'] = (df_itens_final['VLR_ICMS'] + df_itens_final['VLR_ICMS_SN'] + df_itens_final['VLR_ICMS_MONO']).round(2)
+                    df_itens_final['VLR_ICMS_TOTAL_ITEM'] = df_itens_final['VLR_ICMS'] + df_itens_final['VLR_ICMS_SN'] + df_itens_final['VLR_ICMS_MONO']
                 else:
-                    df_itens_final['VLR_ICMS_TOTAL_ITEM'] = df_itens_final['VLR_ICMS'] if 'VLR_ICMS' in df_itens_final.columns else 0.0
+                    df_itens_final['VLR_ICMS_TOTAL_ITEM'] = df_itens_final['VLR_ICMS'] if 'VLR_ICMS' in df_itens_final.columns else 0
 
                 if 'VL_DOC_XML' in df_itens_final.columns and 'VL_DOC_SPED' in df_itens_final.columns:
-                    df_itens_final['DIF_VALOR_TOTAL'] = (df_itens_final['VL_DOC_XML'] - df_itens_final['VL_DOC_SPED']).round(2)
+                    df_itens_final['DIF_VALOR_TOTAL'] = df_itens_final['VL_DOC_XML'] - df_itens_final['VL_DOC_SPED']
                 else:
-                    df_itens_final['DIF_VALOR_TOTAL'] = 0.0
+                    df_itens_final['DIF_VALOR_TOTAL'] = 0
 
         # -------------------------------------------------------------------------
         # 4. Preparação dos DataFrames para o Excel
@@ -369,7 +463,7 @@ def executar_analise_completa(
         colunas_relatorio = [
             'STATUS_GERAL', 'SITUACAO_NOTA', 'CHV_NFE', 'NUM_NF', 'CNPJ_EMITENTE', 'ACUMULADOR',
             'TIPO_NOTA', 'STATUS_VALOR', 'VL_DOC_XML', 'VL_DOC_SPED',
-            'STATUS_CFOP', 'CFOP_XML', 'CFOP_SPED', 'CEST_XML',
+            'STATUS_CFOP', 'CFOP_XML', 'CFOP_SPED', 'CST_XML', 'CEST_XML',
             'STATUS_ICMS', 'ICMS_TOTAL_XML', 'ICMS_SPED',
             'STATUS_ICMS_ST', 'ICMS_ST_XML', 'ICMS_ST_SPED',
             'STATUS_FCP_ST', 'FCP_ST_XML', 'FCP_ST_SPED',
@@ -379,10 +473,13 @@ def executar_analise_completa(
             'STATUS_COFINS', 'COFINS_CALC', 'COFINS_SPED',
         ]
         if not df_recon.empty:
-            df_recon_relatorio = df_recon[[col for col in colunas_relatorio if col in df_recon.columns]]
+            df_recon_relatorio = compactar_dataframe(df_recon[[col for col in colunas_relatorio if col in df_recon.columns]], 'Conciliacao')
             if 'STATUS_GERAL' in df_recon.columns:
                 total_problemas = df_recon['STATUS_GERAL'].apply(lambda x: isinstance(x, str) and x != 'OK' and x != 'N/A').sum()
 
+        if modo_divergencias and not df_recon_completo.empty:
+            tabelas_exportacao['Conciliacao'] = compactar_dataframe(df_recon_completo[[col for col in colunas_relatorio if col in df_recon_completo.columns]])
+
         if not df_itens_final.empty:
             colunas_itens_xml = [
                 'STATUS_GERAL', 'SITUACAO_NOTA', 'TIPO_NOTA', 'CHV_NFE', 'NUM_NF', 'CNPJ_EMITENTE', 'ACUMULADOR', 'N_ITEM',
@@ -403,7 +500,7 @@ def executar_analise_completa(
             ]
 
             colunas_itens_existentes = [col for col in colunas_itens_xml if col in df_itens_final.columns]
-            df_itens_aba = df_itens_final[colunas_itens_existentes].copy()
+            df_itens_aba = compactar_dataframe(df_itens_final[colunas_itens_existentes].copy(), 'Itens_XML')
             df_itens_aba.rename(columns={'VLR_IPI_SPED_ITEM': 'IPI_SPED (Item C170)'}, inplace=True)
 
         if not df_itens_final.empty and caminho_regras_detalhadas:
@@ -432,21 +529,14 @@ def executar_analise_completa(
         logging.info("Calculando totalizadores combinados (NF-e, CT-e, Energia, Com)...")
         df_totalizadores_cst = _calcular_totalizadores_cfop_cst(df_sped_analitico_combinado)
 
-        if not df_totalizadores_cst.empty:
-            cfop_str = df_totalizadores_cst['CFOP (SPED)'].astype(str)
-            df_totalizadores_entrada = df_totalizadores_cst[cfop_str.str.startswith(('1', '2', '3'))].copy()
-            df_totalizadores_saida = df_totalizadores_cst[cfop_str.str.startswith(('5', '6', '7'))].copy()
-        else:
-            df_totalizadores_entrada = pd.DataFrame()
-            df_totalizadores_saida = pd.DataFrame()
+        df_totalizadores_entrada, df_totalizadores_saida = separar_totalizadores_entrada_saida(df_totalizadores_cst)
 
         df_base_difal_por_cfop = pd.DataFrame()
         if not df_chaves_difal.empty and not df_sped_analitico_combinado.empty:
             logging.info("Calculando Base de Cálculo para abatimento de DIFAL (C101)...")
-            df_analitico_difal = pd.merge(df_sped_analitico_combinado, df_chaves_difal, on='CHV_NFE', how='inner')
-            if not df_analitico_difal.empty:
-                df_base_difal_por_cfop = df_analitico_difal.groupby('CFOP_SPED_ITEM')['VL_BC_ICMS_SPED_ITEM'].sum().reset_index()
-                df_base_difal_por_cfop.rename(columns={'CFOP_SPED_ITEM': 'CFOP', 'VL_BC_ICMS_SPED_ITEM': 'VALOR_BASE_DIFAL'}, inplace=True)
+            df_base_difal_por_cfop = calcular_base_difal_por_cfop(
+                indice_chaves.mesclar(df_sped_analitico_combinado, df_chaves_difal, how='inner')
+            )
 
         # -------------------------------------------------------------------------
         # 6. Conciliação CT-e (Atualizado com Novas Colunas)
@@ -498,26 +588,26 @@ def executar_analise_completa(
                 default='OK'
             )
 
-            # Preenche zeros apenas nas colunas de SOMA do SPED
+            # Preenche zeros apenas nas colunas de SOMA do SPED (centavos)
             numeric_cols_cte_agg = ['VL_OPR_SPED_SUM', 'VL_BC_ICMS_SPED_SUM', 'VL_ICMS_SPED_SUM']
             for col in numeric_cols_cte_agg:
-                if col in df_cte_merge.columns: df_cte_merge[col] = df_cte_merge[col].fillna(0.0)
+                if col in df_cte_merge.columns: df_cte_merge[col] = df_cte_merge[col].fillna(0).astype('int64')
 
             # Status Valor (Compara Total XML vs Total Operação SPED ou Valor Operação XML vs SPED)
             # Preferimos VL_TOTAL_CTE_XML se existir, senão VL_OPR_XML
             col_valor_xml = 'VL_TOTAL_CTE_XML' if 'VL_TOTAL_CTE_XML' in df_cte_merge.columns else 'VL_OPR_XML'
 
             # Garante que col_valor_xml não é NaN para a comparação
-            df_cte_merge[col_valor_xml] = df_cte_merge[col_valor_xml].fillna(0.0)
+            df_cte_merge[col_valor_xml] = df_cte_merge[col_valor_xml].fillna(0).astype('int64')
 
             df_cte_merge['STATUS_VALOR'] = np.where(
-                (df_cte_merge[col_valor_xml] - df_cte_merge['VL_OPR_SPED_SUM']).abs() <= tolerancia_valor, 'OK', 'DIVERGENTE'
+                dentro_da_tolerancia(df_cte_merge[col_valor_xml], df_cte_merge['VL_OPR_SPED_SUM'], tolerancia_valor), 'OK', 'DIVERGENTE'
             )
             df_cte_merge['STATUS_BC_ICMS'] = np.where(
-                (df_cte_merge['VL_BC_ICMS_XML'].fillna(0.0) - df_cte_merge['VL_BC_ICMS_SPED_SUM']).abs() <= tolerancia_valor, 'OK', 'DIVERGENTE'
+                dentro_da_tolerancia(df_cte_merge['VL_BC_ICMS_XML'].fillna(0), df_cte_merge['VL_BC_ICMS_SPED_SUM'], tolerancia_valor), 'OK', 'DIVERGENTE'
             )
             df_cte_merge['STATUS_ICMS'] = np.where(
-                (df_cte_merge['VL_ICMS_XML'].fillna(0.0) - df_cte_merge['VL_ICMS_SPED_SUM']).abs() <= tolerancia_valor, 'OK', 'DIVERGENTE'
+                dentro_da_tolerancia(df_cte_merge['VL_ICMS_XML'].fillna(0), df_cte_merge['VL_ICMS_SPED_SUM'], tolerancia_valor), 'OK', 'DIVERGENTE'
             )
 
             df_cte_merge['CFOP_SPED_AGG'] = df_cte_merge['CFOP_SPED_LIST'].apply(lambda x: '/'.join(x) if isinstance(x, list) else '')
@@ -540,9 +630,10 @@ def executar_analise_completa(
             status_cols_to_add = [col for col in status_cols_to_add if col in df_cte_merge.columns]
 
             logging.info("Mapeando status da conciliação de volta para os registros D190 originais...")
+            # A chave do XML vira CHV_CTE_XML: CHV_CTE fica sendo a do D190 (colunas duplicadas quebram a exportação)
             df_report_cte = pd.merge(
                 df_report_cte,
-                df_cte_merge[status_cols_to_add],
+                df_cte_merge[status_cols_to_add].rename(columns={'CHV_CTE': 'CHV_CTE_XML'}),
                 on='NUM_CTE_SPED',
                 how='left'
             )
@@ -552,16 +643,16 @@ def executar_analise_completa(
             cols_status = ['STATUS_VALOR', 'STATUS_BC_ICMS', 'STATUS_ICMS', 'STATUS_CFOP']
             df_report_cte[cols_status] = df_report_cte[cols_status].fillna('N/A')
 
-            # Preenche NaN nas colunas novas com vazios ou zeros
-            cols_numericas_cte = ['VL_OPR_XML', 'VL_BC_ICMS_XML', 'VL_ICMS_XML', 'VL_TOTAL_CTE_XML', 'ALIQ_ICMS_XML']
+            # Preenche NaN nas colunas novas com vazios ou zeros (valores em centavos, alíquota em %)
+            cols_numericas_cte = ['VL_OPR_XML', 'VL_BC_ICMS_XML', 'VL_ICMS_XML', 'VL_TOTAL_CTE_XML']
             for col in cols_numericas_cte:
-                if col in df_report_cte.columns: df_report_cte[col] = df_report_cte[col].fillna(0.0)
+                if col in df_report_cte.columns: df_report_cte[col] = df_report_cte[col].fillna(0).astype('int64')
+            if 'ALIQ_ICMS_XML' in df_report_cte.columns: df_report_cte['ALIQ_ICMS_XML'] = df_report_cte['ALIQ_ICMS_XML'].fillna(0.0)
 
             cols_texto_cte = ['CHV_CTE_XML', 'CFOP_XML', 'CST_XML', 'CNPJ_TRANSPORTADOR', 'IE_TRANSPORTADOR', 'UF_EMITENTE_CTE', 'REMETENTE_NOME', 'DESTINATARIO_NOME', 'TOMADOR_CNPJ', 'TOMADOR_NOME', 'MUN_ORIGEM', 'MUN_DESTINO', 'ITEM_PREDOMINANTE']
             for col in cols_texto_cte:
                 if col in df_report_cte.columns: df_report_cte[col] = df_report_cte[col].fillna('')
 
-            if 'CHV_CTE_y' in df_report_cte.columns: df_report_cte.rename(columns={'CHV_CTE_y': 'CHV_CTE_XML'}, inplace=True)
 
         elif df_report_cte.empty:
             pass
@@ -572,6 +663,12 @@ def executar_analise_completa(
 
         df_sped_cte_d190_final = df_report_cte
 
+        registrar_memoria({
+            'SPED C100/C500/D500': df_sped, 'SPED C170': df_sped_itens, 'SPED C190/D190': df_sped_analitico_combinado,
+            'XML NF-e (itens)': df_itens_global, 'Conciliacao': df_recon_relatorio, 'Itens_XML': df_itens_aba,
+            'Aliquota_XML': df_aliquota_aba, 'CTe': df_sped_cte_d190_final
+        })
+
         # 7. Geração do Arquivo Excel
         caminho_saida = caminho_sped.parent / f'Relatorio_Conciliacao_Fiscal_{time.strftime("%Y%m%d_%H%M%S")}.xlsx'
         logging.info(f"Gerando relatório em Excel: {caminho_saida}")
@@ -584,7 +681,10 @@ def executar_analise_completa(
             df_aliquota_aba,
             df_totalizadores_entrada,
             df_totalizadores_saida,
-            df_sped_cte_d190_final
+            df_sped_cte_d190_final,
+            somente_divergencias=somente_divergencias_excel or modo_divergencias,
+            exportar_dados=exportar_dados_completos,
+            tabelas_exportacao=tabelas_exportacao
         )
 
         # 8. Preenchimento do Template de Apuração
@@ -1,311 +1,447 @@
 import sys
 import os
 import logging
+import zipfile
+import numpy as np
 import pandas as pd
 import xml.etree.ElementTree as ET
 from pathlib import Path
 from datetime import datetime
 from collections import Counter
-from typing import Optional, Callable
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Callable, Tuple
 
 # --- IMPORTAÇÕES PARA ESTILO EXCEL ---
 from openpyxl import load_workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side, NamedStyle
+from openpyxl.formatting.rule import FormulaRule
 from openpyxl.utils import get_column_letter
 
+from .excel_streaming import criar_workbook_streaming, escrever_dataframe_streaming, estimar_largura
+
 # -----------------------------
-# 1. PARSER XML PADRÃO (ATUALIZADO COM PIS/COFINS)
+# 1. PARSER XML (NF-e -> ITENS DO INVEST)
 # -----------------------------
-def ler_xmls_diretamente(pasta_xml: Path, progress_callback: Optional[Callable[[int, int], None]] = None) -> pd.DataFrame:
-    dados = []
-    arquivos = list(pasta_xml.glob('*.xml'))
-    total_arquivos = len(arquivos)
-
-    if total_arquivos == 0:
-        return pd.DataFrame()
-
-    ns = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
-
-    for i, arquivo in enumerate(arquivos):
-        if progress_callback:
-            progress_callback(i + 1, total_arquivos)
+# Uma travessia por arquivo: as tags são comparadas sem namespace (XML com ou
+# sem o namespace da NF-e) e cada nó é indexado pelos filhos diretos, sem
+# buscas './/' repetidas. Os arquivos (soltos ou dentro de .zip) são lidos em
+# lotes, em processos separados quando há mais de um lote.
+
+# (coluna, tipo) na ordem das colunas do DataFrame; 'valor' = float64
+COLUNAS_XML_INVEST = [
+    ('n da nf', 'texto'), ('cnpj', 'texto'), ('uf', 'texto'), ('data', 'texto'), ('cst', 'texto'),
+    ('qnt', 'valor'), ('vl unit', 'valor'), ('vl total', 'valor'), ('vlr', 'valor'),
+    ('icms bc', 'valor'), ('alq icms', 'valor'), ('icms', 'valor'), ('ipi', 'valor'),
+    ('icms st', 'valor'), ('fcp st', 'valor'), ('aql sn', 'valor'), ('icms sn', 'valor'),
+    ('descrição', 'texto'), ('COD. PROD.', 'texto'), ('ipi dev', 'valor'), ('difal', 'valor'),
+    ('COD_PROD_INTERNO', 'texto'), ('NCM', 'texto'), ('CFOP', 'texto'), ('protocolo', 'texto'),
+    ('cst_pis', 'texto'), ('vlr_pis', 'valor'), ('cst_cofins', 'texto'), ('vlr_cofins', 'valor'),
+    ('pc', 'texto'), ('st', 'texto'),
+]
+TAMANHO_LOTE_XML = 250
+
+def _tag_local(tag: str) -> str:
+    return tag.rpartition('}')[2]
+
+def _filhos(node: Optional[ET.Element]) -> Dict[str, ET.Element]:
+    """Filhos diretos por tag (sem namespace); vale o primeiro, como no find()."""
+    filhos: Dict[str, ET.Element] = {}
+    if node is not None:
+        for filho in node:
+            filhos.setdefault(_tag_local(filho.tag), filho)
+    return filhos
+
+def _textos(node: Optional[ET.Element]) -> Dict[str, str]:
+    return {tag: filho.text or '' for tag, filho in _filhos(node).items()}
+
+def _valor(textos: Dict[str, str], tag: str) -> float:
+    val = textos.get(tag)
+    return float(val.replace(',', '.')) if val else 0.0
+
+def _ler_nfe_invest(conteudo: bytes) -> List[tuple]:
+    """Linhas (uma por <det>) na ordem de COLUNAS_XML_INVEST. XML sem infNFe -> []."""
+    root = ET.fromstring(conteudo)
+    inf_nfe = next((node for node in root.iter() if _tag_local(node.tag) == 'infNFe'), None)
+    if inf_nfe is None: return []
+
+    # --- CABEÇALHO ---
+    nfe = _filhos(inf_nfe)
+    ide = _textos(nfe.get('ide'))
+    dest_node = nfe.get('dest')
+    dest = _textos(dest_node)
+    nNF = ide.get('nNF', '')
+    dhEmi = ide.get('dhEmi', '')[:10]
+    cnpj_dest = dest.get('CNPJ', '')
+    uf_dest = _textos(_filhos(dest_node).get('enderDest')).get('UF', '')
+    protocolo = _textos(_filhos(_filhos(root).get('protNFe')).get('infProt')).get('nProt', '')
+
+    # --- ITENS ---
+    linhas = []
+    for det in inf_nfe:
+        if _tag_local(det.tag) != 'det': continue
+        det_filhos = _filhos(det)
+        prod_node = det_filhos.get('prod')
+        if prod_node is None: continue
+        prod = _textos(prod_node)
+
+        vProd = _valor(prod, 'vProd')
+        vFrete = _valor(prod, 'vFrete'); vSeg = _valor(prod, 'vSeg')
+        vDesc = _valor(prod, 'vDesc'); vOutro = _valor(prod, 'vOutro')
+
+        cst = ''; vBC = 0.0; pICMS = 0.0; vICMS = 0.0
+        vIPI = 0.0; vIPIDevol = 0.0; vICMSST = 0.0; vFCPST = 0.0
+        pCredSN = 0.0; vCredICMSSN = 0.0; vICMSUFDest = 0.0
+        cst_pis = ''; vPIS = 0.0
+        cst_cofins = ''; vCOFINS = 0.0
+
+        imposto_node = det_filhos.get('imposto')
+        if imposto_node is not None:
+            imposto = _filhos(imposto_node)
+
+            # ICMS (ICMS00, ICMS10, ICMSSN102...): para no primeiro grupo com CST/CSOSN
+            for grupo in imposto.get('ICMS', ()):
+                icms = _textos(grupo)
+                cst_val = icms.get('CST') or icms.get('CSOSN')
+                if cst_val: cst = cst_val
+                vBC = _valor(icms, 'vBC'); pICMS = _valor(icms, 'pICMS'); vICMS = _valor(icms, 'vICMS')
+                vICMSST = _valor(icms, 'vICMSST'); vFCPST = _valor(icms, 'vFCPST')
+                pCredSN = _valor(icms, 'pCredSN'); vCredICMSSN = _valor(icms, 'vCredICMSSN')
+                if cst: break
+
+            # IPI
+            ipi_node = imposto.get('IPI')
+            if ipi_node is not None:
+                ipi = _filhos(ipi_node)
+                vIPI = _valor(_textos(ipi['IPITrib']) if 'IPITrib' in ipi else _textos(ipi_node), 'vIPI')
+
+            # IPI Devol (det/impostoDevol/IPI/vIPIDevol)
+            devol = _filhos(det_filhos.get('impostoDevol'))
+            vIPIDevol = _valor(_textos(devol.get('IPI')), 'vIPIDevol')
+
+            # DIFAL
+            vICMSUFDest = _valor(_textos(imposto.get('ICMSUFDest')), 'vICMSUFDest')
+
+            # PIS / COFINS (PISAliq, PISOutr...): vale o último grupo
+            for grupo in imposto.get('PIS', ()):
+                pis = _textos(grupo)
+                if pis.get('CST'): cst_pis = pis['CST']
+                vPIS = _valor(pis, 'vPIS')
+            for grupo in imposto.get('COFINS', ()):
+                cofins = _textos(grupo)
+                if cofins.get('CST'): cst_cofins = cofins['CST']
+                vCOFINS = _valor(cofins, 'vCOFINS')
+
+        vItemContabil = (vProd + vIPI + vICMSST + vFrete + vSeg + vOutro + vFCPST) - vDesc
+        cProd = prod.get('cProd', '')
+
+        linhas.append((
+            nNF, cnpj_dest, uf_dest, dhEmi, cst,
+            _valor(prod, 'qCom'), _valor(prod, 'vUnCom'), vProd, vItemContabil,
+            vBC, pICMS, vICMS, vIPI,
+            vICMSST, vFCPST, pCredSN, vCredICMSSN,
+            prod.get('xProd', ''), cProd, vIPIDevol, vICMSUFDest,
+            cProd, prod.get('NCM', ''), prod.get('CFOP', ''), protocolo,
+            cst_pis, vPIS, cst_cofins, vCOFINS,
+            '', ''
+        ))
+    return linhas
+
+def _listar_xmls_invest(origem: Path) -> List[Tuple[str, Optional[str]]]:
+    """(arquivo, membro do zip ou None) de cada XML: .xml da pasta e .xml dentro dos .zip (pasta ou o próprio .zip)."""
+    if origem.is_file() and origem.suffix.lower() == '.zip':
+        zips, entradas = [origem], []
+    else:
+        entradas = [(str(arquivo), None) for arquivo in origem.glob('*.xml')]
+        zips = [arquivo for arquivo in origem.glob('*.zip')]
 
+    for caminho_zip in zips:
         try:
-            tree = ET.parse(arquivo)
-            root = tree.getroot()
-            infNFe = root.find('.//nfe:infNFe', ns)
-            if infNFe is None:
-                infNFe = root.find('.//infNFe')
-                if infNFe is None: continue
-
-            def get_text(node, tag):
-                if node is None: return ''
-                el = node.find(f'nfe:{tag}', ns)
-                if el is None: el = node.find(tag)
-                return el.text if el is not None else ''
-
-            def get_float(node, tag):
-                val = get_text(node, tag)
-                if val:
-                    return float(val.replace(',', '.'))
-                return 0.0
-
-            # --- CABEÇALHO ---
-            ide = infNFe.find('.//nfe:ide', ns) or infNFe.find('ide')
-            dest = infNFe.find('.//nfe:dest', ns) or infNFe.find('dest')
-            prot = root.find('.//nfe:protNFe', ns) or root.find('.//protNFe')
-
-            nNF = get_text(ide, 'nNF')
-            dhEmi = get_text(ide, 'dhEmi')[:10]
-            cnpj_dest = get_text(dest, 'CNPJ')
-
-            uf_dest = ''
-            if dest is not None:
-                ender = dest.find('.//nfe:enderDest', ns) or dest.find('enderDest')
-                if ender is not None:
-                    uf_dest = get_text(ender, 'UF')
-
-            protocolo = ''
-            if prot:
-                infProt = prot.find('.//nfe:infProt', ns) or prot.find('infProt')
-                if infProt is not None:
-                    protocolo = get_text(infProt, 'nProt')
-
-            # --- ITENS ---
-            dets = infNFe.findall('.//nfe:det', ns) or infNFe.findall('det')
-
-            for det in dets:
-                prod = det.find('.//nfe:prod', ns) or det.find('prod')
-                imposto = det.find('.//nfe:imposto', ns) or det.find('imposto')
-
-                if prod is None: continue
-
-                cProd = get_text(prod, 'cProd')
-                xProd = get_text(prod, 'xProd')
-                NCM = get_text(prod, 'NCM')
-                CFOP = get_text(prod, 'CFOP')
-
-                vProd = get_float(prod, 'vProd')
-                qCom = get_float(prod, 'qCom')
-                vUnCom = get_float(prod, 'vUnCom')
-                vFrete = get_float(prod, 'vFrete')
-                vSeg = get_float(prod, 'vSeg')
-                vDesc = get_float(prod, 'vDesc')
-                vOutro = get_float(prod, 'vOutro')
-
-                cst = ''; vBC = 0.0; pICMS = 0.0; vICMS = 0.0
-                vIPI = 0.0; vIPIDevol = 0.0; vICMSST = 0.0; vFCPST = 0.0
-                pCredSN = 0.0; vCredICMSSN = 0.0; vICMSUFDest = 0.0
-
-                # Variáveis PIS/COFINS
-                cst_pis = ''; vBC_pis = 0.0; pPIS = 0.0; vPIS = 0.0
-                cst_cofins = ''; vBC_cofins = 0.0; pCOFINS = 0.0; vCOFINS = 0.0
-
-                if imposto is not None:
-                    # ICMS
-                    icms_node = imposto.find('.//nfe:ICMS', ns) or imposto.find('ICMS')
-                    if icms_node is not None:
-                        for child in icms_node:
-                            cst_val = get_text(child, 'CST') or get_text(child, 'CSOSN')
-                            if cst_val: cst = cst_val
-                            vBC = get_float(child, 'vBC')
-                            pICMS = get_float(child, 'pICMS')
-                            vICMS = get_float(child, 'vICMS')
-                            vICMSST = get_float(child, 'vICMSST')
-                            vFCPST = get_float(child, 'vFCPST')
-                            pCredSN = get_float(child, 'pCredSN')
-                            vCredICMSSN = get_float(child, 'vCredICMSSN')
-                            if cst: break
-
-                    # IPI
-                    ipi_node = imposto.find('.//nfe:IPI', ns) or imposto.find('IPI')
-                    if ipi_node is not None:
-                        ipi_trib = ipi_node.find('.//nfe:IPITrib', ns) or ipi_node.find('IPITrib')
-                        if ipi_trib is not None:
-                            vIPI = get_float(ipi_trib, 'vIPI')
-                        else:
-                            vIPI = get_float(ipi_node, 'vIPI')
-
-                    # IPI Devol
-                    impostoDevol = det.find('.//nfe:impostoDevol', ns) or det.find('impostoDevol')
-                    if impostoDevol is not None:
-                        vIPIDevol = get_float(impostoDevol, 'vIPIDevol')
-
-                    # DIFAL
-                    icms_uf = imposto.find('.//nfe:ICMSUFDest', ns) or imposto.find('ICMSUFDest')
-                    if icms_uf is not None:
-                        vICMSUFDest = get_float(icms_uf, 'vICMSUFDest')
-
-                    # PIS
-                    pis_node = imposto.find('.//nfe:PIS', ns) or imposto.find('PIS')
-                    if pis_node is not None:
-                        for child in pis_node:
-                            cst_pis_val = get_text(child, 'CST')
-                            if cst_pis_val: cst_pis = cst_pis_val
-                            vBC_pis = get_float(child, 'vBC')
-                            pPIS = get_float(child, 'pPIS')
-                            vPIS = get_float(child, 'vPIS')
-
-                    # COFINS
-                    cofins_node = imposto.find('.//nfe:COFINS', ns) or imposto.find('COFINS')
-                    if cofins_node is not None:
-                        for child in cofins_node:
-                            cst_cofins_val = get_text(child, 'CST')
-                            if cst_cofins_val: cst_cofins = cst_cofins_val
-                            vBC_cofins = get_float(child, 'vBC')
-                            pCOFINS = get_float(child, 'pCOFINS')
-                            vCOFINS = get_float(child, 'vCOFINS')
-
-                vItemContabil = (vProd + vIPI + vICMSST + vFrete + vSeg + vOutro + vFCPST) - vDesc
-
-                dados.append({
-                    'n da nf': nNF, 'cnpj': cnpj_dest, 'uf': uf_dest, 'data': dhEmi, 'cst': cst,
-                    'qnt': qCom, 'vl unit': vUnCom, 'vl total': vProd, 'vlr': vItemContabil,
-                    'icms bc': vBC, 'alq icms': pICMS, 'icms': vICMS, 'ipi': vIPI,
-                    'icms st': vICMSST, 'fcp st': vFCPST, 'aql sn': pCredSN, 'icms sn': vCredICMSSN,
-                    'descrição': xProd,
-                    'COD. PROD.': cProd,
-                    'ipi dev': vIPIDevol, 'difal': vICMSUFDest,
-                    'COD_PROD_INTERNO': cProd, 'NCM': NCM, 'CFOP': CFOP, 'protocolo': protocolo,
-                    'cst_pis': cst_pis, 'vlr_pis': vPIS, 'cst_cofins': cst_cofins, 'vlr_cofins': vCOFINS,
-                    'pc': '', 'st': ''
-                })
+            with zipfile.ZipFile(caminho_zip) as zf:
+                entradas.extend((str(caminho_zip), membro) for membro in zf.namelist() if membro.lower().endswith('.xml'))
+        except zipfile.BadZipFile as e:
+            logging.error(f"Arquivo ZIP inválido {caminho_zip.name}: {e}")
+    return entradas
+
+def _ler_lote_invest(entradas: List[Tuple[str, Optional[str]]]) -> Tuple[Dict[str, Any], List[str]]:
+    """Lê um lote de XMLs (executado nos workers). Retorna as colunas tipadas e as mensagens de erro."""
+    linhas: List[tuple] = []
+    erros: List[str] = []
+    zips_abertos: Dict[str, zipfile.ZipFile] = {}
+    try:
+        for caminho, membro in entradas:
+            try:
+                if membro is None:
+                    conteudo = Path(caminho).read_bytes()
+                else:
+                    if caminho not in zips_abertos: zips_abertos[caminho] = zipfile.ZipFile(caminho)
+                    conteudo = zips_abertos[caminho].read(membro)
+                linhas.extend(_ler_nfe_invest(conteudo))
+            except Exception as e:
+                nome = Path(caminho).name if membro is None else f"{Path(caminho).name}:{membro}"
+                erros.append(f"Erro ao processar arquivo {nome}: {e}")
+    finally:
+        for zf in zips_abertos.values(): zf.close()
+
+    valores = list(zip(*linhas)) if linhas else [()] * len(COLUNAS_XML_INVEST)
+    colunas = {
+        nome: np.asarray(coluna, dtype='float64') if tipo == 'valor' else list(coluna)
+        for (nome, tipo), coluna in zip(COLUNAS_XML_INVEST, valores)
+    }
+    return colunas, erros
+
+def ler_xmls_diretamente(
+    pasta_xml: Path,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    max_workers: Optional[int] = None
+) -> pd.DataFrame:
+    """
+    Itens das NF-e da pasta (arquivos .xml e .zip com XMLs) ou de um .zip.
+    Os lotes de TAMANHO_LOTE_XML arquivos rodam em até max_workers processos
+    (padrão: núcleos da máquina) e as linhas saem na ordem dos arquivos.
+    """
+    entradas = _listar_xmls_invest(Path(pasta_xml))
+    total_arquivos = len(entradas)
 
-        except Exception as e:
-            logging.error(f"Erro ao processar arquivo {arquivo.name}: {e}")
-            continue
+    if total_arquivos == 0:
+        return pd.DataFrame()
 
+    lotes = [entradas[i:i + TAMANHO_LOTE_XML] for i in range(0, total_arquivos, TAMANHO_LOTE_XML)]
+    resultados: List[Optional[Dict[str, Any]]] = [None] * len(lotes)
+    processados = 0
+
+    def _registrar(i: int, colunas: Dict[str, Any], erros: List[str]):
+        nonlocal processados
+        resultados[i] = colunas
+        for erro in erros: logging.error(erro)
+        processados += len(lotes[i])
+        if progress_callback: progress_callback(processados, total_arquivos)
+
+    n_workers = max_workers or min(len(lotes), os.cpu_count() or 1)
+    if n_workers <= 1 or len(lotes) == 1:
+        for i, lote in enumerate(lotes):
+            _registrar(i, *_ler_lote_invest(lote))
+    else:
+        logging.info(f"Lendo {total_arquivos} XMLs em {len(lotes)} lotes ({n_workers} processos)...")
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(_ler_lote_invest, lote): i for i, lote in enumerate(lotes)}
+            for future in as_completed(futures):
+                _registrar(futures[future], *future.result())
+
+    dados = {}
+    for nome, tipo in COLUNAS_XML_INVEST:
+        partes = [colunas[nome] for colunas in resultados]
+        dados[nome] = np.concatenate(partes) if tipo == 'valor' else [v for parte in partes for v in parte]
+    if not len(dados['n da nf']):
+        return pd.DataFrame()
     return pd.DataFrame(dados)
 
 
 # -----------------------------
-# 2. FUNÇÕES DE EXCEL (ATUALIZADO COM VERMELHO PARA SEM REGRA)
+# 2. FUNÇÕES DE EXCEL (STREAMING, ESTILOS POR COLUNA E REGRAS CONDICIONAIS)
 # -----------------------------
-def formatar_excel(writer):
-    workbook = writer.book
-
-    # --- ESTILOS PADRÃO ---
-    header_font = Font(name='Calibri', size=11, bold=True, color='FFFFFF')
-    header_fill = PatternFill(start_color='1F4E78', end_color='1F4E78', fill_type='solid')
-    body_font = Font(name='Calibri', size=10)
-    border = Border(left=Side(style='thin', color="BFBFBF"), right=Side(style='thin', color="BFBFBF"),
-                    top=Side(style='thin', color="BFBFBF"), bottom=Side(style='thin', color="BFBFBF"))
-
-    # --- ESTILOS DE DESTAQUE ---
-    highlight_fill_orange = PatternFill(start_color='FFC000', end_color='FFC000', fill_type='solid') # Laranja (PC)
-    highlight_fill_red = PatternFill(start_color='FF0000', end_color='FF0000', fill_type='solid') # Vermelho (Erro/Sem Regra)
-    white_font = Font(name='Calibri', size=10, color='FFFFFF', bold=True) # Fonte branca para fundo vermelho
-
-    for sheet_name in writer.sheets:
-        ws = writer.sheets[sheet_name]
-
-        # Formata Cabeçalho
-        for cell in ws[1]:
-            cell.font = header_font; cell.fill = header_fill; cell.border = border
-
-        # Formata Corpo
-        for col in ws.columns:
-            max_len = 0
-            col_letter = get_column_letter(col[0].column)
-            col_name = str(col[0].value).lower()
-            is_money = any(x in col_name for x in ['vlr', 'icms', 'ipi', 'base', 'alq', 'difal', 'total', 'unit', 'operação', 'cont', 'bc'])
-
-            for cell in col[1:]:
-                cell.font = body_font; cell.border = border
-                if is_money: cell.number_format = '#,##0.00'
-
-                if col_name in ['descrição', 'cfops envolvidos', 'totalizador sete', 'pc']:
-                    cell_len = len(str(cell.value)) if cell.value else 0
-                    max_len = max(max_len, cell_len)
-                elif cell.value:
-                    max_len = max(max_len, len(str(cell.value)))
-
-            ws.column_dimensions[col_letter].width = min(max(max_len + 2, 12), 70)
-        ws.freeze_panes = 'A2'
-
-        # --- APLICA A COR LARANJA (PC) ---
-        if sheet_name in ['Totalizador_PC_CFOP', 'Resumo_Fechado_CFOP']:
-            pc_col_idx = None
-            for cell in ws[1]:
-                if str(cell.value).strip() == 'PC':
-                    pc_col_idx = cell.column - 1
-                    break
-
-            if pc_col_idx is not None:
-                for row in ws.iter_rows(min_row=2):
-                    cell_pc = row[pc_col_idx]
-                    if str(cell_pc.value) == "PERFUMARIA TC":
-                        for cell in row:
-                            cell.fill = highlight_fill_orange
-
-        # --- APLICA A COR VERMELHA (SEM REGRA NO RESUMO SETE) ---
-        if sheet_name == 'Resumo_SETE_Base':
-            totalizador_idx = 0 # Assume primeira coluna 'Totalizador SETE'
-            for row in ws.iter_rows(min_row=2):
-                cell_totalizador = row[totalizador_idx]
-                valor_texto = str(cell_totalizador.value).lower()
-
-                # Se contiver "sem regra específica", pinta de vermelho
-                if "sem regra específica" in valor_texto:
-                    for cell in row:
-                        cell.fill = highlight_fill_red
-                        cell.font = white_font
-
-        # --- APLICA A COR VERMELHA (ALERTA PIS COFINS) ---
-        if sheet_name == 'Alerta_PIS_COFINS':
-             for row in ws.iter_rows(min_row=2):
-                for cell in row:
-                    cell.fill = highlight_fill_red
-                    cell.font = white_font
+# O workbook é write-only: cada coluna tem um estilo nomeado compartilhado
+# (registrado uma vez no arquivo), as larguras vêm de uma amostra e os
+# destaques de linha (PERFUMARIA TC / Sem Regra Específica) são formatação
+# condicional, então o custo de formatar cresce com as colunas, não com as células.
+
+COR_BORDA = 'BFBFBF'
+TERMOS_COLUNA_VALOR = ['vlr', 'icms', 'ipi', 'base', 'alq', 'difal', 'total', 'unit', 'operação', 'cont', 'bc']
+
+def _estilos_invest() -> Dict[str, NamedStyle]:
+    """Estilos nomeados do relatório (novos a cada workbook: o NamedStyle fica vinculado ao arquivo)."""
+    lado = Side(style='thin', color=COR_BORDA)
+    borda = Border(left=lado, right=lado, top=lado, bottom=lado)
+    fonte = Font(name='Calibri', size=10)
+    fonte_alerta = Font(name='Calibri', size=10, color='FFFFFF', bold=True) # Fonte branca para fundo vermelho
+    fundo_alerta = PatternFill(start_color='FF0000', end_color='FF0000', fill_type='solid')
+    return {
+        'cabecalho': NamedStyle('Invest Cabeçalho', font=Font(name='Calibri', size=11, bold=True, color='FFFFFF'),
+                                fill=PatternFill(start_color='1F4E78', end_color='1F4E78', fill_type='solid'), border=borda),
+        'texto': NamedStyle('Invest Texto', font=fonte, border=borda),
+        'valor': NamedStyle('Invest Valor', font=fonte, border=borda, number_format='#,##0.00'),
+        'alerta_texto': NamedStyle('Invest Alerta Texto', font=fonte_alerta, fill=fundo_alerta, border=borda),
+        'alerta_valor': NamedStyle('Invest Alerta Valor', font=fonte_alerta, fill=fundo_alerta, border=borda, number_format='#,##0.00'),
+    }
+
+# Destaques de linha inteira: PERFUMARIA TC em laranja, "Sem Regra Específica" em vermelho
+_FUNDO_PC = PatternFill(start_color='FFC000', end_color='FFC000', fill_type='solid')
+_FUNDO_SEM_REGRA = PatternFill(start_color='FF0000', end_color='FF0000', fill_type='solid')
+_FONTE_SEM_REGRA = Font(color='FFFFFF', bold=True)
+
+def _destacar_linhas(ws, df: pd.DataFrame, nome_aba: str, ultima_linha: int):
+    if ultima_linha < 2 or df.empty: return
+    intervalo = f"A2:{get_column_letter(len(df.columns))}{ultima_linha}"
+
+    if nome_aba in ('Totalizador_PC_CFOP', 'Resumo_Fechado_CFOP') and 'PC' in df.columns:
+        col_pc = get_column_letter(df.columns.get_loc('PC') + 1)
+        ws.conditional_formatting.add(intervalo, FormulaRule(formula=[f'${col_pc}2="PERFUMARIA TC"'], fill=_FUNDO_PC))
+
+    if nome_aba == 'Resumo_SETE_Base':
+        # Primeira coluna = 'Totalizador SETE' (SEARCH não diferencia maiúsculas)
+        ws.conditional_formatting.add(intervalo, FormulaRule(
+            formula=['ISNUMBER(SEARCH("sem regra específica",$A2))'], fill=_FUNDO_SEM_REGRA, font=_FONTE_SEM_REGRA
+        ))
+
+def _escrever_aba_invest(wb, nome_aba: str, df: pd.DataFrame, estilos: Dict[str, NamedStyle], alerta: bool = False):
+    """Aba em streaming: cabeçalho, estilo por coluna (alerta = linhas em vermelho), larguras e destaques."""
+    ws = wb.create_sheet(nome_aba)
+    prefixo = 'alerta_' if alerta else ''
+    estilos_colunas, larguras = {}, {}
+    for i, col in enumerate(df.columns):
+        eh_valor = any(termo in str(col).lower() for termo in TERMOS_COLUNA_VALOR)
+        estilos_colunas[i] = {'style': estilos[prefixo + ('valor' if eh_valor else 'texto')]}
+        larguras[i] = estimar_largura(df[col], col, minimo=10, maximo=70)
+
+    ultima_linha = escrever_dataframe_streaming(
+        ws, df,
+        estilos_colunas=estilos_colunas,
+        estilo_cabecalho={'style': estilos['cabecalho']},
+        larguras=larguras,
+        filtro=False
+    )
+    _destacar_linhas(ws, df, nome_aba, ultima_linha)
+
+def gravar_excel_invest(caminho_final: Path, abas: List[Tuple[str, pd.DataFrame]], abas_alerta: Tuple[str, ...] = ('Alerta_PIS_COFINS',)):
+    """Grava as abas (nome, DataFrame), na ordem, em um workbook write-only."""
+    wb = criar_workbook_streaming()
+    estilos = _estilos_invest()
+    for nome_aba, df in abas:
+        _escrever_aba_invest(wb, nome_aba, df, estilos, alerta=nome_aba in abas_alerta)
+    wb.save(str(caminho_final))
 
-def preencher_planilha_sete_existente(df_resumo, caminho_planilha_sete, data_referencia_str):
-    if not caminho_planilha_sete or not os.path.exists(caminho_planilha_sete):
-        return False, "Caminho inválido."
+# -----------------------------
+# 2.1 PLANILHA SETE (UM OU VÁRIOS MESES / EMPRESAS)
+# -----------------------------
+# Cada planilha SETE é aberta e salva uma única vez, com todos os meses dela.
+# As linhas de cada aba (MM.AAAA) são localizadas uma vez pelo rótulo da coluna A.
+
+# Rótulo na planilha -> (Totalizador SETE do resumo, sinal)
+MAPA_LINHAS_SETE = {
+    "Saídas Internas Com Benefício":        ("Saídas Internos Com Benefício", 1),
+    "Devoluções Internas Com Benefício":    ("Devoluçãos Internos Com Benefício", -1),
+    "Saídas Interestaduais Com Benefício":  ("Saídas Interestaduals Com Benefício", 1),
+    "Devoluções Interestaduais Com Benefício": ("Devoluçãos Interestaduals Com Benefício", -1)
+}
+LINHAS_BUSCA_SETE = 60
+# Colunas B, C e D da planilha <- colunas do resumo
+COLUNAS_VALORES_SETE = ((2, 'VLR OPERAÇÃO'), (3, 'BASE CÁLCULO'), (4, 'VLR ICMS'))
+
+def _nome_aba_sete(data_referencia_str: str) -> str:
+    return datetime.strptime(data_referencia_str, '%Y-%m-%d').strftime('%m.%Y')
+
+def _indexar_linhas_sete(ws) -> Dict[str, List[int]]:
+    """Rótulo do MAPA_LINHAS_SETE -> linhas da aba (até LINHAS_BUSCA_SETE) cuja coluna A o contém."""
+    linhas: Dict[str, List[int]] = {chave: [] for chave in MAPA_LINHAS_SETE}
+    for r, (valor,) in enumerate(ws.iter_rows(min_row=1, max_row=LINHAS_BUSCA_SETE, min_col=1, max_col=1, values_only=True), start=1):
+        texto = str(valor).strip().lower() if valor else ""
+        for chave_excel in MAPA_LINHAS_SETE:
+            if chave_excel.lower() in texto:
+                linhas[chave_excel].append(r)
+    return linhas
+
+def _valores_por_totalizador(df_resumo: pd.DataFrame) -> Dict[str, Tuple[float, ...]]:
+    colunas = [nome for _, nome in COLUNAS_VALORES_SETE]
+    somas = df_resumo.groupby('Totalizador SETE')[colunas].sum()
+    return {totalizador: tuple(float(v) for v in linha) for totalizador, linha in zip(somas.index, somas.to_numpy())}
+
+def resumos_sete_por_mes(df_itens: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """Resumo SETE de cada mês ('AAAA-MM-01') dos itens classificados, pela coluna 'data' (AAAA-MM-DD)."""
+    meses = df_itens['data'].astype(str).str[:7]
+    return {f"{mes}-01": agregar_resumos_invest(grupo)['resumo_sete'] for mes, grupo in df_itens.groupby(meses) if mes}
+
+def atualizar_planilhas_sete_em_lote(lancamentos: List[Dict[str, Any]], simular: bool = False) -> List[Dict[str, Any]]:
+    """
+    Preenche várias abas mensais de uma ou mais planilhas SETE.
 
-    try:
-        dt = datetime.strptime(data_referencia_str, '%Y-%m-%d')
-        nome_aba = dt.strftime('%m.%Y')
-        wb = load_workbook(caminho_planilha_sete)
-
-        if nome_aba not in wb.sheetnames:
-            return False, f"Aba '{nome_aba}' não encontrada na planilha base."
-
-        ws = wb[nome_aba]
-
-        def get_vals_by_totalizador(nome_totalizador):
-            row = df_resumo[df_resumo['Totalizador SETE'] == nome_totalizador]
-            if not row.empty:
-                return (
-                    float(row['VLR OPERAÇÃO'].sum()),
-                    float(row['BASE CÁLCULO'].sum()),
-                    float(row['VLR ICMS'].sum())
-                )
-            return (0.0, 0.0, 0.0)
-
-        mapa_linhas = {
-            "Saídas Internas Com Benefício":        ("Saídas Internos Com Benefício", 1),
-            "Devoluções Internas Com Benefício":    ("Devoluçãos Internos Com Benefício", -1),
-            "Saídas Interestaduais Com Benefício":  ("Saídas Interestaduals Com Benefício", 1),
-            "Devoluções Interestaduais Com Benefício": ("Devoluçãos Interestaduals Com Benefício", -1)
-        }
-
-        linhas_alteradas = 0
-        for row in ws.iter_rows(min_row=1, max_row=60, min_col=1, max_col=1):
-            cell_val = str(row[0].value).strip().lower() if row[0].value else ""
-            for chave_excel, (chave_df, fator) in mapa_linhas.items():
-                if chave_excel.lower() in cell_val:
-                    valores = get_vals_by_totalizador(chave_df)
-                    r = row[0].row
-                    ws.cell(row=r, column=2).value = abs(valores[0]) * fator
-                    ws.cell(row=r, column=3).value = abs(valores[1]) * fator
-                    ws.cell(row=r, column=4).value = abs(valores[2]) * fator
-                    linhas_alteradas += 1
-
-        wb.save(caminho_planilha_sete)
-        return True, f"Planilha SETE atualizada! ({linhas_alteradas} linhas alteradas)"
+    Cada lançamento é um dict com 'caminho_sete', 'data_referencia'
+    ('AAAA-MM-DD', qualquer dia do mês), 'resumo_sete' (resumo do Invest) e,
+    opcionalmente, 'empresa'. Lançamentos do mesmo mês na mesma planilha (ex.:
+    duas empresas numa SETE) têm os resumos somados antes da gravação.
 
-    except Exception as e:
-        return False, f"Erro ao salvar SETE: {e}"
+    simular=True não grava nada: o retorno traz só o que mudaria.
+
+    Retorna um resumo por planilha, na ordem em que aparecem: caminho, status
+    ('ok' / 'erro'), abas atualizadas, abas não encontradas, linhas alteradas
+    e 'alteracoes' (aba, linha, rótulo, coluna, valor anterior e novo).
+    """
+    por_planilha: Dict[str, List[Dict[str, Any]]] = {}
+    for lancamento in lancamentos:
+        por_planilha.setdefault(str(lancamento.get('caminho_sete') or ''), []).append(lancamento)
+
+    resultados = []
+    for caminho, itens in por_planilha.items():
+        resultado = {'caminho': caminho, 'empresas': sorted({str(i.get('empresa')) for i in itens if i.get('empresa')}),
+                     'status': 'ok', 'abas': [], 'abas_ausentes': [], 'linhas_alteradas': 0, 'alteracoes': [], 'erro': None}
+        resultados.append(resultado)
+        if not caminho or not os.path.exists(caminho):
+            resultado.update({'status': 'erro', 'erro': "Caminho inválido."})
+            continue
+
+        try:
+            wb = load_workbook(caminho)
+            resumos_por_aba: Dict[str, List[pd.DataFrame]] = {}
+            for item in itens:
+                resumos_por_aba.setdefault(_nome_aba_sete(item['data_referencia']), []).append(item['resumo_sete'])
+
+            for nome_aba, resumos in resumos_por_aba.items():
+                if nome_aba not in wb.sheetnames:
+                    resultado['abas_ausentes'].append(nome_aba)
+                    continue
+                if len(resumos) > 1:
+                    logging.info(f"[SETE] {Path(caminho).name} {nome_aba}: {len(resumos)} lançamentos somados.")
+                ws = wb[nome_aba]
+                resultado['abas'].append(nome_aba)
+
+                valores = _valores_por_totalizador(pd.concat(resumos, ignore_index=True))
+                for chave_excel, linhas in _indexar_linhas_sete(ws).items():
+                    chave_df, fator = MAPA_LINHAS_SETE[chave_excel]
+                    valores_linha = valores.get(chave_df, (0.0,) * len(COLUNAS_VALORES_SETE))
+                    for r in linhas:
+                        for (coluna, _), valor in zip(COLUNAS_VALORES_SETE, valores_linha):
+                            cell = ws.cell(row=r, column=coluna)
+                            novo = abs(valor) * fator
+                            if cell.value != novo:
+                                resultado['alteracoes'].append({'aba': nome_aba, 'linha': r, 'rotulo': chave_excel,
+                                                                'coluna': get_column_letter(coluna), 'antes': cell.value, 'depois': novo})
+                            if not simular: cell.value = novo
+                        resultado['linhas_alteradas'] += 1
+
+            if simular:
+                for alt in resultado['alteracoes']:
+                    logging.info(f"[SETE simulação] {Path(caminho).name} {alt['aba']}!{alt['coluna']}{alt['linha']} ({alt['rotulo']}): {alt['antes']} -> {alt['depois']}")
+            elif resultado['abas']:
+                wb.save(caminho)
+            logging.info(f"[SETE] {Path(caminho).name}: {len(resultado['abas'])} abas, {resultado['linhas_alteradas']} linhas, {len(resultado['alteracoes'])} valores alterados.")
+        except Exception as e:
+            logging.error(f"[SETE] Erro ao atualizar {caminho}: {e}")
+            resultado.update({'status': 'erro', 'erro': str(e)})
+
+    return resultados
+
+def _mensagem_sete(resultado: Dict[str, Any], simular: bool = False) -> Tuple[bool, str]:
+    """(ok, mensagem para a tela) a partir do resumo de uma planilha de atualizar_planilhas_sete_em_lote."""
+    if resultado['erro'] == "Caminho inválido.":
+        return False, resultado['erro']
+    if resultado['erro']:
+        return False, f"Erro ao salvar SETE: {resultado['erro']}"
+    ausentes = ""
+    if resultado['abas_ausentes']:
+        if not resultado['abas']:
+            return False, f"Aba '{resultado['abas_ausentes'][0]}' não encontrada na planilha base."
+        ausentes = f"; abas não encontradas: {', '.join(resultado['abas_ausentes'])}"
+    abas = ', '.join(resultado['abas'])
+    if simular:
+        return True, f"Simulação SETE (nada gravado): {len(resultado['alteracoes'])} valores mudariam nas abas {abas}{ausentes}"
+    if len(resultado['abas']) == 1 and not ausentes:
+        return True, f"Planilha SETE atualizada! ({resultado['linhas_alteradas']} linhas alteradas)"
+    return True, f"Planilha SETE atualizada! (abas {abas}; {resultado['linhas_alteradas']} linhas alteradas{ausentes})"
+
+def preencher_planilha_sete_existente(df_resumo, caminho_planilha_sete, data_referencia_str):
+    """Um mês de uma planilha (mesmas mensagens de antes); ver atualizar_planilhas_sete_em_lote."""
+    resultado = atualizar_planilhas_sete_em_lote([
+        {'caminho_sete': caminho_planilha_sete, 'data_referencia': data_referencia_str, 'resumo_sete': df_resumo}
+    ])[0]
+    return _mensagem_sete(resultado)
 
 # -----------------------------
 # 3. LÓGICA DE REGRAS E CATEGORIZAÇÃO
@@ -347,6 +483,56 @@ def carregar_ncms_externos(caminho_arquivo):
 
     return ncms_set
 
+# --- TABELAS DE CLASSIFICAÇÃO (montadas uma vez na importação) ---
+# Ordem das listas = prioridade: o primeiro grupo que contém o CFOP define o totalizador.
+_GRUPOS_TOTALIZADOR = {
+    'SIM': [
+        (['6101', '6107', '6401', '6910', '6949', '6911', '6917'], "Saídas Interestaduals Com Benefício"),
+        (['5101', '5401', '5910', '5949'], "Saídas Internos Com Benefício"),
+        (['2201', '2949', '2410'], "Devoluçãos Interestaduals Com Benefício"),
+        (['1201', '1410'], "Devoluçãos Internos Com Benefício"),
+    ],
+    'NÃO': [
+        (['6910', '6949', '6102', '6108', '6911', '6917'], "Saídas Interestadual Sem Benefício"),
+        (['5910', '5927', '5102', '5949'], "Saídas Internos Sem Benefício"),
+        (['7101', '7949'], "Outros Outros Sem Benefício"),
+        (['5201', '5556'], "OUTROS - DEVOLUÇÃO DE COMPRA INTERNO"),
+        (['6201'], "OUTROS DEVOLUÇÃO DE COMPRA INTERESTADUAL"),
+        (['5901', '5915', '5913', '5921'], "OUTROS OUTRAS OPERAÇÃOES NÃO TRIBUTADAS INTERNO"),
+        (['6901', '6915', '6913', '6921'], "OUTROS OUTRAS OPERAÇÃOES NÃO TRIBUTADAS INTERESTADUAL"),
+    ],
+}
+
+def _compilar_totalizadores(grupos):
+    tabela = {}
+    for cfops, nome in grupos:
+        for cfop in cfops: tabela.setdefault(cfop, nome)
+    return tabela
+
+# INVEST -> {CFOP -> Totalizador SETE}
+TOTALIZADOR_POR_INVEST_CFOP = {invest: _compilar_totalizadores(grupos) for invest, grupos in _GRUPOS_TOTALIZADOR.items()}
+
+# CFOPs que 'comumente' têm regra de PIS/COFINS (Vendas, Devoluções de Vendas).
+# Se o CFOP não estiver aqui, ele vai para o alerta.
+CFOPS_COM_REGRA_PIS_COFINS = frozenset([
+    # Saídas Estaduais
+    '5101', '5102', '5103', '5104', '5105', '5106', '5109', '5110',
+    '5111', '5112', '5113', '5114', '5115', '5116', '5117', '5118',
+    '5119', '5120', '5122', '5123', '5124', '5125', '5401', '5402',
+    '5403', '5405', '5651', '5652', '5653', '5654', '5655', '5656',
+
+    # Saídas Interestaduais
+    '6101', '6102', '6103', '6104', '6105', '6106', '6107', '6108',
+    '6109', '6110', '6111', '6112', '6113', '6114', '6115', '6116',
+    '6117', '6118', '6119', '6120', '6122', '6123', '6124', '6125',
+    '6401', '6402', '6403', '6404', '6651', '6652', '6653', '6654',
+    '6655', '6656',
+
+    # Devoluções de Vendas (Entradas)
+    '1201', '1202', '1203', '1204', '1410', '1411',
+    '2201', '2202', '2203', '2204', '2410', '2411'
+])
+
 def definir_invest_simples(row):
     try:
         cod = str(row.get('COD_PROD_INTERNO', '')).upper().strip()
@@ -356,44 +542,19 @@ def definir_invest_simples(row):
     except:
         return 'ERRO'
 
-def definir_nome_totalizador(row):
-    invest = row['INVEST']
-    cfop = str(row['CFOP']).strip()
-
-    sim_saida_inter = ['6101', '6107', '6401', '6910', '6949', '6911', '6917']
-    sim_saida_intra = ['5101', '5401', '5910', '5949']
-    sim_dev_inter   = ['2201', '2949', '2410']
-    sim_dev_intra   = ['1201', '1410']
-
-    nao_saida_inter = ['6910', '6949', '6102', '6108', '6911', '6917']
-    nao_saida_intra = ['5910', '5927', '5102', '5949']
-    nao_outros      = ['7101', '7949']
-    nao_dev_comp_intra = ['5201', '5556']
-    nao_dev_comp_inter = ['6201']
-    nao_nao_trib_intra = ['5901', '5915', '5913', '5921']
-    nao_nao_trib_inter = ['6901', '6915', '6913', '6921']
-
-    if invest == 'SIM':
-        if cfop in sim_saida_inter: return "Saídas Interestaduals Com Benefício"
-        if cfop in sim_saida_intra: return "Saídas Internos Com Benefício"
-        if cfop in sim_dev_inter:   return "Devoluçãos Interestaduals Com Benefício"
-        if cfop in sim_dev_intra:   return "Devoluçãos Internos Com Benefício"
-
-    else:
-        if cfop in nao_saida_inter: return "Saídas Interestadual Sem Benefício"
-        if cfop in nao_saida_intra: return "Saídas Internos Sem Benefício"
-        if cfop in nao_outros:      return "Outros Outros Sem Benefício"
-        if cfop in nao_dev_comp_intra: return "OUTROS - DEVOLUÇÃO DE COMPRA INTERNO"
-        if cfop in nao_dev_comp_inter: return "OUTROS DEVOLUÇÃO DE COMPRA INTERESTADUAL"
-        if cfop in nao_nao_trib_intra: return "OUTROS OUTRAS OPERAÇÃOES NÃO TRIBUTADAS INTERNO"
-        if cfop in nao_nao_trib_inter: return "OUTROS OUTRAS OPERAÇÃOES NÃO TRIBUTADAS INTERESTADUAL"
-
+def _totalizador_sem_regra(cfop: str, invest: str) -> str:
     regiao = 'Interno' if cfop.startswith(('1','5')) else 'Interestadual'
     natureza = 'Devolução' if cfop.startswith(('1','2')) else ('Saída' if cfop.startswith(('5','6')) else 'Outros')
     suffix = "Com Benefício" if invest == 'SIM' else "Sem Benefício"
     # IMPORTANTE: A formatação condicional busca por "Sem Regra Específica"
     return f"{natureza} {regiao} {suffix} (Sem Regra Específica)"
 
+def definir_nome_totalizador(row):
+    invest = row['INVEST']
+    cfop = str(row['CFOP']).strip()
+    tabela = TOTALIZADOR_POR_INVEST_CFOP['SIM' if invest == 'SIM' else 'NÃO']
+    return tabela.get(cfop) or _totalizador_sem_regra(cfop, invest)
+
 def definir_tipo_pc(row, ncms_validos_set):
     try:
         ncm = str(row.get('NCM', '')).replace('.', '').strip()
@@ -408,32 +569,96 @@ def definir_tipo_pc(row, ncms_validos_set):
 
 def verificar_status_pis_cofins(cfop):
     """
-    Lista de CFOPs que 'comumente' têm regra de PIS/COFINS (Vendas, Devoluções de Vendas).
-    Se o CFOP não estiver aqui, ele vai para o alerta.
+    'COM REGRA' se o CFOP está em CFOPS_COM_REGRA_PIS_COFINS; senão 'SEM REGRA' (vai para o alerta).
     """
-    cfops_com_regra = [
-        # Saídas Estaduais
-        '5101', '5102', '5103', '5104', '5105', '5106', '5109', '5110',
-        '5111', '5112', '5113', '5114', '5115', '5116', '5117', '5118',
-        '5119', '5120', '5122', '5123', '5124', '5125', '5401', '5402',
-        '5403', '5405', '5651', '5652', '5653', '5654', '5655', '5656',
-
-        # Saídas Interestaduais
-        '6101', '6102', '6103', '6104', '6105', '6106', '6107', '6108',
-        '6109', '6110', '6111', '6112', '6113', '6114', '6115', '6116',
-        '6117', '6118', '6119', '6120', '6122', '6123', '6124', '6125',
-        '6401', '6402', '6403', '6404', '6651', '6652', '6653', '6654',
-        '6655', '6656',
-
-        # Devoluções de Vendas (Entradas)
-        '1201', '1202', '1203', '1204', '1410', '1411',
-        '2201', '2202', '2203', '2204', '2410', '2411'
-    ]
-
-    if str(cfop).strip() in cfops_com_regra:
+    if str(cfop).strip() in CFOPS_COM_REGRA_PIS_COFINS:
         return "COM REGRA"
     return "SEM REGRA"
 
+# --- VERSÕES VETORIZADAS (coluna inteira de uma vez, mesmos resultados das funções por linha) ---
+def classificar_invest(cod_produto: pd.Series) -> np.ndarray:
+    """definir_invest_simples para a coluna COD_PROD_INTERNO."""
+    comeca_com_a = cod_produto.astype(str).str.upper().str.strip().str.startswith('A').fillna(False).to_numpy(dtype=bool)
+    return np.where(comeca_com_a, 'SIM', 'NÃO')
+
+def classificar_totalizador(invest: pd.Series, cfop: pd.Series) -> np.ndarray:
+    """
+    definir_nome_totalizador para as colunas INVEST e CFOP_STR (CFOP sem
+    espaços). A regra roda só nos pares (INVEST, CFOP) distintos, que são
+    poucos, e o resultado volta para as linhas pelos códigos dos pares.
+    """
+    codigos_invest, invests = pd.factorize(invest, use_na_sentinel=False)
+    codigos_cfop, cfops = pd.factorize(cfop, use_na_sentinel=False)
+    codigos_par, pares = pd.factorize(codigos_invest.astype(np.int64) * len(cfops) + codigos_cfop)
+    nomes = [
+        definir_nome_totalizador({'INVEST': invests[par // len(cfops)], 'CFOP': cfops[par % len(cfops)]})
+        for par in pares
+    ]
+    return np.asarray(nomes, dtype=object)[codigos_par]
+
+def classificar_pc(ncm: pd.Series, ncms_validos_set) -> np.ndarray:
+    """definir_tipo_pc para a coluna NCM (pontos e espaços ignorados)."""
+    ncm_limpo = ncm.astype(str).str.replace('.', '', regex=False).str.strip()
+    perfumaria = ncm_limpo.isin(ncms_validos_set) & (ncm_limpo != '')
+    return np.where(perfumaria.to_numpy(dtype=bool), "PERFUMARIA TC", "(-)")
+
+def classificar_status_pis_cofins(cfop: pd.Series) -> np.ndarray:
+    """verificar_status_pis_cofins para a coluna CFOP_STR."""
+    return np.where(cfop.isin(CFOPS_COM_REGRA_PIS_COFINS).to_numpy(dtype=bool), "COM REGRA", "SEM REGRA")
+
+# --- AGREGAÇÃO DOS RESUMOS (UMA PASSADA) ---
+CHAVES_BASE_RESUMOS = ['Totalizador SETE', 'INVEST', 'CFOP', 'CFOP_STR', 'PC', 'cst']
+VALORES_RESUMOS = ['vlr', 'icms bc', 'icms', 'ipi', 'icms st', 'difal']
+
+def agregar_resumos_invest(df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    Agrega os itens classificados uma única vez, no grão (Totalizador SETE,
+    INVEST, CFOP, PC, CST), e monta todos os resumos a partir dessa base, que
+    tem poucas linhas. A lista de CFOPs do resumo SETE sai dos pares distintos
+    e o Totalizador_PC_CFOP / Resumo_Fechado_CFOP usam o mesmo resultado.
+    Só o alerta de PIS/COFINS (por descrição) é agrupado à parte, sobre os
+    itens 'SEM REGRA'.
+    """
+    base = df.groupby(CHAVES_BASE_RESUMOS, sort=False, dropna=False, observed=True)[VALORES_RESUMOS].sum().reset_index()
+
+    # Resumo SETE
+    resumo_sete = base.groupby(['Totalizador SETE', 'INVEST'])[VALORES_RESUMOS].sum()
+    pares_cfop = base[['Totalizador SETE', 'INVEST']].assign(CFOP_STR=base['CFOP_STR'].astype(str))
+    pares_cfop = pares_cfop.drop_duplicates().sort_values('CFOP_STR')
+    resumo_sete['CFOPs Envolvidos'] = pares_cfop.groupby(['Totalizador SETE', 'INVEST'])['CFOP_STR'].agg(', '.join)
+    resumo_sete = resumo_sete.reset_index()[['Totalizador SETE', 'INVEST', 'vlr', 'icms bc', 'icms', 'ipi', 'difal', 'icms st', 'CFOPs Envolvidos']]
+    resumo_sete.columns = ['Totalizador SETE', 'INVEST', 'VLR OPERAÇÃO', 'BASE CÁLCULO', 'VLR ICMS', 'VLR IPI', 'VLR DIFAL', 'VLR ICMS ST', 'CFOPs Envolvidos']
+
+    # Totalizador detalhado (PC -> CFOP) e aba fechada: mesmo agrupamento
+    totalizador_pc = base.groupby(['CFOP', 'PC'])[VALORES_RESUMOS].sum().reset_index()
+    totalizador_pc = totalizador_pc[['CFOP', 'PC', 'vlr', 'icms bc', 'icms', 'ipi', 'icms st', 'difal']]
+    totalizador_pc.columns = ['CFOP', 'PC', 'VL CONT', 'BC ICMS', 'ICMS', 'IPI', 'ICMS ST', 'DIFAL']
+
+    # Resumo por CST
+    resumo_cst = base.groupby('cst')[['vlr', 'icms bc', 'icms', 'ipi', 'icms st']].sum().reset_index()
+    resumo_cst.columns = ['CST/CSOSN', 'Vlr Contábil', 'Base ICMS', 'Vlr ICMS', 'Vlr IPI', 'Vlr ICMS ST']
+
+    # Alerta PIS/COFINS: CFOPs que deram "SEM REGRA"
+    df_alerta_pis = df.loc[df['Status_PisCofins'] == 'SEM REGRA', ['CFOP', 'descrição', 'qnt', 'vlr', 'cst_pis', 'cst_cofins']]
+    if not df_alerta_pis.empty:
+        resumo_alerta_pis = df_alerta_pis.groupby(['CFOP', 'descrição']).agg(
+            qnt=('qnt', 'sum'),
+            vlr_total=('vlr', 'sum'),
+            cst_pis=('cst_pis', 'first'), # Pega o primeiro exemplo
+            cst_cofins=('cst_cofins', 'first')
+        ).reset_index()
+        resumo_alerta_pis.rename(columns={'descrição': 'Exemplo Descrição'}, inplace=True)
+    else:
+        resumo_alerta_pis = pd.DataFrame(columns=['CFOP', 'Exemplo Descrição', 'qnt', 'vlr_total', 'cst_pis', 'cst_cofins'])
+
+    return {
+        'resumo_sete': resumo_sete,
+        'totalizador_pc': totalizador_pc,
+        'resumo_fechado_cfop': totalizador_pc.copy(),
+        'resumo_cst': resumo_cst,
+        'alerta_pis_cofins': resumo_alerta_pis,
+    }
+
 # -----------------------------
 # 4. EXECUTOR PRINCIPAL
 # -----------------------------
@@ -444,8 +669,14 @@ def executar_apuracao_invest(
     status_callback: Optional[Callable[[str], None]] = None,
     progress_callback: Optional[Callable[[int, int], None]] = None,
     done_callback: Optional[Callable[[str], None]] = None,
-    error_callback: Optional[Callable[[str], None]] = None
+    error_callback: Optional[Callable[[str], None]] = None,
+    simular_sete: bool = False
 ) -> str:
+    """
+    Com caminho_sete, cada mês presente nos XMLs (coluna 'data') atualiza a
+    sua aba (MM.AAAA) da planilha SETE. simular_sete=True só registra no log
+    o que mudaria, sem gravar a planilha.
+    """
     logging.info(">>> Iniciando Apuração Invest...")
     if status_callback: status_callback("Iniciando Apuração Invest/Contribuições...")
 
@@ -468,13 +699,13 @@ def executar_apuracao_invest(
 
     # 3. Processamento
     if status_callback: status_callback("Processando regras e cálculos...")
-    df['INVEST'] = df.apply(definir_invest_simples, axis=1)
+    df['INVEST'] = classificar_invest(df['COD_PROD_INTERNO'])
     df['CFOP_STR'] = df['CFOP'].astype(str).str.strip()
-    df['Totalizador SETE'] = df.apply(definir_nome_totalizador, axis=1)
-    df['PC'] = df.apply(lambda row: definir_tipo_pc(row, ncms_perfumaria_validos), axis=1)
+    df['Totalizador SETE'] = classificar_totalizador(df['INVEST'], df['CFOP_STR'])
+    df['PC'] = classificar_pc(df['NCM'], ncms_perfumaria_validos)
 
     # Validação PIS/COFINS
-    df['Status_PisCofins'] = df['CFOP_STR'].apply(verificar_status_pis_cofins)
+    df['Status_PisCofins'] = classificar_status_pis_cofins(df['CFOP_STR'])
 
     cols_calc = ['vlr', 'vl total', 'vl unit', 'icms bc', 'icms', 'ipi', 'icms st', 'difal', 'fcp st', 'qnt', 'vlr_pis', 'vlr_cofins']
     for c in cols_calc:
@@ -486,76 +717,21 @@ def executar_apuracao_invest(
     mask_perfumaria = df_perfumaria['PC'] == 'PERFUMARIA TC'
     cols_to_zero = ['vlr', 'vl total', 'vl unit', 'icms bc', 'icms', 'ipi', 'icms st', 'difal', 'fcp st']
     df_perfumaria.loc[~mask_perfumaria, cols_to_zero] = 0.0
-    df_perfumaria['Status Regra'] = df_perfumaria.apply(lambda x: 'NA REGRA' if x['PC'] == 'PERFUMARIA TC' else '(-)', axis=1)
-
-    # 4. Resumos
-
-    # 4.0 Resumo SETE
-    resumo_sete = df.groupby(['Totalizador SETE', 'INVEST']).agg(
-        vlr=('vlr', 'sum'),
-        icms_bc=('icms bc', 'sum'),
-        icms=('icms', 'sum'),
-        ipi=('ipi', 'sum'),
-        difal=('difal', 'sum'),
-        icms_st=('icms st', 'sum'),
-        cfops=('CFOP_STR', lambda x: ', '.join(sorted(set(x.astype(str)))))
-    ).reset_index()
-
-    resumo_sete.rename(columns={
-        'vlr': 'VLR OPERAÇÃO',
-        'icms_bc': 'BASE CÁLCULO',
-        'icms': 'VLR ICMS',
-        'ipi': 'VLR IPI',
-        'difal': 'VLR DIFAL',
-        'icms_st': 'VLR ICMS ST',
-        'cfops': 'CFOPs Envolvidos'
-    }, inplace=True)
-
-    cols_order = ['Totalizador SETE', 'INVEST', 'VLR OPERAÇÃO', 'BASE CÁLCULO', 'VLR ICMS', 'VLR IPI', 'VLR DIFAL', 'VLR ICMS ST', 'CFOPs Envolvidos']
-    resumo_sete = resumo_sete[cols_order]
-
-    # 4.1.A. TOTALIZADOR DETALHADO (PC -> CFOP)
-    totalizador_pc = df.pivot_table(
-        index=['CFOP', 'PC'],
-        values=['vlr', 'icms bc', 'icms', 'ipi', 'icms st', 'difal'],
-        aggfunc='sum'
-    ).reset_index().sort_values(by=['CFOP', 'PC'])
-    totalizador_pc = totalizador_pc[['CFOP', 'PC', 'vlr', 'icms bc', 'icms', 'ipi', 'icms st', 'difal']]
-    totalizador_pc.columns = ['CFOP', 'PC', 'VL CONT', 'BC ICMS', 'ICMS', 'IPI', 'ICMS ST', 'DIFAL']
+    df_perfumaria['Status Regra'] = np.where(mask_perfumaria, 'NA REGRA', '(-)')
 
-    # 4.1.B. ABA FECHADA
-    resumo_fechado_cfop = df.pivot_table(
-        index=['CFOP', 'PC'],
-        values=['vlr', 'icms bc', 'icms', 'ipi', 'icms st', 'difal'],
-        aggfunc='sum'
-    ).reset_index().sort_values(by=['CFOP', 'PC'])
-
-    resumo_fechado_cfop = resumo_fechado_cfop[['CFOP', 'PC', 'vlr', 'icms bc', 'icms', 'ipi', 'icms st', 'difal']]
-    resumo_fechado_cfop.columns = ['CFOP', 'PC', 'VL CONT', 'BC ICMS', 'ICMS', 'IPI', 'ICMS ST', 'DIFAL']
-
-    # 4.2. Resumo por CST
-    resumo_cst = df.pivot_table(index=['cst'], values=['vlr', 'icms bc', 'icms', 'ipi', 'icms st'], aggfunc='sum').reset_index()
-    resumo_cst = resumo_cst[['cst', 'vlr', 'icms bc', 'icms', 'ipi', 'icms st']]
-    resumo_cst.columns = ['CST/CSOSN', 'Vlr Contábil', 'Base ICMS', 'Vlr ICMS', 'Vlr IPI', 'Vlr ICMS ST']
-
-    # 4.3. ALERTA PIS/COFINS (Nova Aba)
-    # Filtra CFOPs que deram "SEM REGRA" e cria um resumo
-    df_alerta_pis = df[df['Status_PisCofins'] == 'SEM REGRA'].copy()
-    if not df_alerta_pis.empty:
-        resumo_alerta_pis = df_alerta_pis.groupby(['CFOP', 'descrição']).agg(
-            qnt=('qnt', 'sum'),
-            vlr_total=('vlr', 'sum'),
-            cst_pis=('cst_pis', 'first'), # Pega o primeiro exemplo
-            cst_cofins=('cst_cofins', 'first')
-        ).reset_index()
-        resumo_alerta_pis.rename(columns={'descrição': 'Exemplo Descrição'}, inplace=True)
-    else:
-        resumo_alerta_pis = pd.DataFrame(columns=['CFOP', 'Exemplo Descrição', 'qnt', 'vlr_total', 'cst_pis', 'cst_cofins'])
+    # 4. Resumos (uma passada sobre os itens)
+    resumos = agregar_resumos_invest(df)
+    resumo_sete = resumos['resumo_sete']
+    totalizador_pc = resumos['totalizador_pc']
+    resumo_fechado_cfop = resumos['resumo_fechado_cfop']
+    resumo_cst = resumos['resumo_cst']
+    resumo_alerta_pis = resumos['alerta_pis_cofins']
 
     # 5. Salvar
     if status_callback: status_callback("Gerando Excel...")
     nome_arquivo = f"Resultado_Invest_Contrib_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    caminho_final = pasta_xml / nome_arquivo
+    pasta_saida = pasta_xml.parent if pasta_xml.is_file() else pasta_xml # .zip informado direto
+    caminho_final = pasta_saida / nome_arquivo
 
     cols_perfumaria_raw = ['n da nf', 'data', 'descrição', 'NCM', 'CFOP', 'Status Regra', 'vlr', 'icms', 'PC']
     cols_perfumaria = [c for c in cols_perfumaria_raw if c in df_perfumaria.columns]
@@ -563,26 +739,21 @@ def executar_apuracao_invest(
     cols_analise_raw = ['n da nf', 'data', 'descrição', 'NCM', 'CFOP', 'vlr', 'icms', 'PC']
     cols_analise = [c for c in cols_analise_raw if c in df.columns]
 
-    try:
-        with pd.ExcelWriter(caminho_final, engine='openpyxl') as writer:
-            resumo_sete.to_excel(writer, sheet_name='Resumo_SETE_Base', index=False)
-
-            # Nova Aba de Alerta Vermelho
-            resumo_alerta_pis.to_excel(writer, sheet_name='Alerta_PIS_COFINS', index=False)
-
-            df_perfumaria[cols_perfumaria].to_excel(writer, sheet_name='Conferencia_Perfumaria_NCM', index=False)
-            df[cols_analise].to_excel(writer, sheet_name='Analise_Geral_PC', index=False)
-
-            totalizador_pc.to_excel(writer, sheet_name='Totalizador_PC_CFOP', index=False)
-            resumo_fechado_cfop.to_excel(writer, sheet_name='Resumo_Fechado_CFOP', index=False)
-            resumo_cst.to_excel(writer, sheet_name='Resumo_Por_CST', index=False)
+    cols_final = ['n da nf', 'cnpj', 'uf', 'data', 'cst', 'qnt', 'vl unit', 'vl total', 'vlr', 'icms bc', 'alq icms', 'icms', 'ipi', 'icms st', 'fcp st', 'aql sn', 'icms sn', 'descrição', 'COD. PROD.', 'ipi dev', 'pc', 'st', 'protocolo', 'difal', 'INVEST', 'Totalizador SETE', 'PC', 'CFOP', 'NCM', 'cst_pis', 'vlr_pis', 'cst_cofins', 'vlr_cofins']
+    for c in cols_final:
+        if c not in df.columns: df[c] = ''
 
-            cols_final = ['n da nf', 'cnpj', 'uf', 'data', 'cst', 'qnt', 'vl unit', 'vl total', 'vlr', 'icms bc', 'alq icms', 'icms', 'ipi', 'icms st', 'fcp st', 'aql sn', 'icms sn', 'descrição', 'COD. PROD.', 'ipi dev', 'pc', 'st', 'protocolo', 'difal', 'INVEST', 'Totalizador SETE', 'PC', 'CFOP', 'NCM', 'cst_pis', 'vlr_pis', 'cst_cofins', 'vlr_cofins']
-            for c in cols_final:
-                if c not in df.columns: df[c] = ''
-            df[cols_final].to_excel(writer, sheet_name='Conferencia_Detalhada', index=False)
-
-            formatar_excel(writer)
+    try:
+        gravar_excel_invest(caminho_final, [
+            ('Resumo_SETE_Base', resumo_sete),
+            ('Alerta_PIS_COFINS', resumo_alerta_pis), # Aba de alerta em vermelho
+            ('Conferencia_Perfumaria_NCM', df_perfumaria[cols_perfumaria]),
+            ('Analise_Geral_PC', df[cols_analise]),
+            ('Totalizador_PC_CFOP', totalizador_pc),
+            ('Resumo_Fechado_CFOP', resumo_fechado_cfop),
+            ('Resumo_Por_CST', resumo_cst),
+            ('Conferencia_Detalhada', df[cols_final]),
+        ])
     except Exception as e:
         logging.error(f"Erro ao salvar Excel: {e}")
         if error_callback: error_callback(f"Erro ao salvar Excel: {e}")
@@ -591,8 +762,14 @@ def executar_apuracao_invest(
     status_msg = ""
     if caminho_sete:
         if status_callback: status_callback("Atualizando Planilha SETE...")
-        data_freq = df['data'].mode()[0] if not df.empty else datetime.now().strftime('%Y-%m-%d')
-        ok, msg = preencher_planilha_sete_existente(resumo_sete, caminho_sete, data_freq)
+        lancamentos = [
+            {'caminho_sete': caminho_sete, 'data_referencia': mes, 'resumo_sete': resumo_mes}
+            for mes, resumo_mes in resumos_sete_por_mes(df).items()
+        ]
+        if lancamentos:
+            ok, msg = _mensagem_sete(atualizar_planilhas_sete_em_lote(lancamentos, simular=simular_sete)[0], simular_sete)
+        else:
+            ok, msg = False, "Nenhum XML com data de emissão para identificar o mês."
         status_msg = f"\n\nStatus Planilha SETE: {msg}"
 
     if done_callback:
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+from typing import Union
+
+# ==============================================================================
+# VALORES MONETÁRIOS EM CENTAVOS (INT64)
+# ==============================================================================
+# Os valores são lidos do texto ("1234,56" do SPED / "1234.56" do XML) direto
+# para centavos inteiros, sem passar por float, e ficam em colunas int64 nos
+# DataFrames da conciliação (COLUNAS_MONETARIAS): somas, diferenças,
+# comparações com tolerância, alíquotas e rateios são feitos em inteiros, sem
+# .round(2). A volta para reais acontece uma vez, na saída: em_reais() no
+# relatório Excel e na exportação das tabelas, e ao fim das agregações dos
+# totalizadores/base DIFAL, que seguem para os templates de apuração.
+
+Numerico = Union[pd.Series, np.ndarray]
+
+# Colunas em centavos nos DataFrames da conciliação (leitura do SPED/XML até o relatório)
+COLUNAS_MONETARIAS = frozenset({
+    # SPED C100/C500/D500 e XML NF-e (totais da nota)
+    'VL_DOC_SPED', 'ICMS_SPED', 'ICMS_ST_SPED', 'IPI_SPED', 'PIS_SPED', 'COFINS_SPED', 'IPI_DEVOL_SPED',
+    'FCP_ST_SPED', 'ICMS_SN_SPED', 'ICMS_MONO_SPED',
+    'VL_DOC_XML', 'ICMS_XML', 'ICMS_ST_XML', 'IPI_XML', 'IPI_DEVOL_XML', 'FCP_ST_XML', 'ICMS_SN_XML', 'ICMS_MONO_XML',
+    # Calculadas na conciliação
+    'ICMS_TOTAL_XML', 'IPI_TOTAL_XML', 'BC_PIS_COFINS_CALC', 'PIS_CALC', 'COFINS_CALC',
+    'VLR_ICMS_TOTAL_ITEM', 'DIF_VALOR_TOTAL',
+    # SPED C170/C190/D190/C590/D590
+    'VL_OPR_SPED_ITEM', 'VL_BC_ICMS_SPED_ITEM', 'VL_ICMS_SPED_ITEM', 'VL_BC_ICMS_ST_SPED_ITEM', 'VL_ICMS_ST_SPED_ITEM',
+    'VLR_IPI_SPED_ITEM', 'IPI_SPED (Item C170)',
+    'VL_OPR_SPED_D190', 'VL_BC_ICMS_SPED_D190', 'VL_ICMS_SPED_D190',
+    # XML NF-e (itens)
+    'VLR_PROD', 'DESPESA_XML', 'VLR_ICMS', 'VLR_ICMS_ST', 'VLR_FCP_ST', 'VLR_IPI', 'VLR_PIS', 'VLR_COFINS',
+    'VLR_ICMS_SN', 'VLR_ICMS_MONO', 'VLR_TOTAL_NF', 'VLR_BC_ICMS_XML',
+    # XML CT-e
+    'VL_TOTAL_CTE_XML', 'VL_BC_ICMS_XML', 'VL_ICMS_XML', 'VL_OPR_XML',
+})
+
+_PADRAO_VALOR = r'^\s*([+-]?)(\d*)(?:[.,](\d*))?\s*$'
+
+def texto_para_centavos(texto: str) -> int:
+    """'1234,56' / '1234.56' / '-0.005' -> centavos (arredondamento comercial na 3ª casa). Inválido = 0."""
+    if not texto: return 0
+    texto = texto.strip().replace(',', '.')
+    negativo = texto.startswith('-')
+    inteiro, _, fracao = texto.lstrip('+-').partition('.')
+    if not (inteiro or fracao) or not (inteiro or '0').isdigit() or (fracao and not fracao.isdigit()):
+        return 0
+    fracao = (fracao + '000')[:3]
+    centavos = int(inteiro or 0) * 100 + int(fracao[:2]) + (1 if fracao[2] >= '5' else 0)
+    return -centavos if negativo else centavos
+
+def serie_para_centavos(serie: pd.Series) -> pd.Series:
+    """Versão vetorizada de texto_para_centavos para uma coluna de textos."""
+    partes = serie.astype(str).str.extract(_PADRAO_VALOR)
+    validos = partes[1].fillna('').str.len().gt(0) | partes[2].fillna('').str.len().gt(0)
+
+    inteiro = pd.to_numeric(partes[1].where(partes[1].str.len() > 0, '0'), errors='coerce').fillna(0).astype('int64')
+    fracao = partes[2].fillna('').str.ljust(3, '0').str[:3]
+    fracao = pd.to_numeric(fracao, errors='coerce').fillna(0).astype('int64')
+
+    centavos = inteiro * 100 + fracao // 10 + (fracao % 10 >= 5).astype('int64')
+    centavos = centavos.where(partes[0] != '-', -centavos)
+    return centavos.where(validos, 0).astype('int64')
+
+def para_centavos(valores: Numerico) -> Numerico:
+    """Reais (float) -> centavos int64, arredondando ao centavo mais próximo (remove o ruído de ponto flutuante)."""
+    if isinstance(valores, pd.Series):
+        return np.rint(pd.to_numeric(valores, errors='coerce').fillna(0) * 100).astype('int64')
+    return np.rint(np.nan_to_num(np.asarray(valores, dtype='float64')) * 100).astype('int64')
+
+def para_reais(centavos: Numerico) -> Numerico:
+    return centavos / 100
+
+def dentro_da_tolerancia(centavos_a: Numerico, centavos_b: Numerico, tolerancia: float) -> np.ndarray:
+    """|a - b| <= tolerância, com os dois lados em centavos e a tolerância em reais."""
+    diferenca = np.abs(np.asarray(centavos_a, dtype='int64') - np.asarray(centavos_b, dtype='int64'))
+    return diferenca <= int(round(tolerancia * 100))
+
+def aplicar_aliquota(base_centavos: Numerico, aliquota_percentual: float) -> Numerico:
+    """Base em centavos x alíquota em % (ex.: 1.65), arredondado ao centavo (meio para cima), em inteiros."""
+    aliquota = int(round(aliquota_percentual * 100)) # 1.65% -> 165 / 10.000
+    base = np.asarray(base_centavos, dtype='int64')
+    resultado = np.sign(base) * ((2 * np.abs(base) * aliquota + 10_000) // 20_000)
+    return pd.Series(resultado, index=base_centavos.index) if isinstance(base_centavos, pd.Series) else resultado
+
+def ratear_centavos(total_centavos: Numerico, parte_centavos: Numerico, base_centavos: Numerico) -> np.ndarray:
+    """
+    total * parte / base por linha, arredondado ao centavo (meio para cima);
+    0 quando a base não é positiva. Usa inteiros, com float só se o produto
+    estourar o int64 (valores acima de ~R$ 30 milhões por nota).
+    """
+    total = np.asarray(total_centavos, dtype='int64')
+    parte = np.asarray(parte_centavos, dtype='int64')
+    base = np.asarray(base_centavos, dtype='int64')
+    positiva = base > 0
+    base_segura = np.where(positiva, base, 1)
+
+    limite = np.iinfo('int64').max // 2
+    estoura = np.abs(total.astype('float64') * parte.astype('float64')) >= limite
+    produto = np.where(estoura, 0, total) * np.where(estoura, 0, parte)
+
+    sinal = np.sign(produto)
+    inteiro = sinal * ((2 * np.abs(produto) + base_segura) // (2 * base_segura))
+    aproximado = np.rint(total * (parte / base_segura)).astype('int64')
+    return np.where(positiva, np.where(estoura, aproximado, inteiro), 0)
+
+def em_reais(df: pd.DataFrame) -> pd.DataFrame:
+    """DataFrame com as COLUNAS_MONETARIAS ainda em centavos (int) convertidas para reais; os demais ficam como estão."""
+    colunas = [col for col in df.columns if col in COLUNAS_MONETARIAS and pd.api.types.is_integer_dtype(df[col])]
+    if not colunas: return df
+    return df.assign(**{col: para_reais(df[col]) for col in colunas})
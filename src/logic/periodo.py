@@ -0,0 +1,54 @@
+import logging
+import pandas as pd
+from datetime import date
+from pathlib import Path
+from typing import Optional, Set, Tuple
+
+from .sped_parser import ler_periodo_sped
+from .xml_parser import amostrar_chaves_xml
+from .chaves import decompor_chaves
+
+# ==============================================================================
+# PRÉ-VALIDAÇÃO DO PERÍODO (SPED x PASTA DE XMLs)
+# ==============================================================================
+# Antes da leitura completa, compara o período do 0000 do SPED com o AAMM
+# embutido nas chaves de uma amostra dos XMLs. Uma pasta de outro mês aparece
+# aqui em segundos, em vez de no fim da análise como FALTA XML / FALTA NO SPED.
+
+MODOS_PRE_VALIDACAO = ('avisar', 'abortar', 'desligado')
+
+def meses_do_periodo(dt_ini: date, dt_fin: date) -> Set[str]:
+    """Meses (AAMM, como na chave de acesso) cobertos pelo período."""
+    meses = pd.period_range(dt_ini, dt_fin, freq='M')
+    return {f"{m.year % 100:02d}{m.month:02d}" for m in meses}
+
+def verificar_periodo(caminho_sped: Path, pasta_xmls: Path, tamanho_amostra: int = 200) -> Optional[Tuple[float, str]]:
+    """
+    (sobreposição, descrição): fração das chaves válidas da amostra cujo AAMM
+    está no período do SPED. None quando o período ou as chaves não puderem
+    ser determinados (a conferência é pulada).
+
+    O AAMM é o da emissão: notas de entrada emitidas no mês anterior contam
+    como fora do período, por isso o limite de sobreposição deve ser folgado.
+    """
+    periodo = ler_periodo_sped(caminho_sped)
+    if periodo is None:
+        logging.info("Pré-validação do período: registro 0000 não encontrado no SPED. Conferência pulada.")
+        return None
+
+    chaves = amostrar_chaves_xml(pasta_xmls, tamanho_amostra)
+    campos = decompor_chaves(chaves)
+    aamm = campos.loc[campos['CHV_VALIDA'], 'CHV_AAMM'].astype(str)
+    if aamm.empty:
+        logging.info("Pré-validação do período: nenhuma chave válida na amostra dos XMLs. Conferência pulada.")
+        return None
+
+    dt_ini, dt_fin = periodo
+    sobreposicao = float(aamm.isin(meses_do_periodo(dt_ini, dt_fin)).mean())
+    frequentes = ', '.join(f"{m[2:]}/20{m[:2]} ({n})" for m, n in aamm.value_counts().head(3).items())
+    descricao = (
+        f"Período do SPED {dt_ini:%d/%m/%Y} a {dt_fin:%d/%m/%Y}: {sobreposicao:.0%} de {len(aamm)} "
+        f"XMLs amostrados emitidos no período (meses mais frequentes na amostra: {frequentes})."
+    )
+    logging.info(f"Pré-validação do período: {descricao}")
+    return sobreposicao, descricao
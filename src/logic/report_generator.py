@@ -1,13 +1,383 @@
 import logging
+import math
+import os
+import tempfile
 import pandas as pd
 from pathlib import Path
-from typing import Dict
+from types import SimpleNamespace
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
 # --- IMPORTAÇÕES DO OPENPYXL ---
 from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import TIME_FORMATS
+from openpyxl.formatting.formatting import ConditionalFormattingList
 from openpyxl.formatting.rule import CellIsRule, FormulaRule
 from openpyxl.utils import get_column_letter
-from openpyxl.worksheet.worksheet import Worksheet
+
+from .excel_streaming import (
+    criar_workbook_streaming, escrever_dataframe_streaming, estimar_largura,
+    referencia_filtro, montar_xlsx_de_abas
+)
+from .exportacao_dados import exportar_tabelas_detalhe
+from .monetario import em_reais
+
+LIMITE_LINHAS_EXCEL = 1_048_575 # 1.048.576 linhas do Excel, menos o cabeçalho
+VALORES_DIVERGENTES = ['DIVERGENTE', 'FALTA XML', 'FALTA NO SPED', 'SEM CNPJ NO XML']
+LINHAS_MINIMAS_PARALELO = 50_000 # Abaixo disso, abrir processos custa mais do que escrever em sequência
+
+# --- Definição dos Estilos (Sintaxe OpenPyXL) ---
+header_fill = PatternFill(start_color='2D3E50', end_color='2D3E50', fill_type='solid')
+header_font = Font(bold=True, color='FFFFFF')
+header_align = Alignment(horizontal='center', vertical='center', wrap_text=True)
+thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+
+ok_fill = PatternFill(start_color='C6EFCE', end_color='C6EFCE', fill_type='solid')
+ok_font = Font(color='006100')
+divergent_fill = PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')
+divergent_font = Font(color='9C0006')
+revisar_fill = PatternFill(start_color='FFEB9C', end_color='FFEB9C', fill_type='solid')
+revisar_font = Font(color='9C6500')
+multiple_fill = PatternFill(start_color='FFFF00', end_color='FFFF00', fill_type='solid')
+multiple_font = Font(bold=True)
+na_font = Font(color='808080', italic=True)
+
+format_currency = 'R$ #,##0.00'
+format_percent = '0.00%'
+format_number = '#,##0.0000'
+format_mva = '0.00'
+format_aliquota = '0.00'
+
+ESTILO_CABECALHO = {'fill': header_fill, 'font': header_font, 'alignment': header_align, 'border': thin_border}
+
+# (status_cols_map, cfop_cols_map, col_formats_map) de uma aba
+LayoutAba = Tuple[Dict, Dict, Dict]
+
+# ==============================================================================
+# 1. FORMATAÇÃO CONDICIONAL
+# ==============================================================================
+
+def _adicionar_regras_condicionais(ws, max_row: int, status_cols_map: Dict, cfop_cols_map: Dict):
+    """Aplica as regras de formatação condicional das colunas de status e CFOP."""
+    for col_name, col_idx in status_cols_map.items():
+        col_letter = get_column_letter(col_idx + 1)
+        cell_range = f"{col_letter}2:{col_letter}{max_row}"
+        first_cell = f"{col_letter}2"
+
+        if col_name == 'TIPO_NOTA':
+            ws.conditional_formatting.add(cell_range, CellIsRule(operator='equal', formula=['"Devolução"'], stopIfTrue=True, fill=divergent_fill, font=divergent_font))
+            ws.conditional_formatting.add(cell_range, CellIsRule(operator='equal', formula=['"Complementar"'], stopIfTrue=True, fill=revisar_fill, font=revisar_font))
+            ws.conditional_formatting.add(cell_range, CellIsRule(operator='equal', formula=['"Ajuste"'], stopIfTrue=True, fill=revisar_fill, font=revisar_font))
+            ws.conditional_formatting.add(cell_range, FormulaRule(formula=[f'ISNUMBER(SEARCH("Energia Elétrica",{first_cell}))'], stopIfTrue=True, fill=revisar_fill, font=revisar_font))
+            ws.conditional_formatting.add(cell_range, FormulaRule(formula=[f'ISNUMBER(SEARCH("Comunicação",{first_cell}))'], stopIfTrue=True, fill=revisar_fill, font=revisar_font))
+
+        ws.conditional_formatting.add(cell_range, CellIsRule(operator='equal', formula=['"DIVERGENTE"'], stopIfTrue=True, fill=divergent_fill, font=divergent_font))
+        ws.conditional_formatting.add(cell_range, CellIsRule(operator='equal', formula=['"FALTA XML"'], stopIfTrue=True, fill=divergent_fill, font=divergent_font))
+        ws.conditional_formatting.add(cell_range, CellIsRule(operator='equal', formula=['"FALTA NO SPED"'], stopIfTrue=True, fill=divergent_fill, font=divergent_font))
+
+        ws.conditional_formatting.add(cell_range, FormulaRule(formula=[f'ISNUMBER(SEARCH("REVISAR",{first_cell}))'], stopIfTrue=True, fill=revisar_fill, font=revisar_font))
+        ws.conditional_formatting.add(cell_range, CellIsRule(operator='equal', formula=['"SEM CNPJ NO XML"'], stopIfTrue=True, fill=revisar_fill, font=revisar_font))
+
+        ws.conditional_formatting.add(cell_range, CellIsRule(operator='equal', formula=['"OK"'], stopIfTrue=True, fill=ok_fill, font=ok_font))
+
+        ws.conditional_formatting.add(cell_range, CellIsRule(operator='equal', formula=['"N/A"'], stopIfTrue=True, font=na_font))
+
+    for col_name, col_idx in cfop_cols_map.items():
+        col_letter = get_column_letter(col_idx + 1)
+        cell_range = f"{col_letter}2:{col_letter}{max_row}"
+        first_cell = f"{col_letter}2"
+        ws.conditional_formatting.add(cell_range, FormulaRule(formula=[f'ISNUMBER(SEARCH("/",{first_cell}))'], stopIfTrue=True, fill=multiple_fill, font=multiple_font))
+        if col_name == 'STATUS_CFOP':
+            ws.conditional_formatting.add(cell_range, FormulaRule(formula=[f'ISNUMBER(SEARCH("Múltiplos",{first_cell}))'], stopIfTrue=True, fill=multiple_fill, font=multiple_font))
+
+# ==============================================================================
+# 2. LAYOUT (LARGURAS, FORMATOS E REGRAS) POR ABA
+# ==============================================================================
+
+def _layout_conciliacao(df: pd.DataFrame) -> LayoutAba:
+    status_cols_conc = {}
+    cfop_cols_conc = {}
+    col_formats_conc = {}
+
+    for col_idx, col_name in enumerate(df.columns):
+        num_format_to_apply = None
+        width = 18
+
+        if col_name.startswith('STATUS_') or col_name == 'SITUACAO_NOTA':
+            status_cols_conc[col_name] = col_idx
+
+        if col_name in ['CFOP_XML', 'CFOP_SPED', 'STATUS_CFOP']:
+            cfop_cols_conc[col_name] = col_idx
+
+        if any(substring in col_name for substring in ['VL_', 'ICMS', 'IPI', 'PIS', 'COFINS', 'FCP', 'BC_']):
+            num_format_to_apply = format_currency
+        elif col_name == 'CHV_NFE': width = 48
+        elif col_name == 'CEST_XML': width = 25
+        elif col_name == 'TIPO_NOTA':
+            width = 25
+            status_cols_conc[col_name] = col_idx
+        else:
+            width = estimar_largura(df[col_name], col_name, maximo=60)
+
+        col_formats_conc[col_idx] = (col_name, width, num_format_to_apply)
+
+    return status_cols_conc, cfop_cols_conc, col_formats_conc
+
+def _layout_itens(df: pd.DataFrame) -> LayoutAba:
+    status_cols_itens = {}
+    cfop_cols_itens = {}
+    col_formats_itens = {}
+
+    sped_item_currency_cols = ['VL_OPR_SPED_ITEM', 'VL_BC_ICMS_SPED_ITEM', 'VL_ICMS_SPED_ITEM', 'VL_BC_ICMS_ST_SPED_ITEM', 'VL_ICMS_ST_SPED_ITEM', 'VLR_IPI_SPED_ITEM']
+
+    for col_idx, col_name in enumerate(df.columns):
+        num_format_to_apply = None
+        width = 18
+
+        if col_name.startswith('STATUS_') or col_name == 'SITUACAO_NOTA':
+            status_cols_itens[col_name] = col_idx
+
+        if (any(substring in col_name for substring in ['VL_', '_SPED', '_CALC', '_XML', 'VLR_', 'DIF_', 'IPI_SPED (Item C170)']) or col_name in sped_item_currency_cols) \
+            and col_name not in ['CFOP_XML', 'CFOP_SPED', 'CFOP_SPED_ITEM', 'CST_ICMS_XML', 'VLR_UNIT', 'CST_ICMS_SPED_ITEM']:
+            num_format_to_apply = format_currency
+            width = 16
+        elif col_name == 'pICMS_XML':
+            num_format_to_apply = format_percent
+            width = 10
+        elif col_name == 'MVA ORIGINAL':
+            num_format_to_apply = format_mva
+            width = 12
+        elif col_name == 'QTD' or col_name == 'VLR_UNIT':
+            num_format_to_apply = format_number
+            width = 14
+        elif col_name == 'CHV_NFE': width = 48
+        elif col_name == 'CEST': width = 25
+        elif col_name == 'TIPO_NOTA':
+            width = 25
+            status_cols_itens[col_name] = col_idx
+        elif col_name == 'TIPO_DESTINATARIO': width = 10
+        else:
+            width = estimar_largura(df[col_name], col_name, maximo=40)
+
+        col_formats_itens[col_idx] = (col_name, width, num_format_to_apply)
+
+    return status_cols_itens, cfop_cols_itens, col_formats_itens
+
+def _layout_aliquota(df: pd.DataFrame) -> LayoutAba:
+    col_formats_aliquota = {}
+    for col_idx, col_name in enumerate(df.columns):
+        num_format_to_apply = None
+        width = 18
+
+        if col_name == 'Aliquota ICMS (XML)':
+            num_format_to_apply = format_percent
+        elif col_name == 'MVA Original (Regra)':
+            num_format_to_apply = format_mva
+            width = 15
+        elif col_name in ['VLR_BC_ICMS_XML', 'VLR_ICMS', 'VLR_ICMS_ST', 'VLR_PROD', 'VLR_TOTAL_NF', 'VLR_ICMS_SOMA_SN']:
+            num_format_to_apply = format_currency
+        elif col_name == 'CEST': width = 25
+        elif col_name == 'TIPO_NOTA': width = 25
+        else:
+            width = estimar_largura(df[col_name], col_name, maximo=40)
+
+        col_formats_aliquota[col_idx] = (col_name, width, num_format_to_apply)
+
+    return {}, {}, col_formats_aliquota
+
+def _layout_totalizadores(df: pd.DataFrame) -> LayoutAba:
+    col_formats = {}
+    for col_idx, col_name in enumerate(df.columns):
+        num_format_to_apply = None
+        width = 18
+
+        if col_name in ['Total Operação', 'Base de Cálculo ICMS', 'Total ICMS', 'Base de Cálculo ICMS ST', 'Total ICMS ST', 'Total IPI']:
+            num_format_to_apply = format_currency
+            width = 19
+        elif col_name == 'Alíquota ICMS':
+            num_format_to_apply = format_aliquota
+            width = 12
+        elif col_name == 'Alíquota (SPED)':
+            num_format_to_apply = format_aliquota
+            width = 15
+        elif col_name == 'CFOP (SPED)': width = 12
+        elif col_name == 'CST (SPED)': width = 10
+        elif col_name == 'Descricao CST':
+            num_format_to_apply = None
+            width = 45
+        elif col_name == 'QTD Documentos': width = 10
+
+        col_formats[col_idx] = (col_name, width, num_format_to_apply)
+
+    return {}, {}, col_formats
+
+def _layout_cte(df: pd.DataFrame) -> LayoutAba:
+    status_cols_cte = {}
+    cfop_cols_cte = {}
+    col_formats_cte = {}
+
+    for col_idx, col_name in enumerate(df.columns):
+        num_format_to_apply = None
+        width = 18
+
+        # 1. Identifica colunas de STATUS
+        if col_name.startswith('STATUS_') or col_name == 'SITUACAO_CTE':
+            status_cols_cte[col_name] = col_idx # Adiciona ao mapa de status
+            width = 15 # Define uma largura padrão
+
+        # 2. Formata colunas de VALOR (SPED e XML)
+        elif col_name in [
+            'VL_OPR_SPED_D190', 'VL_BC_ICMS_SPED_D190', 'VL_ICMS_SPED_D190',
+            'VL_OPR_XML', 'VL_BC_ICMS_XML', 'VL_ICMS_XML'
+        ]:
+            num_format_to_apply = format_currency
+            width = 19
+
+        # 3. Formata ALÍQUOTA
+        elif col_name == 'ALIQ_ICMS_SPED_D190':
+            num_format_to_apply = format_aliquota
+            width = 12
+
+        # 4. Formata CHAVE
+        elif col_name == 'CHV_CTE':
+            width = 48
+
+        # 5. Formata CFOP/CST (SPED e XML)
+        elif col_name in [
+            'CST_ICMS_SPED_D190', 'CFOP_SPED_D190',
+            'CFOP_XML', 'CST_XML'
+        ]:
+            width = 10
+            if col_name.startswith('CFOP_'):
+                 cfop_cols_cte[col_name] = col_idx # Adiciona ao mapa de CFOP
+        else:
+            width = 15 # Largura padrão para outras colunas
+
+        col_formats_cte[col_idx] = (col_name, width, num_format_to_apply)
+
+    return status_cols_cte, cfop_cols_cte, col_formats_cte
+
+# ==============================================================================
+# 3. ESCRITA DAS ABAS
+# ==============================================================================
+
+def _escrever_parte(ws, df: pd.DataFrame, layout: LayoutAba):
+    """Escreve a aba em modo streaming: cabeçalho, formatos por coluna, larguras, filtro e regras."""
+    status_cols_map, cfop_cols_map, col_formats_map = layout
+
+    larguras = {col_idx: width for col_idx, (_, width, _) in col_formats_map.items()}
+    estilos_colunas = {col_idx: {'number_format': num_format}
+                       for col_idx, (_, _, num_format) in col_formats_map.items() if num_format}
+
+    max_row = escrever_dataframe_streaming(
+        ws, df,
+        estilos_colunas=estilos_colunas,
+        estilo_cabecalho=ESTILO_CABECALHO,
+        larguras=larguras
+    )
+    if max_row > 1:
+        _adicionar_regras_condicionais(ws, max_row, status_cols_map, cfop_cols_map)
+    return ws
+
+def _nomes_partes(nome_aba: str, total_linhas: int) -> List[Tuple[str, int, int]]:
+    """(nome, início, fim) de cada parte; acima do limite do Excel vira nome_1, nome_2, ..."""
+    if total_linhas <= LIMITE_LINHAS_EXCEL:
+        return [(nome_aba, 0, total_linhas)]
+    partes = math.ceil(total_linhas / LIMITE_LINHAS_EXCEL)
+    return [(f"{nome_aba}_{i + 1}", i * LIMITE_LINHAS_EXCEL, min((i + 1) * LIMITE_LINHAS_EXCEL, total_linhas))
+            for i in range(partes)]
+
+def _dividir_aba(nome_aba: str, df: pd.DataFrame, layout: LayoutAba) -> List[Tuple[str, pd.DataFrame, LayoutAba]]:
+    """Partes (mesmo layout) da aba, dividida se passar do limite de linhas do Excel."""
+    partes = _nomes_partes(nome_aba, len(df))
+    if len(partes) > 1:
+        logging.warning(f"Aba '{nome_aba}' com {len(df)} linhas excede o limite do Excel. Dividindo em {len(partes)} abas.")
+    return [(nome_parte, df.iloc[inicio:fim], layout) for nome_parte, inicio, fim in partes]
+
+# ==============================================================================
+# 4. RENDERIZAÇÃO PARALELA (UMA ABA POR PROCESSO)
+# ==============================================================================
+# Cada parte é escrita em um .xlsx próprio num processo separado e os XMLs das
+# abas são depois montados em um único pacote. O modo write-only usa strings
+# inline (não há sharedStrings para unir); os estilos só coincidem se todos os
+# arquivos registrarem a mesma paleta, na mesma ordem, antes de qualquer linha.
+
+def _semear_paleta(wb, ws):
+    """Registra no workbook todos os estilos de célula e de formatação condicional do relatório."""
+    cabecalho = WriteOnlyCell(ws)
+    for atributo, valor in ESTILO_CABECALHO.items():
+        setattr(cabecalho, atributo, valor)
+    cabecalho.style_id
+
+    # Inclui os formatos que o openpyxl atribui sozinho a datetime/date/time/timedelta
+    formatos = (format_currency, format_percent, format_number, format_mva, format_aliquota, *TIME_FORMATS.values())
+    for num_format in formatos:
+        cell = WriteOnlyCell(ws)
+        cell.number_format = num_format
+        cell.style_id
+
+    # Conjunto completo de regras (coluna TIPO_NOTA, outro status e CFOP) só para colher os dxf
+    regras = SimpleNamespace(conditional_formatting=ConditionalFormattingList())
+    _adicionar_regras_condicionais(regras, 2, {'TIPO_NOTA': 0, 'STATUS_GERAL': 1}, {'STATUS_CFOP': 2})
+    for formatacao in regras.conditional_formatting:
+        for regra in formatacao.rules:
+            wb._differential_styles.add(regra.dxf)
+
+def _renderizar_parte(nome_parte: str, df: pd.DataFrame, layout: LayoutAba, caminho_destino: str) -> str:
+    """Executado no worker: grava a parte sozinha em um .xlsx com a paleta padrão."""
+    wb = criar_workbook_streaming()
+    ws = wb.create_sheet(nome_parte)
+    _semear_paleta(wb, ws)
+    _escrever_parte(ws, df, layout)
+    wb.save(caminho_destino)
+    return caminho_destino
+
+def _salvar_esqueleto(partes: List[Tuple[str, pd.DataFrame, LayoutAba]], caminho_destino: Path):
+    """Workbook com as abas vazias na ordem final, mesma paleta e mesmos filtros (nomes definidos)."""
+    wb = criar_workbook_streaming()
+    for i, (nome_parte, df, _) in enumerate(partes):
+        ws = wb.create_sheet(nome_parte)
+        if i == 0: _semear_paleta(wb, ws)
+        if len(df.columns):
+            ws.auto_filter.ref = referencia_filtro(len(df.columns), len(df) + 1)
+    wb.save(str(caminho_destino))
+
+def _gerar_em_paralelo(caminho_saida: Path, partes: List[Tuple[str, pd.DataFrame, LayoutAba]], n_workers: int):
+    with tempfile.TemporaryDirectory(prefix="relatorio_abas_") as pasta_temp:
+        pasta = Path(pasta_temp)
+        destinos = [str(pasta / f"aba_{i}.xlsx") for i in range(len(partes))]
+
+        logging.info(f"Gerando {len(partes)} abas em {n_workers} processos...")
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            # As maiores primeiro, para o tempo total ficar próximo ao da maior aba
+            ordem = sorted(range(len(partes)), key=lambda i: len(partes[i][1]), reverse=True)
+            futures = [executor.submit(_renderizar_parte, *partes[i], destinos[i]) for i in ordem]
+            _salvar_esqueleto(partes, pasta / "esqueleto.xlsx")
+            for future in futures:
+                future.result()
+
+        montar_xlsx_de_abas(pasta / "esqueleto.xlsx", [Path(d) for d in destinos], Path(caminho_saida))
+
+def _gerar_em_sequencia(caminho_saida: Path, partes: List[Tuple[str, pd.DataFrame, LayoutAba]]):
+    wb = criar_workbook_streaming()
+    for nome_parte, df, layout in partes:
+        _escrever_parte(wb.create_sheet(nome_parte), df, layout)
+    wb.save(str(caminho_saida))
+
+# ==============================================================================
+# 5. FUNÇÃO PRINCIPAL
+# ==============================================================================
+
+def _filtrar_divergentes(df: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """Linhas com algum status divergente/revisar (as mesmas destacadas em vermelho/amarelo)."""
+    status_cols = [c for c in df.columns if c.startswith('STATUS_') or c.startswith('SITUACAO_')]
+    if not status_cols: return None
+    valores = df[status_cols].astype(str)
+    mask = valores.isin(VALORES_DIVERGENTES).any(axis=1)
+    for col in status_cols:
+        mask |= valores[col].str.contains('REVISAR', regex=False)
+    return df.loc[mask]
 
 def gerar_relatorio_excel(
     caminho_saida: Path,
@@ -16,347 +386,94 @@ def gerar_relatorio_excel(
     df_aliquota_aba: pd.DataFrame,
     df_totalizadores_entrada: pd.DataFrame,
     df_totalizadores_saida: pd.DataFrame,
-    df_cte_bruto_aba: pd.DataFrame
-) -> None:
-    """Gera o arquivo Excel final com todas as abas e formatações."""
+    df_cte_bruto_aba: pd.DataFrame,
+    somente_divergencias: bool = False,
+    exportar_dados: Optional[bool] = None,
+    tabelas_exportacao: Optional[Dict[str, pd.DataFrame]] = None,
+    paralelo: bool = True,
+    max_workers: Optional[int] = None
+) -> Dict[str, str]:
+    """
+    Gera o arquivo Excel final com todas as abas e formatações.
+
+    A escrita é em streaming (workbook write-only): formatos são definidos por
+    coluna antes das linhas, as linhas são enviadas em lotes e as larguras vêm
+    de amostras, então o pico de memória não depende do número de linhas.
+    Abas acima do limite do Excel são divididas (Itens_XML_1, Itens_XML_2, ...).
+    Os valores monetários chegam em centavos (int64) e são escritos em reais.
+
+    somente_divergencias: o Excel leva os totalizadores completos e, nas demais
+    abas, apenas as linhas divergentes/a revisar.
+    exportar_dados: exporta as tabelas completas (Parquet ou CSV.gz + SQLite) em
+    <relatorio>_dados. None = automático (quando alguma aba excede o limite ou
+    no modo somente_divergencias). Retorna os arquivos exportados.
+    tabelas_exportacao: tabelas que substituem (mesmo nome) ou complementam as
+    das abas na exportação, ex.: a conciliação completa quando as abas já vêm
+    filtradas pelo orquestrador.
+    paralelo: com várias abas e volume acima de LINHAS_MINIMAS_PARALELO, cada aba
+    é renderizada em um processo e o .xlsx é montado no final; em caso de falha
+    o relatório é gerado em sequência.
+    """
+
+    # (nome da aba, DataFrame, função de layout, é resumo?, aviso se vazio)
+    abas = [
+        ('Conciliacao', df_recon_relatorio, _layout_conciliacao, False,
+         "DataFrame de conciliação (NF-e, C500, D500) vazio. Aba 'Conciliacao' não será gerada (ou estará vazia)."),
+        ('Itens_XML', df_itens_aba, _layout_itens, False,
+         "DataFrame de itens vazio. Aba 'Itens_XML' não será gerada."),
+        ('Aliquota_XML', df_aliquota_aba, _layout_aliquota, False, None),
+        ('Totalizadores_Entrada', df_totalizadores_entrada, _layout_totalizadores, True,
+         "DataFrame de totalizadores (Entrada) vazio. Aba 'Totalizadores_Entrada' não será gerada."),
+        ('Totalizadores_Saida', df_totalizadores_saida, _layout_totalizadores, True,
+         "DataFrame de totalizadores (Saida) vazio. Aba 'Totalizadores_Saida' não será gerada."),
+        ('Dados_CTe_SPED', df_cte_bruto_aba, _layout_cte, False,
+         "DataFrame de CT-e (D190) vazio. Aba 'Dados_CTe_SPED' não será gerada."),
+    ]
+
+    if exportar_dados is None:
+        exportar_dados = somente_divergencias or any(len(df) > LIMITE_LINHAS_EXCEL for _, df, _, _, _ in abas)
 
-    writer = None
     try:
-        writer = pd.ExcelWriter(str(caminho_saida), engine='openpyxl')
-    except ImportError:
-        msg = "'openpyxl' é necessário. Instale com: pip install openpyxl"
-        logging.error(msg)
-        raise ImportError(msg)
-
-    # --- Definição dos Estilos (Sintaxe OpenPyXL) ---
-    header_fill = PatternFill(start_color='2D3E50', end_color='2D3E50', fill_type='solid')
-    header_font = Font(bold=True, color='FFFFFF')
-    header_align = Alignment(horizontal='center', vertical='center', wrap_text=True)
-    thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-
-    ok_fill = PatternFill(start_color='C6EFCE', end_color='C6EFCE', fill_type='solid')
-    ok_font = Font(color='006100')
-    divergent_fill = PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')
-    divergent_font = Font(color='9C0006')
-    revisar_fill = PatternFill(start_color='FFEB9C', end_color='FFEB9C', fill_type='solid')
-    revisar_font = Font(color='9C6500')
-    multiple_fill = PatternFill(start_color='FFFF00', end_color='FFFF00', fill_type='solid')
-    multiple_font = Font(bold=True)
-    na_font = Font(color='808080', italic=True)
-
-    format_currency = 'R$ #,##0.00'
-    format_percent = '0.00%'
-    format_number = '#,##0.0000'
-    format_mva = '0.00'
-    format_aliquota = '0.00'
-
-    def apply_styles_and_rules_v2(ws: Worksheet, df: pd.DataFrame, status_cols_map: Dict, cfop_cols_map: Dict, col_formats_map: Dict):
-        """Aplica cabeçalho, larguras, formatos e formatação condicional."""
-
-        if df.empty: return
-
-        max_row = ws.max_row
-        max_col = ws.max_column
-
-        for cell in ws[1]:
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = header_align
-            cell.border = thin_border
-
-        for col_name, col_idx in status_cols_map.items():
-            col_letter = get_column_letter(col_idx + 1)
-            cell_range = f"{col_letter}2:{col_letter}{max_row}"
-            first_cell = f"{col_letter}2"
-
-            if col_name == 'TIPO_NOTA':
-                ws.conditional_formatting.add(cell_range, CellIsRule(operator='equal', formula=['"Devolução"'], stopIfTrue=True, fill=divergent_fill, font=divergent_font))
-                ws.conditional_formatting.add(cell_range, CellIsRule(operator='equal', formula=['"Complementar"'], stopIfTrue=True, fill=revisar_fill, font=revisar_font))
-                ws.conditional_formatting.add(cell_range, CellIsRule(operator='equal', formula=['"Ajuste"'], stopIfTrue=True, fill=revisar_fill, font=revisar_font))
-                ws.conditional_formatting.add(cell_range, FormulaRule(formula=[f'ISNUMBER(SEARCH("Energia Elétrica",{first_cell}))'], stopIfTrue=True, fill=revisar_fill, font=revisar_font))
-                ws.conditional_formatting.add(cell_range, FormulaRule(formula=[f'ISNUMBER(SEARCH("Comunicação",{first_cell}))'], stopIfTrue=True, fill=revisar_fill, font=revisar_font))
-
-            ws.conditional_formatting.add(cell_range, CellIsRule(operator='equal', formula=['"DIVERGENTE"'], stopIfTrue=True, fill=divergent_fill, font=divergent_font))
-            ws.conditional_formatting.add(cell_range, CellIsRule(operator='equal', formula=['"FALTA XML"'], stopIfTrue=True, fill=divergent_fill, font=divergent_font))
-            ws.conditional_formatting.add(cell_range, CellIsRule(operator='equal', formula=['"FALTA NO SPED"'], stopIfTrue=True, fill=divergent_fill, font=divergent_font))
-
-            ws.conditional_formatting.add(cell_range, FormulaRule(formula=[f'ISNUMBER(SEARCH("REVISAR",{first_cell}))'], stopIfTrue=True, fill=revisar_fill, font=revisar_font))
-            ws.conditional_formatting.add(cell_range, CellIsRule(operator='equal', formula=['"SEM CNPJ NO XML"'], stopIfTrue=True, fill=revisar_fill, font=revisar_font))
-
-            ws.conditional_formatting.add(cell_range, CellIsRule(operator='equal', formula=['"OK"'], stopIfTrue=True, fill=ok_fill, font=ok_font))
-
-            ws.conditional_formatting.add(cell_range, CellIsRule(operator='equal', formula=['"N/A"'], stopIfTrue=True, font=na_font))
-
-        for col_name, col_idx in cfop_cols_map.items():
-            col_letter = get_column_letter(col_idx + 1)
-            cell_range = f"{col_letter}2:{col_letter}{max_row}"
-            first_cell = f"{col_letter}2"
-            ws.conditional_formatting.add(cell_range, FormulaRule(formula=[f'ISNUMBER(SEARCH("/",{first_cell}))'], stopIfTrue=True, fill=multiple_fill, font=multiple_font))
-            if col_name == 'STATUS_CFOP':
-                ws.conditional_formatting.add(cell_range, FormulaRule(formula=[f'ISNUMBER(SEARCH("Múltiplos",{first_cell}))'], stopIfTrue=True, fill=multiple_fill, font=multiple_font))
-
-        for col_idx_0based, (col_name, width, num_format) in col_formats_map.items():
-            col_letter = get_column_letter(col_idx_0based + 1)
-            ws.column_dimensions[col_letter].width = width
-
-            if num_format and max_row > 1:
-                for row_idx in range(2, max_row + 1):
-                    ws.cell(row=row_idx, column=col_idx_0based + 1).number_format = num_format
-
-        ws.freeze_panes = 'A2'
-        ws.auto_filter.ref = ws.dimensions
-
-    try:
-        # --- GERAÇÃO DA ABA 'Conciliacao' ---
-        if not df_recon_relatorio.empty:
-            df_recon_relatorio.to_excel(writer, sheet_name='Conciliacao', index=False)
-            ws_conciliacao = writer.sheets['Conciliacao']
-
-            status_cols_conc = {}
-            cfop_cols_conc = {}
-            col_formats_conc = {}
-
-            for col_idx, col_name in enumerate(df_recon_relatorio.columns):
-                num_format_to_apply = None
-                width = 18
-
-                if col_name.startswith('STATUS_') or col_name == 'SITUACAO_NOTA':
-                    status_cols_conc[col_name] = col_idx
-
-                if col_name in ['CFOP_XML', 'CFOP_SPED', 'STATUS_CFOP']:
-                    cfop_cols_conc[col_name] = col_idx
-
-                if any(substring in col_name for substring in ['VL_', 'ICMS', 'IPI', 'PIS', 'COFINS', 'FCP', 'BC_']):
-                    num_format_to_apply = format_currency
-                elif col_name == 'CHV_NFE': width = 48
-                elif col_name == 'CEST_XML': width = 25
-                elif col_name == 'TIPO_NOTA':
-                    width = 25
-                    status_cols_conc[col_name] = col_idx
-                else:
-                    try: max_len = max(len(str(col_name)), df_recon_relatorio[col_name].astype(str).map(len).max(), 8) + 2
-                    except: max_len = len(str(col_name)) + 5
-                    width = min(max_len, 60)
-
-                col_formats_conc[col_idx] = (col_name, width, num_format_to_apply)
-
-            apply_styles_and_rules_v2(ws_conciliacao, df_recon_relatorio, status_cols_conc, cfop_cols_conc, col_formats_conc)
-        else:
-            logging.warning("DataFrame de conciliação (NF-e, C500, D500) vazio. Aba 'Conciliacao' não será gerada (ou estará vazia).")
-
-        # --- GERAÇÃO DA ABA 'Itens_XML' ---
-        if not df_itens_aba.empty:
-            logging.info("Gerando aba 'Itens_XML' (motor openpyxl)...")
-            df_itens_aba.to_excel(writer, sheet_name='Itens_XML', index=False)
-            ws_itens = writer.sheets['Itens_XML']
-
-            status_cols_itens = {}
-            cfop_cols_itens = {}
-            col_formats_itens = {}
-
-            for col_idx, col_name in enumerate(df_itens_aba.columns):
-                num_format_to_apply = None
-                width = 18
-
-                if col_name.startswith('STATUS_') or col_name == 'SITUACAO_NOTA':
-                    status_cols_itens[col_name] = col_idx
-
-                sped_item_currency_cols = ['VL_OPR_SPED_ITEM', 'VL_BC_ICMS_SPED_ITEM', 'VL_ICMS_SPED_ITEM', 'VL_BC_ICMS_ST_SPED_ITEM', 'VL_ICMS_ST_SPED_ITEM', 'VLR_IPI_SPED_ITEM']
-
-                if (any(substring in col_name for substring in ['VL_', '_SPED', '_CALC', '_XML', 'VLR_', 'DIF_', 'IPI_SPED (Item C170)']) or col_name in sped_item_currency_cols) \
-                    and col_name not in ['CFOP_XML', 'CFOP_SPED', 'CFOP_SPED_ITEM', 'CST_ICMS_XML', 'VLR_UNIT', 'CST_ICMS_SPED_ITEM']:
-                    num_format_to_apply = format_currency
-                    width = 16
-                elif col_name == 'pICMS_XML':
-                    num_format_to_apply = format_percent
-                    width = 10
-                elif col_name == 'MVA ORIGINAL':
-                    num_format_to_apply = format_mva
-                    width = 12
-                elif col_name == 'QTD' or col_name == 'VLR_UNIT':
-                    num_format_to_apply = format_number
-                    width = 14
-                elif col_name == 'CHV_NFE': width = 48
-                elif col_name == 'CEST': width = 25
-                elif col_name == 'TIPO_NOTA':
-                    width = 25
-                    status_cols_itens[col_name] = col_idx
-                elif col_name == 'TIPO_DESTINATARIO': width = 10
-                else:
-                    try: max_len = max(len(str(col_name)), df_itens_aba[col_name].astype(str).map(len).max(), 8) + 2
-                    except: max_len = len(str(col_name)) + 5
-                    width = min(max_len, 40)
-
-                col_formats_itens[col_idx] = (col_name, width, num_format_to_apply)
-
-            apply_styles_and_rules_v2(ws_itens, df_itens_aba, status_cols_itens, cfop_cols_itens, col_formats_itens)
-        else:
-            logging.warning("DataFrame de itens vazio. Aba 'Itens_XML' não será gerada.")
-
-        # --- GERAÇÃO DA ABA 'Aliquota_XML' ---
-        if not df_aliquota_aba.empty:
-            logging.info("Gerando aba 'Aliquota_XML' (motor openpyxl)...")
-            df_aliquota_aba.to_excel(writer, sheet_name='Aliquota_XML', index=False)
-            ws_aliquota = writer.sheets['Aliquota_XML']
-
-            col_formats_aliquota = {}
-            for col_idx, col_name in enumerate(df_aliquota_aba.columns):
-                num_format_to_apply = None
-                width = 18
-
-                if col_name == 'Aliquota ICMS (XML)':
-                    num_format_to_apply = format_percent
-                elif col_name == 'MVA Original (Regra)':
-                    num_format_to_apply = format_mva
-                    width = 15
-                elif col_name in ['VLR_BC_ICMS_XML', 'VLR_ICMS', 'VLR_ICMS_ST', 'VLR_PROD', 'VLR_TOTAL_NF', 'VLR_ICMS_SOMA_SN']:
-                    num_format_to_apply = format_currency
-                elif col_name == 'CEST': width = 25
-                elif col_name == 'TIPO_NOTA': width = 25
-                else:
-                    try: max_len = max(len(str(col_name)), df_aliquota_aba[col_name].astype(str).map(len).max(), 8) + 2
-                    except: max_len = len(str(col_name)) + 5
-                    width = min(max_len, 40)
-
-                col_formats_aliquota[col_idx] = (col_name, width, num_format_to_apply)
-
-            apply_styles_and_rules_v2(ws_aliquota, df_aliquota_aba, {}, {}, col_formats_aliquota)
-
-        # --- GERAÇÃO DA ABA 'Totalizadores_Entrada' ---
-        if not df_totalizadores_entrada.empty:
-            logging.info("Gerando aba 'Totalizadores_Entrada' (motor openpyxl)...")
-            df_totalizadores_entrada.to_excel(writer, sheet_name='Totalizadores_Entrada', index=False)
-            ws_totalizadores_ent = writer.sheets['Totalizadores_Entrada']
-
-            col_formats_ent = {}
-            for col_idx, col_name in enumerate(df_totalizadores_entrada.columns):
-                num_format_to_apply = None
-                width = 18
-
-                if col_name in ['Total Operação', 'Base de Cálculo ICMS', 'Total ICMS', 'Base de Cálculo ICMS ST', 'Total ICMS ST', 'Total IPI']:
-                    num_format_to_apply = format_currency
-                    width = 19
-                elif col_name == 'Alíquota ICMS':
-                    num_format_to_apply = format_aliquota
-                    width = 12
-                elif col_name == 'Alíquota (SPED)':
-                    num_format_to_apply = format_aliquota
-                    width = 15
-                elif col_name == 'CFOP (SPED)': width = 12
-                elif col_name == 'CST (SPED)': width = 10
-                elif col_name == 'Descricao CST':
-                    num_format_to_apply = None
-                    width = 45
-                elif col_name == 'QTD Documentos': width = 10
-
-                col_formats_ent[col_idx] = (col_name, width, num_format_to_apply)
-
-            apply_styles_and_rules_v2(ws_totalizadores_ent, df_totalizadores_entrada, {}, {}, col_formats_ent)
-        else:
-            logging.warning("DataFrame de totalizadores (Entrada) vazio. Aba 'Totalizadores_Entrada' não será gerada.")
-
-        # --- GERAÇÃO DA ABA 'Totalizadores_Saida' ---
-        if not df_totalizadores_saida.empty:
-            logging.info("Gerando aba 'Totalizadores_Saida' (motor openpyxl)...")
-            df_totalizadores_saida.to_excel(writer, sheet_name='Totalizadores_Saida', index=False)
-            ws_totalizadores_sai = writer.sheets['Totalizadores_Saida']
-
-            col_formats_sai = {}
-            for col_idx, col_name in enumerate(df_totalizadores_saida.columns):
-                num_format_to_apply = None
-                width = 18
-
-                if col_name in ['Total Operação', 'Base de Cálculo ICMS', 'Total ICMS', 'Base de Cálculo ICMS ST', 'Total ICMS ST', 'Total IPI']:
-                    num_format_to_apply = format_currency
-                    width = 19
-                elif col_name == 'Alíquota ICMS':
-                    num_format_to_apply = format_aliquota
-                    width = 12
-                elif col_name == 'Alíquota (SPED)':
-                    num_format_to_apply = format_aliquota
-                    width = 15
-                elif col_name == 'CFOP (SPED)': width = 12
-                elif col_name == 'CST (SPED)': width = 10
-                elif col_name == 'Descricao CST':
-                    num_format_to_apply = None
-                    width = 45
-                elif col_name == 'QTD Documentos': width = 10
-
-                col_formats_sai[col_idx] = (col_name, width, num_format_to_apply)
-
-            apply_styles_and_rules_v2(ws_totalizadores_sai, df_totalizadores_saida, {}, {}, col_formats_sai)
-        else:
-            logging.warning("DataFrame de totalizadores (Saida) vazio. Aba 'Totalizadores_Saida' não será gerada.")
-
-        # --- GERAÇÃO DA ABA 'Dados_CTe_SPED' (D190 Bruto e Limpo) ---
-        if not df_cte_bruto_aba.empty:
-            logging.info("Gerando aba 'Dados_CTe_SPED' (motor openpyxl)...")
-            df_cte_bruto_aba.to_excel(writer, sheet_name='Dados_CTe_SPED', index=False)
-            ws_cte = writer.sheets['Dados_CTe_SPED']
-
-            # --- MUDANÇA INICIA AQUI ---
-            status_cols_cte = {} # Agora preenchemos este dicionário
-            cfop_cols_cte = {}   # Adicionado para consistência
-            col_formats_cte = {}
-
-            for col_idx, col_name in enumerate(df_cte_bruto_aba.columns):
-                num_format_to_apply = None
-                width = 18
-
-                # 1. Identifica colunas de STATUS
-                if col_name.startswith('STATUS_') or col_name == 'SITUACAO_CTE':
-                    status_cols_cte[col_name] = col_idx # Adiciona ao mapa de status
-                    width = 15 # Define uma largura padrão
-
-                # 2. Formata colunas de VALOR (SPED e XML)
-                elif col_name in [
-                    'VL_OPR_SPED_D190', 'VL_BC_ICMS_SPED_D190', 'VL_ICMS_SPED_D190',
-                    'VL_OPR_XML', 'VL_BC_ICMS_XML', 'VL_ICMS_XML'
-                ]:
-                    num_format_to_apply = format_currency
-                    width = 19
-
-                # 3. Formata ALÍQUOTA
-                elif col_name == 'ALIQ_ICMS_SPED_D190':
-                    num_format_to_apply = format_aliquota
-                    width = 12
-
-                # 4. Formata CHAVE
-                elif col_name == 'CHV_CTE':
-                    width = 48
-
-                # 5. Formata CFOP/CST (SPED e XML)
-                elif col_name in [
-                    'CST_ICMS_SPED_D190', 'CFOP_SPED_D190',
-                    'CFOP_XML', 'CST_XML'
-                ]:
-                    width = 10
-                    if col_name.startswith('CFOP_'):
-                         cfop_cols_cte[col_name] = col_idx # Adiciona ao mapa de CFOP
-                else:
-                    width = 15 # Largura padrão para outras colunas
-
-                col_formats_cte[col_idx] = (col_name, width, num_format_to_apply)
-
-            # 6. Chama a função com os dicionários PREENCHIDOS
-            apply_styles_and_rules_v2(
-                ws_cte,
-                df_cte_bruto_aba,
-                status_cols_cte, # Passa o mapa de status
-                cfop_cols_cte,   # Passa o mapa de cfop
-                col_formats_cte
-            )
-            # --- FIM DA MUDANÇA ---
-        else:
-            logging.warning("DataFrame de CT-e (D190) vazio. Aba 'Dados_CTe_SPED' não será gerada.")
-
-        writer.close()
+        partes = []
+        for nome_aba, df, funcao_layout, eh_resumo, aviso_vazio in abas:
+            if df.empty:
+                if aviso_vazio: logging.warning(aviso_vazio)
+                continue
+
+            if somente_divergencias and not eh_resumo:
+                df_divergentes = _filtrar_divergentes(df)
+                if df_divergentes is None:
+                    logging.info(f"Modo divergências: aba '{nome_aba}' fica apenas na exportação de dados.")
+                    continue
+                logging.info(f"Modo divergências: aba '{nome_aba}' com {len(df_divergentes)} de {len(df)} linhas.")
+                df = df_divergentes
+
+            logging.info(f"Preparando aba '{nome_aba}'...")
+            df = em_reais(df)
+            partes.extend(_dividir_aba(nome_aba, df, funcao_layout(df)))
+
+        n_workers = max_workers or min(len(partes), os.cpu_count() or 1)
+        usar_paralelo = paralelo and n_workers > 1 and len(partes) > 1 \
+            and sum(len(df) for _, df, _ in partes) >= LINHAS_MINIMAS_PARALELO
+
+        gerado = False
+        if usar_paralelo:
+            try:
+                _gerar_em_paralelo(caminho_saida, partes, n_workers)
+                gerado = True
+            except Exception as e:
+                logging.warning(f"Falha na geração paralela das abas ({e}). Gerando em sequência...")
+        if not gerado:
+            _gerar_em_sequencia(caminho_saida, partes)
 
     except Exception as e:
         logging.exception("Ocorreu uma falha crítica na geração do relatório Excel.")
-        if writer is not None and hasattr(writer, 'close') and not writer.closed:
-            try:
-                writer.close()
-            except Exception as close_e:
-                logging.error(f"Erro ao tentar fechar o ExcelWriter (openpyxl v2) após falha: {close_e}")
-        raise
\ No newline at end of file
+        raise
+
+    if not exportar_dados:
+        return {}
+
+    logging.info("Exportando tabelas completas (fora do Excel)...")
+    tabelas = {nome_aba: df for nome_aba, df, _, _, _ in abas}
+    tabelas.update(tabelas_exportacao or {})
+    return exportar_tabelas_detalhe(caminho_saida, tabelas)
@@ -0,0 +1,35 @@
+import pandas as pd
+from openpyxl.worksheet.worksheet import Worksheet
+from typing import Dict, Optional
+
+from .apuracao_logic import preencher_aba_apuracao
+from .apuracao_moveleiro import preencher_aba_moveleiro
+from .apuracao_ecommerce import preencher_aba_ecommerce
+
+# ==============================================================================
+# SETORES DE APURAÇÃO (LOTE E ANUAL)
+# ==============================================================================
+
+# Setor -> (função que preenche a aba, sufixo do arquivo gerado)
+SETORES_APURACAO = {
+    'Comercio': (preencher_aba_apuracao, '_PREENCHIDA'),
+    'Moveleiro': (preencher_aba_moveleiro, '_MOVELEIRO_PREENCHIDA'),
+    'E-commerce': (preencher_aba_ecommerce, '_ECOMMERCE_PREENCHIDA'),
+}
+
+def validar_setor(tipo_setor: str):
+    if tipo_setor not in SETORES_APURACAO:
+        raise ValueError(f"Setor de apuração desconhecido: {tipo_setor}")
+
+def preencher_aba_setor(
+    tipo_setor: str,
+    ws: Worksheet,
+    df_entradas: Optional[pd.DataFrame],
+    df_saidas: Optional[pd.DataFrame],
+    df_base_difal: Optional[pd.DataFrame] = None
+) -> Dict[str, Optional[pd.DataFrame]]:
+    """Preenche uma aba já carregada com a função do setor e retorna as sobras (só o moveleiro usa a base DIFAL)."""
+    funcao_preenchimento, _ = SETORES_APURACAO[tipo_setor]
+    if tipo_setor == 'Moveleiro':
+        return funcao_preenchimento(ws, df_entradas, df_saidas, df_base_difal)
+    return funcao_preenchimento(ws, df_entradas, df_saidas)
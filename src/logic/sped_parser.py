@@ -1,8 +1,26 @@
 import logging
 import pandas as pd
+from datetime import date, datetime
 from pathlib import Path
 from typing import List, Tuple, Any, Dict, Optional, IO
 
+from .monetario import serie_para_centavos, para_reais
+from .tipos_dados import compactar_dataframe
+from .chaves import anexar_campos_chave
+
+def _texto_para_percentual(serie: pd.Series) -> pd.Series:
+    """Alíquota '18,00' -> 18.0 (duas casas, lidas como inteiro). Inválido = 0."""
+    return para_reais(serie_para_centavos(serie))
+
+def _converter_colunas(df: pd.DataFrame, colunas: List[str]) -> None:
+    """Valores monetários em centavos (int64) e alíquotas (ALIQ_*) em %; coluna ausente = 0."""
+    for col in colunas:
+        percentual = col.startswith('ALIQ_')
+        if col not in df.columns:
+            df[col] = 0.0 if percentual else 0
+        else:
+            df[col] = _texto_para_percentual(df[col]) if percentual else serie_para_centavos(df[col])
+
 # --- Função Auxiliar de Leitura de Linhas ---
 def _processar_linhas_sped(
     f: IO[Any],
@@ -54,15 +72,8 @@ def _processar_linhas_sped(
         elif reg_type == 'C170' and current_chv_nfe:
             if len(campos) > 11 and campos[11]: current_cfops_nfe.add(campos[11])
             if len(campos) > 11:
-                vlr_ipi_item_sped = 0.0
-                if len(campos) > 24:
-                    try:
-                        vl_ipi_str = campos[24]
-                        if vl_ipi_str: vlr_ipi_item_sped = float(vl_ipi_str.replace(',', '.'))
-                    except (ValueError, TypeError) as e:
-                        logging.warning(f"Erro ao ler IPI: {e}")
-                        vlr_ipi_item_sped = 0.0
-                vlr_ipi_item_str = str(vlr_ipi_item_sped).replace('.', ',')
+                # Mantido como texto: a conversão para centavos é feita na coluna inteira
+                vlr_ipi_item_str = (campos[24] if len(campos) > 24 else '') or '0,00'
 
                 dados_itens_sped.append({
                     'CHV_NFE': current_chv_nfe,
@@ -190,7 +201,7 @@ def _processar_linhas_sped(
 # --- Função Principal de Extração ---
 def extrair_dados_sped(caminho_arquivo_sped: Path) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
     """
-    Retorna 5 DataFrames:
+    Retorna 5 DataFrames (valores monetários em centavos int64, alíquotas em %):
     1. df_sped (Cabeçalhos C100/D100/etc)
     2. df_sped_itens (C170)
     3. df_sped_analitico (C190/D190/etc)
@@ -227,11 +238,7 @@ def extrair_dados_sped(caminho_arquivo_sped: Path) -> Tuple[pd.DataFrame, pd.Dat
     df_sped = pd.DataFrame(dados_completos)
     if not df_sped.empty:
         numeric_cols_sped = ['VL_DOC_SPED', 'ICMS_SPED', 'ICMS_ST_SPED', 'IPI_SPED', 'PIS_SPED', 'COFINS_SPED', 'IPI_DEVOL_SPED', 'FCP_ST_SPED', 'ICMS_SN_SPED', 'ICMS_MONO_SPED']
-        for col in numeric_cols_sped:
-            if col in df_sped.columns:
-                df_sped[col] = pd.to_numeric(df_sped[col].astype(str).str.replace(',', '.'), errors='coerce').fillna(0).round(2)
-            else:
-                df_sped[col] = 0.0
+        _converter_colunas(df_sped, numeric_cols_sped)
         string_cols_sped = ['CHV_NFE', 'CFOP_SPED', 'TIPO_NOTA_SPED']
         for col in string_cols_sped:
             if col not in df_sped.columns: df_sped[col] = ''
@@ -243,11 +250,7 @@ def extrair_dados_sped(caminho_arquivo_sped: Path) -> Tuple[pd.DataFrame, pd.Dat
     numeric_sped_item_cols_c170 = ['VL_OPR_SPED_ITEM', 'VL_BC_ICMS_SPED_ITEM', 'VL_ICMS_SPED_ITEM', 'VL_BC_ICMS_ST_SPED_ITEM', 'VL_ICMS_ST_SPED_ITEM', 'VLR_IPI_SPED_ITEM']
     if not df_sped_itens.empty:
         df_sped_itens = df_sped_itens.fillna('')
-        for col in numeric_sped_item_cols_c170:
-             if col in df_sped_itens.columns:
-                  df_sped_itens[col] = pd.to_numeric(df_sped_itens[col].astype(str).str.replace(',', '.'), errors='coerce').fillna(0).round(2)
-             else:
-                  df_sped_itens[col] = 0.0
+        _converter_colunas(df_sped_itens, numeric_sped_item_cols_c170)
         if 'CST_ICMS_SPED_ITEM' not in df_sped_itens.columns: df_sped_itens['CST_ICMS_SPED_ITEM'] = ''
         df_sped_itens['N_ITEM_SPED'] = df_sped_itens['N_ITEM_SPED'].astype(str)
         df_sped_itens.drop_duplicates(subset=['CHV_NFE', 'N_ITEM_SPED'], keep='first', inplace=True)
@@ -257,11 +260,7 @@ def extrair_dados_sped(caminho_arquivo_sped: Path) -> Tuple[pd.DataFrame, pd.Dat
     numeric_analitico = ['ALIQ_ICMS_SPED_ITEM', 'VL_OPR_SPED_ITEM', 'VL_BC_ICMS_SPED_ITEM', 'VL_ICMS_SPED_ITEM', 'VL_BC_ICMS_ST_SPED_ITEM', 'VL_ICMS_ST_SPED_ITEM', 'VLR_IPI_SPED_ITEM']
     if not df_sped_analitico.empty:
          df_sped_analitico = df_sped_analitico.fillna('')
-         for col in numeric_analitico:
-             if col in df_sped_analitico.columns:
-                 df_sped_analitico[col] = pd.to_numeric(df_sped_analitico[col].astype(str).str.replace(',', '.'), errors='coerce').fillna(0).round(2)
-             else:
-                 df_sped_analitico[col] = 0.0
+         _converter_colunas(df_sped_analitico, numeric_analitico)
 
     # 4. CTE Específico
     df_sped_cte = pd.DataFrame(dados_cte_sped_d190)
@@ -270,13 +269,41 @@ def extrair_dados_sped(caminho_arquivo_sped: Path) -> Tuple[pd.DataFrame, pd.Dat
          if 'VL_RED_BC_SPED_D190' in df_sped_cte.columns: df_sped_cte.drop(columns=['VL_RED_BC_SPED_D190'], inplace=True)
          if 'COD_OBS_SPED_D190' in df_sped_cte.columns: df_sped_cte.drop(columns=['COD_OBS_SPED_D190'], inplace=True)
          df_sped_cte = df_sped_cte.fillna('')
-         for col in numeric_cte:
-             if col in df_sped_cte.columns:
-                  df_sped_cte[col] = pd.to_numeric(df_sped_cte[col].astype(str).str.replace(',', '.'), errors='coerce').fillna(0).round(2)
-             else:
-                  df_sped_cte[col] = 0.0
+         _converter_colunas(df_sped_cte, numeric_cte)
+
+    # Campos da chave (UF, AAMM, CNPJ, modelo, série, número) e validade do DV
+    df_sped = anexar_campos_chave(df_sped, 'CHV_NFE', 'SPED (C100/C500/D500)')
+
+    # CFOP/CST/tipo da nota como categóricas; chaves em string Arrow (se disponível)
+    df_sped = compactar_dataframe(df_sped, 'SPED C100/C500/D500')
+    df_sped_itens = compactar_dataframe(df_sped_itens, 'SPED C170')
+    df_sped_analitico = compactar_dataframe(df_sped_analitico, 'SPED C190/D190')
 
     # 5. NOVO: Chaves com DIFAL (C101)
     df_chaves_difal = pd.DataFrame(list(chaves_com_c101), columns=['CHV_NFE'])
 
-    return df_sped, df_sped_itens, df_sped_analitico, df_sped_cte, df_chaves_difal
\ No newline at end of file
+    return df_sped, df_sped_itens, df_sped_analitico, df_sped_cte, df_chaves_difal
+
+
+# --- Período declarado no registro 0000 (pré-validação) ---
+def ler_periodo_sped(caminho_arquivo_sped: Path, max_linhas: int = 50) -> Optional[Tuple[date, date]]:
+    """
+    (DT_INI, DT_FIN) do registro 0000, lendo só o início do arquivo. Vale para
+    EFD ICMS/IPI e EFD Contribuições: as datas são os dois primeiros campos
+    ddmmaaaa consecutivos do registro. None se o 0000 não for encontrado.
+    """
+    try:
+        with open(caminho_arquivo_sped, 'r', encoding='latin-1', errors='replace') as f:
+            for _, linha in zip(range(max_linhas), f):
+                campos = linha.strip().split('|')
+                if len(campos) < 3 or campos[1] != '0000': continue
+                for atual, seguinte in zip(campos, campos[1:]):
+                    if len(atual) == 8 and atual.isdigit() and len(seguinte) == 8 and seguinte.isdigit():
+                        try:
+                            return datetime.strptime(atual, '%d%m%Y').date(), datetime.strptime(seguinte, '%d%m%Y').date()
+                        except ValueError:
+                            continue
+                return None
+    except OSError as e:
+        logging.warning(f"Não foi possível ler o período do SPED: {e}")
+    return None
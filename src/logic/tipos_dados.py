@@ -0,0 +1,95 @@
+import functools
+import logging
+import importlib.util
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, Optional
+
+# ==============================================================================
+# ESQUEMA COMPACTO DOS DATAFRAMES DA CONCILIAÇÃO
+# ==============================================================================
+# Códigos (CFOP, CST, NCM, CEST, UNID, CNPJ) e colunas de status se repetem em
+# milhões de linhas: como categóricas, cada valor distinto é guardado uma vez e
+# as linhas passam a ser códigos inteiros. As chaves de 44 posições (CHV_NFE /
+# CHV_CTE) usam string Arrow (pyarrow, em requirements.txt e no SiegAuto.spec).
+# Sem o pyarrow as chaves ficam como texto comum, com um aviso no log; os
+# cruzamentos não dependem disso, pois rodam sobre os códigos int32 ID_CHV
+# (chaves.IndiceChaves).
+
+COLUNAS_CHAVE = ('CHV_NFE', 'CHV_CTE')
+COLUNAS_CATEGORICAS = {
+    'CNPJ_EMITENTE', 'NCM', 'CEST', 'UNID', 'cBenef', 'ACUMULADOR',
+    'TIPO_NOTA', 'TIPO_NOTA_SPED', 'TIPO_DESTINATARIO', 'SITUACAO_NOTA',
+    'CFOP', 'CFOP_XML', 'CFOP_SPED', 'CFOP_SPED_ITEM',
+    'CST_XML', 'CST_ICMS_XML', 'CST_ICMS_SPED_ITEM', 'CEST_XML',
+    'PRODUTO', 'ST', 'REGIME_PIS_COFINS',
+    'CHV_UF', 'CHV_AAMM', 'CHV_CNPJ', 'CHV_MODELO', 'CHV_SERIE', 'CHV_TP_EMIS',
+}
+PREFIXOS_CATEGORICOS = ('STATUS_',)
+
+# Só converte quando há repetição suficiente (distintos / linhas)
+LIMITE_CARDINALIDADE = 0.5
+
+_AVISO_SEM_PYARROW = "pyarrow não instalado: chaves de acesso mantidas como texto comum (instale as dependências de requirements.txt)."
+
+@functools.lru_cache(maxsize=None)
+def _dtype_chave() -> Optional[pd.StringDtype]:
+    if importlib.util.find_spec('pyarrow') is None:
+        logging.warning(_AVISO_SEM_PYARROW) # uma vez por processo (cache)
+        return None
+    try:
+        return pd.StringDtype('pyarrow', na_value=np.nan)
+    except TypeError:
+        return pd.StringDtype('pyarrow') # pandas < 2.3
+
+def _eh_texto(serie: pd.Series) -> bool:
+    return serie.dtype == object or pd.api.types.is_string_dtype(serie.dtype)
+
+def memoria_mb(df: pd.DataFrame) -> float:
+    return df.memory_usage(deep=True).sum() / (1024 * 1024)
+
+def compactar_dataframe(df: pd.DataFrame, nome: Optional[str] = None) -> pd.DataFrame:
+    """
+    Converte as colunas de código/status para category e as chaves para string
+    Arrow (se disponível). Retorna um novo DataFrame; colunas fora do esquema,
+    numéricas ou com pouca repetição ficam como estão.
+    """
+    if df is None or df.empty: return df
+
+    conversoes = {}
+    dtype_chave = _dtype_chave()
+    for col in df.columns:
+        serie = df[col]
+        if isinstance(serie.dtype, pd.CategoricalDtype) or not _eh_texto(serie): continue
+        if col in COLUNAS_CHAVE:
+            if dtype_chave is not None and serie.dtype != dtype_chave: conversoes[col] = dtype_chave
+        elif col in COLUNAS_CATEGORICAS or col.startswith(PREFIXOS_CATEGORICOS):
+            if serie.nunique(dropna=False) <= LIMITE_CARDINALIDADE * len(serie): conversoes[col] = 'category'
+
+    if not conversoes: return df
+    antes = memoria_mb(df) if nome else 0.0
+    df = df.astype(conversoes)
+    if nome:
+        logging.info(f"Esquema compacto '{nome}': {len(conversoes)} colunas convertidas, {antes:.1f} MB -> {memoria_mb(df):.1f} MB.")
+    return df
+
+def preencher_vazios(df: pd.DataFrame, colunas: Iterable[str], valor: str = '') -> pd.DataFrame:
+    """fillna de texto que também funciona em colunas categóricas (inclui o valor nas categorias)."""
+    for col in colunas:
+        serie = df[col]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            if not serie.isna().any(): continue
+            if valor not in serie.cat.categories: serie = serie.cat.add_categories([valor])
+        df[col] = serie.fillna(valor)
+    return df
+
+def registrar_memoria(frames: Dict[str, Optional[pd.DataFrame]]):
+    """Loga linhas e memória (deep) de cada DataFrame e o total."""
+    total = 0.0
+    for nome, df in frames.items():
+        if df is None or df.empty: continue
+        mb = memoria_mb(df)
+        total += mb
+        categoricas = sum(isinstance(dtype, pd.CategoricalDtype) for dtype in df.dtypes)
+        logging.info(f"Memória '{nome}': {len(df)} linhas x {len(df.columns)} colunas ({categoricas} categóricas) = {mb:.1f} MB")
+    logging.info(f"Memória total dos DataFrames da análise: {total:.1f} MB")
@@ -1,4 +1,5 @@
 import logging
+import re
 import xml.etree.ElementTree as ET
 import pandas as pd
 from pathlib import Path
@@ -6,35 +7,294 @@ from typing import List, Any, Dict, Optional, Tuple, Callable
 
 # Importa as constantes da pasta local
 from .constants import MAPA_FINNFE
+from .monetario import texto_para_centavos
+from .tipos_dados import compactar_dataframe
+from .chaves import anexar_campos_chave
 
 # --- CONSTANTES DE NAMESPACE ---
 NS_NFE = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
 NS_CTE_URI = 'http://www.portalfiscal.inf.br/cte'
 NS_CTE_FIND = f"{{{NS_CTE_URI}}}" # Formato {uri}Tag para buscas diretas no ElementTree
+NS_NFE_FIND = f"{{{NS_NFE['nfe']}}}"
 # --- FIM DAS CONSTANTES ---
 
+# Perfis de extração de NF-e: 'completo' lê todos os itens; 'totais' (NFC-e /
+# varejo de alto volume) lê só ide/emit/dest/ICMSTot e agrega CFOP/CST por nota.
+PERFIS_EXTRACAO = ('completo', 'totais')
+TAGS_ICMS_MONO = ['vICMSMono', 'vICMSMonoOp', 'vICMSMonoDifer', 'vICMSMonoRet']
 
-def processar_pasta_xml(pasta_xmls: Path, progress_callback: Optional[Callable[[int, int], None]] = None) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-    """Lê arquivos XML e retorna três DataFrames: (df_nfe_totais, df_nfe_itens, df_cte_totais)."""
+
+# --- HELPERS DE NF-e ---
+def get_text_nfe(element: Optional[ET.Element], path: str, default: str = '') -> str:
+    if element is None: return default
+    node = element.find(path, NS_NFE)
+    return node.text.strip() if node is not None and node.text is not None else default
+
+def get_float_nfe(element: Optional[ET.Element], path: str, default: float = 0.0) -> float:
+    text_val = get_text_nfe(element, path, '')
+    if not text_val: return default
+    try:
+        return float(text_val.replace(',', '.'))
+    except (ValueError, TypeError):
+        return default
+
+def get_centavos_nfe(element: Optional[ET.Element], path: str) -> int:
+    """Valor monetário lido do texto direto para centavos inteiros (sem passar por float)."""
+    return texto_para_centavos(get_text_nfe(element, path, ''))
+
+
+def _ler_item_nfe(item: ET.Element, prod: ET.Element, imposto: ET.Element, cabecalho: Optional[Dict[str, Any]] = None) -> Tuple[Tuple[str, str, int, int, int], Optional[Dict[str, Any]]]:
+    """
+    Lê um <det>. Retorna o resumo usado nos totais da nota (CFOP, CEST, ICMS SN,
+    ICMS monofásico e base PIS/COFINS) e, se receber os dados do cabeçalho da
+    nota, a linha completa do item. Valores monetários em centavos.
+    """
+    detalhado = cabecalho is not None
+    cfop_text = get_text_nfe(prod, 'nfe:CFOP')
+    cest_code = get_text_nfe(prod, 'nfe:CEST')
+
+    cst_icms_xml = ''; vlr_bc_icms_xml = 0; p_icms_xml = 0.0
+    vlr_icms_sn_item = 0; vlr_icms_mono_item = 0
+
+    icms_element = imposto.find('nfe:ICMS', NS_NFE)
+    if icms_element is not None:
+        icms_type_tag = next(iter(icms_element), None)
+        if icms_type_tag is not None:
+            vlr_icms_sn_item = get_centavos_nfe(icms_type_tag, 'nfe:vCredICMSSN')
+            if detalhado:
+                cst_icms_xml = get_text_nfe(icms_type_tag, 'nfe:CST', default=get_text_nfe(icms_type_tag, 'nfe:CSOSN'))
+                vlr_bc_icms_xml = get_centavos_nfe(icms_type_tag, 'nfe:vBC')
+                p_icms_xml_raw = get_float_nfe(icms_type_tag, 'nfe:pICMS')
+                if p_icms_xml_raw > 0: p_icms_xml = round(p_icms_xml_raw / 100.0, 4)
+
+    # Soma campos de ICMS Monofásico
+    for tag_mono in TAGS_ICMS_MONO:
+         vlr_icms_mono_item += get_centavos_nfe(imposto.find(f'.//nfe:{tag_mono}', NS_NFE), '.')
+
+    vlr_frete_item = get_centavos_nfe(prod, 'nfe:vFrete'); vlr_seguro_item = get_centavos_nfe(prod, 'nfe:vSeg')
+    vlr_desconto_item = get_centavos_nfe(prod, 'nfe:vDesc'); vlr_outras_desp = get_centavos_nfe(prod, 'nfe:vOutro')
+
+    vlr_icms_item = get_centavos_nfe(imposto.find('.//nfe:vICMS', NS_NFE), '.')
+    vlr_icms_st_item = get_centavos_nfe(imposto.find('.//nfe:vICMSST', NS_NFE), '.')
+    vlr_fcp_st_item = get_centavos_nfe(imposto.find('.//nfe:vFCPST', NS_NFE), '.')
+
+    vlr_ipi_item = get_centavos_nfe(imposto.find('.//nfe:vIPI', NS_NFE), '.')
+    imposto_devol = item.find('nfe:impostoDevol', NS_NFE)
+    if imposto_devol: vlr_ipi_item += get_centavos_nfe(imposto_devol, 'nfe:IPI/nfe:vIPIDevol')
+
+    vlr_prod_base = get_centavos_nfe(prod, 'nfe:vProd')
+    vlr_prod_calculado = vlr_prod_base + vlr_ipi_item + vlr_icms_st_item + vlr_fcp_st_item + vlr_frete_item + vlr_seguro_item - vlr_desconto_item + vlr_outras_desp
+
+    icms_a_deduzir = (vlr_icms_item + vlr_icms_sn_item) if vlr_icms_mono_item == 0 else 0
+    bc_pis_cofins_item = max(vlr_prod_calculado - icms_a_deduzir - vlr_icms_st_item - vlr_fcp_st_item - vlr_ipi_item, 0)
+
+    resumo = (cfop_text, cest_code, vlr_icms_sn_item, vlr_icms_mono_item, bc_pis_cofins_item)
+    if not detalhado:
+        return resumo, None
+
+    vlr_pis_item = get_centavos_nfe(imposto.find('.//nfe:vPIS', NS_NFE), '.')
+    vlr_cofins_item = get_centavos_nfe(imposto.find('.//nfe:vCOFINS', NS_NFE), '.')
+
+    item_data: Dict[str, Any] = {
+        'CHV_NFE': cabecalho['CHV_NFE'], 'CNPJ_EMITENTE': cabecalho['CNPJ_EMITENTE'], 'N_ITEM': item.attrib.get('nItem', ''),
+        'TIPO_NOTA': cabecalho['TIPO_NOTA'], 'TIPO_DESTINATARIO': cabecalho['TIPO_DESTINATARIO'],
+        'COD_PROD': get_text_nfe(prod, 'nfe:cProd'), 'DESC_PROD': get_text_nfe(prod, 'nfe:xProd'),
+        'NCM': get_text_nfe(prod, 'nfe:NCM'), 'CEST': cest_code, 'cBenef': get_text_nfe(prod, 'nfe:cBenef'),
+        'CFOP': cfop_text, 'QTD': get_float_nfe(prod, 'nfe:qCom'), 'UNID': get_text_nfe(prod, 'nfe:uCom'),
+        'VLR_UNIT': get_float_nfe(prod, 'nfe:vUnCom'), 'VLR_PROD': vlr_prod_calculado, 'DESPESA_XML': vlr_outras_desp,
+        'VLR_ICMS': vlr_icms_item, 'VLR_ICMS_ST': vlr_icms_st_item,
+        'VLR_FCP_ST': vlr_fcp_st_item, 'VLR_IPI': vlr_ipi_item,
+        'VLR_PIS': vlr_pis_item, 'VLR_COFINS': vlr_cofins_item,
+        'VLR_ICMS_SN': vlr_icms_sn_item, 'VLR_ICMS_MONO': vlr_icms_mono_item,
+        'BC_PIS_COFINS_CALC': bc_pis_cofins_item, 'VLR_TOTAL_NF': cabecalho['VLR_TOTAL_NF'],
+        'CST_ICMS_XML': cst_icms_xml, 'VLR_BC_ICMS_XML': vlr_bc_icms_xml, 'pICMS_XML': p_icms_xml
+    }
+    return resumo, item_data
+
+
+# Fase 1 (só totais da nota): tags lidas numa passada pelos filhos diretos de
+# <prod> e numa passada por <imposto>, guardando a primeira ocorrência de cada
+# uma (a mesma que as buscas './/' de _ler_item_nfe encontram).
+_TAGS_RESUMO_PROD = {f"{NS_NFE_FIND}{tag}" for tag in ('CFOP', 'CEST', 'vProd', 'vFrete', 'vSeg', 'vDesc', 'vOutro')}
+_TAGS_RESUMO_IMPOSTO = {f"{NS_NFE_FIND}{tag}" for tag in ('vCredICMSSN', 'vICMS', 'vICMSST', 'vFCPST', 'vIPI', *TAGS_ICMS_MONO)}
+
+def _primeiras_ocorrencias(nos, tags: set) -> Dict[str, str]:
+    valores: Dict[str, str] = {}
+    for no in nos:
+        tag = no.tag
+        if tag in tags and tag not in valores:
+            valores[tag] = (no.text or '').strip()
+    return valores
+
+def _resumo_item_nfe(item: ET.Element, prod: ET.Element, imposto: ET.Element) -> Tuple[str, str, int, int, int]:
+    """Mesmo resumo de _ler_item_nfe (centavos), sem as buscas por tag de cada campo."""
+    campos_prod = _primeiras_ocorrencias(prod, _TAGS_RESUMO_PROD)
+    campos_imposto = _primeiras_ocorrencias(imposto.iter(), _TAGS_RESUMO_IMPOSTO)
+
+    def centavos(campos: Dict[str, str], tag: str) -> int:
+        return texto_para_centavos(campos.get(f"{NS_NFE_FIND}{tag}", ''))
+
+    vlr_icms_sn_item = centavos(campos_imposto, 'vCredICMSSN')
+    vlr_icms_mono_item = sum(centavos(campos_imposto, tag) for tag in TAGS_ICMS_MONO)
+    vlr_icms_item = centavos(campos_imposto, 'vICMS')
+    vlr_icms_st_item = centavos(campos_imposto, 'vICMSST')
+    vlr_fcp_st_item = centavos(campos_imposto, 'vFCPST')
+    vlr_ipi_item = centavos(campos_imposto, 'vIPI')
+    imposto_devol = item.find('nfe:impostoDevol', NS_NFE)
+    if imposto_devol: vlr_ipi_item += get_centavos_nfe(imposto_devol, 'nfe:IPI/nfe:vIPIDevol')
+
+    vlr_prod_calculado = (centavos(campos_prod, 'vProd') + vlr_ipi_item + vlr_icms_st_item + vlr_fcp_st_item
+                          + centavos(campos_prod, 'vFrete') + centavos(campos_prod, 'vSeg')
+                          - centavos(campos_prod, 'vDesc') + centavos(campos_prod, 'vOutro'))
+    icms_a_deduzir = (vlr_icms_item + vlr_icms_sn_item) if vlr_icms_mono_item == 0 else 0
+    bc_pis_cofins_item = max(vlr_prod_calculado - icms_a_deduzir - vlr_icms_st_item - vlr_fcp_st_item - vlr_ipi_item, 0)
+
+    return (campos_prod.get(f"{NS_NFE_FIND}CFOP", ''), campos_prod.get(f"{NS_NFE_FIND}CEST", ''),
+            vlr_icms_sn_item, vlr_icms_mono_item, bc_pis_cofins_item)
+
+
+def _cabecalho_nfe(root: ET.Element, inf_nfe: ET.Element, chave_nfe: str) -> Tuple[Dict[str, Any], Dict[str, Any], Optional[ET.Element]]:
+    """Lê ide/emit/dest/ICMSTot. Retorna (linha de totais, dados do cabeçalho para os itens, ICMSTot)."""
+    ide = inf_nfe.find('nfe:ide', NS_NFE)
+    emit = inf_nfe.find('nfe:emit', NS_NFE)
+    dest = inf_nfe.find('nfe:dest', NS_NFE)
+
+    numero_nf = get_text_nfe(ide, 'nfe:nNF')
+    fin_nfe_code = get_text_nfe(ide, 'nfe:finNFe', default='1')
+    tipo_nota_texto = MAPA_FINNFE.get(fin_nfe_code, 'Desconhecido')
+
+    cnpj_emitente = get_text_nfe(emit, 'nfe:CNPJ', default=get_text_nfe(emit, 'nfe:CPF'))
+    cnpj_dest = get_text_nfe(dest, 'nfe:CNPJ')
+    cpf_dest = get_text_nfe(dest, 'nfe:CPF')
+
+    tipo_dest = 'PJ' if (cnpj_dest and len(cnpj_dest) >= 14) else ('PF' if cpf_dest else 'OUTRO')
+
+    icms_tot_element = root.find('.//nfe:ICMSTot', NS_NFE)
+    linha: Dict[str, Any] = {
+        'CHV_NFE': chave_nfe, 'NUM_NF': numero_nf, 'CNPJ_EMITENTE': cnpj_emitente,
+        'CFOP_XML': '', 'CEST_XML': '', 'TIPO_NOTA': tipo_nota_texto,
+        'VL_DOC_XML': get_centavos_nfe(icms_tot_element, 'nfe:vNF'),
+        'ICMS_XML': get_centavos_nfe(icms_tot_element, 'nfe:vICMS'),
+        'ICMS_ST_XML': get_centavos_nfe(icms_tot_element, 'nfe:vST'),
+        'IPI_XML': get_centavos_nfe(icms_tot_element, 'nfe:vIPI'),
+        'IPI_DEVOL_XML': get_centavos_nfe(icms_tot_element, 'nfe:vIPIDevol'),
+        'FCP_ST_XML': get_centavos_nfe(icms_tot_element, 'nfe:vFCPST'),
+        'ICMS_SN_XML': 0, 'ICMS_MONO_XML': 0
+    }
+    cabecalho = {
+        'CHV_NFE': chave_nfe, 'CNPJ_EMITENTE': cnpj_emitente, 'TIPO_NOTA': tipo_nota_texto,
+        'TIPO_DESTINATARIO': tipo_dest, 'VLR_TOTAL_NF': linha['VL_DOC_XML']
+    }
+    return linha, cabecalho, icms_tot_element
+
+
+def _juntar_codigos(codigos: set) -> str:
+    return '/'.join(sorted(list(filter(None, codigos)))) if codigos else ''
+
+
+def _processar_nfe(root: ET.Element, inf_nfe: ET.Element, chave_nfe: str, dados_itens: Optional[List[Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    Monta a linha de totais da NF-e. Com dados_itens (lista), também anexa os
+    itens detalhados; com None (fase 1), de cada <det> só sai o resumo que
+    entra nos totais da nota (_resumo_item_nfe).
+    """
+    linha_completa, cabecalho, _ = _cabecalho_nfe(root, inf_nfe, chave_nfe)
+
+    cfops_set: set[str] = set()
+    cest_set: set[str] = set()
+    icms_sn_total_itens: int = 0
+    icms_mono_total_itens: int = 0
+    bc_pis_cofins_total: int = 0
+
+    detalhado = dados_itens is not None
+    for item in root.findall('.//nfe:det', NS_NFE):
+        prod = item.find('nfe:prod', NS_NFE)
+        imposto = item.find('nfe:imposto', NS_NFE)
+        if prod is None or imposto is None: continue
+
+        if detalhado:
+            resumo, item_data = _ler_item_nfe(item, prod, imposto, cabecalho)
+        else:
+            resumo = _resumo_item_nfe(item, prod, imposto)
+        cfop_text, cest_code, vlr_icms_sn_item, vlr_icms_mono_item, bc_pis_cofins_item = resumo
+        cfops_set.add(cfop_text); cest_set.add(cest_code)
+        icms_sn_total_itens += vlr_icms_sn_item
+        icms_mono_total_itens += vlr_icms_mono_item
+        bc_pis_cofins_total += bc_pis_cofins_item
+
+        if detalhado: dados_itens.append(item_data)
+
+    linha_completa['CFOP_XML'] = _juntar_codigos(cfops_set)
+    linha_completa['CEST_XML'] = _juntar_codigos(cest_set)
+    linha_completa['ICMS_SN_XML'] = icms_sn_total_itens
+    linha_completa['ICMS_MONO_XML'] = icms_mono_total_itens
+    if not detalhado:
+        # Sem os itens, a base de PIS/COFINS da nota já segue somada nos totais
+        linha_completa['BC_PIS_COFINS_CALC'] = bc_pis_cofins_total
+    return linha_completa
+
+
+def _processar_nfe_totais(root: ET.Element, inf_nfe: ET.Element, chave_nfe: str) -> Dict[str, Any]:
+    """
+    Perfil 'totais': cabeçalho e ICMSTot, com CFOP/CST/CEST agregados por nota
+    direto das tags. Dos itens só é lido o grupo <ICMS> (CST, crédito do Simples
+    e ICMS monofásico); a base de PIS/COFINS é calculada com os totais da nota.
+    """
+    linha, _, icms_tot = _cabecalho_nfe(root, inf_nfe, chave_nfe)
+
+    cfops_set = {node.text.strip() for node in inf_nfe.iter(f"{NS_NFE_FIND}CFOP") if node.text}
+    cest_set = {node.text.strip() for node in inf_nfe.iter(f"{NS_NFE_FIND}CEST") if node.text}
+    cst_set: set[str] = set()
+    icms_sn = 0
+    icms_mono = 0
+    for icms in inf_nfe.iter(f"{NS_NFE_FIND}ICMS"):
+        icms_type_tag = next(iter(icms), None)
+        if icms_type_tag is None: continue
+        cst_set.add(get_text_nfe(icms_type_tag, 'nfe:CST', default=get_text_nfe(icms_type_tag, 'nfe:CSOSN')))
+        for campo in icms_type_tag:
+            tag = campo.tag.rsplit('}', 1)[-1]
+            if tag == 'vCredICMSSN':
+                icms_sn += get_centavos_nfe(campo, '.')
+            elif tag in TAGS_ICMS_MONO:
+                icms_mono += get_centavos_nfe(campo, '.')
+
+    icms_a_deduzir = (get_centavos_nfe(icms_tot, 'nfe:vICMS') + icms_sn) if icms_mono == 0 else 0
+    bc_pis_cofins = (get_centavos_nfe(icms_tot, 'nfe:vProd') + get_centavos_nfe(icms_tot, 'nfe:vFrete') + get_centavos_nfe(icms_tot, 'nfe:vSeg')
+                     - get_centavos_nfe(icms_tot, 'nfe:vDesc') + get_centavos_nfe(icms_tot, 'nfe:vOutro') - icms_a_deduzir)
+
+    linha['CFOP_XML'] = _juntar_codigos(cfops_set)
+    linha['CEST_XML'] = _juntar_codigos(cest_set)
+    linha['CST_XML'] = _juntar_codigos(cst_set)
+    linha['ICMS_SN_XML'] = icms_sn
+    linha['ICMS_MONO_XML'] = icms_mono
+    linha['BC_PIS_COFINS_CALC'] = max(bc_pis_cofins, 0)
+    return linha
+
+
+def processar_pasta_xml(
+    pasta_xmls: Path,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    extrair_itens: bool = True,
+    perfil_extracao: str = 'completo'
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Lê arquivos XML e retorna três DataFrames: (df_nfe_totais, df_nfe_itens, df_cte_totais),
+    com os valores monetários em centavos (int64).
+
+    extrair_itens=False é a fase 1 da leitura em duas fases: df_nfe_itens volta
+    vazio e os totais trazem BC_PIS_COFINS_CALC e ARQUIVO_XML, para que os itens
+    sejam lidos depois (extrair_itens_nfe) só das notas que precisarem deles.
+
+    perfil_extracao='totais' (ver PERFIS_EXTRACAO) não lê itens: df_nfe_itens
+    volta vazio e os totais trazem CST_XML e BC_PIS_COFINS_CALC por nota.
+    """
+    if perfil_extracao not in PERFIS_EXTRACAO:
+        raise ValueError(f"Perfil de extração desconhecido: {perfil_extracao}")
     logging.info('Lendo arquivos XML (NF-e e CT-e)...')
     dados_totais: List[Dict[str, Any]] = []    # Para totais de NF-e
     dados_itens: List[Dict[str, Any]] = []      # Para itens de NF-e
     dados_cte_xml: List[Dict[str, Any]] = []    # Para totais de CT-e
 
-    # --- HELPERS DE NF-e ---
-    def get_text_nfe(element: Optional[ET.Element], path: str, default: str = '') -> str:
-        if element is None: return default
-        node = element.find(path, NS_NFE)
-        return node.text.strip() if node is not None and node.text is not None else default
-
-    def get_float_nfe(element: Optional[ET.Element], path: str, default: float = 0.0) -> float:
-        text_val = get_text_nfe(element, path, '')
-        if not text_val: return default
-        try:
-            return float(text_val.replace(',', '.'))
-        except (ValueError, TypeError):
-            return default
-
     # --- HELPERS DE CT-e ---
     def get_text_cte(element: Optional[ET.Element], tag_name: str, default: str = '') -> str:
         """Busca uma tag filha usando o namespace de CTe."""
@@ -48,6 +308,9 @@ def processar_pasta_xml(pasta_xmls: Path, progress_callback: Optional[Callable[[
         if not text_val: return default
         try: return float(text_val.replace(',', '.'))
         except (ValueError, TypeError): return default
+
+    def get_centavos_cte(element: Optional[ET.Element], tag_name: str) -> int:
+        return texto_para_centavos(get_text_cte(element, tag_name, ''))
     # --- FIM DOS HELPERS ---
 
     try:
@@ -97,112 +360,11 @@ def processar_pasta_xml(pasta_xmls: Path, progress_callback: Optional[Callable[[
                     continue
                 chaves_processadas.add(chave_nfe)
 
-                ide = inf_nfe.find('nfe:ide', NS_NFE)
-                emit = inf_nfe.find('nfe:emit', NS_NFE)
-                dest = inf_nfe.find('nfe:dest', NS_NFE)
-
-                numero_nf = get_text_nfe(ide, 'nfe:nNF')
-                fin_nfe_code = get_text_nfe(ide, 'nfe:finNFe', default='1')
-                tipo_nota_texto = MAPA_FINNFE.get(fin_nfe_code, 'Desconhecido')
-
-                cnpj_emitente = get_text_nfe(emit, 'nfe:CNPJ', default=get_text_nfe(emit, 'nfe:CPF'))
-                cnpj_dest = get_text_nfe(dest, 'nfe:CNPJ')
-                cpf_dest = get_text_nfe(dest, 'nfe:CPF')
-
-                tipo_dest = 'PJ' if (cnpj_dest and len(cnpj_dest) >= 14) else ('PF' if cpf_dest else 'OUTRO')
-
-                icms_tot_element = root.find('.//nfe:ICMSTot', NS_NFE)
-                dados_impostos: Dict[str, float] = {
-                    'VL_DOC_XML': round(get_float_nfe(icms_tot_element, 'nfe:vNF'), 2),
-                    'ICMS_XML': round(get_float_nfe(icms_tot_element, 'nfe:vICMS'), 2),
-                    'ICMS_ST_XML': round(get_float_nfe(icms_tot_element, 'nfe:vST'), 2),
-                    'IPI_XML': round(get_float_nfe(icms_tot_element, 'nfe:vIPI'), 2),
-                    'IPI_DEVOL_XML': round(get_float_nfe(icms_tot_element, 'nfe:vIPIDevol'), 2),
-                    'FCP_ST_XML': round(get_float_nfe(icms_tot_element, 'nfe:vFCPST'), 2),
-                    'ICMS_SN_XML': 0.0, 'ICMS_MONO_XML': 0.0
-                }
-
-                cfops_set: set[str] = set()
-                cest_set: set[str] = set()
-                icms_sn_total_itens: float = 0.0
-                icms_mono_total_itens: float = 0.0
-
-                itens_list = root.findall('.//nfe:det', NS_NFE)
-
-                for item in itens_list:
-                    prod = item.find('nfe:prod', NS_NFE)
-                    imposto = item.find('nfe:imposto', NS_NFE)
-                    if prod is None or imposto is None: continue
-
-                    cfop_text = get_text_nfe(prod, 'nfe:CFOP'); cfops_set.add(cfop_text)
-                    cest_code = get_text_nfe(prod, 'nfe:CEST'); cest_set.add(cest_code)
-
-                    cst_icms_xml = ''; vlr_bc_icms_xml = 0.0; p_icms_xml = 0.0
-                    vlr_icms_sn_item = 0.0; vlr_icms_mono_item = 0.0
-
-                    icms_element = imposto.find('nfe:ICMS', NS_NFE)
-                    if icms_element is not None:
-                        icms_type_tag = next(iter(icms_element), None)
-                        if icms_type_tag is not None:
-                            cst_icms_xml = get_text_nfe(icms_type_tag, 'nfe:CST', default=get_text_nfe(icms_type_tag, 'nfe:CSOSN'))
-                            vlr_bc_icms_xml = get_float_nfe(icms_type_tag, 'nfe:vBC')
-                            p_icms_xml_raw = get_float_nfe(icms_type_tag, 'nfe:pICMS')
-                            if p_icms_xml_raw > 0: p_icms_xml = round(p_icms_xml_raw / 100.0, 4)
-                            vlr_icms_sn_item = get_float_nfe(icms_type_tag, 'nfe:vCredICMSSN')
-
-                    icms_sn_total_itens += vlr_icms_sn_item
-
-                    # Soma campos de ICMS Monofásico
-                    for tag_mono in ['vICMSMono', 'vICMSMonoOp', 'vICMSMonoDifer', 'vICMSMonoRet']:
-                         vlr_icms_mono_item += get_float_nfe(imposto.find(f'.//nfe:{tag_mono}', NS_NFE), '.')
-                    icms_mono_total_itens += vlr_icms_mono_item
-
-                    vlr_unit_base = get_float_nfe(prod, 'nfe:vUnCom'); quantidade = get_float_nfe(prod, 'nfe:qCom')
-                    vlr_frete_item = get_float_nfe(prod, 'nfe:vFrete'); vlr_seguro_item = get_float_nfe(prod, 'nfe:vSeg')
-                    vlr_desconto_item = get_float_nfe(prod, 'nfe:vDesc'); vlr_outras_desp = get_float_nfe(prod, 'nfe:vOutro')
-
-                    vlr_icms_item = get_float_nfe(imposto.find('.//nfe:vICMS', NS_NFE), '.')
-                    vlr_icms_st_item = get_float_nfe(imposto.find('.//nfe:vICMSST', NS_NFE), '.')
-                    vlr_fcp_st_item = get_float_nfe(imposto.find('.//nfe:vFCPST', NS_NFE), '.')
-                    vlr_pis_item = get_float_nfe(imposto.find('.//nfe:vPIS', NS_NFE), '.')
-                    vlr_cofins_item = get_float_nfe(imposto.find('.//nfe:vCOFINS', NS_NFE), '.')
-
-                    vlr_ipi_item = get_float_nfe(imposto.find('.//nfe:vIPI', NS_NFE), '.')
-                    imposto_devol = item.find('nfe:impostoDevol', NS_NFE)
-                    if imposto_devol: vlr_ipi_item += get_float_nfe(imposto_devol, 'nfe:IPI/nfe:vIPIDevol')
-
-                    vlr_prod_base = get_float_nfe(prod, 'nfe:vProd')
-                    vlr_prod_calculado = round(vlr_prod_base + vlr_ipi_item + vlr_icms_st_item + vlr_fcp_st_item + vlr_frete_item + vlr_seguro_item - vlr_desconto_item + vlr_outras_desp, 2)
-
-                    icms_a_deduzir = (round(vlr_icms_item, 2) + round(vlr_icms_sn_item, 2)) if vlr_icms_mono_item == 0.0 else 0.0
-                    bc_pis_cofins_item = round(vlr_prod_calculado - icms_a_deduzir - round(vlr_icms_st_item, 2) - round(vlr_fcp_st_item, 2) - round(vlr_ipi_item, 2), 2)
-
-                    item_data: Dict[str, Any] = {
-                        'CHV_NFE': chave_nfe, 'CNPJ_EMITENTE': cnpj_emitente, 'N_ITEM': item.attrib.get('nItem', ''),
-                        'TIPO_NOTA': tipo_nota_texto, 'TIPO_DESTINATARIO': tipo_dest,
-                        'COD_PROD': get_text_nfe(prod, 'nfe:cProd'), 'DESC_PROD': get_text_nfe(prod, 'nfe:xProd'),
-                        'NCM': get_text_nfe(prod, 'nfe:NCM'), 'CEST': cest_code, 'cBenef': get_text_nfe(prod, 'nfe:cBenef'),
-                        'CFOP': cfop_text, 'QTD': quantidade, 'UNID': get_text_nfe(prod, 'nfe:uCom'),
-                        'VLR_UNIT': vlr_unit_base, 'VLR_PROD': vlr_prod_calculado, 'DESPESA_XML': round(vlr_outras_desp, 2),
-                        'VLR_ICMS': round(vlr_icms_item, 2), 'VLR_ICMS_ST': round(vlr_icms_st_item, 2),
-                        'VLR_FCP_ST': round(vlr_fcp_st_item, 2), 'VLR_IPI': round(vlr_ipi_item, 2),
-                        'VLR_PIS': round(vlr_pis_item, 2), 'VLR_COFINS': round(vlr_cofins_item, 2),
-                        'VLR_ICMS_SN': round(vlr_icms_sn_item, 2), 'VLR_ICMS_MONO': round(vlr_icms_mono_item, 2),
-                        'BC_PIS_COFINS_CALC': max(bc_pis_cofins_item, 0.0), 'VLR_TOTAL_NF': dados_impostos['VL_DOC_XML'],
-                        'CST_ICMS_XML': cst_icms_xml, 'VLR_BC_ICMS_XML': round(vlr_bc_icms_xml, 2), 'pICMS_XML': p_icms_xml
-                    }
-                    dados_itens.append(item_data)
-
-                dados_impostos['ICMS_SN_XML'] = round(icms_sn_total_itens, 2)
-                dados_impostos['ICMS_MONO_XML'] = round(icms_mono_total_itens, 2)
-
-                linha_completa: Dict[str, Any] = {
-                    'CHV_NFE': chave_nfe, 'NUM_NF': numero_nf, 'CNPJ_EMITENTE': cnpj_emitente,
-                    'CFOP_XML': '/'.join(sorted(list(filter(None, cfops_set)))) if cfops_set else '',
-                    'CEST_XML': '/'.join(sorted(list(filter(None, cest_set)))) if cest_set else '',
-                    'TIPO_NOTA': tipo_nota_texto
-                }
-                linha_completa.update(dados_impostos)
+                if perfil_extracao == 'totais':
+                    linha_completa = _processar_nfe_totais(root, inf_nfe, chave_nfe)
+                else:
+                    linha_completa = _processar_nfe(root, inf_nfe, chave_nfe, dados_itens if extrair_itens else None)
+                    if not extrair_itens: linha_completa['ARQUIVO_XML'] = str(arquivo)
                 dados_totais.append(linha_completa)
 
 
@@ -303,9 +465,9 @@ def processar_pasta_xml(pasta_xmls: Path, progress_callback: Optional[Callable[[
                              item_predominante = get_text_cte(compl.find(f"{NS_CTE_FIND}ObsCont/infCont"), 'xCampo')
 
                     # --- Valores e Impostos ---
-                    vlr_total_cte = get_float_cte(vPrest, 'vTPrest')
-                    vlr_bc_xml = get_float_cte(icms_type_tag, 'vBC')
-                    vlr_icms_xml = get_float_cte(icms_type_tag, 'vICMS')
+                    vlr_total_cte = get_centavos_cte(vPrest, 'vTPrest')
+                    vlr_bc_xml = get_centavos_cte(icms_type_tag, 'vBC')
+                    vlr_icms_xml = get_centavos_cte(icms_type_tag, 'vICMS')
                     aliq_icms_xml = get_float_cte(icms_type_tag, 'pICMS')
                     cst_cte = get_text_cte(icms_type_tag, 'CST')
 
@@ -325,9 +487,9 @@ def processar_pasta_xml(pasta_xmls: Path, progress_callback: Optional[Callable[[
                         'TOMADOR_NOME': tomador_nome,
                         'MUN_ORIGEM': mun_origem,
                         'MUN_DESTINO': mun_destino,
-                        'VL_TOTAL_CTE_XML': round(vlr_total_cte, 2),
-                        'VL_BC_ICMS_XML': round(vlr_bc_xml, 2),
-                        'VL_ICMS_XML': round(vlr_icms_xml, 2),
+                        'VL_TOTAL_CTE_XML': vlr_total_cte,
+                        'VL_BC_ICMS_XML': vlr_bc_xml,
+                        'VL_ICMS_XML': vlr_icms_xml,
                         'ALIQ_ICMS_XML': round(aliq_icms_xml, 2),
                         'CFOP_XML': cfop_xml,
                         'CST_XML': cst_cte,
@@ -371,4 +533,68 @@ def processar_pasta_xml(pasta_xmls: Path, progress_callback: Optional[Callable[[
     if not df_itens.empty: df_itens.drop_duplicates(subset=['CHV_NFE', 'N_ITEM'], keep='first', inplace=True)
     if not df_cte_xml.empty: df_cte_xml.drop_duplicates(subset=['CHV_CTE'], keep='first', inplace=True)
 
-    return df_totais, df_itens, df_cte_xml
\ No newline at end of file
+    df_totais = anexar_campos_chave(df_totais, 'CHV_NFE', 'XMLs de NF-e')
+    df_cte_xml = anexar_campos_chave(df_cte_xml, 'CHV_CTE', 'XMLs de CT-e')
+    df_totais = compactar_dataframe(df_totais, 'XML NF-e (totais)')
+    df_itens = compactar_dataframe(df_itens, 'XML NF-e (itens)')
+    return df_totais, df_itens, df_cte_xml
+
+def extrair_itens_nfe(arquivos: List[Path], progress_callback: Optional[Callable[[int, int], None]] = None) -> pd.DataFrame:
+    """
+    Fase 2 da leitura em duas fases: reabre apenas os XMLs indicados (coluna
+    ARQUIVO_XML da fase 1) e extrai os itens das NF-e, com as mesmas colunas de
+    processar_pasta_xml.
+    """
+    dados_itens: List[Dict[str, Any]] = []
+    total_files = len(arquivos)
+    logging.info(f"Extraindo itens de {total_files} NF-e selecionadas...")
+
+    for i, arquivo in enumerate(arquivos):
+        try:
+            root = ET.parse(str(arquivo)).getroot()
+            inf_nfe = root.find('.//nfe:infNFe', NS_NFE)
+            if inf_nfe is not None:
+                chave_nfe = inf_nfe.attrib.get('Id', '').replace('NFe', '')
+                _processar_nfe(root, inf_nfe, chave_nfe, dados_itens)
+        except Exception as e:
+            logging.error(f"Erro ao extrair itens do XML {Path(arquivo).name}: {e}")
+
+        if progress_callback:
+            progress_callback(i + 1, total_files)
+
+    df_itens = pd.DataFrame(dados_itens)
+    if not df_itens.empty: df_itens.drop_duplicates(subset=['CHV_NFE', 'N_ITEM'], keep='first', inplace=True)
+    return compactar_dataframe(df_itens, 'XML NF-e (itens selecionados)')
+
+# ==============================================================================
+# AMOSTRA DE CHAVES (PRÉ-VALIDAÇÃO DO PERÍODO)
+# ==============================================================================
+_PADRAO_CHAVE_NOME = re.compile(r'(?<!\d)(\d{44})(?!\d)')
+_PADRAO_CHAVE_CONTEUDO = re.compile(rb'Id="(?:NFe|CTe)(\d{44})"|<ch(?:NFe|CTe)>(\d{44})<')
+
+def _chave_do_arquivo(arquivo: Path, bytes_lidos: int = 4096) -> Optional[str]:
+    """Chave pelo nome do arquivo; se não houver, pelo Id do infNFe/infCte no início do XML (sem parse)."""
+    encontrada = _PADRAO_CHAVE_NOME.search(arquivo.name)
+    if encontrada: return encontrada.group(1)
+    try:
+        with open(arquivo, 'rb') as f:
+            encontrada = _PADRAO_CHAVE_CONTEUDO.search(f.read(bytes_lidos))
+    except OSError:
+        return None
+    if not encontrada: return None
+    return (encontrada.group(1) or encontrada.group(2)).decode('ascii')
+
+def amostrar_chaves_xml(pasta_xmls: Path, tamanho_amostra: int = 200) -> pd.Series:
+    """
+    Chaves de uma amostra espaçada dos XMLs da pasta (nome do arquivo ou
+    primeiros KB do conteúdo), para conferências rápidas antes da leitura completa.
+    """
+    try:
+        arquivos = sorted(list(pasta_xmls.glob('*.xml')) + list(pasta_xmls.glob('*.XML')))
+    except (FileNotFoundError, OSError):
+        return pd.Series([], dtype=object)
+    if len(arquivos) > tamanho_amostra:
+        passo = len(arquivos) / tamanho_amostra
+        arquivos = [arquivos[int(i * passo)] for i in range(tamanho_amostra)]
+    chaves = [chave for chave in map(_chave_do_arquivo, arquivos) if chave]
+    return pd.Series(chaves, dtype=object)
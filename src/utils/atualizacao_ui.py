@@ -0,0 +1,147 @@
+import logging
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, List, Optional, TextIO, Tuple
+
+import flet as ft
+
+# ==============================================================================
+# ATUALIZAÇÕES DE UI AGRUPADAS (PROGRESSO E LOG DAS ANÁLISES)
+# ==============================================================================
+# As lógicas chamam progress_callback uma vez por XML e status_callback a cada
+# etapa. Chamar self.update() em cada uma manda um diff da tela inteira pelo
+# canal do Flet e segura a thread da análise enquanto isso. Aqui os callbacks
+# só guardam o último progresso e enfileiram as linhas; uma thread de quadros
+# aplica tudo na tela num único update() a cada 1/quadros_por_segundo. A lista
+# de log visível é limitada (as mais antigas saem) e o log completo vai para
+# um arquivo em logs/.
+
+PASTA_LOGS = Path("logs")
+
+class AtualizadorUI:
+    def __init__(
+        self,
+        tela: Any,
+        barra_progresso: ft.ProgressBar,
+        lista_log: ft.ListView,
+        prefixo_log: str = "analise",
+        quadros_por_segundo: float = 10.0,
+        max_linhas_visiveis: int = 500,
+    ):
+        self.tela = tela
+        self.barra_progresso = barra_progresso
+        self.lista_log = lista_log
+        self.prefixo_log = prefixo_log
+        self.intervalo = 1.0 / quadros_por_segundo
+        self.max_linhas_visiveis = max_linhas_visiveis
+        self.caminho_log: Optional[Path] = None
+
+        self._trava = threading.Lock()
+        self._linhas: List[str] = []
+        self._progresso: Optional[Tuple[int, int]] = None
+        self._parar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._arquivo: Optional[TextIO] = None
+        self._zerar_metricas()
+
+    def _zerar_metricas(self):
+        self.chamadas_progresso = 0
+        self.chamadas_log = 0
+        self.tempo_callbacks = 0.0 # segundos da thread da análise dentro de progresso()/log()
+        self.quadros = 0
+        self.tempo_quadros = 0.0 # segundos gastos em update() pela thread de quadros
+        self.linhas_ocultas = 0
+
+    # --- Ciclo de vida ---
+
+    def iniciar(self):
+        """Limpa o log visível, abre o arquivo de log da execução e começa os quadros."""
+        self.encerrar()
+        self._zerar_metricas()
+        self.lista_log.controls.clear()
+        self._linhas, self._progresso = [], None
+        try:
+            PASTA_LOGS.mkdir(exist_ok=True)
+            self.caminho_log = PASTA_LOGS / f"{self.prefixo_log}_{datetime.now():%Y%m%d_%H%M%S}.log"
+            self._arquivo = open(self.caminho_log, 'w', encoding='utf-8', buffering=1)
+        except OSError as e:
+            logging.warning(f"Não foi possível criar o arquivo de log da execução: {e}")
+            self.caminho_log, self._arquivo = None, None
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._laco_quadros, name=f"quadros-{self.prefixo_log}", daemon=True)
+        self._thread.start()
+
+    def encerrar(self):
+        """Para os quadros, aplica o que estiver pendente e fecha o arquivo. Pode ser chamado mais de uma vez."""
+        if self._thread is None: # já encerrado: só aplica linhas que chegaram depois (erro seguido de conclusão)
+            self._aplicar()
+            return
+        self._parar.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+        if self.linhas_ocultas and self.caminho_log:
+            self.log(f"[LOG] {self.linhas_ocultas} linhas antigas ocultas. Log completo em: {self.caminho_log.resolve()}")
+        self._aplicar()
+        if self._arquivo:
+            self._arquivo.close()
+            self._arquivo = None
+
+        logging.info(
+            f"Atualizações de UI ({self.prefixo_log}): {self.chamadas_progresso} progresso + {self.chamadas_log} log "
+            f"= {self.tempo_callbacks * 1000:.0f} ms da análise em callbacks; {self.quadros} quadros "
+            f"({self.tempo_quadros * 1000:.0f} ms em update())."
+        )
+
+    # --- Callbacks (thread da análise) ---
+
+    def progresso(self, atual: int, total: int):
+        inicio = time.perf_counter()
+        self._progresso = (atual, total) # atribuição de tupla: não precisa da trava
+        self.chamadas_progresso += 1
+        self.tempo_callbacks += time.perf_counter() - inicio
+
+    def log(self, mensagem: str):
+        inicio = time.perf_counter()
+        with self._trava:
+            self._linhas.append(mensagem)
+        if self._arquivo:
+            self._arquivo.write(f"{datetime.now():%H:%M:%S} {mensagem}\n")
+        self.chamadas_log += 1
+        self.tempo_callbacks += time.perf_counter() - inicio
+
+    # --- Quadros ---
+
+    def _laco_quadros(self):
+        while not self._parar.wait(self.intervalo):
+            self._aplicar()
+
+    def _aplicar(self):
+        with self._trava:
+            linhas, self._linhas = self._linhas, []
+        progresso, self._progresso = self._progresso, None
+        if not linhas and progresso is None: return
+
+        inicio = time.perf_counter()
+        if progresso is not None:
+            atual, total = progresso
+            self.barra_progresso.visible = total > 0
+            if total > 0: self.barra_progresso.value = atual / total
+
+        if linhas:
+            controles = self.lista_log.controls
+            controles.extend(ft.Text(m, size=12, color=ft.Colors.WHITE, font_family="Consolas") for m in linhas)
+            excesso = len(controles) - self.max_linhas_visiveis
+            if excesso > 0:
+                del controles[:excesso]
+                self.linhas_ocultas += excesso
+
+        try:
+            self.tela.update()
+        except Exception as e: # Tela fora da página (logout): o estado fica nos controles
+            logging.debug(f"Quadro de UI não enviado: {e}")
+        self.quadros += 1
+        self.tempo_quadros += time.perf_counter() - inicio
@@ -0,0 +1,159 @@
+import importlib
+import logging
+import re
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import flet as ft
+
+# ==============================================================================
+# CARREGAMENTO SOB DEMANDA DAS TELAS E AQUECIMENTO DOS MÓDULOS PESADOS
+# ==============================================================================
+# main.py importa só o login. Cada tela (e a lógica dela: pandas, numpy,
+# openpyxl...) é importada na primeira navegação; depois do login uma thread
+# em segundo plano adianta os imports pesados enquanto o usuário escolhe a tela.
+# Os módulos daqui são importados por nome: manter a lista de hiddenimports
+# do SiegAuto.spec em sincronia com VIEWS.
+
+# Rótulo do menu -> (módulo, classe, recebe a page no construtor)
+VIEWS: Dict[str, Tuple[str, str, bool]] = {
+    "Dashboard": ("src.views.dashboard_view", "DashboardView", False),
+    "Admin": ("src.views.admin_view", "AdminView", True),
+    "SPED": ("src.views.sped_view", "SpedView", True),
+    "Invest / Contrib": ("src.views.invest_view", "InvestView", True),
+    "Extrator Chaves": ("src.views.keys_extractor_view", "KeysExtractorView", True),
+    "Filtro SPED": ("src.views.sped_filter_view", "SpedFilterView", True),
+    "Fila de Jobs": ("src.views.jobs_view", "JobsView", True),
+    "Configurações": ("src.views.settings_view", "SettingsView", True),
+}
+
+# Importados em segundo plano após o login (bibliotecas primeiro, depois as lógicas)
+MODULOS_AQUECIMENTO = ('numpy', 'pandas', 'openpyxl', 'src.logic.fiscal_logic', 'src.logic.invest_logic')
+
+_aquecimento: Optional[threading.Thread] = None
+
+def criar_view(rotulo: str, page: Any) -> Any:
+    """Instancia a tela do menu, importando o módulo dela na primeira vez."""
+    modulo, classe, recebe_page = VIEWS[rotulo]
+    inicio = time.perf_counter()
+    view_cls = getattr(importlib.import_module(modulo), classe)
+    decorrido = time.perf_counter() - inicio
+    if decorrido > 0.05:
+        logging.info(f"Tela '{rotulo}' carregada em {decorrido:.2f}s (import de {modulo}).")
+    return view_cls(page) if recebe_page else view_cls()
+
+def _aquecer(modulos: Sequence[str]):
+    inicio = time.perf_counter()
+    for modulo in modulos:
+        try:
+            importlib.import_module(modulo)
+        except Exception as e: # Sem dependência opcional etc.: a tela reporta ao abrir
+            logging.warning(f"Aquecimento: falha ao importar {modulo}: {e}")
+    logging.info(f"Aquecimento dos módulos concluído em {time.perf_counter() - inicio:.2f}s.")
+
+def aquecer_modulos(modulos: Sequence[str] = MODULOS_AQUECIMENTO) -> threading.Thread:
+    """Importa os módulos pesados numa thread daemon (uma vez por processo)."""
+    global _aquecimento
+    if _aquecimento is None:
+        _aquecimento = threading.Thread(target=_aquecer, args=(tuple(modulos),), name="aquecimento-imports", daemon=True)
+        _aquecimento.start()
+    return _aquecimento
+
+# ==============================================================================
+# REGISTRO DAS TELAS DA SESSÃO
+# ==============================================================================
+# Cada tela é criada uma vez por sessão (FilePickers registrados uma vez no
+# overlay) e continua montada depois que o usuário navega para outra: a troca
+# de tela só alterna 'visible'. Assim os caminhos escolhidos são preservados e
+# os callbacks de uma análise rodando em thread continuam atualizando
+# controles que estão na página (tela oculta não é desenhada, mas recebe as
+# atualizações e aparece em dia quando o usuário volta).
+
+class RegistroTelas:
+    def __init__(self, page: Any):
+        self.page = page
+        self.telas: Dict[str, Any] = {}
+        self.atual: Optional[str] = None
+        self.conteudo = ft.Column(expand=True, spacing=0)
+
+    def exibir(self, rotulo: str) -> Any:
+        """Mostra a tela do rótulo, criando-a na primeira vez. Não chama page.update()."""
+        tela = self.telas.get(rotulo)
+        if tela is None:
+            tela = criar_view(rotulo, self.page)
+            self.telas[rotulo] = tela
+            self.conteudo.controls.append(tela)
+        for nome, outra in self.telas.items():
+            outra.visible = nome == rotulo
+        self.atual = rotulo
+        return tela
+
+    def limpar(self):
+        """Descarta as telas da sessão e os FilePickers delas (logout); telas com encerrar() param as threads."""
+        for tela in self.telas.values():
+            encerrar = getattr(tela, 'encerrar', None)
+            if callable(encerrar): encerrar()
+        self.page.overlay.clear()
+        self.telas.clear()
+        self.conteudo.controls.clear()
+        self.atual = None
+
+# ==============================================================================
+# PERFIL DE IMPORTAÇÃO (-X importtime)
+# ==============================================================================
+# Uso: python -m src.utils.carregamento [módulo ...] [--saida arquivo.tsv]
+# Sem módulos, mede o 'main' (o que roda antes da tela de login). O TSV pode
+# ser versionado/comparado entre builds para acompanhar regressões.
+
+_LINHA_IMPORTTIME = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S.*)$')
+
+def perfil_importacao(modulos: Sequence[str] = ('main',)) -> List[Dict[str, Any]]:
+    """
+    Roda um interpretador novo com -X importtime importando os módulos e
+    devolve um registro por módulo importado (self_us, cumulativo_us,
+    profundidade), do maior cumulativo para o menor.
+    """
+    codigo = '; '.join(f"import {m}" for m in modulos)
+    raiz = Path(__file__).resolve().parents[2]
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', codigo],
+                          cwd=str(raiz), capture_output=True, text=True)
+    if proc.returncode != 0:
+        ultima = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else ''
+        raise RuntimeError(f"Falha ao importar {', '.join(modulos)}: {ultima}")
+
+    registros = []
+    for linha in proc.stderr.splitlines():
+        encontrado = _LINHA_IMPORTTIME.match(linha)
+        if not encontrado: continue
+        proprio, cumulativo, recuo, nome = encontrado.groups()
+        registros.append({'modulo': nome.strip(), 'self_us': int(proprio), 'cumulativo_us': int(cumulativo),
+                          'profundidade': len(recuo) // 2})
+    return sorted(registros, key=lambda r: r['cumulativo_us'], reverse=True)
+
+def formatar_perfil(registros: List[Dict[str, Any]], limite: int = 30) -> str:
+    total = sum(r['cumulativo_us'] for r in registros if r['profundidade'] == 0)
+    linhas = [f"Total (imports de primeiro nível): {total / 1000:.1f} ms em {len(registros)} módulos",
+              f"{'cumulativo_ms':>14} {'self_ms':>9}  módulo"]
+    for r in registros[:limite]:
+        linhas.append(f"{r['cumulativo_us'] / 1000:>14.1f} {r['self_us'] / 1000:>9.1f}  {r['modulo']}")
+    return '\n'.join(linhas)
+
+if __name__ == '__main__':
+    argumentos = sys.argv[1:]
+    saida = None
+    if '--saida' in argumentos:
+        i = argumentos.index('--saida')
+        saida = argumentos[i + 1]
+        del argumentos[i:i + 2]
+    perfil = perfil_importacao(argumentos or ('main',))
+    print(formatar_perfil(perfil))
+    if saida:
+        with open(saida, 'w', encoding='utf-8') as f:
+            f.write("modulo\tself_us\tcumulativo_us\tprofundidade\n")
+            for r in perfil:
+                f.write(f"{r['modulo']}\t{r['self_us']}\t{r['cumulativo_us']}\t{r['profundidade']}\n")
+        print(f"Perfil salvo em {saida}")
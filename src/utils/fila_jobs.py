@@ -0,0 +1,401 @@
+import atexit
+import importlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .database import DB_NAME
+from .processo_analise import ExecucaoEmProcesso
+
+# ==============================================================================
+# FILA PERSISTENTE DE JOBS (SQLITE)
+# ==============================================================================
+# Cada job é um conjunto de parâmetros de executar_analise_completa ou de
+# executar_apuracao_invest, guardado em jobs.db ao lado do contabilidade.db
+# (arquivo separado para a gravação de progresso não disputar o lock do
+# cadastro de usuários). A fila sobrevive ao fechamento do app: jobs que
+# estavam executando voltam para pendente na próxima abertura.
+#
+# Ordem de execução: maior prioridade primeiro, depois o mais antigo. Um job
+# que falha volta para a fila até esgotar max_tentativas.
+
+CAMINHO_BANCO_JOBS = Path(DB_NAME).with_name("jobs.db")
+
+# tipo -> (módulo, função, rótulo)
+TIPOS_JOB: Dict[str, Tuple[str, str, str]] = {
+    'sped': ('src.logic.fiscal_logic', 'executar_analise_completa', 'Analisador Fiscal (SPED)'),
+    'invest': ('src.logic.invest_logic', 'executar_apuracao_invest', 'Invest / Contribuições'),
+}
+STATUS_JOB = ('pendente', 'executando', 'concluido', 'erro', 'cancelado')
+MAX_TENTATIVAS_PADRAO = 2
+MAX_WORKERS_PADRAO = 1
+
+INTERVALO_AGENDADOR = 1.0 # segundos entre verificações da fila (enfileirar/terminar acorda antes)
+INTERVALO_GRAVACAO_PROGRESSO = 1.0 # progresso de cada job gravado no banco no máximo 1x/s
+
+def _conectar() -> sqlite3.Connection:
+    conn = sqlite3.connect(CAMINHO_BANCO_JOBS, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def inicializar_fila_jobs():
+    """Cria as tabelas da fila, se não existirem."""
+    conn = _conectar()
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT NOT NULL,
+            descricao TEXT,
+            usuario TEXT,
+            parametros TEXT NOT NULL,
+            prioridade INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'pendente',
+            tentativas INTEGER DEFAULT 0,
+            max_tentativas INTEGER DEFAULT 1,
+            cancelar_solicitado BOOLEAN DEFAULT 0,
+            criado_em TEXT,
+            iniciado_em TEXT,
+            concluido_em TEXT,
+            mensagem TEXT,
+            progresso_atual INTEGER DEFAULT 0,
+            progresso_total INTEGER DEFAULT 0,
+            resultado TEXT,
+            caminho_relatorio TEXT,
+            erro TEXT,
+            worker_pid INTEGER
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_fila ON jobs (status, prioridade DESC, id)')
+    conn.execute('CREATE TABLE IF NOT EXISTS fila_config (chave TEXT PRIMARY KEY, valor TEXT)')
+    conn.commit()
+    conn.close()
+
+# --- Parâmetros (JSON com Path preservado) ---
+
+def _codificar(valor: Any) -> Any:
+    if isinstance(valor, Path): return {'__caminho__': str(valor)}
+    raise TypeError(f"Parâmetro de job não serializável: {type(valor).__name__}")
+
+def _decodificar(objeto: Dict[str, Any]) -> Any:
+    if len(objeto) == 1 and '__caminho__' in objeto: return Path(objeto['__caminho__'])
+    return objeto
+
+def _agora() -> str:
+    return datetime.now().isoformat(timespec='seconds')
+
+def _atualizar(job_id: int, **campos):
+    atribuicoes = ', '.join(f"{nome} = ?" for nome in campos)
+    conn = _conectar()
+    conn.execute(f"UPDATE jobs SET {atribuicoes} WHERE id = ?", (*campos.values(), job_id))
+    conn.commit()
+    conn.close()
+
+# --- Operações da fila ---
+
+def enfileirar_job(
+    tipo: str,
+    args: Sequence[Any] = (),
+    kwargs: Optional[Dict[str, Any]] = None,
+    descricao: str = '',
+    prioridade: int = 0,
+    max_tentativas: int = MAX_TENTATIVAS_PADRAO,
+    usuario: Optional[str] = None
+) -> int:
+    """Grava o job como pendente e devolve o id. args/kwargs sem os callbacks."""
+    if tipo not in TIPOS_JOB:
+        raise ValueError(f"Tipo de job desconhecido: {tipo}")
+    parametros = json.dumps({'args': list(args), 'kwargs': kwargs or {}}, default=_codificar, ensure_ascii=False)
+    conn = _conectar()
+    cursor = conn.execute(
+        'INSERT INTO jobs (tipo, descricao, usuario, parametros, prioridade, max_tentativas, criado_em, mensagem) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        (tipo, descricao, usuario, parametros, prioridade, max(1, max_tentativas), _agora(), 'Aguardando na fila')
+    )
+    conn.commit()
+    job_id = cursor.lastrowid
+    conn.close()
+    logging.info(f"Job {job_id} ({tipo}) enfileirado com prioridade {prioridade}: {descricao}")
+    if _gerenciador is not None: _gerenciador.acordar()
+    return job_id
+
+def listar_jobs(limite: int = 200) -> List[Dict[str, Any]]:
+    """Jobs em execução e pendentes primeiro (na ordem da fila), depois os finalizados mais recentes."""
+    conn = _conectar()
+    linhas = conn.execute('''
+        SELECT * FROM jobs
+        ORDER BY CASE status WHEN 'executando' THEN 0 WHEN 'pendente' THEN 1 ELSE 2 END,
+                 CASE WHEN status = 'pendente' THEN -prioridade ELSE 0 END,
+                 CASE WHEN status IN ('executando', 'pendente') THEN id ELSE -id END
+        LIMIT ?
+    ''', (limite,)).fetchall()
+    conn.close()
+    return [dict(linha) for linha in linhas]
+
+def cancelar_job(job_id: int) -> bool:
+    """Pendente: cancela na hora. Executando: pede o cancelamento ao gerenciador (encerra o processo)."""
+    conn = _conectar()
+    cursor = conn.execute(
+        "UPDATE jobs SET status = 'cancelado', concluido_em = ?, mensagem = 'Cancelado antes de iniciar' "
+        "WHERE id = ? AND status = 'pendente'", (_agora(), job_id)
+    )
+    if cursor.rowcount == 0:
+        cursor = conn.execute("UPDATE jobs SET cancelar_solicitado = 1 WHERE id = ? AND status = 'executando'", (job_id,))
+    conn.commit()
+    alterado = cursor.rowcount > 0
+    conn.close()
+    if alterado and _gerenciador is not None: _gerenciador.acordar()
+    return alterado
+
+def reenfileirar_job(job_id: int) -> bool:
+    """Volta um job com erro ou cancelado para a fila, com as tentativas zeradas."""
+    conn = _conectar()
+    cursor = conn.execute('''
+        UPDATE jobs SET status = 'pendente', tentativas = 0, cancelar_solicitado = 0, iniciado_em = NULL,
+               concluido_em = NULL, erro = NULL, resultado = NULL, caminho_relatorio = NULL,
+               progresso_atual = 0, progresso_total = 0, mensagem = 'Aguardando na fila'
+        WHERE id = ? AND status IN ('erro', 'cancelado')
+    ''', (job_id,))
+    conn.commit()
+    alterado = cursor.rowcount > 0
+    conn.close()
+    if alterado and _gerenciador is not None: _gerenciador.acordar()
+    return alterado
+
+def alterar_prioridade(job_id: int, delta: int):
+    conn = _conectar()
+    conn.execute("UPDATE jobs SET prioridade = prioridade + ? WHERE id = ? AND status = 'pendente'", (delta, job_id))
+    conn.commit()
+    conn.close()
+
+def _reservar_proximo() -> Optional[Dict[str, Any]]:
+    """Marca o próximo pendente como executando (transação exclusiva) e o devolve."""
+    conn = _conectar()
+    conn.isolation_level = None
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        linha = conn.execute(
+            "SELECT * FROM jobs WHERE status = 'pendente' ORDER BY prioridade DESC, id LIMIT 1"
+        ).fetchone()
+        if linha is None:
+            conn.execute('COMMIT')
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = 'executando', tentativas = tentativas + 1, iniciado_em = ?, concluido_em = NULL, "
+            "mensagem = 'Iniciando...', progresso_atual = 0, progresso_total = 0, cancelar_solicitado = 0 WHERE id = ?",
+            (_agora(), linha['id'])
+        )
+        conn.execute('COMMIT')
+        job = dict(linha)
+        job['tentativas'] += 1
+        return job
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+def _ler_config(chave: str, padrao: str) -> str:
+    conn = _conectar()
+    linha = conn.execute('SELECT valor FROM fila_config WHERE chave = ?', (chave,)).fetchone()
+    conn.close()
+    return linha['valor'] if linha else padrao
+
+def _gravar_config(chave: str, valor: str):
+    conn = _conectar()
+    conn.execute('INSERT OR REPLACE INTO fila_config (chave, valor) VALUES (?, ?)', (chave, valor))
+    conn.commit()
+    conn.close()
+
+# --- Métricas para a tela ---
+
+def _data(texto: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(texto) if texto else None
+
+def metricas_job(job: Dict[str, Any]) -> Tuple[Optional[float], Optional[float]]:
+    """(duração em segundos, vazão em XMLs/s). Job em execução mede até agora."""
+    inicio = _data(job.get('iniciado_em'))
+    if inicio is None: return None, None
+    fim = _data(job.get('concluido_em')) or datetime.now()
+    duracao = max((fim - inicio).total_seconds(), 0.0)
+    itens = job.get('progresso_total') if job.get('status') != 'executando' else job.get('progresso_atual')
+    vazao = itens / duracao if itens and duracao > 0 else None
+    return duracao, vazao
+
+def _caminho_relatorio(resultado: Sequence[Any]) -> Optional[str]:
+    """Primeiro argumento do done_callback: Path (SPED) ou texto começando pelo caminho (Invest)."""
+    if not resultado: return None
+    primeira_linha = str(resultado[0]).split('\n')[0].strip()
+    return primeira_linha or None
+
+# ==============================================================================
+# GERENCIADOR (POOL DE PROCESSOS DE ANÁLISE)
+# ==============================================================================
+# Uma thread agendadora reserva jobs enquanto houver vaga no pool e roda cada
+# um num processo próprio (ExecucaoEmProcesso). Os callbacks gravam status e
+# progresso no banco; a tela da fila só lê o banco. Supõe uma instância do app
+# por jobs.db.
+
+class GerenciadorJobs:
+    def __init__(self, max_workers: int = MAX_WORKERS_PADRAO):
+        self.max_workers = max(1, max_workers)
+        self._execucoes: Dict[int, ExecucaoEmProcesso] = {}
+        self._trava = threading.Lock()
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._encerrando = False
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def em_execucao(self) -> List[int]:
+        with self._trava:
+            return list(self._execucoes)
+
+    def iniciar(self):
+        if self._thread is not None: return
+        conn = _conectar()
+        recuperados = conn.execute(
+            "UPDATE jobs SET status = 'pendente', mensagem = 'Retomado após fechamento do app' WHERE status = 'executando'"
+        ).rowcount
+        conn.commit()
+        conn.close()
+        if recuperados:
+            logging.warning(f"Fila de jobs: {recuperados} job(s) interrompidos na última sessão voltaram para a fila.")
+        self._thread = threading.Thread(target=self._laco, name="fila-jobs", daemon=True)
+        self._thread.start()
+        logging.info(f"Fila de jobs iniciada com {self.max_workers} worker(s).")
+
+    def acordar(self):
+        self._acordar.set()
+
+    def definir_workers(self, quantidade: int):
+        self.max_workers = max(1, int(quantidade))
+        _gravar_config('max_workers', str(self.max_workers))
+        logging.info(f"Fila de jobs: pool ajustado para {self.max_workers} worker(s).")
+        self.acordar()
+
+    def encerrar(self):
+        """Saída do app: os jobs em execução são interrompidos e voltam para pendente."""
+        self._encerrando = True
+        self._parar.set()
+        self._acordar.set()
+
+    # --- Agendador ---
+
+    def _laco(self):
+        while not self._parar.is_set():
+            try:
+                self._ciclo()
+            except Exception as e:
+                logging.error(f"Fila de jobs: erro no agendador: {e}")
+            self._acordar.wait(INTERVALO_AGENDADOR)
+            self._acordar.clear()
+
+    def _ciclo(self):
+        ativos = self.em_execucao
+        if ativos:
+            conn = _conectar()
+            marcados = conn.execute(
+                f"SELECT id FROM jobs WHERE cancelar_solicitado = 1 AND id IN ({','.join('?' * len(ativos))})", ativos
+            ).fetchall()
+            conn.close()
+            for linha in marcados:
+                with self._trava:
+                    execucao = self._execucoes.get(linha['id'])
+                if execucao and not execucao.cancelada:
+                    logging.info(f"Fila de jobs: cancelando job {linha['id']}.")
+                    execucao.cancelar()
+
+        while len(self.em_execucao) < self.max_workers and not self._parar.is_set():
+            job = _reservar_proximo()
+            if job is None: break
+            try:
+                self._iniciar_job(job)
+            except Exception as e:
+                logging.error(f"Fila de jobs: falha ao iniciar o job {job['id']}: {e}")
+                _atualizar(job['id'], status='erro', erro=str(e), concluido_em=_agora(), mensagem='Falha ao iniciar')
+
+    def _iniciar_job(self, job: Dict[str, Any]):
+        job_id = job['id']
+        modulo, funcao, _ = TIPOS_JOB[job['tipo']]
+        alvo = getattr(importlib.import_module(modulo), funcao)
+        parametros = json.loads(job['parametros'], object_hook=_decodificar)
+        estado = {'resultado': None, 'erros': [], 'gravado_em': 0.0}
+
+        def status(mensagem: str):
+            _atualizar(job_id, mensagem=mensagem)
+
+        def progresso(atual: int, total: int):
+            agora = time.monotonic()
+            if atual < total and agora - estado['gravado_em'] < INTERVALO_GRAVACAO_PROGRESSO: return
+            estado['gravado_em'] = agora
+            _atualizar(job_id, progresso_atual=atual, progresso_total=total)
+
+        def concluido(*resultado):
+            estado['resultado'] = resultado
+
+        def erro(mensagem: str):
+            estado['erros'].append(mensagem)
+            _atualizar(job_id, mensagem=f"ERRO: {mensagem}")
+
+        def fim(codigo_saida: Optional[int]):
+            with self._trava:
+                execucao = self._execucoes.pop(job_id, None)
+            self._finalizar_job(job, execucao, estado, codigo_saida)
+            self.acordar()
+
+        execucao = ExecucaoEmProcesso(
+            alvo, parametros['args'], parametros['kwargs'],
+            status_callback=status, progress_callback=progresso,
+            done_callback=concluido, error_callback=erro, fim_callback=fim
+        )
+        with self._trava:
+            self._execucoes[job_id] = execucao
+        execucao.iniciar()
+        _atualizar(job_id, worker_pid=execucao.processo.pid)
+        logging.info(f"Fila de jobs: job {job_id} ({job['tipo']}, tentativa {job['tentativas']}/{job['max_tentativas']}) "
+                     f"iniciado no processo {execucao.processo.pid}.")
+
+    def _finalizar_job(self, job: Dict[str, Any], execucao: Optional[ExecucaoEmProcesso],
+                       estado: Dict[str, Any], codigo_saida: Optional[int]):
+        job_id = job['id']
+        erros = '\n'.join(estado['erros']) or None
+        if self._encerrando:
+            _atualizar(job_id, status='pendente', tentativas=job['tentativas'] - 1, mensagem='Interrompido pelo fechamento do app')
+        elif estado['resultado'] is not None:
+            # A análise pode ter avisado erros e ainda gerado o relatório (ex.: falha só no template)
+            resultado = estado['resultado']
+            _atualizar(job_id, status='concluido', concluido_em=_agora(), erro=erros,
+                       resultado=str(resultado[0]) if resultado else None,
+                       caminho_relatorio=_caminho_relatorio(resultado),
+                       mensagem='Concluído' if not erros else 'Concluído com avisos')
+        elif execucao is not None and execucao.cancelada:
+            _atualizar(job_id, status='cancelado', concluido_em=_agora(), mensagem='Cancelado pelo usuário')
+        elif job['tentativas'] < job['max_tentativas']:
+            _atualizar(job_id, status='pendente', erro=erros, mensagem=f"Falhou na tentativa {job['tentativas']}; aguardando nova tentativa")
+            logging.warning(f"Fila de jobs: job {job_id} falhou (tentativa {job['tentativas']}/{job['max_tentativas']}); volta para a fila.")
+            return
+        else:
+            _atualizar(job_id, status='erro', concluido_em=_agora(), erro=erros or f"Processo terminou com código {codigo_saida}",
+                       mensagem='Falhou')
+        logging.info(f"Fila de jobs: job {job_id} finalizado.")
+
+_gerenciador: Optional[GerenciadorJobs] = None
+
+def gerenciador_jobs() -> GerenciadorJobs:
+    """Gerenciador da sessão (criado e iniciado na primeira chamada)."""
+    global _gerenciador
+    if _gerenciador is None:
+        inicializar_fila_jobs()
+        _gerenciador = GerenciadorJobs(int(_ler_config('max_workers', str(MAX_WORKERS_PADRAO))))
+        _gerenciador.iniciar()
+    return _gerenciador
+
+@atexit.register # registrado depois do de processo_analise, então roda antes dele
+def _encerrar_gerenciador():
+    if _gerenciador is not None: _gerenciador.encerrar()
@@ -0,0 +1,170 @@
+import atexit
+import logging
+import logging.handlers
+import multiprocessing
+import queue
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, Optional, Sequence
+
+# ==============================================================================
+# ANÁLISE EM PROCESSO SEPARADO
+# ==============================================================================
+# As análises (pandas pesado) rodavam numa thread do processo do Flet,
+# disputando o GIL com a interface e deixando o heap fragmentado depois de
+# cada execução. Aqui cada análise roda num processo novo (spawn): os
+# callbacks de status/progresso/conclusão/erro viram mensagens numa fila e
+# uma thread do processo da interface chama os callbacks da tela, com a mesma
+# assinatura de antes. Quando o processo termina, a memória volta para o
+# sistema. O processo não é daemon porque a leitura dos XMLs do Invest abre
+# o próprio pool de processos.
+
+# Progresso enviado no máximo a cada INTERVALO_PROGRESSO segundos (o último sempre vai)
+INTERVALO_PROGRESSO = 0.05
+
+_execucoes_ativas: "weakref.WeakSet[ExecucaoEmProcesso]" = weakref.WeakSet()
+
+class _CanalFila:
+    """Callbacks do lado do processo da análise: cada chamada vira uma mensagem na fila."""
+
+    def __init__(self, fila):
+        self.fila = fila
+        self._ultimo_progresso = 0.0
+
+    def status(self, mensagem: str):
+        self.fila.put(('status', (mensagem,)))
+
+    def progresso(self, atual: int, total: int):
+        agora = time.monotonic()
+        if atual >= total or agora - self._ultimo_progresso >= INTERVALO_PROGRESSO:
+            self._ultimo_progresso = agora
+            self.fila.put(('progresso', (atual, total)))
+
+    def concluido(self, *resultado):
+        self.fila.put(('concluido', resultado))
+
+    def erro(self, mensagem: str):
+        self.fila.put(('erro', (mensagem,)))
+
+def _processo_analise(fila, alvo: Callable, args: Sequence[Any], kwargs: Dict[str, Any]):
+    """Ponto de entrada do processo filho (precisa ser importável pelo spawn)."""
+    raiz = logging.getLogger()
+    raiz.handlers[:] = [logging.handlers.QueueHandler(fila)] # logs vão para o app.log do processo principal
+    raiz.setLevel(logging.INFO)
+
+    canal = _CanalFila(fila)
+    try:
+        alvo(
+            *args,
+            status_callback=canal.status,
+            progress_callback=canal.progresso,
+            done_callback=canal.concluido,
+            error_callback=canal.erro,
+            **kwargs
+        )
+    except Exception as e:
+        logging.exception("Erro não tratado no processo da análise")
+        canal.erro(str(e))
+
+class ExecucaoEmProcesso:
+    """
+    Roda alvo(*args, status_callback=..., progress_callback=..., done_callback=...,
+    error_callback=..., **kwargs) num processo separado. alvo, args e kwargs
+    precisam ser serializáveis (funções de módulo, Path, listas, textos).
+    """
+
+    def __init__(
+        self,
+        alvo: Callable,
+        args: Sequence[Any] = (),
+        kwargs: Optional[Dict[str, Any]] = None,
+        status_callback: Optional[Callable[[str], None]] = None,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+        done_callback: Optional[Callable[..., None]] = None,
+        error_callback: Optional[Callable[[str], None]] = None,
+        fim_callback: Optional[Callable[[Optional[int]], None]] = None,
+    ):
+        self.alvo = alvo
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs or {})
+        self.callbacks = {
+            'status': status_callback,
+            'progresso': progress_callback,
+            'concluido': done_callback,
+            'erro': error_callback,
+        }
+        self.fim_callback = fim_callback # chamado por último, com o exitcode do processo
+        self.processo: Optional[multiprocessing.Process] = None
+        self.cancelada = False
+        self._finalizada = False
+        self._leitor: Optional[threading.Thread] = None
+
+    @property
+    def em_execucao(self) -> bool:
+        return self._leitor is not None and self._leitor.is_alive()
+
+    def iniciar(self):
+        contexto = multiprocessing.get_context('spawn')
+        self._fila = contexto.Queue()
+        self.processo = contexto.Process(
+            target=_processo_analise,
+            args=(self._fila, self.alvo, self.args, self.kwargs),
+            name=f"analise-{getattr(self.alvo, '__name__', 'alvo')}",
+        )
+        self.processo.start()
+        _execucoes_ativas.add(self)
+        logging.info(f"Análise iniciada no processo {self.processo.pid} ({self.processo.name}).")
+        self._leitor = threading.Thread(target=self._ler_fila, name=f"leitor-{self.processo.name}", daemon=True)
+        self._leitor.start()
+
+    def cancelar(self):
+        """Encerra o processo da análise; o error_callback recebe o aviso de cancelamento."""
+        if self.processo is None or not self.processo.is_alive(): return
+        self.cancelada = True
+        logging.info(f"Cancelando a análise do processo {self.processo.pid}.")
+        self.processo.terminate()
+
+    def _despachar(self, mensagem):
+        if isinstance(mensagem, logging.LogRecord):
+            logging.getLogger(mensagem.name).handle(mensagem)
+            return
+        tipo, argumentos = mensagem
+        # A análise pode avisar erro e ainda concluir (ex.: falha só no template): tudo é repassado
+        if tipo in ('concluido', 'erro'): self._finalizada = True
+        callback = self.callbacks.get(tipo)
+        if callback:
+            callback(*argumentos)
+
+    def _ler_fila(self):
+        while True:
+            try:
+                mensagem = self._fila.get(timeout=0.2)
+            except queue.Empty:
+                if self.processo.is_alive(): continue
+                break
+            except (EOFError, OSError): # fila interrompida pelo terminate()
+                break
+            if self.cancelada: continue # descarta o que ainda estava na fila
+            try:
+                self._despachar(mensagem)
+            except Exception as e:
+                logging.error(f"Erro no callback da análise ({mensagem[0] if isinstance(mensagem, tuple) else 'log'}): {e}")
+
+        self.processo.join()
+        _execucoes_ativas.discard(self)
+        logging.info(f"Processo da análise {self.processo.pid} encerrado (código {self.processo.exitcode}).")
+        callback_erro = self.callbacks.get('erro')
+        if not self._finalizada and callback_erro:
+            self._finalizada = True
+            if self.cancelada:
+                callback_erro("Análise cancelada pelo usuário.")
+            else:
+                callback_erro(f"O processo da análise terminou sem resultado (código {self.processo.exitcode}).")
+        if self.fim_callback:
+            self.fim_callback(self.processo.exitcode)
+
+@atexit.register
+def _encerrar_execucoes():
+    for execucao in list(_execucoes_ativas):
+        execucao.cancelar()
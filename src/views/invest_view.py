@@ -1,8 +1,10 @@
 import flet as ft
-import threading
 from pathlib import Path
 from src.logic.invest_logic import executar_apuracao_invest
 import logging
+from src.utils.atualizacao_ui import AtualizadorUI
+from src.utils.processo_analise import ExecucaoEmProcesso
+from src.utils.fila_jobs import enfileirar_job, gerenciador_jobs
 
 class InvestView(ft.Container):
     def __init__(self, page: ft.Page):
@@ -27,6 +29,7 @@ class InvestView(ft.Container):
         self.sete_path_text = ft.Text(value="Nenhum arquivo selecionado (Opcional)", italic=True)
         self.pick_sete_dialog = ft.FilePicker(on_result=self.pick_sete_result)
         self.page.overlay.append(self.pick_sete_dialog)
+        self.simulate_sete_checkbox = ft.Checkbox(label="Só simular a atualização da SETE (não grava; o que mudaria vai para o log do programa)", value=False)
 
         # 3. NCM Rules CSV (Optional)
         self.ncm_path_text = ft.Text(value="Nenhum arquivo selecionado (Opcional)", italic=True)
@@ -37,6 +40,8 @@ class InvestView(ft.Container):
         self.status_text = ft.Text("Aguardando início...", size=16, weight="bold")
         self.progress_bar = ft.ProgressBar(width=600, value=0, visible=False)
         self.log_view = ft.ListView(expand=True, spacing=5, auto_scroll=True, height=200)
+        # Progresso e log aplicados em quadros (a análise não espera a UI)
+        self.atualizador = AtualizadorUI(self, self.progress_bar, self.log_view, prefixo_log="apuracao_invest")
         self.log_container = ft.Container(
             content=self.log_view,
             border=ft.border.all(1, ft.Colors.GREY_400),
@@ -54,6 +59,31 @@ class InvestView(ft.Container):
             on_click=self.start_analysis,
             disabled=True
         )
+        self.cancel_button = ft.OutlinedButton(
+            "CANCELAR",
+            icon=ft.Icons.STOP,
+            on_click=self.cancel_analysis,
+            disabled=True
+        )
+        self.execucao = None
+
+        # Fila de jobs (tela "Fila de Jobs"): roda depois, sem acompanhar aqui
+        self.enqueue_button = ft.OutlinedButton(
+            "ADICIONAR À FILA",
+            icon=ft.Icons.QUEUE,
+            on_click=self.enqueue_analysis,
+            disabled=True
+        )
+        self.queue_priority_dropdown = ft.Dropdown(
+            label="Prioridade na fila",
+            options=[
+                ft.dropdown.Option("10", "Alta"),
+                ft.dropdown.Option("0", "Normal"),
+                ft.dropdown.Option("-10", "Baixa"),
+            ],
+            value="0",
+            width=180
+        )
 
         # Layout
         self.content = ft.Column(
@@ -89,8 +119,10 @@ class InvestView(ft.Container):
                     ]),
                 ]),
 
+                self.simulate_sete_checkbox,
+
                 ft.Divider(),
-                self.start_button,
+                ft.Row([self.start_button, self.cancel_button, self.enqueue_button, self.queue_priority_dropdown]),
 
                 ft.Divider(),
                 self.status_text,
@@ -127,33 +159,28 @@ class InvestView(ft.Container):
     def check_can_start(self):
         can_start = (self.xml_folder_val is not None)
         self.start_button.disabled = not can_start
+        self.enqueue_button.disabled = not can_start
         self.update()
 
     # --- Analysis Logic ---
 
     def add_log(self, message: str):
-        self.log_view.controls.append(ft.Text(message, size=12, color=ft.Colors.WHITE, font_family="Consolas"))
-        self.update()
+        self.atualizador.log(message)
 
     def update_status(self, message: str):
         self.status_text.value = f"Status: {message}"
         self.add_log(f"[STATUS] {message}")
-        self.update()
 
     def update_progress(self, current, total):
-        if total > 0:
-            val = current / total
-            self.progress_bar.value = val
-            self.progress_bar.visible = True
-        else:
-            self.progress_bar.visible = False
-        self.update()
+        self.atualizador.progresso(current, total)
 
     def on_done(self, result_msg):
+        self.add_log(f"[SUCESSO] {result_msg}")
+        self.atualizador.encerrar()
         self.status_text.value = f"Concluído!"
         self.progress_bar.value = 1.0
-        self.add_log(f"[SUCESSO] {result_msg}")
         self.start_button.disabled = False
+        self.cancel_button.disabled = True
 
         # Show snackbar
         self.page.snack_bar = ft.SnackBar(ft.Text(f"Análise concluída!"))
@@ -163,40 +190,55 @@ class InvestView(ft.Container):
     def on_error(self, error_msg):
         self.status_text.value = f"ERRO: {error_msg}"
         self.add_log(f"[ERRO] {error_msg}")
+        self.atualizador.encerrar()
         self.start_button.disabled = False
+        self.cancel_button.disabled = True
         self.progress_bar.visible = False
         self.update()
 
+    def cancel_analysis(self, e):
+        if self.execucao:
+            self.cancel_button.disabled = True
+            self.status_text.value = "Cancelando..."
+            self.update()
+            self.execucao.cancelar()
+
+    def build_analysis_params(self):
+        """kwargs de executar_apuracao_invest, sem os callbacks."""
+        return {
+            "pasta_xml": Path(self.xml_folder_val),
+            "caminho_sete": self.sete_path_val,
+            "caminho_ncm_csv": self.ncm_path_val,
+            "simular_sete": bool(self.simulate_sete_checkbox.value),
+        }
+
+    def enqueue_analysis(self, e):
+        job_id = enfileirar_job(
+            "invest", kwargs=self.build_analysis_params(),
+            descricao=Path(self.xml_folder_val).name,
+            prioridade=int(self.queue_priority_dropdown.value or 0)
+        )
+        gerenciador_jobs()
+        self.page.snack_bar = ft.SnackBar(ft.Text(f"Job {job_id} adicionado à fila. Acompanhe em 'Fila de Jobs'."))
+        self.page.snack_bar.open = True
+        self.page.update()
+
     def start_analysis(self, e):
         self.start_button.disabled = True
-        self.log_view.controls.clear()
+        self.cancel_button.disabled = False
+        self.atualizador.iniciar()
         self.status_text.value = "Iniciando..."
         self.progress_bar.visible = True
         self.progress_bar.value = None
         self.update()
 
-        xml = Path(self.xml_folder_val)
-        sete = self.sete_path_val
-        ncm = self.ncm_path_val
-
-        # Run in thread
-        t = threading.Thread(
-            target=self.run_wrapper,
-            args=(xml, sete, ncm),
-            daemon=True
+        # Roda em processo separado (callbacks chegam por fila, mesma assinatura)
+        self.execucao = ExecucaoEmProcesso(
+            executar_apuracao_invest,
+            kwargs=self.build_analysis_params(),
+            status_callback=self.update_status,
+            progress_callback=self.update_progress,
+            done_callback=self.on_done,
+            error_callback=self.on_error
         )
-        t.start()
-
-    def run_wrapper(self, xml, sete, ncm):
-        try:
-            executar_apuracao_invest(
-                pasta_xml=xml,
-                caminho_sete=sete,
-                caminho_ncm_csv=ncm,
-                status_callback=self.update_status,
-                progress_callback=self.update_progress,
-                done_callback=self.on_done,
-                error_callback=self.on_error
-            )
-        except Exception as e:
-            self.on_error(str(e))
+        self.execucao.iniciar()
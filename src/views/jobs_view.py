@@ -0,0 +1,184 @@
+import flet as ft
+import os
+import threading
+import logging
+from pathlib import Path
+from src.utils.fila_jobs import (
+    TIPOS_JOB, alterar_prioridade, cancelar_job, gerenciador_jobs, listar_jobs, metricas_job, reenfileirar_job
+)
+
+# Segundos entre as atualizações automáticas da lista (só com a tela visível)
+INTERVALO_ATUALIZACAO = 2.0
+
+CORES_STATUS = {
+    'pendente': ft.Colors.GREY_700,
+    'executando': ft.Colors.BLUE,
+    'concluido': ft.Colors.GREEN,
+    'erro': ft.Colors.RED,
+    'cancelado': ft.Colors.ORANGE,
+}
+
+def _formatar_duracao(segundos):
+    if segundos is None: return "-"
+    segundos = int(segundos)
+    if segundos >= 3600: return f"{segundos // 3600}h{(segundos % 3600) // 60:02d}m"
+    if segundos >= 60: return f"{segundos // 60}m{segundos % 60:02d}s"
+    return f"{segundos}s"
+
+class JobsView(ft.Container):
+    def __init__(self, page: ft.Page):
+        super().__init__()
+        self.page = page
+        self.expand = True
+        self.padding = 20
+        self.gerenciador = gerenciador_jobs()
+
+        self.workers_dropdown = ft.Dropdown(
+            label="Análises simultâneas",
+            options=[ft.dropdown.Option(str(n)) for n in range(1, max(os.cpu_count() or 1, 1) + 1)],
+            value=str(self.gerenciador.max_workers),
+            width=200,
+            on_change=self.change_workers
+        )
+        self.summary_text = ft.Text("", size=14)
+        self.jobs_table = ft.DataTable(
+            columns=[
+                ft.DataColumn(ft.Text("ID"), numeric=True),
+                ft.DataColumn(ft.Text("Cliente / Pasta")),
+                ft.DataColumn(ft.Text("Tipo")),
+                ft.DataColumn(ft.Text("Prioridade"), numeric=True),
+                ft.DataColumn(ft.Text("Status")),
+                ft.DataColumn(ft.Text("Tentativas")),
+                ft.DataColumn(ft.Text("Progresso")),
+                ft.DataColumn(ft.Text("Duração")),
+                ft.DataColumn(ft.Text("Vazão")),
+                ft.DataColumn(ft.Text("Relatório")),
+                ft.DataColumn(ft.Text("Ações")),
+            ],
+            rows=[],
+            column_spacing=20
+        )
+
+        self.content = ft.Column(
+            [
+                ft.Text("Fila de Jobs", size=30, weight="bold"),
+                ft.Text("Análises adicionadas pelas telas SPED e Invest / Contrib rodam aqui, uma por processo.", size=14),
+                ft.Divider(),
+                ft.Row([
+                    self.workers_dropdown,
+                    ft.ElevatedButton("Atualizar", icon=ft.Icons.REFRESH, on_click=lambda _: self.refresh()),
+                    self.summary_text
+                ], vertical_alignment=ft.CrossAxisAlignment.CENTER),
+                ft.Row([self.jobs_table], scroll=ft.ScrollMode.AUTO),
+            ],
+            scroll=ft.ScrollMode.AUTO
+        )
+        self.load_rows()
+
+        # Atualização automática só enquanto a tela está montada na página
+        self._parar_atualizacao = threading.Event()
+        self._thread_atualizacao = None
+
+    # --- Ciclo de vida ---
+
+    def did_mount(self):
+        if self._thread_atualizacao is not None and self._thread_atualizacao.is_alive(): return
+        self._parar_atualizacao.clear()
+        self._thread_atualizacao = threading.Thread(target=self.auto_refresh, name="tela-fila-jobs", daemon=True)
+        self._thread_atualizacao.start()
+
+    def will_unmount(self):
+        self.encerrar()
+
+    def encerrar(self):
+        """Para a atualização automática (desmontagem ou logout, via RegistroTelas.limpar)."""
+        self._parar_atualizacao.set()
+
+    # --- Dados ---
+
+    def load_rows(self):
+        jobs = listar_jobs()
+        contagem = {}
+        for job in jobs:
+            contagem[job['status']] = contagem.get(job['status'], 0) + 1
+        self.summary_text.value = "   ".join(f"{status.capitalize()}: {contagem.get(status, 0)}" for status in CORES_STATUS)
+        self.jobs_table.rows = [self.build_row(job) for job in jobs]
+
+    def refresh(self):
+        try:
+            self.load_rows()
+            self.update()
+        except Exception as e:
+            logging.debug(f"Tela da fila não atualizada: {e}")
+
+    def auto_refresh(self):
+        while not self._parar_atualizacao.wait(INTERVALO_ATUALIZACAO):
+            if self.visible and self.page is not None:
+                self.refresh()
+
+    def build_row(self, job):
+        status = job['status']
+        duracao, vazao = metricas_job(job)
+        if job['progresso_total']:
+            progresso = f"{job['progresso_atual']}/{job['progresso_total']}"
+        else:
+            progresso = "-"
+
+        relatorio = ft.Text("-")
+        if job['caminho_relatorio']:
+            caminho = job['caminho_relatorio']
+            relatorio = ft.TextButton(
+                Path(caminho).name,
+                tooltip=caminho,
+                on_click=lambda e, c=caminho: self.open_report(c)
+            )
+
+        acoes = []
+        if status in ('pendente', 'executando'):
+            acoes.append(ft.IconButton(ft.Icons.CANCEL, tooltip="Cancelar", on_click=lambda e, j=job['id']: self.cancel_job(j)))
+        if status == 'pendente':
+            acoes.append(ft.IconButton(ft.Icons.ARROW_UPWARD, tooltip="Aumentar prioridade", on_click=lambda e, j=job['id']: self.change_priority(j, 1)))
+            acoes.append(ft.IconButton(ft.Icons.ARROW_DOWNWARD, tooltip="Diminuir prioridade", on_click=lambda e, j=job['id']: self.change_priority(j, -1)))
+        if status in ('erro', 'cancelado'):
+            acoes.append(ft.IconButton(ft.Icons.REPLAY, tooltip="Reenfileirar", on_click=lambda e, j=job['id']: self.retry_job(j)))
+
+        return ft.DataRow(cells=[
+            ft.DataCell(ft.Text(str(job['id']))),
+            ft.DataCell(ft.Text(job['descricao'] or "-", tooltip=job['mensagem'])),
+            ft.DataCell(ft.Text(TIPOS_JOB.get(job['tipo'], (None, None, job['tipo']))[2])),
+            ft.DataCell(ft.Text(str(job['prioridade']))),
+            ft.DataCell(ft.Text(status.upper(), color=CORES_STATUS.get(status), weight="bold",
+                                tooltip=job['erro'] or job['mensagem'])),
+            ft.DataCell(ft.Text(f"{job['tentativas']}/{job['max_tentativas']}")),
+            ft.DataCell(ft.Text(progresso)),
+            ft.DataCell(ft.Text(_formatar_duracao(duracao))),
+            ft.DataCell(ft.Text(f"{vazao:.1f} XML/s" if vazao else "-")),
+            ft.DataCell(relatorio),
+            ft.DataCell(ft.Row(acoes, spacing=0)),
+        ])
+
+    # --- Ações ---
+
+    def change_workers(self, e):
+        self.gerenciador.definir_workers(int(self.workers_dropdown.value))
+
+    def cancel_job(self, job_id):
+        cancelar_job(job_id)
+        self.refresh()
+
+    def retry_job(self, job_id):
+        reenfileirar_job(job_id)
+        self.refresh()
+
+    def change_priority(self, job_id, delta):
+        alterar_prioridade(job_id, delta)
+        self.refresh()
+
+    def open_report(self, caminho):
+        arquivo = Path(caminho)
+        if not arquivo.exists():
+            self.page.snack_bar = ft.SnackBar(ft.Text(f"Relatório não encontrado: {caminho}"))
+            self.page.snack_bar.open = True
+            self.page.update()
+            return
+        self.page.launch_url(arquivo.resolve().as_uri())
@@ -1,8 +1,10 @@
 import flet as ft
-import threading
 from pathlib import Path
 from src.logic.fiscal_logic import executar_analise_completa
 import logging
+from src.utils.atualizacao_ui import AtualizadorUI
+from src.utils.processo_analise import ExecucaoEmProcesso
+from src.utils.fila_jobs import enfileirar_job, gerenciador_jobs
 
 class SpedView(ft.Container):
     def __init__(self, page: ft.Page):
@@ -73,10 +75,35 @@ class SpedView(ft.Container):
             ])
         )
 
+        # 7. Report Options
+        self.divergences_only_checkbox = ft.Checkbox(label="Relatório rápido: só notas com divergência e seus itens (totalizadores completos; conciliação completa exportada à parte, itens de todas as notas só marcando a exportação abaixo)", value=False)
+        self.export_data_checkbox = ft.Checkbox(label="Exportar tabelas completas (Parquet/CSV + SQLite)", value=False)
+        self.extraction_profile_dropdown = ft.Dropdown(
+            label="Leitura dos XMLs",
+            options=[
+                ft.dropdown.Option(key="completo", text="Completa (notas e itens)"),
+                ft.dropdown.Option(key="totais", text="Somente totais (NFC-e / varejo)"),
+            ],
+            value="completo",
+            width=320
+        )
+        self.period_check_dropdown = ft.Dropdown(
+            label="Conferência do período (SPED x XMLs)",
+            options=[
+                ft.dropdown.Option(key="avisar", text="Avisar se os XMLs forem de outro mês"),
+                ft.dropdown.Option(key="abortar", text="Interromper se os XMLs forem de outro mês"),
+                ft.dropdown.Option(key="desligado", text="Não conferir"),
+            ],
+            value="avisar",
+            width=320
+        )
+
         # Output Area
         self.status_text = ft.Text("Aguardando início...", size=16, weight="bold")
         self.progress_bar = ft.ProgressBar(width=600, value=0, visible=False)
         self.log_view = ft.ListView(expand=True, spacing=5, auto_scroll=True, height=200)
+        # Progresso e log aplicados em quadros (a análise não espera a UI)
+        self.atualizador = AtualizadorUI(self, self.progress_bar, self.log_view, prefixo_log="analise_sped")
         self.log_container = ft.Container(
             content=self.log_view,
             border=ft.border.all(1, ft.Colors.GREY_400),
@@ -94,6 +121,31 @@ class SpedView(ft.Container):
             on_click=self.start_analysis,
             disabled=True
         )
+        self.cancel_button = ft.OutlinedButton(
+            "CANCELAR",
+            icon=ft.Icons.STOP,
+            on_click=self.cancel_analysis,
+            disabled=True
+        )
+        self.execucao = None
+
+        # Fila de jobs (tela "Fila de Jobs"): roda depois, sem acompanhar aqui
+        self.enqueue_button = ft.OutlinedButton(
+            "ADICIONAR À FILA",
+            icon=ft.Icons.QUEUE,
+            on_click=self.enqueue_analysis,
+            disabled=True
+        )
+        self.queue_priority_dropdown = ft.Dropdown(
+            label="Prioridade na fila",
+            options=[
+                ft.dropdown.Option("10", "Alta"),
+                ft.dropdown.Option("0", "Normal"),
+                ft.dropdown.Option("-10", "Baixa"),
+            ],
+            value="0",
+            width=180
+        )
 
         # Layout
         self.content = ft.Column(
@@ -138,8 +190,13 @@ class SpedView(ft.Container):
                 self.template_checkbox,
                 self.template_container,
 
+                self.divergences_only_checkbox,
+                self.export_data_checkbox,
+                self.extraction_profile_dropdown,
+                self.period_check_dropdown,
+
                 ft.Divider(),
-                self.start_button,
+                ft.Row([self.start_button, self.cancel_button, self.enqueue_button, self.queue_priority_dropdown]),
 
                 ft.Divider(),
                 self.status_text,
@@ -209,32 +266,27 @@ class SpedView(ft.Container):
                 can_start = False
 
         self.start_button.disabled = not can_start
+        self.enqueue_button.disabled = not can_start
         self.update()
 
     # --- Analysis Logic ---
 
     def add_log(self, message: str):
-        self.log_view.controls.append(ft.Text(message, size=12, color=ft.Colors.WHITE, font_family="Consolas"))
-        self.update()
+        self.atualizador.log(message)
 
     def update_status(self, message: str):
         self.status_text.value = f"Status: {message}"
         self.add_log(f"[STATUS] {message}")
-        self.update()
 
     def update_progress(self, current, total):
-        if total > 0:
-            val = current / total
-            self.progress_bar.value = val
-            self.progress_bar.visible = True
-        else:
-            self.progress_bar.visible = False
-        self.update()
+        self.atualizador.progresso(current, total)
 
     def on_done(self, report_path, issues_count):
+        self.atualizador.encerrar()
         self.status_text.value = f"Concluído! {issues_count} inconsistências. Relatório: {report_path}"
         self.progress_bar.value = 1.0
         self.start_button.disabled = False
+        self.cancel_button.disabled = True
 
         # Show snackbar
         self.page.snack_bar = ft.SnackBar(ft.Text(f"Análise concluída! Relatório salvo em {report_path}"))
@@ -244,18 +296,21 @@ class SpedView(ft.Container):
     def on_error(self, error_msg):
         self.status_text.value = f"ERRO: {error_msg}"
         self.add_log(f"[ERRO] {error_msg}")
+        self.atualizador.encerrar()
         self.start_button.disabled = False
+        self.cancel_button.disabled = True
         self.progress_bar.visible = False
         self.update()
 
-    def start_analysis(self, e):
-        self.start_button.disabled = True
-        self.log_view.controls.clear()
-        self.status_text.value = "Iniciando..."
-        self.progress_bar.visible = True
-        self.progress_bar.value = None # Indeterminate
-        self.update()
+    def cancel_analysis(self, e):
+        if self.execucao:
+            self.cancel_button.disabled = True
+            self.status_text.value = "Cancelando..."
+            self.update()
+            self.execucao.cancelar()
 
+    def build_analysis_params(self):
+        """(args, kwargs) de executar_analise_completa, sem os callbacks."""
         # Configs from logic (assuming we can pass them or they are defaults)
         # In fiscal_logic.py, executing_analise_completa takes:
         # cfop_sem_credito_icms: List[str], cfop_sem_credito_ipi: List[str], tolerancia_valor: float
@@ -290,22 +345,53 @@ class SpedView(ft.Container):
         sector = self.sector_dropdown.value
         username = "admin" # TODO: Get from session
 
-        # Run in thread
-        t = threading.Thread(
-            target=executar_analise_completa,
-            args=(
-                sped, xml, rules, username,
-                cfop_sem_credito_icms, cfop_sem_credito_ipi, tolerancia_valor
-            ),
-            kwargs={
-                "status_callback": self.update_status,
-                "progress_callback": self.update_progress,
-                "done_callback": self.on_done,
-                "error_callback": self.on_error,
-                "caminho_regras_detalhadas": detailed_rules,
-                "template_apuracao_path": template,
-                "tipo_setor": sector
-            },
-            daemon=True
+        args = (
+            sped, xml, rules, username,
+            cfop_sem_credito_icms, cfop_sem_credito_ipi, tolerancia_valor
+        )
+        kwargs = {
+            "caminho_regras_detalhadas": detailed_rules,
+            "template_apuracao_path": template,
+            "tipo_setor": sector,
+            "modo_relatorio": 'divergencias' if self.divergences_only_checkbox.value else 'completo',
+            "perfil_extracao": self.extraction_profile_dropdown.value or 'completo',
+            "pre_validacao_periodo": self.period_check_dropdown.value or 'avisar',
+            # Desmarcado = automático (exporta se alguma aba passar do limite do Excel)
+            "exportar_dados_completos": True if self.export_data_checkbox.value else None
+        }
+        return args, kwargs
+
+    def enqueue_analysis(self, e):
+        args, kwargs = self.build_analysis_params()
+        job_id = enfileirar_job(
+            "sped", args, kwargs,
+            descricao=Path(self.sped_path_val).name,
+            prioridade=int(self.queue_priority_dropdown.value or 0)
+        )
+        gerenciador_jobs()
+        self.page.snack_bar = ft.SnackBar(ft.Text(f"Job {job_id} adicionado à fila. Acompanhe em 'Fila de Jobs'."))
+        self.page.snack_bar.open = True
+        self.page.update()
+
+    def start_analysis(self, e):
+        self.start_button.disabled = True
+        self.cancel_button.disabled = False
+        self.atualizador.iniciar()
+        self.status_text.value = "Iniciando..."
+        self.progress_bar.visible = True
+        self.progress_bar.value = None # Indeterminate
+        self.update()
+
+        args, kwargs = self.build_analysis_params()
+
+        # Roda em processo separado (callbacks chegam por fila, mesma assinatura)
+        self.execucao = ExecucaoEmProcesso(
+            executar_analise_completa,
+            args=args,
+            kwargs=kwargs,
+            status_callback=self.update_status,
+            progress_callback=self.update_progress,
+            done_callback=self.on_done,
+            error_callback=self.on_error
         )
-        t.start()
+        self.execucao.iniciar()
@@ -0,0 +1,97 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+RAIZ = Path(__file__).resolve().parents[1]
+if str(RAIZ) not in sys.path: sys.path.insert(0, str(RAIZ))
+
+CNPJ_EMITENTE = '11222333000181'
+
+# ==============================================================================
+# MONTAGEM DE ARQUIVOS FISCAIS MÍNIMOS (NF-e, SPED, REGRAS)
+# ==============================================================================
+
+def chave_nfe(numero: int, modelo: str = '55') -> str:
+    """Chave de 44 posições (SP, 03/2024, emitente fixo) com DV módulo 11 válido."""
+    base = f"352403{CNPJ_EMITENTE}{modelo}001{numero:09d}1{numero:08d}"
+    pesos = [2 + (i % 8) for i in range(43)][::-1]
+    resto = sum(int(d) * p for d, p in zip(base, pesos)) % 11
+    return base + str(0 if resto < 2 else 11 - resto)
+
+def xml_nfe(chave: str, valores_itens, cfop: str = '5102', emissao: str = '2024-03-10', prefixo_produto: str = 'P') -> str:
+    dets = ''.join(
+        f'<det nItem="{i}"><prod><cProd>{prefixo_produto}{i}</cProd><xProd>Produto {i}</xProd><NCM>22030000</NCM>'
+        f'<CFOP>{cfop}</CFOP><uCom>UN</uCom><qCom>1.0000</qCom><vUnCom>{v:.2f}</vUnCom><vProd>{v:.2f}</vProd></prod>'
+        f'<imposto><ICMS><ICMS00><orig>0</orig><CST>00</CST><vBC>{v:.2f}</vBC><pICMS>18.00</pICMS>'
+        f'<vICMS>{v * 0.18:.2f}</vICMS></ICMS00></ICMS></imposto></det>'
+        for i, v in enumerate(valores_itens, start=1)
+    )
+    total = sum(valores_itens)
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?><nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00">'
+        f'<NFe><infNFe Id="NFe{chave}" versao="4.00"><ide><cUF>35</cUF><nNF>{int(chave[25:34])}</nNF><mod>55</mod>'
+        f'<finNFe>1</finNFe><dhEmi>{emissao}T10:00:00-03:00</dhEmi></ide>'
+        f'<emit><CNPJ>{CNPJ_EMITENTE}</CNPJ></emit><dest><CNPJ>12345678000199</CNPJ></dest>{dets}'
+        f'<total><ICMSTot><vBC>{total:.2f}</vBC><vICMS>{total * 0.18:.2f}</vICMS><vST>0.00</vST><vFCPST>0.00</vFCPST>'
+        f'<vProd>{total:.2f}</vProd><vIPI>0.00</vIPI><vIPIDevol>0.00</vIPIDevol><vNF>{total:.2f}</vNF></ICMSTot></total>'
+        '</infNFe></NFe></nfeProc>'
+    )
+
+def xml_cte(chave: str, valor: float, cfop: str = '1353') -> str:
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?><cteProc xmlns="http://www.portalfiscal.inf.br/cte" versao="4.00">'
+        f'<CTe><infCte Id="CTe{chave}" versao="4.00"><ide><CFOP>{cfop}</CFOP><nCT>{int(chave[25:34])}</nCT>'
+        '<toma3><toma>0</toma></toma3></ide>'
+        f'<emit><CNPJ>{CNPJ_EMITENTE}</CNPJ></emit><vPrest><vTPrest>{valor:.2f}</vTPrest></vPrest>'
+        f'<imp><ICMS><ICMS00><CST>00</CST><vBC>{valor:.2f}</vBC><pICMS>12.00</pICMS><vICMS>{valor * 0.12:.2f}</vICMS></ICMS00></ICMS></imp>'
+        '</infCte></CTe></cteProc>'
+    )
+
+def _br(valor: float) -> str:
+    return f"{valor:.2f}".replace('.', ',')
+
+def linhas_sped_nfe(chave: str, valores_itens, cfop: str = '1102'):
+    total = sum(valores_itens)
+    icms = sum(round(v * 0.18, 2) for v in valores_itens)
+    linhas = [
+        f"|C100|0|1|P|55|00|1|{int(chave[25:34])}|{chave}|10032024|10032024|{_br(total)}|0|0|0|{_br(total)}|0|0|0|0|"
+        f"{_br(total)}|{_br(icms)}|0|0|0|0|0|0|"
+    ]
+    for i, v in enumerate(valores_itens, start=1):
+        linhas.append(f"|C170|{i}|P{i}|Produto {i}|1|UN|{_br(v)}|0|0|000|{cfop}|x|{_br(v)}|18|{_br(v * 0.18)}|0|0|0|0|0|0|0|0|0|0|")
+    return linhas
+
+def linhas_sped_cte(chave: str, valor: float, cfop: str = '1353'):
+    return [
+        f"|D100|0|1|P|57|00|1||{int(chave[25:34])}|{chave}|10032024|10032024|",
+        f"|D190|00|{cfop}|12,00|{_br(valor)}|{_br(valor)}|{_br(valor * 0.12)}|0||",
+    ]
+
+@pytest.fixture
+def cenario_fiscal(tmp_path):
+    """
+    Pasta com duas NF-e e um SPED que escritura só a primeira (a segunda fica
+    FALTA NO SPED), mais o CSV de regras de acumuladores.
+    """
+    pasta_xmls = tmp_path / 'xmls'
+    pasta_xmls.mkdir()
+    escrituradas = {chave_nfe(1): [100.0, 50.0]}
+    fora_do_sped = {chave_nfe(2): [80.0, 20.0, 10.0]}
+    for chave, valores in {**escrituradas, **fora_do_sped}.items():
+        (pasta_xmls / f"{chave}.xml").write_text(xml_nfe(chave, valores), encoding='utf-8')
+
+    linhas = ['|0000|017|0|01032024|31032024|EMPRESA TESTE|11222333000181||SP|||||A|1|']
+    for chave, valores in escrituradas.items():
+        linhas.extend(linhas_sped_nfe(chave, valores))
+    linhas.append('|9999|1|')
+    caminho_sped = tmp_path / 'sped.txt'
+    caminho_sped.write_text('\n'.join(linhas) + '\n', encoding='latin-1')
+
+    caminho_regras = tmp_path / 'regras.csv'
+    caminho_regras.write_text(f"CNPJ_CPF;CFOP;ACUMULADOR\n{CNPJ_EMITENTE};1102;10\n", encoding='utf-8')
+
+    return {
+        'sped': caminho_sped, 'xmls': pasta_xmls, 'regras': caminho_regras,
+        'escrituradas': list(escrituradas), 'fora_do_sped': list(fora_do_sped),
+    }
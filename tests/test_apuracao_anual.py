@@ -0,0 +1,68 @@
+import pandas as pd
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.formatting.rule import CellIsRule
+from openpyxl.styles import PatternFill
+from openpyxl.worksheet.datavalidation import DataValidation
+
+from src.logic.apuracao_anual import periodos_de_speds, preencher_apuracao_anual
+from conftest import chave_nfe, linhas_sped_nfe
+
+def _template(caminho):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'Entradas'
+    ws['B5'], ws['F5'] = '1102', 18
+    validacao = DataValidation(type='list', formula1='"SIM,NÃO"')
+    validacao.add('A1')
+    ws.add_data_validation(validacao)
+    ws.conditional_formatting.add('Q3', CellIsRule(operator='greaterThan', formula=['0'], fill=PatternFill(bgColor='FFC7CE')))
+    wb.save(caminho)
+    return caminho
+
+def _sped(caminho, mes, notas):
+    """SPED de um mês com as notas {número: [valores dos itens]} e um C190 por nota."""
+    linhas = [f'|0000|017|0|01{mes}2024|28{mes}2024|EMPRESA TESTE|11222333000181||SP|||||A|1|']
+    for numero, valores in notas.items():
+        linhas.extend(linhas_sped_nfe(chave_nfe(numero), valores))
+        total = sum(valores)
+        linhas.append(f"|C190|000|1102|18,00|{total:.2f}|{total:.2f}|{total * 0.18:.2f}|0|0|0|0||".replace('.', ','))
+    linhas.append('|9999|1|')
+    caminho.write_text('\n'.join(linhas) + '\n', encoding='latin-1')
+    return caminho
+
+@pytest.fixture
+def periodos(tmp_path):
+    speds = [
+        _sped(tmp_path / 'sped_01.txt', '01', {1: [100.0, 50.0], 2: [30.0]}),
+        _sped(tmp_path / 'sped_02.txt', '02', {3: [200.0]}),
+    ]
+    return periodos_de_speds(speds)
+
+def test_periodos_de_speds_traz_os_totalizadores_de_cada_mes(periodos):
+    assert [p['periodo'] for p in periodos] == ['01.2024', '02.2024']
+    assert [p['df_entradas']['Total Operação'].sum() for p in periodos] == [180.0, 200.0]
+    assert all(p['df_saidas'].empty for p in periodos)
+
+def test_consolidado_anual_e_a_soma_dos_periodos(periodos, tmp_path):
+    caminho = preencher_apuracao_anual(_template(tmp_path / 'Apuracao.xlsx'), periodos)
+
+    wb = load_workbook(caminho)
+    assert wb.sheetnames == ['01.2024', '02.2024', 'Consolidado Anual', 'Resumo Anual']
+    # Placar geral das entradas (Vlr Contábil, Base, ICMS) em Q3:S3
+    placar = {aba: [wb[aba].cell(row=3, column=c).value for c in (17, 18, 19)] for aba in wb.sheetnames[:3]}
+    soma_periodos = [a + b for a, b in zip(placar['01.2024'], placar['02.2024'])]
+    assert placar['Consolidado Anual'] == pytest.approx(soma_periodos)
+    assert placar['Consolidado Anual'][0] == pytest.approx(380.0)
+
+    resumo = pd.read_excel(caminho, sheet_name='Resumo Anual')
+    total_anual = resumo.set_index('Período').loc['TOTAL ANUAL']
+    assert total_anual.to_numpy() == pytest.approx(resumo.iloc[:-1, 1:].sum().to_numpy())
+
+def test_abas_dos_periodos_mantem_validacoes_e_formatacao_do_template(periodos, tmp_path):
+    caminho = preencher_apuracao_anual(_template(tmp_path / 'Apuracao.xlsx'), periodos)
+
+    wb = load_workbook(caminho)
+    for aba in ('01.2024', '02.2024', 'Consolidado Anual'):
+        assert len(wb[aba].data_validations.dataValidation) == 1
+        assert len(list(wb[aba].conditional_formatting)) == 1
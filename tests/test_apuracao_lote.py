@@ -0,0 +1,40 @@
+import pandas as pd
+import pytest
+from openpyxl import Workbook, load_workbook
+
+from src.logic.apuracao_lote import preencher_templates_em_lote
+
+def _template(caminho):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'Entradas'
+    ws['B5'], ws['F5'] = '1102', 18
+    wb.save(caminho)
+    return caminho
+
+def _totalizadores(total):
+    return pd.DataFrame({'CFOP (SPED)': ['1102'], 'Alíquota (SPED)': [18.0], 'Alíquota ICMS': [18.0],
+                         'Total Operação': [total], 'Base de Cálculo ICMS': [total], 'Total ICMS': [total * 0.18]})
+
+def test_mesmo_cliente_em_dois_periodos_gera_dois_arquivos(tmp_path):
+    template = _template(tmp_path / 'Apuracao.xlsx')
+    jobs = [
+        {'nome': 'Cliente A', 'periodo': '2024-01', 'df_entradas': _totalizadores(1000.0), 'df_saidas': None},
+        {'nome': 'Cliente A', 'periodo': '2024-02', 'df_entradas': _totalizadores(250.0), 'df_saidas': None},
+    ]
+
+    resumo = preencher_templates_em_lote(template, jobs, max_workers=1)
+
+    assert [item['status'] for item in resumo] == ['ok', 'ok']
+    caminhos = [item['caminho'] for item in resumo]
+    assert len(set(caminhos)) == 2
+    # Placar geral das entradas: Vlr Contábil na Q3
+    assert [load_workbook(c)['Entradas']['Q3'].value for c in caminhos] == [1000.0, 250.0]
+
+def test_jobs_com_o_mesmo_arquivo_de_saida_sao_recusados(tmp_path):
+    template = _template(tmp_path / 'Apuracao.xlsx')
+    jobs = [{'nome': 'Cliente A', 'df_entradas': _totalizadores(1.0)}, {'nome': 'cliente a', 'df_entradas': _totalizadores(2.0)}]
+
+    with pytest.raises(ValueError, match='mesmo arquivo de saída'):
+        preencher_templates_em_lote(template, jobs, max_workers=1)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['Apuracao.xlsx']
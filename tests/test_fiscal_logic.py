@@ -0,0 +1,58 @@
+import pandas as pd
+import pytest
+
+from src.logic import fiscal_logic
+
+from conftest import chave_nfe, linhas_sped_cte, xml_cte
+
+def _executar(cenario, **kwargs):
+    resultado = {}
+    erros = []
+    fiscal_logic.executar_analise_completa(
+        cenario['sped'], cenario['xmls'], cenario['regras'], 'teste', [], [], 0.03,
+        done_callback=lambda caminho, problemas: resultado.update(caminho=caminho, problemas=problemas),
+        error_callback=erros.append,
+        **kwargs
+    )
+    return resultado, erros
+
+@pytest.mark.parametrize('kwargs', [
+    {},
+    {'modo_relatorio': 'divergencias'},
+    {'modo_relatorio': 'divergencias', 'leitura_xml_duas_fases': False},
+], ids=['completo', 'divergencias_duas_fases', 'divergencias_uma_fase'])
+def test_xml_fora_do_sped_nao_interrompe_a_analise(cenario_fiscal, kwargs):
+    """Itens sem C170 correspondente (nota FALTA NO SPED) entram no relatório com os valores do SPED zerados."""
+    resultado, erros = _executar(cenario_fiscal, **kwargs)
+
+    assert erros == []
+    assert resultado['caminho'].exists()
+    itens = pd.read_excel(resultado['caminho'], sheet_name='Itens_XML', dtype=str)
+    coluna_chave = next(c for c in itens.columns if 'CHV' in c.upper() or 'CHAVE' in c.upper())
+    assert set(cenario_fiscal['fora_do_sped']) <= set(itens[coluna_chave])
+
+def _tabelas_exportadas(caminho_relatorio):
+    pastas = [p for p in caminho_relatorio.parent.iterdir() if p.is_dir() and p.name.startswith(caminho_relatorio.stem)]
+    assert len(pastas) == 1
+    return {arquivo.name.split('.')[0] for arquivo in pastas[0].iterdir()}
+
+def test_divergencias_com_exportacao_completa_traz_itens_de_todas_as_notas(cenario_fiscal):
+    resultado, erros = _executar(cenario_fiscal, modo_relatorio='divergencias', exportar_dados_completos=True)
+
+    assert erros == []
+    assert 'Itens_XML_Bruto' in _tabelas_exportadas(resultado['caminho'])
+
+def test_cte_escriturado_entra_na_exportacao_completa(cenario_fiscal):
+    """O CT-e conciliado (XML x D190) não repete a coluna CHV_CTE, que a exportação em SQLite rejeitaria."""
+    chave = chave_nfe(9, modelo='57')
+    (cenario_fiscal['xmls'] / f"{chave}.xml").write_text(xml_cte(chave, 500.0), encoding='utf-8')
+    linhas = cenario_fiscal['sped'].read_text(encoding='latin-1').splitlines()
+    cenario_fiscal['sped'].write_text('\n'.join(linhas[:-1] + linhas_sped_cte(chave, 500.0) + linhas[-1:]) + '\n', encoding='latin-1')
+
+    resultado, erros = _executar(cenario_fiscal, exportar_dados_completos=True)
+
+    assert erros == []
+    assert 'Dados_CTe_SPED' in _tabelas_exportadas(resultado['caminho'])
+    cte = pd.read_excel(resultado['caminho'], sheet_name='Dados_CTe_SPED', dtype=str)
+    assert cte.loc[0, 'SITUACAO_CTE'] == 'OK'
+    assert cte.loc[0, 'STATUS_VALOR'] == 'OK'
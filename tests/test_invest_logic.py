@@ -0,0 +1,64 @@
+import openpyxl
+import pandas as pd
+import pytest
+
+from src.logic import invest_logic
+from conftest import chave_nfe, xml_nfe
+
+ABAS_SETE = ('03.2024', '04.2024')
+
+def _planilha_sete(caminho):
+    wb = openpyxl.Workbook()
+    wb.remove(wb.active)
+    for aba in ABAS_SETE:
+        ws = wb.create_sheet(aba)
+        ws['A1'] = 'Resumo'
+        ws['A2'] = 'Saídas Internas Com Benefício'
+    wb.save(caminho)
+    return caminho
+
+@pytest.fixture
+def cenario_invest(tmp_path):
+    """Notas com benefício (cProd 'A...', CFOP 5101) em dois meses e uma SETE com as duas abas."""
+    pasta_xmls = tmp_path / 'xmls'
+    pasta_xmls.mkdir()
+    notas = [(1, [100.0, 50.0], '2024-03-10'), (2, [80.0], '2024-04-05')]
+    for numero, valores, emissao in notas:
+        chave = chave_nfe(numero)
+        conteudo = xml_nfe(chave, valores, cfop='5101', emissao=emissao, prefixo_produto='A')
+        (pasta_xmls / f"{chave}.xml").write_text(conteudo, encoding='utf-8')
+    return {'xmls': pasta_xmls, 'sete': _planilha_sete(tmp_path / 'sete.xlsx')}
+
+def _valores_saidas(caminho_sete):
+    wb = openpyxl.load_workbook(caminho_sete)
+    return {aba: wb[aba]['B2'].value for aba in ABAS_SETE}
+
+def test_apuracao_invest_atualiza_a_aba_de_cada_mes(cenario_invest):
+    mensagem = invest_logic.executar_apuracao_invest(cenario_invest['xmls'], caminho_sete=str(cenario_invest['sete']))
+
+    assert 'Planilha SETE atualizada' in mensagem
+    assert _valores_saidas(cenario_invest['sete']) == {'03.2024': 150.0, '04.2024': 80.0}
+
+def test_apuracao_invest_simulada_nao_grava_a_sete(cenario_invest):
+    mensagem = invest_logic.executar_apuracao_invest(
+        cenario_invest['xmls'], caminho_sete=str(cenario_invest['sete']), simular_sete=True
+    )
+
+    assert 'Simulação SETE' in mensagem
+    assert _valores_saidas(cenario_invest['sete']) == {'03.2024': None, '04.2024': None}
+
+def test_lancamentos_do_mesmo_mes_na_mesma_sete_sao_somados(tmp_path):
+    caminho_sete = str(_planilha_sete(tmp_path / 'sete.xlsx'))
+    def resumo(valor):
+        return pd.DataFrame({'Totalizador SETE': ['Saídas Internos Com Benefício'], 'INVEST': ['SIM'],
+                             'VLR OPERAÇÃO': [valor], 'BASE CÁLCULO': [valor], 'VLR ICMS': [valor * 0.18]})
+    lancamentos = [
+        {'caminho_sete': caminho_sete, 'data_referencia': '2024-03-01', 'resumo_sete': resumo(100.0), 'empresa': 'Matriz'},
+        {'caminho_sete': caminho_sete, 'data_referencia': '2024-03-15', 'resumo_sete': resumo(40.0), 'empresa': 'Filial'},
+    ]
+
+    resultado, = invest_logic.atualizar_planilhas_sete_em_lote(lancamentos)
+
+    assert resultado['abas'] == ['03.2024']
+    assert resultado['linhas_alteradas'] == 1
+    assert _valores_saidas(caminho_sete)['03.2024'] == 140.0
@@ -0,0 +1,26 @@
+import pandas as pd
+
+from src.logic.monetario import dentro_da_tolerancia, em_reais, serie_para_centavos, texto_para_centavos
+
+def test_diferenca_igual_a_tolerancia_nao_diverge():
+    xml = pd.Series([30, 10005, 1000])
+    sped = pd.Series([29, 10000, 1002])
+
+    assert dentro_da_tolerancia(xml, sped, 0.01).tolist() == [True, False, False]
+    assert dentro_da_tolerancia(xml, sped, 0.05).tolist() == [True, True, True]
+    assert dentro_da_tolerancia(pd.Series([107]), pd.Series([100]), 0.07).tolist() == [True]
+
+def test_leitura_do_texto_direto_para_centavos():
+    assert texto_para_centavos('1234,56') == 123456
+    assert texto_para_centavos('-0.005') == -1
+    assert serie_para_centavos(pd.Series(['1234,56', '0.1', '', 'abc'])).tolist() == [123456, 10, 0, 0]
+
+def test_em_reais_converte_so_colunas_monetarias_em_centavos():
+    df = pd.DataFrame({'VL_DOC_XML': [123456, 10], 'N_ITEM': [1, 2], 'ICMS_SPED': [0.5, 1.0]})
+
+    convertido = em_reais(df)
+
+    assert convertido['VL_DOC_XML'].tolist() == [1234.56, 0.1]
+    assert convertido['N_ITEM'].tolist() == [1, 2]
+    assert convertido['ICMS_SPED'].tolist() == [0.5, 1.0]
+    assert df['VL_DOC_XML'].tolist() == [123456, 10]
@@ -0,0 +1,31 @@
+import pandas as pd
+from openpyxl import load_workbook
+
+from src.logic import report_generator
+from src.logic.report_generator import gerar_relatorio_excel
+
+def _conciliacao(n):
+    return pd.DataFrame({
+        'CHV_NFE': [f'{i:044d}' for i in range(n)],
+        'DT_EMISSAO': pd.date_range('2024-03-01', periods=n, freq='h'),
+        'VL_DOC_XML': [100.0 + i for i in range(n)],
+        'STATUS_GERAL': ['OK'] * n,
+    })
+
+def test_paralelo_monta_relatorio_com_coluna_de_data(tmp_path, monkeypatch):
+    def _sem_fallback(*args, **kwargs):
+        raise AssertionError("geração paralela caiu para a sequencial")
+
+    monkeypatch.setattr(report_generator, 'LINHAS_MINIMAS_PARALELO', 0)
+    monkeypatch.setattr(report_generator, '_gerar_em_sequencia', _sem_fallback)
+    vazio = pd.DataFrame()
+    caminho = tmp_path / 'relatorio.xlsx'
+
+    gerar_relatorio_excel(caminho, _conciliacao(30), _conciliacao(20), vazio, vazio, vazio, vazio,
+                          exportar_dados=False, paralelo=True, max_workers=2)
+
+    wb = load_workbook(caminho)
+    assert wb.sheetnames == ['Conciliacao', 'Itens_XML']
+    celula = wb['Conciliacao']['B2']
+    assert celula.value == pd.Timestamp('2024-03-01 00:00:00')
+    assert celula.number_format == 'yyyy-mm-dd h:mm:ss'